@@ -0,0 +1,38 @@
+"""
+Бенчмарки
+Воспроизводимые замеры горячих путей бота, запуск: python -m benchmarks.<модуль>
+
+Бенчмарки БД пишут в базу (seed_dataset очищает таблицы), поэтому база указывается
+явно — --database-url или BENCH_DATABASE_URL — и не может совпадать с DATABASE_URL бота.
+"""
+import os
+from urllib.parse import urlsplit
+
+BENCH_DATABASE_URL_ENV = 'BENCH_DATABASE_URL'
+_LOCAL_HOSTS = {'localhost', '127.0.0.1', '::1'}
+
+
+def add_database_argument(parser):
+    parser.add_argument(
+        '--database-url', default=os.getenv(BENCH_DATABASE_URL_ENV),
+        help=f"отдельная база для бенчмарков (по умолчанию {BENCH_DATABASE_URL_ENV})"
+    )
+
+
+def _target(url: str):
+    parts = urlsplit(url)
+    host = (parts.hostname or 'localhost').lower()
+    if host in _LOCAL_HOSTS:
+        host = 'localhost'
+    return host, parts.port or 5432, parts.path.strip('/') or parts.username
+
+
+def bench_database_url(url) -> str:
+    """База бенчмарка; SystemExit, если не задана или это база бота"""
+    from config import DATABASE_URL
+
+    if not url:
+        raise SystemExit(f"Укажите отдельную базу: --database-url или {BENCH_DATABASE_URL_ENV}")
+    if _target(url) == _target(DATABASE_URL):
+        raise SystemExit("База бенчмарка совпадает с DATABASE_URL бота — укажите отдельную базу")
+    return url
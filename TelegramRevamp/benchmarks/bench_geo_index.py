@@ -0,0 +1,100 @@
+"""
+Бенчмарк геоиндекса заказов
+Сравнивает GeoGridIndex с полным перебором на синтетических открытых заказах
+вокруг нескольких городов и проверяет, что выдача k ближайших совпадает.
+
+    python -m benchmarks.bench_geo_index --orders 100000 --queries 2000
+"""
+import argparse
+import heapq
+import random
+import statistics
+import time
+
+from geo_index import GeoGridIndex, haversine_km
+
+# Центры и разброс (градусы) — заказы кучкуются в городах, как в реальной ленте
+CITIES = [
+    (55.7558, 37.6173, 0.35),   # Москва
+    (59.9343, 30.3351, 0.25),   # Санкт-Петербург
+    (56.8389, 60.6057, 0.15),   # Екатеринбург
+    (55.0084, 82.9357, 0.15),   # Новосибирск
+    (55.7961, 49.1064, 0.12),   # Казань
+]
+
+
+def random_point(rng: random.Random):
+    lat, lon, spread = rng.choice(CITIES)
+    return lat + rng.gauss(0, spread), lon + rng.gauss(0, spread * 1.6)
+
+
+def brute_force(points, lat, lon, k):
+    return heapq.nsmallest(k, ((haversine_km(lat, lon, plat, plon), pid) for pid, (plat, plon) in points.items()))
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def run(orders: int, queries: int, k: int, radius_km: float, seed: int, brute_queries: int):
+    rng = random.Random(seed)
+    points = {order_id: random_point(rng) for order_id in range(1, orders + 1)}
+
+    started = time.perf_counter()
+    index = GeoGridIndex()
+    for order_id, (lat, lon) in points.items():
+        index.add(order_id, lat, lon)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    query_points = [random_point(rng) for _ in range(queries)]
+
+    knn_us = []
+    for lat, lon in query_points:
+        started = time.perf_counter()
+        index.nearest(lat, lon, k)
+        knn_us.append((time.perf_counter() - started) * 1e6)
+
+    radius_us = []
+    radius_hits = []
+    for lat, lon in query_points:
+        started = time.perf_counter()
+        radius_hits.append(len(index.within(lat, lon, radius_km)))
+        radius_us.append((time.perf_counter() - started) * 1e6)
+
+    brute_us = []
+    mismatches = 0
+    for lat, lon in query_points[:brute_queries]:
+        started = time.perf_counter()
+        expected = brute_force(points, lat, lon, k)
+        brute_us.append((time.perf_counter() - started) * 1e6)
+        got = index.nearest(lat, lon, k)
+        if [pid for _, pid in got] != [pid for _, pid in expected]:
+            mismatches += 1
+
+    print(f"Заказов: {orders}, запросов: {queries}, k={k}, радиус={radius_km} км")
+    print(f"Построение индекса: {build_ms:.0f} мс ({len(index._cells)} ячеек)")
+    print(f"k ближайших:   p50 {statistics.median(knn_us):8.1f} мкс   p99 {percentile(knn_us, 99):8.1f} мкс")
+    print(f"радиус:        p50 {statistics.median(radius_us):8.1f} мкс   p99 {percentile(radius_us, 99):8.1f} мкс"
+          f"   (в среднем {statistics.mean(radius_hits):.0f} заказов)")
+    print(f"перебор:       p50 {statistics.median(brute_us):8.1f} мкс   p99 {percentile(brute_us, 99):8.1f} мкс"
+          f"   ({len(brute_us)} запросов)")
+    print(f"Расхождений с перебором: {mismatches}")
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк GeoGridIndex")
+    parser.add_argument("--orders", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2_000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--radius", type=float, default=3.0)
+    parser.add_argument("--brute-queries", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    mismatches = run(args.orders, args.queries, args.k, args.radius, args.seed, args.brute_queries)
+    raise SystemExit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Бенчмарк логирования в горячих путях бота
+Синтетический хендлер повторяет запись в лог при открытии ленты, листании
+страниц и /s (те же логгеры и сообщения, что в bot.py) и строит текст страницы.
+Апдейты идут с заданной параллельностью; сравниваются пропускная способность
+и p99 хендлера в режимах:
+
+- sync-info  — StreamHandler прямо из цикла событий, уровень INFO (как было);
+- queue-info — log_setup: очередь + поток вывода, выборка LOG_SAMPLING, INFO;
+- queue-warn — то же с уровнем WARNING.
+
+Вывод идёт в файл; --write-delay-ms имитирует медленный поток вывода
+(переполненный pipe, docker json-file на загруженном диске).
+
+    python -m benchmarks.bench_logging --updates 20000 --concurrency 64 --write-delay-ms 0.2
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import tempfile
+import time
+
+from config import LOG_SAMPLING
+from log_setup import TEXT_FORMAT, log_context, setup_logging
+
+MODES = ("sync-info", "queue-info", "queue-warn")
+
+logger = logging.getLogger("bot")
+feed_logger = logging.getLogger("bot.feed")
+event_logger = logging.getLogger("aiogram.event")
+
+
+class SlowStream:
+    """Файл, каждая запись в который задерживает пишущий поток"""
+
+    def __init__(self, f, delay: float):
+        self.f = f
+        self.delay = delay
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def render_page(update_id: int) -> str:
+    text = "📱 <b>Лента заказов</b>\n━━━━━━━━━━━━━━━\n\n"
+    for order_id in range(update_id, update_id + 5):
+        text += (
+            f"<b>#{order_id}</b> 💰 {order_id % 5000} ₽\n"
+            f"📍 ул. Тестовая, {order_id % 90}\n⏰ 09:00 | 👥 2 чел.\n\n"
+        )
+    return text
+
+
+async def handle(update_id: int, user_id: int, latencies: list):
+    started = time.perf_counter()
+    token = log_context.set((update_id, user_id))
+    try:
+        kind = update_id % 3
+        if kind == 0:
+            feed_logger.info("Открытие ленты: пользователь %s, чат %s", user_id, user_id)
+        if kind == 2:
+            logger.info("Роль пользователя %s: %s → %s", user_id, "customer", "executor")
+            logger.debug("Новое меню %s отправлено пользователю %s", update_id, user_id)
+        else:
+            feed_logger.info(
+                "Лента: пользователь %s, страница %s, заказов %s", user_id, update_id % 7, 42
+            )
+        render_page(update_id)
+        # Запросы к БД и Bot API
+        await asyncio.sleep(0)
+        event_logger.info("Update id=%s is handled. Duration %d ms by bot id=%d", update_id, 3, 1)
+    finally:
+        log_context.reset(token)
+    latencies.append(time.perf_counter() - started)
+
+
+async def drive(updates: int, concurrency: int) -> tuple:
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(update_id: int):
+        async with semaphore:
+            await handle(update_id, 100_000 + update_id % 500, latencies)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(update_id) for update_id in range(1, updates + 1)))
+    return time.perf_counter() - started, latencies
+
+
+def configure(mode: str, stream):
+    """Возвращает слушатель очереди (для queue-режимов)"""
+    if mode == "sync-info":
+        root = logging.getLogger()
+        for old in root.handlers[:]:
+            root.removeHandler(old)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.INFO)
+        return None
+    level = "INFO" if mode == "queue-info" else "WARNING"
+    return setup_logging(level, "json", LOG_SAMPLING, stream=stream)
+
+
+def run(mode: str, updates: int, concurrency: int, write_delay: float, directory: str) -> dict:
+    path = os.path.join(directory, f"{mode}.log")
+    with open(path, "w", encoding="utf-8") as f:
+        listener = configure(mode, SlowStream(f, write_delay))
+        elapsed, latencies = asyncio.run(drive(updates, concurrency))
+        drain_started = time.perf_counter()
+        if listener:
+            listener.stop()
+        drain = time.perf_counter() - drain_started
+    with open(path, encoding="utf-8") as f:
+        lines = sum(1 for _ in f)
+    return {
+        "mode": mode,
+        "rate": updates / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "lines": lines,
+        "drain_ms": drain * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк логирования хендлеров")
+    parser.add_argument("--updates", type=int, default=20_000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument(
+        "--write-delay-ms", type=float, default=0.0, help="задержка каждой записи в поток вывода"
+    )
+    parser.add_argument("--modes", default=",".join(MODES))
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for mode in args.modes.split(","):
+            results.append(
+                run(mode, args.updates, args.concurrency, args.write_delay_ms / 1000, directory)
+            )
+    logging.getLogger().handlers.clear()
+
+    print(
+        f"Апдейтов: {args.updates}, параллельно: {args.concurrency}, "
+        f"задержка записи: {args.write_delay_ms} мс, выборка: {LOG_SAMPLING or '—'}"
+    )
+    print(
+        f"{'режим':<12}{'апд/с':>10}{'p50, мс':>10}{'p99, мс':>10}{'строк':>9}{'дозапись, мс':>15}"
+    )
+    for row in results:
+        print(
+            f"{row['mode']:<12}{row['rate']:>10.0f}{row['p50_ms']:>10.2f}{row['p99_ms']:>10.2f}"
+            f"{row['lines']:>9}{row['drain_ms']:>15.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
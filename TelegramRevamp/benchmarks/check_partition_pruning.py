@@ -0,0 +1,114 @@
+"""
+Проверка отсечения секций
+Вызывает методы Database, читающие секционированные таблицы (partitioning.py),
+перехватывает их запросы (db_metrics.capture_queries), выполняет для них
+EXPLAIN ANALYZE и показывает, сколько секций реально просмотрено из общего числа.
+Запросы по недавнему периоду должны трогать одну-две секции, а не все.
+
+Всё выполняется в одной транзакции, которая в конце откатывается: методы,
+которые пишут (refresh_daily_stats, retention_purge_batch), данных не меняют.
+
+    python -m benchmarks.check_partition_pruning
+"""
+import asyncio
+import json
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import asyncpg
+
+import partitioning
+import retention
+from config import DATABASE_URL
+from database import Database, encode_keyset_cursor
+from db_metrics import InstrumentedPool, capture_queries
+
+RETENTION_POLICIES = {policy.name: policy for policy in retention.DEFAULT_POLICIES}
+
+# (название, таблица, метод Database, аргументы по (now, chat_id))
+CHECKS = [
+    (
+        "get_chat_history (вторая страница)", 'messages', 'get_chat_history',
+        lambda now, chat_id: (chat_id, encode_keyset_cursor(now - timedelta(days=1), 2 ** 31 - 1)),
+    ),
+    (
+        "refresh_daily_stats (модерация за 2 дня)", 'moderation_logs', 'refresh_daily_stats',
+        lambda now, chat_id: (2,),
+    ),
+    (
+        "get_suspicious_orders", 'moderation_logs', 'get_suspicious_orders',
+        lambda now, chat_id: (4,),
+    ),
+    (
+        "retention: пачка notifications_read", 'notifications', 'retention_purge_batch',
+        lambda now, chat_id: (
+            RETENTION_POLICIES['notifications_read'],
+            RETENTION_POLICIES['notifications_read'].cutoff(now),
+        ),
+    ),
+]
+
+
+class SingleConnectionPool:
+    """Пул из одного соединения: все методы Database идут в транзакцию проверки"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    @asynccontextmanager
+    async def acquire(self):
+        yield self._conn
+
+
+def scanned_relations(plan: dict, found: set):
+    """Имена таблиц в узлах плана, которые действительно выполнялись"""
+    if plan.get('Relation Name') and plan.get('Actual Loops', 1) > 0:
+        found.add(plan['Relation Name'])
+    for child in plan.get('Plans', []):
+        scanned_relations(child, found)
+    return found
+
+
+async def explain(conn, sql: str, args) -> dict:
+    # Точка сохранения: ошибка EXPLAIN не обрывает общую транзакцию
+    async with conn.transaction():
+        raw = await conn.fetchval(f'EXPLAIN (ANALYZE, FORMAT JSON) {sql}', *args)
+    return (json.loads(raw) if isinstance(raw, str) else raw)[0]['Plan']
+
+
+async def main():
+    conn = await asyncpg.connect(DATABASE_URL)
+    db = Database()
+    db.pool = InstrumentedPool(SingleConnectionPool(conn), db.metrics)
+    now = datetime.now()
+    transaction = conn.transaction()
+    await transaction.start()
+    try:
+        latest_chat = 'SELECT chat_id FROM messages ORDER BY created_at DESC LIMIT 1'
+        chat_id = await conn.fetchval(latest_chat) or 0
+        for title, table, method, make_args in CHECKS:
+            partitions = [name for name, *_ in await partitioning.list_partitions(conn, table)]
+            with capture_queries() as captured:
+                await getattr(db, method)(*make_args(now, chat_id))
+            mentions = re.compile(rf'\b{table}\b')
+            for query_name, conn_method, sql, args in captured:
+                if conn_method == 'executemany' or not mentions.search(sql):
+                    continue
+                try:
+                    plan = await explain(conn, sql, args)
+                except Exception as e:
+                    print(f"{title} [{query_name}]: EXPLAIN не выполнен — {e}")
+                    continue
+                scanned = sorted(scanned_relations(plan, set()) & set(partitions))
+                print(
+                    f"{title} [{query_name}]: секций {len(scanned)} из {len(partitions)} — "
+                    f"{', '.join(scanned) or 'ни одной'}"
+                )
+    finally:
+        await transaction.rollback()
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
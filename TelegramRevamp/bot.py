@@ -1,5 +1,6 @@
 import os
 import asyncio
+import html
 from typing import Any, Coroutine, Dict, Optional
 from dotenv import load_dotenv
 from datetime import datetime, timedelta
@@ -9,22 +10,74 @@ from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardRemove, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.enums import ChatAction
 from database import Database
+from memory_database import MemoryDatabase
+from leaderboard import LeaderboardService
+from username_index import UsernameIndex
+from geo_index import OrderGeoIndex, format_distance, haversine_km
+from chat_relay import CAPTION_CONTENT_TYPES, ChatMessageWriter, describe_message
+from retention import RetentionEngine
+from order_archive import ARCHIVE_DAYS_CHOICES, OrderArchiver
+from handler_tracing import HandlerTracer
+from edit_coordinator import EditCoordinator
+from message_cleanup import MessageCleanup
+from update_recorder import UpdateRecorder
+from health import RuntimeHealth
+from log_setup import LogContextMiddleware
+from update_journal import UpdateJournal
+from config import (
+    ARCHIVE_BATCH_SIZE, ARCHIVE_INTERVAL, DATABASE_BACKEND, HANDLER_TRACE_WINDOW, HEALTH_MAX_LOOP_LAG,
+    HEALTH_WATCHDOG_INTERVAL, RECORD_UPDATES_PATH, RECORD_UPDATES_SALT,
+    RETENTION_BATCH_PAUSE, RETENTION_BATCH_SIZE, RETENTION_INTERVAL, RETENTION_MAX_BATCHES,
+    SHUTDOWN_DRAIN_TIMEOUT, SLOW_UPDATE_MS, UPDATE_JOURNAL_PATH
+)
 from keyboards import *
 import logging
 
 load_dotenv()
 load_dotenv("telebot.env")
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
+# Частые записи ленты — в отдельный логгер, его выборку задаёт LOG_SAMPLING
+feed_logger = logging.getLogger('bot.feed')
 
 bot = Bot(token=os.getenv('TELEGRAM_BOT_TOKEN'))
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
-db = Database()
+dp.update.outer_middleware(LogContextMiddleware())
+db = MemoryDatabase() if DATABASE_BACKEND == 'memory' else Database()
+leaderboard_service = LeaderboardService(db)
+username_index = UsernameIndex(db)
+order_geo = OrderGeoIndex(db)
+chat_writer = ChatMessageWriter(db)
+retention_engine = RetentionEngine(
+    db,
+    batch_size=RETENTION_BATCH_SIZE,
+    batch_pause=RETENTION_BATCH_PAUSE,
+    max_batches=RETENTION_MAX_BATCHES,
+    interval=RETENTION_INTERVAL
+)
+order_archiver = OrderArchiver(db, batch_size=ARCHIVE_BATCH_SIZE, interval=ARCHIVE_INTERVAL)
+handler_tracer = HandlerTracer(slow_update_ms=SLOW_UPDATE_MS, window=HANDLER_TRACE_WINDOW)
+handler_tracer.install(dp, bot, db.metrics)
+edit_coordinator = EditCoordinator(bot)
+bot.session.middleware(edit_coordinator.middleware())
+message_cleanup = MessageCleanup(bot)
+update_recorder = UpdateRecorder(RECORD_UPDATES_PATH, RECORD_UPDATES_SALT) if RECORD_UPDATES_PATH else None
+if update_recorder:
+    dp.update.outer_middleware(update_recorder.middleware())
+runtime_health = RuntimeHealth(db, interval=HEALTH_WATCHDOG_INTERVAL, max_loop_lag=HEALTH_MAX_LOOP_LAG)
+runtime_health.install(dp)
+runtime_health.add_queue('chat_messages', chat_writer)
+runtime_health.add_queue('message_cleanup', message_cleanup)
+if update_recorder:
+    runtime_health.add_queue('update_recorder', update_recorder)
+# После runtime_health: при остановке бот сначала перестаёт быть готовым, потом дожидается апдейтов
+update_journal = UpdateJournal(UPDATE_JOURNAL_PATH, drain_timeout=SHUTDOWN_DRAIN_TIMEOUT)
+update_journal.install(dp)
+runtime_health.add_queue('update_journal', update_journal)
 
 last_command_time: Dict[int, datetime] = {}
 running_start_tasks: Dict[int, asyncio.Task] = {}
@@ -49,8 +102,7 @@ def _run_background(coro: Coroutine[Any, Any, Any], *, name: str) -> asyncio.Tas
 
 async def _delete_user_message(chat_id: int, message_id: int):
     """Удаляет исходное сообщение пользователя, не блокируя /start."""
-    with contextlib.suppress(asyncio.TimeoutError, Exception):
-        await asyncio.wait_for(bot.delete_message(chat_id, message_id), timeout=1.5)
+    message_cleanup.schedule(chat_id, message_id)
 
 
 async def _cleanup_previous_bot_message(user_id: int, chat_id: int):
@@ -69,11 +121,7 @@ async def _cleanup_previous_bot_message(user_id: int, chat_id: int):
     if not last_bot_msg or last_bot_msg.get('chat_id') != chat_id:
         return
 
-    with contextlib.suppress(asyncio.TimeoutError, Exception):
-        await asyncio.wait_for(
-            bot.delete_message(chat_id, last_bot_msg['last_bot_message_id']),
-            timeout=1.5,
-        )
+    message_cleanup.schedule(chat_id, last_bot_msg['last_bot_message_id'])
 
 ADMIN_CODE = "4577"
 
@@ -115,9 +163,21 @@ class AdminResetOrder(StatesGroup):
 class Chat(StatesGroup):
     messaging = State()
 
+if update_recorder:
+    # Переписка заказчика и исполнителя в запись апдейтов открытым текстом не попадает
+    update_recorder.private_states.add(Chat.messaging.state)
+
 class OrderFeed(StatesGroup):
     page = State()
 
+class FeedNearby(StatesGroup):
+    waiting_location = State()
+
+class FeedFilter(StatesGroup):
+    query = State()
+    location = State()
+    preset_name = State()
+
 class ViewReviews(StatesGroup):
     page = State()
     executor_id = State()
@@ -320,8 +380,8 @@ async def get_main_menu_text(user_id: int = None):
     # Получаем количество пользователей
     users_count = 0
     try:
-        users = await db.get_all_users(limit=1000)
-        users_count = len(users)
+        stats = await db.get_stats()
+        users_count = stats['total_users']
     except Exception as e:
         logger.debug(f"Ошибка при получении пользователей: {e}")
         users_count = 0
@@ -329,7 +389,7 @@ async def get_main_menu_text(user_id: int = None):
     # Получаем топ лидеров по рейтингу
     leaderboard_text = ""
     try:
-        top_rated = await db.get_leaderboard('executor', 2)
+        top_rated = await leaderboard_service.top(2)
         if top_rated:
             for exec in top_rated:
                 username = exec['username'] if exec['username'] else exec['first_name'] or 'Пользователь'
@@ -353,13 +413,8 @@ async def get_main_menu_text(user_id: int = None):
     )
 
 async def delete_messages(chat_id: int, message_ids: list):
-    """Удаляет список сообщений из чата"""
-    for msg_id in message_ids:
-        try:
-            await bot.delete_message(chat_id, msg_id)
-        except Exception as e:
-            logger.debug(f"Не удалось удалить сообщение {msg_id}: {e}")
-            pass
+    """Ставит список сообщений чата в очередь на удаление (deleteMessages в фоне)"""
+    message_cleanup.schedule_many(chat_id, message_ids)
 
 async def smart_send(user_id: int, chat_id: int, text: str, reply_markup=None, parse_mode="HTML", delete_user_msg_id: int = None):
     """
@@ -367,19 +422,17 @@ async def smart_send(user_id: int, chat_id: int, text: str, reply_markup=None, p
     Также удаляет сообщение пользователя если указан delete_user_msg_id.
     """
     if delete_user_msg_id:
-        try:
-            await bot.delete_message(chat_id, delete_user_msg_id)
-        except Exception as e:
-            logger.debug(f"Не удалось удалить сообщение пользователя {delete_user_msg_id}: {e}")
+        message_cleanup.schedule(chat_id, delete_user_msg_id)
     
     last_msg = await db.get_last_bot_message(user_id)
     
-    if last_msg and last_msg['chat_id'] == chat_id:
+    if (last_msg and last_msg['chat_id'] == chat_id
+            and not message_cleanup.is_scheduled(chat_id, last_msg['last_bot_message_id'])):
         try:
-            await bot.edit_message_text(
-                text=text,
-                chat_id=chat_id,
-                message_id=last_msg['last_bot_message_id'],
+            await edit_coordinator.edit_text(
+                chat_id,
+                last_msg['last_bot_message_id'],
+                text,
                 reply_markup=reply_markup,
                 parse_mode=parse_mode
             )
@@ -387,10 +440,7 @@ async def smart_send(user_id: int, chat_id: int, text: str, reply_markup=None, p
             return last_msg['last_bot_message_id']
         except Exception as e:
             logger.debug(f"Не удалось отредактировать сообщение: {e}")
-            try:
-                await bot.delete_message(chat_id, last_msg['last_bot_message_id'])
-            except:
-                pass
+            message_cleanup.schedule(chat_id, last_msg['last_bot_message_id'])
     
     sent_msg = await bot.send_message(
         chat_id=chat_id,
@@ -409,8 +459,10 @@ async def smart_edit_or_send(callback: types.CallbackQuery, text: str, reply_mar
     chat_id = callback.message.chat.id
     
     try:
-        await callback.message.edit_text(
-            text=text,
+        await edit_coordinator.edit_text(
+            chat_id,
+            callback.message.message_id,
+            text,
             reply_markup=reply_markup,
             parse_mode=parse_mode
         )
@@ -428,10 +480,7 @@ async def delete_and_send(message: types.Message, text: str, reply_markup=None,
     user_id = message.from_user.id
     chat_id = message.chat.id
     
-    try:
-        await message.delete()
-    except Exception as e:
-        logger.debug(f"Не удалось удалить сообщение пользователя: {e}")
+    message_cleanup.schedule(chat_id, message.message_id)
     
     return await smart_send(user_id, chat_id, text, reply_markup, parse_mode)
 
@@ -463,10 +512,7 @@ async def cmd_start(message: types.Message, state: FSMContext):
     # Удаляем последнее сообщение бота для очистки чата
     last_msg = await db.get_last_bot_message(message.from_user.id)
     if last_msg and last_msg['chat_id'] == message.chat.id:
-        try:
-            await bot.delete_message(message.chat.id, last_msg['last_bot_message_id'])
-        except Exception as e:
-            logger.debug(f"Не удалось удалить предыдущее сообщение бота: {e}")
+        message_cleanup.schedule(message.chat.id, last_msg['last_bot_message_id'])
     
     if await check_banned(message.from_user.id):
         await delete_and_send(message, "❌ Вы заблокированы в системе.")
@@ -504,18 +550,13 @@ async def switch_role(message: types.Message, state: FSMContext):
     user = await db.get_user(user_id)
     current_role = user.get('user_role', 'customer')
     
-    logger.info(f"Текущая роль пользователя {user_id}: {current_role}")
-    
     # Переключаем роль
     new_role = 'executor' if current_role == 'customer' else 'customer'
     await db.update_role(user_id, new_role)
-    logger.info(f"Роль изменена на: {new_role}")
+    logger.info("Роль пользователя %s: %s → %s", user_id, current_role, new_role)
     
     # Удаляем команду пользователя
-    try:
-        await message.delete()
-    except Exception as e:
-        logger.debug(f"Не удалось удалить команду /s: {e}")
+    message_cleanup.schedule(message.chat.id, message.message_id)
     
     # Получаем обновленное меню с новой ролью
     menu_text = await get_main_menu_text(user_id)
@@ -526,28 +567,53 @@ async def switch_role(message: types.Message, state: FSMContext):
         last_msg = await db.get_last_bot_message(user_id)
         
         if last_msg:
-            logger.info(f"Попытка редактирования сообщения {last_msg['last_bot_message_id']} в чате {last_msg['chat_id']}")
+            logger.debug("Редактируем меню %s в чате %s", last_msg['last_bot_message_id'], last_msg['chat_id'])
             try:
-                await bot.edit_message_text(
-                    text=menu_text,
-                    chat_id=last_msg['chat_id'],
-                    message_id=last_msg['last_bot_message_id'],
+                await edit_coordinator.edit_text(
+                    last_msg['chat_id'],
+                    last_msg['last_bot_message_id'],
+                    menu_text,
                     reply_markup=kb,
                     parse_mode="HTML"
                 )
-                logger.info(f"✅ Меню успешно отредактировано (ID: {last_msg['last_bot_message_id']})")
+                logger.debug("Меню %s отредактировано", last_msg['last_bot_message_id'])
                 return
             except Exception as edit_error:
-                logger.error(f"❌ Не удалось отредактировать сообщение {last_msg['last_bot_message_id']}: {edit_error}")
+                logger.error("❌ Не удалось отредактировать сообщение %s: %s", last_msg['last_bot_message_id'], edit_error)
         
         # Если редактирование не прошло или нет последнего сообщения, отправляем новое
-        logger.info(f"Отправляем новое меню пользователю {user_id}")
         msg = await bot.send_message(chat_id, menu_text, reply_markup=kb, parse_mode="HTML")
         await db.save_last_bot_message(user_id, msg.message_id, chat_id)
-        logger.info(f"✅ Новое меню отправлено: {msg.message_id}")
+        logger.debug("Новое меню %s отправлено пользователю %s", msg.message_id, user_id)
         
     except Exception as e:
-        logger.error(f"❌ Ошибка при обновлении меню: {e}", exc_info=True)
+        logger.error("❌ Ошибка при обновлении меню: %s", e, exc_info=True)
+
+@dp.message(Command("dbtop"))
+async def db_top_queries(message: types.Message):
+    """Команда /dbtop: топ-10 запросов к БД по суммарному времени (только админ)"""
+    user = await db.get_user(message.from_user.id)
+    if not user or not user['is_admin']:
+        return
+
+    top = db.metrics.top(10)
+    if not top:
+        await message.answer("📈 Запросов к БД пока не было")
+        return
+
+    lines = ["📈 <b>Топ-10 запросов к БД по суммарному времени</b>\n"]
+    for index, (name, stats) in enumerate(top, start=1):
+        latency = stats.latency
+        acquire_ms = stats.acquire.total / stats.acquire.count * 1000 if stats.acquire.count else 0
+        sql = db.metrics.statements.get(name, '')
+        lines.append(
+            f"{index}. <code>{html.escape(name)}</code>\n"
+            f"   вызовов {latency.count}, всего {latency.total * 1000:.0f} мс, "
+            f"среднее {latency.total / latency.count * 1000:.1f} мс, p95 ≤ {latency.quantile(0.95) * 1000:.0f} мс\n"
+            f"   строк {stats.rows}, ошибок {stats.errors}, ожидание пула {acquire_ms:.1f} мс\n"
+            f"   <i>{html.escape(sql[:120])}{'…' if len(sql) > 120 else ''}</i>"
+        )
+    await message.answer("\n".join(lines), parse_mode="HTML")
 
 # ============================================
 # УНИВЕРСАЛЬНЫЕ ОБРАБОТЧИКИ ДЛЯ КНОПОК В СОСТОЯНИЯХ
@@ -607,10 +673,7 @@ async def refresh_chat_handler(callback: types.CallbackQuery, state: FSMContext)
     """Обработчик для кнопки Обновить чат - удаляет текущее сообщение и отправляет новое главное меню"""
     await state.clear()
     
-    try:
-        await callback.message.delete()
-    except Exception as e:
-        logger.debug(f"Не удалось удалить сообщение: {e}")
+    message_cleanup.schedule(callback.message.chat.id, callback.message.message_id)
     
     sent_msg = await bot.send_message(
         callback.message.chat.id,
@@ -757,6 +820,10 @@ async def probiv_menu(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(Probiv.waiting_username)
     await callback.answer()
 
+def format_username_suggestions(suggestions) -> str:
+    lines = "\n".join(f"• <code>@{name}</code>" for name in suggestions)
+    return f"❓ Возможно, вы имели в виду:\n{lines}\n"
+
 @dp.message(Probiv.waiting_username)
 async def probiv_check_user(message: types.Message, state: FSMContext):
     if message.text == "❌ Отмена":
@@ -777,6 +844,18 @@ async def probiv_check_user(message: types.Message, state: FSMContext):
     user = await db.get_user_by_username(username)
     
     if not user:
+        suggestions = await username_index.suggest(username)
+        if suggestions:
+            # Остаёмся в режиме ввода: можно сразу отправить ник из подсказки
+            await delete_and_send(
+                message,
+                f"❌ Пользователь {html.escape(username)} не найден в системе.\n\n"
+                f"{format_username_suggestions(suggestions)}\n"
+                "Введите @username ещё раз:",
+                reply_markup=get_cancel_keyboard(),
+                parse_mode="HTML"
+            )
+            return
         main_menu_text = await get_main_menu_text(message.from_user.id)
         error_text = f"❌ Пользователь {username} не найден в системе.\n\n{main_menu_text}"
         await delete_and_send(
@@ -790,7 +869,8 @@ async def probiv_check_user(message: types.Message, state: FSMContext):
     
     # Получаем профили и отзывы
     executor_profile = await db.get_executor_profile(user['user_id'])
-    reviews = await db.get_reviews(user['user_id'])
+    rating_summary = await db.get_rating_summary(user['user_id'])
+    reviews = (await db.get_reviews_page(user['user_id'], limit=10))['reviews']
     
     # Формируем информацию
     text = f"🔍 <b>Пробив пользователя @{user['username']}</b>\n\n"
@@ -804,8 +884,11 @@ async def probiv_check_user(message: types.Message, state: FSMContext):
     
     # Отзывы
     if reviews:
-        text += f"💬 <b>Отзывы ({len(reviews)}):</b>\n\n"
-        for review in reviews[:10]:  # Показываем последние 10
+        histogram = rating_summary['histogram']
+        text += f"💬 <b>Отзывы ({rating_summary['reviews_count']}):</b>\n"
+        text += f"⭐ Средняя оценка: {rating_summary['avg_rating']:.2f}\n"
+        text += " ".join(f"{stars}★ {histogram[stars]}" for stars in range(5, 0, -1)) + "\n\n"
+        for review in reviews:  # Последние 10
             reviewer = f"@{review['username']}" if review['username'] else review['first_name']
             text += f"Оценка: {review['rating']}/5\n"
             text += f"От: {reviewer}\n"
@@ -814,8 +897,8 @@ async def probiv_check_user(message: types.Message, state: FSMContext):
             review_date = review['created_at'].strftime("%d.%m.%Y")
             text += f"📅 {review_date}\n\n"
         
-        if len(reviews) > 10:
-            text += f"<i>Показано 10 из {len(reviews)} отзывов</i>\n"
+        if rating_summary['reviews_count'] > 10:
+            text += f"<i>Показано 10 из {rating_summary['reviews_count']} отзывов</i>\n"
     else:
         text += "💬 <b>Отзывов пока нет</b>\n"
     
@@ -1282,7 +1365,9 @@ async def complaint_user_username(message: types.Message, state: FSMContext):
     user = await db.get_user_by_username(username)
     
     if not user:
-        await delete_and_send(message, f"❌ Пользователь @{username} не найден в системе")
+        suggestions = await username_index.suggest(username)
+        hint = f"\n\n{format_username_suggestions(suggestions)}" if suggestions else ""
+        await delete_and_send(message, f"❌ Пользователь @{html.escape(username)} не найден в системе{hint}", parse_mode="HTML")
         return
     
     await state.update_data(target_user_id=str(user['user_id']))
@@ -1481,9 +1566,19 @@ async def create_order_start_time(message: types.Message, state: FSMContext):
         return
     
     await state.update_data(start_time=message.text)
-    await delete_and_send(message, "📍 Введите адрес, где нужно выполнить работу:")
+    await delete_and_send(
+        message,
+        "📍 Введите адрес, где нужно выполнить работу:\n\n"
+        "<i>Можно также отправить геопозицию (📎 → Геопозиция) — исполнители рядом увидят заказ первым.</i>"
+    )
     await state.set_state(CreateOrder.address)
 
+@dp.message(CreateOrder.address, F.location)
+async def create_order_location(message: types.Message, state: FSMContext):
+    # Геопозиция необязательна: сохраняем координаты и всё равно просим адрес текстом
+    await state.update_data(latitude=message.location.latitude, longitude=message.location.longitude)
+    await delete_and_send(message, "📍 Геопозиция прикреплена к заказу.\n\nТеперь введите адрес текстом:")
+
 @dp.message(CreateOrder.address)
 async def create_order_address(message: types.Message, state: FSMContext):
     if message.text == "❌ Отмена":
@@ -1491,6 +1586,10 @@ async def create_order_address(message: types.Message, state: FSMContext):
         await delete_and_send(message, "Отменено.", reply_markup=await get_customer_menu_with_counts(message.from_user.id))
         return
     
+    if not message.text:
+        await delete_and_send(message, "📍 Введите адрес текстом или отправьте геопозицию (📎 → Геопозиция)")
+        return
+    
     await state.update_data(address=message.text)
     await delete_and_send(message, "Сколько исполнителей нужно?")
     await state.set_state(CreateOrder.workers_count)
@@ -1569,7 +1668,10 @@ async def publish_order(callback: types.CallbackQuery, state: FSMContext):
         data['address'],
         data['workers_count'],
         data['comment'],
-        data.get('phone_number')
+        data.get('phone_number'),
+        work_type=data.get('work_type'),
+        latitude=data.get('latitude'),
+        longitude=data.get('longitude')
     )
     
     await db.update_customer_stats(callback.from_user.id)
@@ -1884,10 +1986,7 @@ async def my_orders(message: types.Message, state: FSMContext):
         await delete_and_send(message, "❌ Вы заблокированы в системе.")
         return
     
-    try:
-        await message.delete()
-    except:
-        pass
+    message_cleanup.schedule(message.chat.id, message.message_id)
     
     orders = await db.get_customer_orders(message.from_user.id)
     
@@ -1936,8 +2035,7 @@ async def show_response_card(callback, state, order_id, idx, responses=None):
     resp = responses[idx]
     total = len(responses)
     
-    reviews = await db.get_reviews(resp['executor_id'])
-    reviews_count = len(reviews) if reviews else 0
+    reviews_count = (await db.get_rating_summary(resp['executor_id']))['reviews_count']
     
     text = f"👥 <b>Отклики на заказ #{order_id}</b>\n"
     text += f"━━━━━━━━━━━━━━━\n\n"
@@ -2058,12 +2156,42 @@ async def view_executor_profile(callback: types.CallbackQuery, state: FSMContext
     await show_reviews_page(callback.message, executor_id, order_id, 0, state, is_callback=True)
     await callback.answer()
 
-async def show_reviews_page(message: types.Message, executor_id: int, order_id: int, page: int, state: FSMContext, is_callback=False):
-    reviews = await db.get_reviews(executor_id)
+REVIEWS_PAGE_SIZE = 5
+
+def _cursor_callback(prefix: str, page: int, direction: str, cursor: str) -> str:
+    """callback_data для keyset-листания: номер страницы, направление (o/n) и курсор"""
+    return f"{prefix}_{page}_{direction}_{cursor}"
+
+def _parse_cursor_callback(parts: list, offset: int):
+    """Разбирает хвост callback_data из _cursor_callback; пустой хвост — первая страница"""
+    if len(parts) < offset + 3:
+        return 0, 'older', None
+    page = int(parts[offset])
+    direction = 'newer' if parts[offset + 1] == 'n' else 'older'
+    return page, direction, parts[offset + 2]
+
+def _cursor_nav_buttons(prefix: str, page: int, page_data: dict):
+    nav_buttons = []
+    if page_data['prev_cursor']:
+        nav_buttons.append(InlineKeyboardButton(
+            text="⬅️ Назад",
+            callback_data=_cursor_callback(prefix, page - 1, 'n', page_data['prev_cursor'])
+        ))
+    if page_data['next_cursor']:
+        nav_buttons.append(InlineKeyboardButton(
+            text="➡️ Вперёд",
+            callback_data=_cursor_callback(prefix, page + 1, 'o', page_data['next_cursor'])
+        ))
+    return nav_buttons
+
+async def show_reviews_page(message: types.Message, executor_id: int, order_id: int, page: int, state: FSMContext, is_callback=False, cursor: str = None, direction: str = 'older'):
     executor = await db.get_user(executor_id)
     profile = await db.get_executor_profile(executor_id)
+    rating_summary = await db.get_rating_summary(executor_id)
+    reviews_page = await db.get_reviews_page(executor_id, cursor, REVIEWS_PAGE_SIZE, direction)
+    page_reviews = reviews_page['reviews']
     
-    if not reviews:
+    if not page_reviews:
         text = f"👤 <b>Профиль исполнителя</b>\n\n"
         text += f"@{executor['username'] or 'не указан'}\n"
         text += f"⭐ Рейтинг: {profile['rating']}\n"
@@ -2081,24 +2209,16 @@ async def show_reviews_page(message: types.Message, executor_id: int, order_id:
             await message.answer(text, reply_markup=keyboard, parse_mode="HTML")
         return
     
-    page_size = 5
-    total_pages = (len(reviews) + page_size - 1) // page_size
-    
-    if page < 0:
-        page = 0
-    if page >= total_pages:
-        page = total_pages - 1
-    
-    start_idx = page * page_size
-    end_idx = min(start_idx + page_size, len(reviews))
-    page_reviews = reviews[start_idx:end_idx]
+    total_reviews = rating_summary['reviews_count']
+    total_pages = max(1, (total_reviews + REVIEWS_PAGE_SIZE - 1) // REVIEWS_PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
     
     text = f"👤 <b>Профиль исполнителя</b>\n\n"
     text += f"@{executor['username'] or 'не указан'}\n"
     text += f"⭐ Рейтинг: {profile['rating']}\n"
     text += f"📦 Выполнено заказов: {profile['completed_orders']}\n"
     text += f"🏆 Уровень: {profile['level']}\n\n"
-    text += f"💬 <b>Отзывы ({len(reviews)} всего)</b>\n"
+    text += f"💬 <b>Отзывы ({total_reviews} всего)</b>\n"
     text += f"━━━━━━━━━━━━━━━━━\n\n"
     
     for review in page_reviews:
@@ -2113,12 +2233,7 @@ async def show_reviews_page(message: types.Message, executor_id: int, order_id:
         text += f"━━━━━━━━━━━━━━━━━\n"
     
     buttons = []
-    nav_buttons = []
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"reviews_page_{executor_id}_{order_id}_{page - 1}"))
-    if page < total_pages - 1:
-        nav_buttons.append(InlineKeyboardButton(text="➡️ Вперёд", callback_data=f"reviews_page_{executor_id}_{order_id}_{page + 1}"))
-    
+    nav_buttons = _cursor_nav_buttons(f"reviews_page_{executor_id}_{order_id}", page, reviews_page)
     if nav_buttons:
         buttons.append(nav_buttons)
     
@@ -2137,16 +2252,16 @@ async def navigate_reviews(callback: types.CallbackQuery, state: FSMContext):
     parts = callback.data.split("_")
     executor_id = int(parts[2])
     order_id = int(parts[3])
-    page = int(parts[4])
+    page, direction, cursor = _parse_cursor_callback(parts, 4)
     
     await state.update_data(review_page=page)
-    await show_reviews_page(callback.message, executor_id, order_id, page, state, is_callback=True)
+    await show_reviews_page(callback.message, executor_id, order_id, page, state, is_callback=True, cursor=cursor, direction=direction)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("back_from_reviews_"))
 async def back_from_reviews(callback: types.CallbackQuery):
     order_id = int(callback.data.split("_")[3])
-    await callback.message.delete()
+    message_cleanup.schedule(callback.message.chat.id, callback.message.message_id)
     
     responses = await db.get_responses(order_id)
     
@@ -2346,10 +2461,7 @@ async def confirm_delete_all_callback(callback: types.CallbackQuery):
 @dp.callback_query(F.data == "cancel_delete_all_orders")
 async def cancel_delete_all_callback(callback: types.CallbackQuery):
     # Просто удаляем сообщение подтверждения
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    message_cleanup.schedule(callback.message.chat.id, callback.message.message_id)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("confirm_delete_"))
@@ -2421,11 +2533,7 @@ async def cancel_delete_order(callback: types.CallbackQuery):
 async def start_work(callback: types.CallbackQuery):
     order_id = int(callback.data.split("_")[2])
     
-    async with db.pool.acquire() as conn:
-        await conn.execute(
-            'UPDATE orders SET status = \'in_progress\' WHERE order_id = $1',
-            order_id
-        )
+    await db.set_order_status(order_id, 'in_progress')
     
     await callback.message.edit_text("✅ Работа начата! Заказ перешёл в статус 'В процессе'.")
     await db.save_last_bot_message(callback.from_user.id, callback.message.message_id, callback.message.chat.id)
@@ -2480,11 +2588,7 @@ async def confirm_executor_complete_order(callback: types.CallbackQuery):
         return
     
     # Меняем статус заказа на "в процессе завершения" чтобы разблокировать исполнителя
-    async with db.pool.acquire() as conn:
-        await conn.execute(
-            'UPDATE orders SET status = \'awaiting_confirmation\' WHERE order_id = $1',
-            order_id
-        )
+    await db.set_order_status(order_id, 'awaiting_confirmation')
     
     await callback.message.edit_text(
         "✅ <b>Вы отметили работу как завершённую!</b>\n\n"
@@ -2732,8 +2836,6 @@ async def skip_rating_declined(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data == "order_feed")
 async def order_feed_callback(callback: types.CallbackQuery, state: FSMContext):
-    logger.info(f"order_feed_callback triggered by user {callback.from_user.id}")
-    
     if await check_banned(callback.from_user.id):
         await callback.answer("❌ Вы заблокированы в системе.", show_alert=True)
         return
@@ -2742,7 +2844,7 @@ async def order_feed_callback(callback: types.CallbackQuery, state: FSMContext):
         user_id = callback.from_user.id
         chat_id = callback.message.chat.id
         
-        logger.info(f"Opening order feed for user {user_id}, chat {chat_id}")
+        feed_logger.info("Открытие ленты: пользователь %s, чат %s", user_id, chat_id)
         
         await state.clear()
         
@@ -2772,10 +2874,9 @@ async def order_feed_callback(callback: types.CallbackQuery, state: FSMContext):
             return
         
         await show_feed_page_edit(callback.message, user_id, chat_id, 0, state)
-        logger.info(f"Order feed shown successfully for user {user_id}")
         await callback.answer()
     except Exception as e:
-        logger.error(f"Error in order_feed_callback: {e}", exc_info=True)
+        logger.error("Error in order_feed_callback: %s", e, exc_info=True)
         try:
             await callback.answer("Произошла ошибка. Попробуйте снова.", show_alert=True)
         except:
@@ -2790,25 +2891,54 @@ async def feed_orders(message: types.Message, state: FSMContext):
     # Удаляем предыдущее сообщение ленты, если оно есть
     data = await state.get_data()
     if 'feed_message_id' in data:
-        try:
-            await bot.delete_message(message.chat.id, data['feed_message_id'])
-        except:
-            pass
+        message_cleanup.schedule(message.chat.id, data['feed_message_id'])
     
     # Удаляем сообщение пользователя с нажатой кнопкой
-    try:
-        await message.delete()
-    except:
-        pass
+    message_cleanup.schedule(message.chat.id, message.message_id)
     
     await show_feed_page(message.from_user.id, message.chat.id, 0, state)
 
+async def get_feed_orders(user_id: int):
+    """
+    Открытые заказы с учётом сохранённого фильтра исполнителя. Если исполнитель
+    присылал геопозицию, заказы с координатами идут первыми по расстоянию.
+    Возвращает (заказы, фильтр, {order_id: км}).
+    """
+    filters = await db.get_feed_filter(user_id)
+    orders = await db.search_orders(filters) if filters else await db.get_open_orders()
+    distances = {}
+    location = await db.get_user_location(user_id)
+    if location and orders:
+        for order in orders:
+            if order['latitude'] is not None and order['longitude'] is not None:
+                distances[order['order_id']] = haversine_km(
+                    location['latitude'], location['longitude'], order['latitude'], order['longitude']
+                )
+        if distances:
+            # sorted стабилен: заказы без координат сохраняют исходный порядок в конце
+            orders = sorted(orders, key=lambda o: distances.get(o['order_id'], float('inf')))
+    return orders, filters, distances
+
 async def show_feed_page_edit(message: types.Message, user_id: int, chat_id: int, page: int, state: FSMContext):
     """Показывает ленту заказов - 5 заказов на странице с компактным дизайном"""
-    logger.info(f"show_feed_page_edit called: user_id={user_id}, chat_id={chat_id}, page={page}")
+    orders, filters, distances = await get_feed_orders(user_id)
+    feed_logger.info("Лента: пользователь %s, страница %s, заказов %s", user_id, page, len(orders) if orders else 0)
     
-    orders = await db.get_open_orders()
-    logger.info(f"Found {len(orders) if orders else 0} orders")
+    if not orders and filters:
+        try:
+            await message.edit_text(
+                "📱 <b>Лента заказов</b>\n"
+                "━━━━━━━━━━━━━━━\n\n"
+                f"🔍 Фильтр: {format_order_filters(filters)}\n\n"
+                "📭 <b>По фильтру заказов нет</b>\n\n"
+                "Измените или сбросьте фильтр.",
+                reply_markup=get_filters_keyboard(),
+                parse_mode="HTML"
+            )
+            await db.save_last_bot_message(user_id, message.message_id, chat_id)
+        except Exception as e:
+            logger.error(f"Error editing message: {e}")
+        return
     
     if not orders:
         try:
@@ -2842,7 +2972,10 @@ async def show_feed_page_edit(message: types.Message, user_id: int, chat_id: int
     
     text = "📱 <b>Лента заказов</b>\n"
     text += f"━━━━━━━━━━━━━━━\n"
-    text += f"📊 Всего: {len(orders)} | Стр. {page + 1}/{total_pages}\n\n"
+    text += f"📊 Всего: {len(orders)} | Стр. {page + 1}/{total_pages}\n"
+    if filters:
+        text += f"🔍 Фильтр: {format_order_filters(filters)}\n"
+    text += "\n"
     
     keyboard_rows = []
     
@@ -2864,6 +2997,8 @@ async def show_feed_page_edit(message: types.Message, user_id: int, chat_id: int
         text += f"⏰ {order['start_time']} 📍 {order['address'][:25]}{'...' if len(order['address']) > 25 else ''}\n"
         text += f"📝 {order['comment'][:40]}{'...' if len(order['comment']) > 40 else ''}\n"
         text += f"👥 {order['workers_count']} чел. | ⭐ {customer_rating} | {created_date}\n"
+        if order['order_id'] in distances:
+            text += f"📏 {format_distance(distances[order['order_id']])} от вас\n"
         
         if idx < len(page_orders) - 1:
             text += "───────────────\n"
@@ -2881,6 +3016,10 @@ async def show_feed_page_edit(message: types.Message, user_id: int, chat_id: int
         nav_row.append(InlineKeyboardButton(text="▶️", callback_data=f"feed_page_{page + 1}"))
     keyboard_rows.append(nav_row)
     
+    keyboard_rows.append([
+        InlineKeyboardButton(text="🔍 Фильтры" + (" ✓" if filters else ""), callback_data="feed_filters"),
+        InlineKeyboardButton(text="📍 Рядом", callback_data="feed_nearby")
+    ])
     keyboard_rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_executor_menu")])
     
     feed_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
@@ -2894,10 +3033,22 @@ async def show_feed_page_edit(message: types.Message, user_id: int, chat_id: int
 
 async def show_feed_page(user_id: int, chat_id: int, page: int, state: FSMContext):
     """Показывает ленту заказов - 5 заказов на странице с компактным дизайном"""
-    logger.info(f"show_feed_page called: user_id={user_id}, chat_id={chat_id}, page={page}")
+    orders, filters, distances = await get_feed_orders(user_id)
+    feed_logger.info("Лента: пользователь %s, страница %s, заказов %s", user_id, page, len(orders) if orders else 0)
     
-    orders = await db.get_open_orders()
-    logger.info(f"Found {len(orders) if orders else 0} orders")
+    if not orders and filters:
+        msg = await bot.send_message(
+            chat_id,
+            "📱 <b>Лента заказов</b>\n"
+            "━━━━━━━━━━━━━━━\n\n"
+            f"🔍 Фильтр: {format_order_filters(filters)}\n\n"
+            "📭 <b>По фильтру заказов нет</b>\n\n"
+            "Измените или сбросьте фильтр.",
+            reply_markup=get_filters_keyboard(),
+            parse_mode="HTML"
+        )
+        await db.save_last_bot_message(user_id, msg.message_id, chat_id)
+        return
     
     if not orders:
         msg = await bot.send_message(
@@ -2929,7 +3080,10 @@ async def show_feed_page(user_id: int, chat_id: int, page: int, state: FSMContex
     
     text = "📱 <b>Лента заказов</b>\n"
     text += f"━━━━━━━━━━━━━━━\n"
-    text += f"📊 Всего: {len(orders)} | Стр. {page + 1}/{total_pages}\n\n"
+    text += f"📊 Всего: {len(orders)} | Стр. {page + 1}/{total_pages}\n"
+    if filters:
+        text += f"🔍 Фильтр: {format_order_filters(filters)}\n"
+    text += "\n"
     
     keyboard_rows = []
     
@@ -2951,6 +3105,8 @@ async def show_feed_page(user_id: int, chat_id: int, page: int, state: FSMContex
         text += f"⏰ {order['start_time']} 📍 {order['address'][:25]}{'...' if len(order['address']) > 25 else ''}\n"
         text += f"📝 {order['comment'][:40]}{'...' if len(order['comment']) > 40 else ''}\n"
         text += f"👥 {order['workers_count']} чел. | ⭐ {customer_rating} | {created_date}\n"
+        if order['order_id'] in distances:
+            text += f"📏 {format_distance(distances[order['order_id']])} от вас\n"
         
         if idx < len(page_orders) - 1:
             text += "───────────────\n"
@@ -2968,6 +3124,10 @@ async def show_feed_page(user_id: int, chat_id: int, page: int, state: FSMContex
         nav_row.append(InlineKeyboardButton(text="▶️", callback_data=f"feed_page_{page + 1}"))
     keyboard_rows.append(nav_row)
     
+    keyboard_rows.append([
+        InlineKeyboardButton(text="🔍 Фильтры" + (" ✓" if filters else ""), callback_data="feed_filters"),
+        InlineKeyboardButton(text="📍 Рядом", callback_data="feed_nearby")
+    ])
     keyboard_rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_executor_menu")])
     
     feed_keyboard = InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
@@ -2984,6 +3144,85 @@ async def navigate_feed(callback: types.CallbackQuery, state: FSMContext):
     await show_feed_page_edit(callback.message, callback.from_user.id, callback.message.chat.id, page, state)
     await callback.answer()
 
+NEARBY_RADIUS_KM = 50
+NEARBY_LIMIT = 10
+
+async def build_nearby_text(user_id: int, latitude: float, longitude: float):
+    nearby = await order_geo.nearest_orders(latitude, longitude, NEARBY_LIMIT, NEARBY_RADIUS_KM)
+    
+    text = "📍 <b>Заказы рядом с вами</b>\n"
+    text += "━━━━━━━━━━━━━━━\n\n"
+    keyboard_rows = []
+    if not nearby:
+        text += f"📭 В радиусе {NEARBY_RADIUS_KM} км заказов с геопозицией нет.\n"
+    for distance, order in nearby:
+        text += f"<b>#{order['order_id']}</b> 💰 {order['price']} ₽ — 📏 {format_distance(distance)}\n"
+        text += f"📍 {order['address'][:40]}{'...' if len(order['address']) > 40 else ''}\n"
+        text += f"⏰ {order['start_time']} | 👥 {order['workers_count']} чел.\n\n"
+        keyboard_rows.append([InlineKeyboardButton(
+            text=f"✋ #{order['order_id']} — {format_distance(distance)}",
+            callback_data=f"take_order_{order['order_id']}"
+        )])
+    keyboard_rows.append([InlineKeyboardButton(text="🔄 Обновить геопозицию", callback_data="feed_nearby_update")])
+    keyboard_rows.append([InlineKeyboardButton(text="📱 Вся лента", callback_data="feed_page_0")])
+    return text, InlineKeyboardMarkup(inline_keyboard=keyboard_rows)
+
+async def request_location(callback: types.CallbackQuery, state: FSMContext):
+    await callback.message.answer(
+        "📍 Отправьте геопозицию кнопкой ниже — покажем заказы рядом.\n"
+        "Координаты используются только для сортировки ленты.",
+        reply_markup=ReplyKeyboardMarkup(
+            keyboard=[
+                [KeyboardButton(text="📍 Отправить геопозицию", request_location=True)],
+                [KeyboardButton(text="❌ Отмена")]
+            ],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+    )
+    await state.set_state(FeedNearby.waiting_location)
+
+@dp.callback_query(F.data == "feed_nearby")
+async def feed_nearby(callback: types.CallbackQuery, state: FSMContext):
+    if await check_banned(callback.from_user.id):
+        await callback.answer("❌ Вы заблокированы в системе.", show_alert=True)
+        return
+    
+    location = await db.get_user_location(callback.from_user.id)
+    if not location:
+        await request_location(callback, state)
+        await callback.answer()
+        return
+    
+    text, keyboard = await build_nearby_text(callback.from_user.id, location['latitude'], location['longitude'])
+    await smart_edit_or_send(callback, text, reply_markup=keyboard, parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(F.data == "feed_nearby_update")
+async def feed_nearby_update(callback: types.CallbackQuery, state: FSMContext):
+    await request_location(callback, state)
+    await callback.answer()
+
+@dp.message(FeedNearby.waiting_location)
+@dp.message(StateFilter(None), F.location)
+async def feed_location_received(message: types.Message, state: FSMContext):
+    if message.text == "❌ Отмена":
+        await state.set_state(None)
+        await message.answer("Отменено.", reply_markup=ReplyKeyboardRemove())
+        return
+    if not message.location:
+        await message.answer("📍 Нажмите кнопку «Отправить геопозицию» или «❌ Отмена»")
+        return
+    
+    await state.set_state(None)
+    await db.save_user_location(message.from_user.id, message.location.latitude, message.location.longitude)
+    # Убираем reply-клавиатуру с кнопкой геопозиции
+    notice = await message.answer("📍 Геопозиция сохранена", reply_markup=ReplyKeyboardRemove())
+    message_cleanup.schedule(notice.chat.id, notice.message_id)
+    
+    text, keyboard = await build_nearby_text(message.from_user.id, message.location.latitude, message.location.longitude)
+    await delete_and_send(message, text, reply_markup=keyboard)
+
 @dp.callback_query(F.data.startswith("take_order_"))
 async def take_order(callback: types.CallbackQuery):
     order_id = int(callback.data.split("_")[2])
@@ -2999,12 +3238,13 @@ async def take_order(callback: types.CallbackQuery):
     
     order = await db.get_order(order_id)
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    message_cleanup.schedule(callback.message.chat.id, callback.message.message_id)
     
-    await smart_edit_or_send(callback, "✅ Отклик отправлен! Ожидайте подтверждения от заказчика.")
+    # Карточка заказа уже в очереди на удаление — подтверждение не редактируется в неё
+    await smart_send(
+        callback.from_user.id, callback.message.chat.id,
+        "✅ Отклик отправлен! Ожидайте подтверждения от заказчика."
+    )
     
     try:
         profile = await db.get_executor_profile(callback.from_user.id)
@@ -3671,13 +3911,13 @@ async def my_profile(callback: types.CallbackQuery):
     
     user = await db.get_user(callback.from_user.id)
     profile = await db.get_executor_profile(callback.from_user.id)
-    reviews = await db.get_reviews(callback.from_user.id)
+    rating_summary = await db.get_rating_summary(callback.from_user.id)
     
     days_in_project = (datetime.now() - user['created_at']).days
     username_str = f"@{user['username']}" if user['username'] else "не указан"
     
     # Gamification elements
-    review_count = len(reviews)
+    review_count = rating_summary['reviews_count']
     completed = profile['completed_orders']
     rating = profile['rating']
     
@@ -3734,37 +3974,48 @@ async def my_profile(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data.startswith("show_reviews_"))
 async def show_all_reviews(callback: types.CallbackQuery):
-    user_id = int(callback.data.split("_")[2])
-    reviews = await db.get_reviews(user_id)
+    parts = callback.data.split("_")
+    user_id = int(parts[2])
+    page, direction, cursor = _parse_cursor_callback(parts, 3)
+    
+    rating_summary = await db.get_rating_summary(user_id)
+    reviews_page = await db.get_reviews_page(user_id, cursor, REVIEWS_PAGE_SIZE, direction)
+    reviews = reviews_page['reviews']
     
     if not reviews:
         await callback.answer("💬 Отзывов пока нет", show_alert=True)
         return
     
-    text = f"<b>Все отзывы ({len(reviews)}):</b>\n\n"
+    total_reviews = rating_summary['reviews_count']
+    total_pages = max(1, (total_reviews + REVIEWS_PAGE_SIZE - 1) // REVIEWS_PAGE_SIZE)
+    page = max(0, min(page, total_pages - 1))
+    
+    text = f"<b>Все отзывы ({total_reviews}):</b>\n\n"
     for review in reviews:
         text += f"Оценка: {review['rating']}/5\n"
         text += f"От: @{review['username'] or 'не указан'}\n"
         if review['comment']:
-            text += f"💬 {review['comment']}\n"
+            # Страница из 5 отзывов с обрезанными комментариями не упрётся в лимит 4096
+            comment = review['comment'][:500]
+            if len(review['comment']) > 500:
+                comment += "..."
+            text += f"💬 {comment}\n"
         text += "\n"
     
-    back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="my_profile")]
-    ])
-    await smart_edit_or_send(callback, text, reply_markup=back_keyboard, parse_mode="HTML")
+    buttons = []
+    nav_buttons = _cursor_nav_buttons(f"show_reviews_{user_id}", page, reviews_page)
+    if nav_buttons:
+        buttons.append(nav_buttons)
+    buttons.append([InlineKeyboardButton(text=f"📄 Страница {page + 1}/{total_pages}", callback_data="page_info")])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="my_profile")])
+    
+    await smart_edit_or_send(callback, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
     await callback.answer()
 
-@dp.callback_query(F.data == "leaderboard")
-async def leaderboard(callback: types.CallbackQuery):
-    if await check_banned(callback.from_user.id):
-        await callback.answer("❌ Вы заблокированы в системе.", show_alert=True)
-        return
-    
-    # Получаем топ активных за 24 часа
-    active_24h = await db.get_top_active_executors_24h(3)
-    
-    executors = await db.get_leaderboard('executor', 10)
+async def build_leaderboard_text(user_id: int, footer: str) -> str:
+    """Текст экрана топа из материализованного лидерборда (без запросов к orders)"""
+    active_24h = await leaderboard_service.top_active_24h(3)
+    executors = await leaderboard_service.top(10)
     
     text = "🏆 <b>Топ юзеров</b>\n"
     text += "━━━━━━━━━━━━━━━\n\n"
@@ -3795,8 +4046,22 @@ async def leaderboard(callback: types.CallbackQuery):
     if not executors:
         text += "😔 Пока нет исполнителей в рейтинге\n\n"
     
+    # Позиция текущего пользователя, если он есть в рейтинге
+    rank = await leaderboard_service.rank_of(user_id)
+    if rank:
+        text += f"📍 Ваша позиция: <b>#{rank[0]}</b> из {rank[1]}\n\n"
+    
     text += "━━━━━━━━━━━━━━━\n"
-    text += "💡 Выполняйте заказы, чтобы попасть в топ!"
+    text += footer
+    return text
+
+@dp.callback_query(F.data == "leaderboard")
+async def leaderboard(callback: types.CallbackQuery):
+    if await check_banned(callback.from_user.id):
+        await callback.answer("❌ Вы заблокированы в системе.", show_alert=True)
+        return
+    
+    text = await build_leaderboard_text(callback.from_user.id, "💡 Выполняйте заказы, чтобы попасть в топ!")
     
     back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_executor_menu")]
@@ -3811,42 +4076,7 @@ async def top_executors(callback: types.CallbackQuery):
         await callback.answer("❌ Вы заблокированы в системе.", show_alert=True)
         return
     
-    # Получаем топ активных за 24 часа
-    active_24h = await db.get_top_active_executors_24h(3)
-    
-    executors = await db.get_leaderboard('executor', 10)
-    
-    text = "🏆 <b>Топ юзеров</b>\n"
-    text += "━━━━━━━━━━━━━━━\n\n"
-    
-    # Добавляем счетчик активных за 24 часа
-    if active_24h:
-        text += "🔥 <b>Топ активных (24ч):</b>\n"
-        for i, exec in enumerate(active_24h, 1):
-            username = f"@{exec['username']}" if exec['username'] else exec['first_name'] or 'Пользователь'
-            text += f"{i}. {username} - <b>{exec['orders_24h']} заказов</b>\n"
-        text += "\n"
-    
-    medals = ["🥇", "🥈", "🥉"]
-    for i, exec in enumerate(executors):
-        if i < 3:
-            medal = medals[i]
-        else:
-            medal = f"<b>{i+1}.</b>"
-        
-        username = f"@{exec['username']}" if exec['username'] else exec['first_name'] or 'Пользователь'
-        level_emoji = {"новичок": "🌱", "опытный": "💪", "топ": "👑"}.get(exec['level'], "🌱")
-        
-        text += f"{medal} {username}\n"
-        text += f"    ├ ⭐ Рейтинг: <b>{exec['rating']}</b>\n"
-        text += f"    ├ 📦 Заказов: <b>{exec['completed_orders']}</b>\n"
-        text += f"    └ {level_emoji} <b>{exec['level'].capitalize()}</b>\n\n"
-    
-    if not executors:
-        text += "😔 Пока нет исполнителей в рейтинге\n\n"
-    
-    text += "━━━━━━━━━━━━━━━\n"
-    text += "💡 Лучшие исполнители нашего сервиса!"
+    text = await build_leaderboard_text(callback.from_user.id, "💡 Лучшие исполнители нашего сервиса!")
     
     back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_customer")]
@@ -3885,46 +4115,132 @@ async def top_executors(callback: types.CallbackQuery):
 #         
 #         await message.answer(text, parse_mode="HTML")
 
-@dp.callback_query(F.data.startswith("open_chat_"))
-async def open_chat(callback: types.CallbackQuery, state: FSMContext):
-    order_id = int(callback.data.split("_")[2])
+CHAT_HISTORY_PAGE_SIZE = 10
+
+async def show_chat_page(callback: types.CallbackQuery, order_id: int, page: int = 0, cursor: str = None, direction: str = 'older'):
+    """Страница истории чата по заказу; возвращает (chat_id, id собеседника) или None, если доступа нет"""
     order = await db.get_order(order_id)
-    
     if not order:
         await callback.answer("Заказ не найден", show_alert=True)
-        return
+        return None
     
     if callback.from_user.id == order['customer_id']:
         chat_partner_id = order['executor_id']
-        partner = await db.get_user(chat_partner_id)
-        partner_name = partner['first_name']
     elif callback.from_user.id == order['executor_id']:
         chat_partner_id = order['customer_id']
-        partner = await db.get_user(chat_partner_id)
-        partner_name = partner['first_name']
     else:
         await callback.answer("У вас нет доступа к этому чату", show_alert=True)
-        return
+        return None
+    partner = await db.get_user(chat_partner_id)
+    partner_name = partner['first_name'] if partner else "—"
     
     chat_id = await db.get_or_create_chat(order_id, order['customer_id'], order['executor_id'])
-    messages = await db.get_chat_messages(chat_id)
+    # Сообщения из очереди записи должны попасть в историю и счётчики до чтения;
+    # при недоступной БД чат открывается без них, а не ждёт фоновый сброс
+    if not await chat_writer.flush_before_read():
+        logger.debug("Очередь сообщений чата не сброшена перед чтением истории")
+    unread = await db.get_unread_count(callback.from_user.id, chat_id)
+    history = await db.get_chat_history(chat_id, cursor, CHAT_HISTORY_PAGE_SIZE, direction)
     
     text = f"💬 <b>Чат по заказу #{order_id}</b>\n"
-    text += f"С пользователем: {partner_name}\n\n"
-    
-    if messages:
-        for msg in reversed(messages[-10:]):
-            text += f"<b>{msg['first_name']}</b>: {msg['message']}\n"
+    text += f"С пользователем: {html.escape(partner_name)}\n"
+    if unread:
+        text += f"📬 Новых сообщений: <b>{unread}</b>\n"
+    text += "\n"
+    
+    for msg in history['messages']:
+        sent_at = msg['created_at'].strftime('%d.%m %H:%M')
+        body = describe_message(msg['content_type'] or 'text', msg['message'])
+        text += f"<i>{sent_at}</i> <b>{html.escape(msg['first_name'] or '—')}</b>: {html.escape(body)}\n"
+    if history['messages']:
         text += "\n"
     
-    text += "Отправьте сообщение или нажмите /cancel для выхода:"
+    text += "Отправьте сообщение (текст, фото, файл, голосовое) или нажмите «Отмена» для выхода:"
     
-    await smart_edit_or_send(callback, text, reply_markup=get_cancel_keyboard(), parse_mode="HTML")
+    keyboard_rows = []
+    nav_buttons = []
+    prefix = f"chat_hist_{order_id}"
+    if history['next_cursor']:
+        nav_buttons.append(InlineKeyboardButton(
+            text="⬆️ Раньше", callback_data=_cursor_callback(prefix, page + 1, 'o', history['next_cursor'])
+        ))
+    if history['prev_cursor']:
+        nav_buttons.append(InlineKeyboardButton(
+            text="⬇️ Позже", callback_data=_cursor_callback(prefix, page - 1, 'n', history['prev_cursor'])
+        ))
+    if nav_buttons:
+        keyboard_rows.append(nav_buttons)
+    keyboard_rows.append([InlineKeyboardButton(text="❌ Отмена", callback_data="cancel")])
+    
+    await smart_edit_or_send(callback, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=keyboard_rows), parse_mode="HTML")
+    if unread:
+        await db.mark_chat_read(chat_id, callback.from_user.id)
+    return chat_id, chat_partner_id
+
+@dp.callback_query(F.data.startswith("open_chat_"))
+async def open_chat(callback: types.CallbackQuery, state: FSMContext):
+    order_id = int(callback.data.split("_")[2])
+    opened = await show_chat_page(callback, order_id)
+    if not opened:
+        return
     
-    await state.update_data(chat_id=chat_id, chat_partner_id=chat_partner_id)
+    chat_id, chat_partner_id = opened
+    await state.update_data(chat_id=chat_id, chat_partner_id=chat_partner_id, chat_order_id=order_id)
     await state.set_state(Chat.messaging)
     await callback.answer()
 
+@dp.callback_query(F.data.startswith("chat_hist_"))
+async def chat_history_page(callback: types.CallbackQuery, state: FSMContext):
+    parts = callback.data.split("_")
+    order_id = int(parts[2])
+    page, direction, cursor = _parse_cursor_callback(parts, 3)
+    opened = await show_chat_page(callback, order_id, page, cursor, direction)
+    if not opened:
+        return
+    
+    chat_id, chat_partner_id = opened
+    await state.update_data(chat_id=chat_id, chat_partner_id=chat_partner_id, chat_order_id=order_id)
+    await state.set_state(Chat.messaging)
+    await callback.answer()
+
+async def relay_chat_message(message: types.Message, chat_partner_id: int, order_id: int = None):
+    """
+    Доставляет сообщение собеседнику: текст — одним send_message с заголовком,
+    вложения — copy_message (файл не скачивается и не загружается заново)
+    """
+    header = f"💬 <b>Новое сообщение от {html.escape(message.from_user.first_name or '')}</b>"
+    if order_id:
+        header += f" · заказ #{order_id}"
+    reply_markup = None
+    if order_id:
+        reply_markup = InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="💬 Ответить", callback_data=f"open_chat_{order_id}")]
+        ])
+    
+    if message.text:
+        await bot.send_message(
+            chat_partner_id,
+            f"{header}:\n\n{html.escape(message.text)}",
+            reply_markup=reply_markup,
+            parse_mode="HTML"
+        )
+        return
+    
+    caption = None
+    if message.content_type in CAPTION_CONTENT_TYPES:
+        caption = header + (f":\n\n{html.escape(message.caption)}" if message.caption else "")
+    else:
+        # Стикеры, кружки и геопозиции без подписи — заголовок отдельным сообщением
+        await bot.send_message(chat_partner_id, header, parse_mode="HTML")
+    await bot.copy_message(
+        chat_id=chat_partner_id,
+        from_chat_id=message.chat.id,
+        message_id=message.message_id,
+        caption=caption,
+        parse_mode="HTML" if caption else None,
+        reply_markup=reply_markup
+    )
+
 @dp.message(Chat.messaging)
 async def chat_message(message: types.Message, state: FSMContext):
     if message.text == "❌ Отмена":
@@ -3936,17 +4252,28 @@ async def chat_message(message: types.Message, state: FSMContext):
     chat_id = data['chat_id']
     chat_partner_id = data['chat_partner_id']
     
-    await db.send_message(chat_id, message.from_user.id, message.text)
-    await delete_and_send(message, "✅ Сообщение отправлено")
-    
+    # Сначала доставка собеседнику, запись в БД — в фоне пачкой
+    delivered = True
     try:
-        await bot.send_message(
-            chat_partner_id,
-            f"💬 <b>Новое сообщение от {message.from_user.first_name}:</b>\n\n{message.text}",
-            parse_mode="HTML"
-        )
-    except:
-        pass
+        await relay_chat_message(message, chat_partner_id, data.get('chat_order_id'))
+    except Exception as e:
+        delivered = False
+        logger.debug(f"Не удалось доставить сообщение чата {chat_id} пользователю {chat_partner_id}: {e}")
+    
+    chat_writer.enqueue(
+        chat_id,
+        message.from_user.id,
+        chat_partner_id,
+        message.text or message.caption,
+        content_type=message.content_type,
+        tg_chat_id=message.chat.id,
+        tg_message_id=message.message_id
+    )
+    
+    if delivered:
+        await delete_and_send(message, "✅ Сообщение отправлено")
+    else:
+        await delete_and_send(message, "⚠️ Сообщение сохранено в чате, но собеседнику сейчас не доставлено")
 
 @dp.callback_query(F.data == "back_to_customer")
 async def back_to_customer(callback: types.CallbackQuery):
@@ -4186,36 +4513,221 @@ async def switch_role_menu(callback: types.CallbackQuery):
     )
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("filter_"))
-async def filter_handler(callback: types.CallbackQuery):
-    filter_type = callback.data.replace("filter_", "")
-    filter_names = {
-        "type": "Тип работы",
-        "location": "Локация", 
-        "price": "Цена",
-        "rating": "Рейтинг"
-    }
+def format_order_filters(filters: dict) -> str:
+    if not filters:
+        return "нет"
+    parts = []
+    if filters.get('q'):
+        parts.append(f"«{html.escape(filters['q'])}»")
+    if filters.get('work_type'):
+        parts.append(WORK_TYPE_NAMES.get(filters['work_type'], filters['work_type']))
+    if filters.get('location'):
+        parts.append(f"📍 {html.escape(filters['location'])}")
+    if filters.get('min_price') is not None or filters.get('max_price') is not None:
+        low = f"от {filters['min_price']:g} " if filters.get('min_price') is not None else ""
+        high = f"до {filters['max_price']:g} " if filters.get('max_price') is not None else ""
+        parts.append(f"💰 {low}{high}₽")
+    if filters.get('min_rating') is not None:
+        parts.append(f"⭐ от {filters['min_rating']:g}")
+    return ", ".join(parts)
+
+async def build_filters_menu(user_id: int, notice: str = ""):
+    filters = await db.get_feed_filter(user_id)
+    presets = await db.get_filter_presets(user_id)
+    
+    text = "🔍 <b>Фильтры ленты</b>\n"
+    text += "━━━━━━━━━━━━━━━\n\n"
+    if notice:
+        text += f"{notice}\n\n"
+    text += f"Текущий фильтр: {format_order_filters(filters)}\n"
+    if filters:
+        text += f"📊 Подходящих заказов: <b>{await db.count_orders(filters)}</b>\n"
+    return text, get_filters_keyboard(len(presets))
+
+async def show_filters_menu(callback: types.CallbackQuery, notice: str = ""):
+    text, keyboard = await build_filters_menu(callback.from_user.id, notice)
+    await smart_edit_or_send(callback, text, reply_markup=keyboard, parse_mode="HTML")
+
+async def update_feed_filter(user_id: int, **changes) -> dict:
+    filters = await db.get_feed_filter(user_id)
+    filters.update(changes)
+    return await db.set_feed_filter(user_id, filters)
+
+@dp.callback_query(F.data == "feed_filters")
+async def feed_filters_menu(callback: types.CallbackQuery, state: FSMContext):
+    if await check_banned(callback.from_user.id):
+        await callback.answer("❌ Вы заблокированы в системе.", show_alert=True)
+        return
+    
+    # Выходим из режима ввода, но не трогаем данные ленты (feed_message_id и т.п.)
+    await state.set_state(None)
+    await show_filters_menu(callback)
+    await callback.answer()
+
+@dp.callback_query(F.data == "filter_type")
+async def filter_type_menu(callback: types.CallbackQuery):
+    await smart_edit_or_send(callback, "🔍 <b>Тип работы</b>\n\nВыберите тип:", reply_markup=get_filter_work_types_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(F.data == "filter_price")
+async def filter_price_menu(callback: types.CallbackQuery):
+    await smart_edit_or_send(callback, "💰 <b>Цена</b>\n\nВыберите диапазон:", reply_markup=get_filter_price_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(F.data == "filter_rating")
+async def filter_rating_menu(callback: types.CallbackQuery):
+    await smart_edit_or_send(callback, "⭐ <b>Рейтинг заказчика</b>\n\nМинимальный рейтинг:", reply_markup=get_filter_rating_keyboard(), parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(F.data == "filter_query")
+async def filter_query_start(callback: types.CallbackQuery, state: FSMContext):
     await smart_edit_or_send(
         callback,
-        f"🔍 Фильтр <b>{filter_names.get(filter_type, filter_type)}</b>\n\n"
-        "⚙️ Эта функция находится в разработке.\n"
-        "Скоро вы сможете фильтровать заказы!",
-        reply_markup=await get_executor_menu_with_counts(callback.from_user.id),
+        "🔎 <b>Поиск по тексту</b>\n\n"
+        "Введите слова из описания или адреса (например: <i>грузчики переезд</i>):",
+        reply_markup=get_filter_input_keyboard(),
         parse_mode="HTML"
     )
+    await state.set_state(FeedFilter.query)
     await callback.answer()
 
-@dp.callback_query(F.data == "clear_filters")
-async def clear_filters_handler(callback: types.CallbackQuery):
+@dp.callback_query(F.data == "filter_location")
+async def filter_location_start(callback: types.CallbackQuery, state: FSMContext):
     await smart_edit_or_send(
         callback,
-        "✅ Фильтры сброшены!\n\n"
-        "⚙️ Функция фильтрации находится в разработке.",
-        reply_markup=await get_executor_menu_with_counts(callback.from_user.id),
+        "📍 <b>Локация</b>\n\n"
+        "Введите часть адреса (улица, район, город):",
+        reply_markup=get_filter_input_keyboard(),
         parse_mode="HTML"
     )
+    await state.set_state(FeedFilter.location)
+    await callback.answer()
+
+@dp.callback_query(F.data == "filter_save")
+async def filter_save_start(callback: types.CallbackQuery, state: FSMContext):
+    filters = await db.get_feed_filter(callback.from_user.id)
+    if not filters:
+        await callback.answer("Сначала настройте фильтр", show_alert=True)
+        return
+    await smart_edit_or_send(
+        callback,
+        "💾 <b>Сохранение пресета</b>\n\n"
+        f"Фильтр: {format_order_filters(filters)}\n\n"
+        "Введите название пресета:",
+        reply_markup=get_filter_input_keyboard(),
+        parse_mode="HTML"
+    )
+    await state.set_state(FeedFilter.preset_name)
+    await callback.answer()
+
+async def _filter_text_input(message: types.Message, state: FSMContext, max_length: int):
+    """Общий разбор текстового ввода фильтра; None — ввод некорректен, ответ уже отправлен"""
+    text = (message.text or "").strip()
+    if not text or len(text) > max_length:
+        await delete_and_send(message, f"❌ Введите текст до {max_length} символов", reply_markup=get_filter_input_keyboard())
+        return None
+    await state.set_state(None)
+    return text
+
+async def _send_filters_menu(message: types.Message, notice: str):
+    text, keyboard = await build_filters_menu(message.from_user.id, notice)
+    await delete_and_send(message, text, reply_markup=keyboard)
+
+@dp.message(FeedFilter.query)
+async def filter_query_input(message: types.Message, state: FSMContext):
+    query = await _filter_text_input(message, state, 100)
+    if query is None:
+        return
+    await update_feed_filter(message.from_user.id, q=query)
+    await _send_filters_menu(message, "✅ Текстовый поиск установлен")
+
+@dp.message(FeedFilter.location)
+async def filter_location_input(message: types.Message, state: FSMContext):
+    location = await _filter_text_input(message, state, 100)
+    if location is None:
+        return
+    await update_feed_filter(message.from_user.id, location=location)
+    await _send_filters_menu(message, "✅ Локация установлена")
+
+@dp.message(FeedFilter.preset_name)
+async def filter_preset_name_input(message: types.Message, state: FSMContext):
+    name = await _filter_text_input(message, state, 64)
+    if name is None:
+        return
+    filters = await db.get_feed_filter(message.from_user.id)
+    await db.save_filter_preset(message.from_user.id, name, filters)
+    await _send_filters_menu(message, f"💾 Пресет «{html.escape(name)}» сохранён")
+
+@dp.callback_query(F.data.startswith("fset_"))
+async def filter_set_value(callback: types.CallbackQuery):
+    # fset_type_{code|any}, fset_price_{min}_{max}|fset_price_any, fset_rating_{value|any}
+    parts = callback.data.split("_")
+    kind = parts[1]
+    user_id = callback.from_user.id
+    
+    if kind == "type":
+        work_type = parts[2]
+        await update_feed_filter(user_id, work_type=None if work_type == "any" else work_type)
+    elif kind == "price":
+        if parts[2] == "any":
+            await update_feed_filter(user_id, min_price=None, max_price=None)
+        else:
+            min_price, max_price = int(parts[2]), int(parts[3])
+            await update_feed_filter(user_id, min_price=min_price or None, max_price=max_price or None)
+    elif kind == "rating":
+        await update_feed_filter(user_id, min_rating=None if parts[2] == "any" else float(parts[2]))
+    
+    await show_filters_menu(callback, "✅ Фильтр обновлён")
+    await callback.answer()
+
+@dp.callback_query(F.data == "clear_filters")
+async def clear_filters_handler(callback: types.CallbackQuery):
+    await db.set_feed_filter(callback.from_user.id, {})
+    await show_filters_menu(callback, "✅ Фильтры сброшены!")
     await callback.answer()
 
+@dp.callback_query(F.data == "filter_presets")
+async def filter_presets_menu(callback: types.CallbackQuery):
+    presets = await db.get_filter_presets(callback.from_user.id)
+    if not presets:
+        await callback.answer("Сохранённых пресетов нет", show_alert=True)
+        return
+    
+    text = "📂 <b>Сохранённые пресеты</b>\n"
+    text += "━━━━━━━━━━━━━━━\n\n"
+    buttons = []
+    for preset in presets:
+        text += f"• <b>{html.escape(preset['name'])}</b>: {format_order_filters(preset['filters'])}\n"
+        buttons.append([
+            InlineKeyboardButton(text=f"✅ {preset['name']}", callback_data=f"fpreset_apply_{preset['preset_id']}"),
+            InlineKeyboardButton(text="🗑", callback_data=f"fpreset_del_{preset['preset_id']}")
+        ])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="feed_filters")])
+    
+    await smart_edit_or_send(callback, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("fpreset_"))
+async def filter_preset_action(callback: types.CallbackQuery, state: FSMContext):
+    _, action, preset_id = callback.data.split("_")
+    user_id = callback.from_user.id
+    
+    if action == "apply":
+        filters = await db.apply_filter_preset(user_id, int(preset_id))
+        if filters is None:
+            await callback.answer("❌ Пресет не найден", show_alert=True)
+            return
+        await show_feed_page_edit(callback.message, user_id, callback.message.chat.id, 0, state)
+        await callback.answer("✅ Пресет применён")
+    elif action == "del":
+        await db.delete_filter_preset(user_id, int(preset_id))
+        presets = await db.get_filter_presets(user_id)
+        if presets:
+            await filter_presets_menu(callback)
+        else:
+            await show_filters_menu(callback, "🗑 Пресет удалён")
+            await callback.answer()
+
 @dp.callback_query(F.data == "back_to_admin")
 async def back_from_admin(callback: types.CallbackQuery):
     user = await db.get_user(callback.from_user.id)
@@ -4307,8 +4819,22 @@ async def admin_search_user_process(message: types.Message, state: FSMContext):
         user_id = int(search_text)
         found_user = await db.get_user(user_id)
     except ValueError:
-        users = await db.get_all_users(limit=1000)
-        found_user = next((u for u in users if u.get('username') == search_text), None)
+        matches = await db.search_users(search_text, limit=ADMIN_USERS_PAGE_SIZE)
+        exact = [u for u in matches if (u['username'] or '').lower() == search_text.lower()]
+        if exact:
+            found_user = exact[0]
+        elif matches:
+            # Точного совпадения нет — показываем похожие (префикс и нечёткий поиск)
+            text = f"🔍 <b>Похожие пользователи</b> по «{search_text}»\n"
+            text += "─────────────\n\n"
+            text += "".join(_format_admin_user_row(u) for u in matches)
+            buttons = _admin_user_buttons(matches)
+            buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back_to_users")])
+            await delete_and_send(message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
+            await state.clear()
+            return
+        else:
+            found_user = None
     
     if not found_user:
         await delete_and_send(message, "❌ Пользователь не найден", reply_markup=get_admin_users_menu())
@@ -4318,36 +4844,97 @@ async def admin_search_user_process(message: types.Message, state: FSMContext):
     await show_user_card(message, found_user['user_id'])
     await state.clear()
 
-@dp.callback_query(F.data == "admin_list_executors")
-async def admin_list_executors(callback: types.CallbackQuery):
+ADMIN_USERS_PAGE_SIZE = 10
+
+ADMIN_USER_FILTER_TITLES = {
+    'all': ("👥", "Все пользователи", 'users_total'),
+    'exec': ("⚡", "Исполнители", 'executors'),
+    'cust': ("👤", "Заказчики", 'customers'),
+    'banned': ("🚫", "Заблокированные", 'banned'),
+    'admins': ("👑", "Администраторы", 'admins'),
+}
+
+def _format_admin_user_row(u) -> str:
+    status = "🚫" if u['is_banned'] else "✅"
+    role_emoji = "⚡" if u['user_role'] in ('executor', 'both') else "👤"
+    text = f"{status} {role_emoji} <b>{u['first_name'] or 'Без имени'}</b> (@{u['username'] or 'нет'})\n"
+    if u['executor_rating'] is not None:
+        text += f"    ⭐ {u['executor_rating']} · ✅ {u['completed_orders']} заказов · 💬 {u['reviews_count']}\n"
+    elif u['customer_rating'] is not None:
+        text += f"    ⭐ {u['customer_rating']} · 📦 {u['total_orders']} заказов · 💬 {u['reviews_count']}\n"
+    text += f"    ID: <code>{u['user_id']}</code>\n\n"
+    return text
+
+def _admin_user_buttons(users) -> list:
+    buttons = []
+    for i in range(0, len(users), 2):
+        buttons.append([
+            InlineKeyboardButton(
+                text=f"{'🚫' if u['is_banned'] else '👤'} {u['username'] or u['first_name'] or u['user_id']}",
+                callback_data=f"admin_view_{u['user_id']}"
+            )
+            for u in users[i:i + 2]
+        ])
+    return buttons
+
+async def show_admin_users_page(callback: types.CallbackQuery, user_filter: str = 'all', page: int = 0, cursor: str = None, direction: str = 'older'):
+    """Постраничный список пользователей: фильтры и профили в одном запросе, keyset-листание"""
+    emoji, title, total_field = ADMIN_USER_FILTER_TITLES[user_filter]
+    users_page = await db.browse_users(user_filter, cursor, ADMIN_USERS_PAGE_SIZE, direction)
+    users = users_page['users']
+    
+    total = None
+    try:
+        today = await db.get_today_stats()
+        total = today[total_field]
+    except Exception as e:
+        logger.debug(f"Не удалось получить сводку пользователей: {e}")
+    
+    text = f"{emoji} <b>{title}</b>\n"
+    text += "─────────────\n"
+    if total is not None:
+        text += f"Всего: {total}"
+    text += f" · стр. {page + 1}\n\n"
+    
+    if users:
+        text += "".join(_format_admin_user_row(u) for u in users)
+    else:
+        text += "📭 Никого нет\n"
+    
+    buttons = _admin_user_buttons(users)
+    nav_buttons = _cursor_nav_buttons(f"admin_ub_{user_filter}", page, users_page)
+    if nav_buttons:
+        buttons.append(nav_buttons)
+    buttons.append([
+        InlineKeyboardButton(text=("• " if key == user_filter else "") + value[0], callback_data=f"admin_ub_{key}")
+        for key, value in ADMIN_USER_FILTER_TITLES.items()
+    ])
+    buttons.append([InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back_to_users")])
+    
+    await smart_edit_or_send(callback, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons), parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith("admin_ub_"))
+async def admin_browse_users(callback: types.CallbackQuery):
     user = await db.get_user(callback.from_user.id)
     if not user or not user['is_admin']:
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    users = await db.get_all_users(limit=1000)
-    executors = [u for u in users if u.get('user_role') in ('executor', 'both')]
-    
-    if not executors:
-        await smart_edit_or_send(callback, "📭 Исполнителей нет", reply_markup=get_admin_users_menu())
-        await callback.answer()
+    # admin_ub_{filter}[_{page}_{o|n}_{cursor}]
+    parts = callback.data.split("_")
+    user_filter = parts[2] if parts[2] in ADMIN_USER_FILTER_TITLES else 'all'
+    page, direction, cursor = _parse_cursor_callback(parts, 3)
+    await show_admin_users_page(callback, user_filter, page, cursor, direction)
+    await callback.answer()
+
+@dp.callback_query(F.data == "admin_list_executors")
+async def admin_list_executors(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    text = f"⚡ <b>Список исполнителей</b>\n"
-    text += f"─────────────\n"
-    text += f"Всего: {len(executors)}\n\n"
-    
-    for executor in executors[:10]:
-        profile = await db.get_executor_profile(executor['user_id'])
-        text += f"👤 @{executor.get('username') or 'не указан'}\n"
-        text += f"⭐ Рейтинг: {profile['rating'] if profile else 'N/A'}\n"
-        text += f"✅ Заказов: {profile['completed_orders'] if profile else 0}\n"
-        text += f"ID: <code>{executor['user_id']}</code>\n\n"
-    
-    if len(executors) > 10:
-        text += f"<i>...и ещё {len(executors) - 10} исполнителей</i>"
-    
-    await smart_edit_or_send(callback, text, reply_markup=get_admin_users_menu(), parse_mode="HTML")
+    await show_admin_users_page(callback, 'exec')
     await callback.answer()
 
 @dp.callback_query(F.data == "admin_list_customers")
@@ -4357,28 +4944,7 @@ async def admin_list_customers(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    users = await db.get_all_users(limit=1000)
-    customers = [u for u in users if u.get('user_role') in ('customer', 'both')]
-    
-    if not customers:
-        await smart_edit_or_send(callback, "📭 Заказчиков нет", reply_markup=get_admin_users_menu())
-        await callback.answer()
-        return
-    
-    text = f"👤 <b>Список заказчиков</b>\n"
-    text += f"─────────────\n"
-    text += f"Всего: {len(customers)}\n\n"
-    
-    for customer in customers[:10]:
-        rating = await db.get_customer_rating(customer['user_id'])
-        text += f"👤 @{customer.get('username') or 'не указан'}\n"
-        text += f"⭐ Рейтинг: {rating}\n"
-        text += f"ID: <code>{customer['user_id']}</code>\n\n"
-    
-    if len(customers) > 10:
-        text += f"<i>...и ещё {len(customers) - 10} заказчиков</i>"
-    
-    await smart_edit_or_send(callback, text, reply_markup=get_admin_users_menu(), parse_mode="HTML")
+    await show_admin_users_page(callback, 'cust')
     await callback.answer()
 
 @dp.callback_query(F.data == "admin_ban_menu")
@@ -4435,6 +5001,33 @@ async def admin_reset_menu(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(AdminSearchUser.waiting_username)
     await callback.answer()
 
+@dp.callback_query(F.data == "admin_recompute_ratings")
+async def admin_recompute_ratings(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.answer("⏳ Пересчитываем рейтинги...")
+    try:
+        result = await db.recompute_all_ratings()
+    except Exception as e:
+        logger.error(f"Ошибка пересчёта рейтингов: {e}")
+        await smart_edit_or_send(callback, "❌ Не удалось пересчитать рейтинги", reply_markup=get_admin_users_menu())
+        return
+    
+    await smart_edit_or_send(
+        callback,
+        "♻️ <b>Рейтинги пересчитаны</b>\n"
+        "─────────────\n"
+        f"Агрегатов отзывов: <b>{result['summaries']}</b>\n"
+        f"Профилей исполнителей: <b>{result['executor_profiles']}</b>\n"
+        f"Профилей заказчиков: <b>{result['customer_profiles']}</b>\n\n"
+        "<i>Ручные правки рейтинга заменены средним по отзывам.</i>",
+        reply_markup=get_admin_users_menu(),
+        parse_mode="HTML"
+    )
+
 async def show_user_card(message: types.Message, user_id: int):
     target_user = await db.get_user(user_id)
     if not target_user:
@@ -5365,10 +5958,7 @@ async def admin_settings_back(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    message_cleanup.schedule(callback.message.chat.id, callback.message.message_id)
     
     await bot.send_message(
         callback.from_user.id,
@@ -5407,10 +5997,7 @@ async def block_suspicious_order(callback: types.CallbackQuery):
 
 @dp.callback_query(F.data == "suspicious_back")
 async def suspicious_back(callback: types.CallbackQuery):
-    try:
-        await callback.message.delete()
-    except:
-        pass
+    message_cleanup.schedule(callback.message.chat.id, callback.message.message_id)
     await callback.answer()
 
 @dp.callback_query(F.data == "admin_exit")
@@ -5433,26 +6020,7 @@ async def admin_users(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    users = await db.get_all_users(limit=10)
-    
-    if not users:
-        back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back_to_users")]
-        ])
-        await smart_edit_or_send(callback, "📭 Пользователей нет.", reply_markup=back_keyboard)
-        await callback.answer()
-        return
-    
-    text = "👥 <b>Список пользователей:</b>\n\n"
-    for u in users:
-        status = "🚫" if u['is_banned'] else "✅"
-        role_emoji = "👤" if u['user_role'] == 'customer' else "⚡"
-        text += f"{status} {role_emoji} <b>{u['first_name']}</b> (@{u['username'] or 'нет'}) - ID: <code>{u['user_id']}</code>\n"
-    
-    back_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_back_to_users")]
-    ])
-    await smart_edit_or_send(callback, text, reply_markup=back_keyboard, parse_mode="HTML")
+    await show_admin_users_page(callback, 'all')
     await callback.answer()
 
 @dp.callback_query(F.data == "admin_stats")
@@ -5462,31 +6030,110 @@ async def admin_stats(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    stats = await db.get_stats()
-    users = await db.get_all_users(limit=1000)
+    dashboard = await db.get_stats_dashboard()
+    snap = dashboard['snapshot']
+    week = dashboard['windows'][7]
+    month = dashboard['windows'][30]
+    
+    def trend(field, money=False):
+        parts = []
+        for period in (week, month):
+            current, previous = period['current'][field], period['previous'][field]
+            value = f"{current:,.0f}".replace(",", " ") + " ₽" if money else str(current)
+            if previous:
+                change = (current - previous) * 100 / previous
+                arrow = "▲" if change > 0 else "▼" if change < 0 else "="
+                value += f" {arrow}{abs(change):.0f}%"
+            parts.append(value)
+        return " | ".join(parts)
     
-    banned_count = sum(1 for u in users if u['is_banned'])
-    executors_count = sum(1 for u in users if u.get('user_role') == 'executor' or u.get('user_role') == 'both')
-    customers_count = sum(1 for u in users if u.get('user_role') == 'customer' or u.get('user_role') == 'both')
+    avg_rating = f"{snap['avg_rating']:.2f}" if snap.get('avg_rating') is not None else "—"
+    moderation = month['current']
+    computed_at = snap['computed_at'].strftime('%d.%m %H:%M') if snap.get('computed_at') else "—"
     
     await callback.message.edit_text(
         "📊 <b>Статистика</b>\n"
         "─────────────\n"
-        f"👥 Пользователи: {stats['total_users']}\n"
-        f"⚡ Исполнители: {executors_count}\n"
-        f"👤 Заказчиков: {customers_count}\n\n"
-        f"📦 Активных заказов: {stats['active_orders']}\n"
-        f"✅ Завершённых: {stats['completed_orders']}\n"
-        f"❌ Отменённых: 0\n\n"
-        f"⭐ Средний рейтинг: 4.6\n"
-        f"⚠️ Жалоб за месяц: 0\n"
-        "─────────────",
+        f"👥 Пользователи: {snap['users_total']}\n"
+        f"⚡ Исполнители: {snap['executors']}\n"
+        f"👤 Заказчиков: {snap['customers']}\n"
+        f"🚫 Заблокировано: {snap['banned']}\n\n"
+        f"📦 Активных заказов: {snap['orders_active']}\n"
+        f"✅ Завершённых: {snap['orders_completed_total']}\n"
+        f"❌ Отменённых: {snap['orders_cancelled_total']}\n\n"
+        f"⭐ Средний рейтинг: {avg_rating}\n"
+        f"⚠️ Жалоб за месяц: {month['current']['complaints_new']} (открыто: {snap['complaints_open']})\n"
+        "─────────────\n"
+        "📈 <b>7 дней | 30 дней</b>\n"
+        f"Новые пользователи: {trend('users_new')}\n"
+        f"Новые заказы: {trend('orders_new')}\n"
+        f"Выполнено: {trend('orders_completed')}\n"
+        f"Оборот: {trend('gmv', money=True)}\n"
+        f"Отзывы: {trend('reviews_new')}\n"
+        f"Жалобы: {trend('complaints_new')}\n"
+        "─────────────\n"
+        "🛡 <b>Модерация (30 дней)</b>\n"
+        f"Проверок: {moderation['moderation_checks']}, подозрительных: {moderation['moderation_flagged']}\n"
+        f"Решения админов: 🚫 {moderation['moderation_blocked']} / ✅ {moderation['moderation_approved']}\n"
+        "─────────────\n"
+        f"<i>Обновлено: {computed_at}</i>",
         reply_markup=get_admin_menu(),
         parse_mode="HTML"
     )
     await db.save_last_bot_message(callback.from_user.id, callback.message.message_id, callback.message.chat.id)
     await callback.answer()
 
+def build_perf_dashboard_text() -> str:
+    totals = handler_tracer.totals()
+    uptime = datetime.now() - handler_tracer.started_at
+    lines = [
+        "📝 <b>Производительность бота</b>",
+        "─────────────",
+        f"Апдейтов: {totals['updates']} (ошибок {totals['errors']}), хендлеров: {totals['handlers']}",
+        f"Аптайм: {int(uptime.total_seconds() // 3600)} ч {int(uptime.total_seconds() % 3600 // 60)} мин",
+    ]
+    if totals['updates']:
+        total_time = totals['total_time'] or 1e-9
+        lines.append(
+            f"Время: БД {totals['db_time'] / total_time:.0%}, Bot API {totals['api_time'] / total_time:.0%}, "
+            f"ожидание в среднем {totals['queue_wait'] / totals['updates'] * 1000:.0f} мс"
+        )
+    lines += ["─────────────", "🐢 <b>Топ хендлеров по p95</b> (мс: p50 / p95 / p99)"]
+    summary = handler_tracer.summary(10)
+    if not summary:
+        lines.append("• Пока нет данных")
+    for name, stats in summary:
+        p50, p95, p99 = stats.percentiles(0.5, 0.95, 0.99)
+        lines.append(
+            f"• <code>{html.escape(name)}</code> ×{stats.count}: "
+            f"{p50 * 1000:.0f} / {p95 * 1000:.0f} / {p99 * 1000:.0f}\n"
+            f"   БД {stats.db_time / stats.count * 1000:.0f}, API {stats.api_time / stats.count * 1000:.0f}, "
+            f"ожидание {stats.queue_wait / stats.count * 1000:.0f}"
+            + (f", ошибок {stats.errors}" if stats.errors else "")
+        )
+    lines += ["─────────────", f"🐌 <b>Медленные апдейты</b> (&gt; {handler_tracer.slow_update_seconds * 1000:.0f} мс)"]
+    recent = list(handler_tracer.recent_slow)[-5:]
+    if not recent:
+        lines.append("• Не было")
+    for item in reversed(recent):
+        lines.append(
+            f"• {item['at'].strftime('%H:%M:%S')} <code>{html.escape(item['handler'])}</code> "
+            f"{item['total'] * 1000:.0f} мс: БД {item['db'] * 1000:.0f} ({item['db_calls']}), "
+            f"API {item['api'] * 1000:.0f} ({item['api_calls']}), прочее {item['other'] * 1000:.0f}"
+        )
+    counters = edit_coordinator.counters
+    lines += [
+        "─────────────",
+        f"✏️ <b>Правки сообщений</b>: запрошено {counters['requested']}, ушло в API {counters['api_calls']}",
+        f"Сэкономлено вызовов: {edit_coordinator.saved_calls} "
+        f"(без изменений {counters['skipped_same']}, схлопнуто {counters['coalesced']}); "
+        f"«not modified» от Telegram: {counters['not_modified']}",
+        f"🧹 Удаление: в очереди {len(message_cleanup)}, удалено {message_cleanup.counters['deleted']} "
+        f"за {message_cleanup.counters['api_calls']} вызовов deleteMessages",
+    ]
+    lines += ["─────────────", f"<i>Обновлено: {datetime.now().strftime('%H:%M:%S')}</i>"]
+    return "\n".join(lines)
+
 @dp.callback_query(F.data == "admin_logs")
 async def admin_logs(callback: types.CallbackQuery):
     user = await db.get_user(callback.from_user.id)
@@ -5494,16 +6141,7 @@ async def admin_logs(callback: types.CallbackQuery):
         await callback.answer("❌ Нет доступа", show_alert=True)
         return
     
-    await callback.message.edit_text(
-        "📝 <b>Логи действий</b>\n"
-        "─────────────\n"
-        "Последние действия администраторов:\n\n"
-        "• Пока нет записей\n"
-        "─────────────",
-        reply_markup=get_admin_menu(),
-        parse_mode="HTML"
-    )
-    await db.save_last_bot_message(callback.from_user.id, callback.message.message_id, callback.message.chat.id)
+    await smart_edit_or_send(callback, build_perf_dashboard_text(), reply_markup=get_admin_perf_keyboard(), parse_mode="HTML")
     await callback.answer()
 
 @dp.callback_query(F.data == "admin_broadcast")
@@ -5533,10 +6171,7 @@ async def admin_broadcast_send(message: types.Message, state: FSMContext):
     users = await db.get_all_users(limit=10000)
     sent = 0
     
-    try:
-        await message.delete()
-    except Exception as e:
-        logger.debug(f"Не удалось удалить сообщение пользователя: {e}")
+    message_cleanup.schedule(message.chat.id, message.message_id)
     
     status_msg = await bot.send_message(message.chat.id, f"📤 Отправка... 0/{len(users)}")
     await db.save_last_bot_message(message.from_user.id, status_msg.message_id, message.chat.id)
@@ -5563,7 +6198,7 @@ async def admin_view_user_profile(callback: types.CallbackQuery):
         return
     
     exec_profile = await db.get_executor_profile(target_id)
-    reviews = await db.get_reviews(target_id)
+    rating_summary = await db.get_rating_summary(target_id)
     
     status = "🚫 ЗАБАНЕН" if target_user['is_banned'] else "✅ Активен"
     
@@ -5579,7 +6214,7 @@ async def admin_view_user_profile(callback: types.CallbackQuery):
         text += f"📦 Выполнено заказов: {exec_profile['completed_orders']}\n"
         text += f"🏆 Уровень: {exec_profile['level']}\n\n"
     
-    text += f"💬 Отзывов: {len(reviews)}\n"
+    text += f"💬 Отзывов: {rating_summary['reviews_count']}\n"
     
     if target_user['is_banned']:
         text += f"\n🚫 <b>Причина бана:</b> {target_user['ban_reason']}"
@@ -5695,14 +6330,6 @@ async def handle_work_type(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(CreateOrder.start_time)
     await callback.answer()
 
-@dp.callback_query(F.data.startswith("filter_"))
-async def handle_filters(callback: types.CallbackQuery):
-    filter_type = callback.data.replace("filter_", "")
-    filter_names = {"type": "Тип работы", "location": "Локация", "price": "Цена", "rating": "Рейтинг"}
-    await smart_edit_or_send(callback, f"🔍 Фильтр <b>{filter_names.get(filter_type, filter_type)}</b>\n\n⚙️ Эта функция находится в разработке.", 
-        reply_markup=await get_executor_menu_with_counts(callback.from_user.id), parse_mode="HTML")
-    await callback.answer()
-
 @dp.callback_query(F.data == "admin_commission")
 async def admin_commission(callback: types.CallbackQuery):
     await smart_edit_or_send(callback, "💰 <b>Комиссия</b>\n\n⚙️ В разработке", reply_markup=get_admin_menu(), parse_mode="HTML")
@@ -5718,16 +6345,152 @@ async def admin_executor_limit(callback: types.CallbackQuery):
     await smart_edit_or_send(callback, "👥 <b>Лимит исполнителей</b>\n\n⚙️ В разработке", reply_markup=get_admin_menu(), parse_mode="HTML")
     await callback.answer()
 
-@dp.callback_query(F.data == "admin_auto_archive")
-async def admin_auto_archive(callback: types.CallbackQuery):
-    await smart_edit_or_send(callback, "📦 <b>Автоархив</b>\n\n⚙️ В разработке", reply_markup=get_admin_menu(), parse_mode="HTML")
+async def build_retention_text():
+    preview = await retention_engine.dry_run()
+    
+    text = "🧹 <b>Хранение данных</b>\n"
+    text += "━━━━━━━━━━━━━━━\n\n"
+    text += "<b>Пробный прогон</b> (будет удалено сейчас):\n"
+    for policy in retention_engine.policies:
+        item = preview.get(policy.name, {})
+        if item.get('error'):
+            text += f"├ {policy.title}: ⚠️ ошибка\n"
+            continue
+        oldest = item['oldest'].strftime('%d.%m.%Y') if item.get('oldest') else '—'
+        text += f"├ {policy.title}: <b>{item['rows']}</b> (старейшая: {oldest})\n"
+    
+    text += "\n<b>Последний прогон:</b> "
+    if retention_engine.last_run_at:
+        text += retention_engine.last_run_at.strftime('%d.%m.%Y %H:%M') + "\n"
+        for policy in retention_engine.policies:
+            item = retention_engine.last_run.get(policy.name)
+            if not item:
+                continue
+            line = f"├ {policy.name}: {item['deleted']} строк, {item['batches']} пачек, {item['seconds']:.1f} с"
+            if item.get('partitions_dropped'):
+                line += f", секций удалено: {item['partitions_dropped']}"
+            if item.get('capped'):
+                line += " (лимит пачек, остаток — в следующий прогон)"
+            if item.get('error'):
+                line += " ⚠️ ошибка"
+            text += line + "\n"
+    else:
+        text += "ещё не выполнялся\n"
+    
+    total = sum(retention_engine.totals.values())
+    text += f"\nУдалено с момента запуска бота: <b>{total}</b>\n"
+    text += f"Пачка: {retention_engine.batch_size} строк, пауза {retention_engine.batch_pause} с, "
+    text += f"прогон раз в {retention_engine.interval // 60} мин."
+    return text
+
+@dp.callback_query(F.data == "admin_retention")
+async def admin_retention(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    text = await build_retention_text()
+    await smart_edit_or_send(callback, text, reply_markup=get_admin_retention_keyboard(), parse_mode="HTML")
     await callback.answer()
 
-@dp.callback_query(F.data == "admin_auto_clean")
-async def admin_auto_clean(callback: types.CallbackQuery):
-    await smart_edit_or_send(callback, "🗑️ <b>Автоочистка</b>\n\n⚙️ В разработке", reply_markup=get_admin_menu(), parse_mode="HTML")
+@dp.callback_query(F.data == "admin_retention_run")
+async def admin_retention_run(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    await callback.answer("🧹 Очистка запущена…")
+    report = await retention_engine.run_once()
+    purged = sum(item['deleted'] for item in report.values())
+    
+    text = f"✅ Очистка завершена: удалено <b>{purged}</b> строк\n\n" + await build_retention_text()
+    await smart_edit_or_send(callback, text, reply_markup=get_admin_retention_keyboard(), parse_mode="HTML")
+
+ARCHIVE_RULES = {
+    # правило → (ключ настройки, заголовок, пояснение)
+    'completed': ('completed_days', "📦 <b>Автоархив</b>", "Выполненные заказы старше срока переносятся в архив."),
+    'deleted': ('deleted_days', "🗑️ <b>Автоочистка</b>", "Удалённые заказчиками заказы старше срока переносятся в архив."),
+}
+
+async def show_archive_settings(callback: types.CallbackQuery, rule: str, notice: str = ""):
+    setting_key, title, description = ARCHIVE_RULES[rule]
+    settings = await db.get_archive_settings()
+    completed_before, deleted_before = order_archiver.cutoffs(settings)
+    stats = await db.get_archive_stats(completed_before, deleted_before)
+    current = settings[setting_key]
+    pending = stats['pending_completed'] if rule == 'completed' else stats['pending_deleted']
+    
+    text = notice + f"{title}\n"
+    text += "━━━━━━━━━━━━━━━\n\n"
+    text += f"{description}\n"
+    text += "Вместе с заказом уходят отклики и логи модерации; история заказчиков и исполнителей показывает архив как обычно.\n\n"
+    text += f"⏱ Срок: <b>{f'{current} дн.' if current else 'выключено'}</b>\n"
+    text += f"⏳ Ждут переноса сейчас: <b>{pending}</b>\n"
+    text += f"🗄 Всего в архиве: <b>{stats['archived_total']}</b>\n"
+    if stats['last_archived_at']:
+        text += f"🕒 Последний перенос: {stats['last_archived_at'].strftime('%d.%m.%Y %H:%M')}\n"
+    if order_archiver.last_run:
+        run = order_archiver.last_run
+        text += (
+            f"\n<b>Последний прогон:</b> {run['orders']} заказов, {run['responses']} откликов, "
+            f"{run['moderation_logs']} логов за {run['seconds']:.1f} с"
+        )
+        if run['capped']:
+            text += " (лимит пачек, остаток — в следующий прогон)"
+        text += "\n"
+    
+    await smart_edit_or_send(
+        callback, text,
+        reply_markup=get_admin_archive_keyboard(rule, current, ARCHIVE_DAYS_CHOICES),
+        parse_mode="HTML"
+    )
+
+@dp.callback_query(F.data.in_({"admin_auto_archive", "admin_auto_clean"}))
+async def admin_auto_archive(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    rule = 'completed' if callback.data == "admin_auto_archive" else 'deleted'
+    await show_archive_settings(callback, rule)
     await callback.answer()
 
+@dp.callback_query(F.data.startswith("archive_set_"))
+async def archive_set_days(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    _, _, rule, days = callback.data.split("_")
+    days = int(days)
+    if rule not in ARCHIVE_RULES or days not in ARCHIVE_DAYS_CHOICES:
+        await callback.answer("❌ Неверное значение", show_alert=True)
+        return
+    
+    await db.set_archive_setting(ARCHIVE_RULES[rule][0], days, callback.from_user.id)
+    await show_archive_settings(callback, rule)
+    await callback.answer("✅ Сохранено")
+
+@dp.callback_query(F.data.startswith("archive_run_"))
+async def archive_run(callback: types.CallbackQuery):
+    user = await db.get_user(callback.from_user.id)
+    if not user or not user['is_admin']:
+        await callback.answer("❌ Нет доступа", show_alert=True)
+        return
+    
+    rule = callback.data.split("_")[2]
+    if rule not in ARCHIVE_RULES:
+        await callback.answer()
+        return
+    
+    await callback.answer("📦 Архивация запущена…")
+    report = await order_archiver.run_once()
+    await show_archive_settings(callback, rule, notice=f"✅ Перенесено заказов: <b>{report['orders']}</b>\n\n")
+
 @dp.callback_query(F.data == "admin_welcome_text")
 async def admin_welcome_text(callback: types.CallbackQuery):
     await smart_edit_or_send(callback, "👋 <b>Приветствие</b>\n\n⚙️ В разработке", reply_markup=get_admin_menu(), parse_mode="HTML")
@@ -5862,7 +6625,7 @@ async def delete_user_messages(message: types.Message):
             return
         
         # Удаляем сообщение пользователя
-        await message.delete()
+        message_cleanup.schedule(message.chat.id, message.message_id)
     except Exception as e:
         logger.debug(f"Could not delete message: {e}")
 
@@ -5890,4 +6653,5 @@ async def main():
     await dp.start_polling(bot)
 
 if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
     asyncio.run(main())
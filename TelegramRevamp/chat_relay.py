@@ -0,0 +1,184 @@
+"""
+Пересылка сообщений чата по заказу
+Сообщение уходит собеседнику сразу (copy_message — медиа без повторной загрузки),
+а запись в БД копится в очереди и сохраняется пачками в фоне.
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import List, Optional
+
+import asyncpg
+
+logger = logging.getLogger(__name__)
+
+# Ошибки доступа к БД, а не к данным строки: пачка ждёт в очереди, пока БД не вернётся
+CONNECTION_ERRORS = (
+    OSError,  # в т.ч. ConnectionError и TimeoutError
+    asyncpg.InterfaceError,
+    asyncpg.PostgresConnectionError,
+    asyncpg.exceptions.OperatorInterventionError,
+    asyncpg.exceptions.TooManyConnectionsError,
+)
+
+# Типы сообщений, у которых Telegram разрешает подпись при copy_message
+CAPTION_CONTENT_TYPES = {'photo', 'video', 'document', 'audio', 'animation', 'voice'}
+
+CONTENT_TYPE_LABELS = {
+    'photo': '🖼 Фото',
+    'video': '🎬 Видео',
+    'document': '📎 Файл',
+    'audio': '🎵 Аудио',
+    'animation': '🎞 GIF',
+    'voice': '🎤 Голосовое',
+    'video_note': '📹 Видеосообщение',
+    'sticker': '🙂 Стикер',
+    'location': '📍 Геопозиция',
+    'contact': '👤 Контакт',
+}
+
+
+def describe_message(content_type: str, text: Optional[str]) -> str:
+    """Текст для истории: подпись/текст, а для вложений — метка типа"""
+    label = CONTENT_TYPE_LABELS.get(content_type)
+    if label and text:
+        return f"{label}: {text}"
+    return text or label or f"[{content_type}]"
+
+
+class ChatMessageWriter:
+    """
+    Очередь на запись сообщений чата. Сбрасывается, когда накопилось batch_size
+    сообщений или прошло flush_interval секунд; перед чтением истории вызывающий
+    код делает flush_before_read(), чтобы история и счётчики непрочитанных были полными.
+
+    Пользователю уже ответили «отправлено», поэтому сообщение теряется только
+    из-за самих данных: если пачка не записалась из-за строки (нарушение FK,
+    слишком длинное значение), сообщения пишутся по одному, а не проходящие
+    отбрасываются с записью в лог. При ошибке соединения (CONNECTION_ERRORS)
+    пачка возвращается в очередь и ждёт БД сколько угодно; предел — только
+    max_pending сообщений, при переполнении теряются самые старые.
+    """
+
+    def __init__(self, db, batch_size: int = 100, flush_interval: float = 0.5,
+                 max_pending: int = 10_000, read_flush_timeout: float = 1.0):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.read_flush_timeout = read_flush_timeout
+        self.dropped = 0
+        self._pending: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._read_flush: Optional[asyncio.Task] = None
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _trim(self):
+        overflow = len(self._pending) - self.max_pending
+        if overflow > 0:
+            del self._pending[:overflow]
+            self.dropped += overflow
+            logger.error(f"Очередь сообщений чата переполнена: отброшено {overflow} самых старых")
+
+    def _requeue(self, rows: List[dict], error: Exception):
+        # В начало очереди: следующая попытка сохранит эти сообщения первыми
+        self._pending[:0] = rows
+        self._trim()
+        logger.warning(f"БД недоступна, {len(rows)} сообщений чата ждут в очереди: {error}")
+
+    def enqueue(self, chat_id: int, sender_id: int, recipient_id: Optional[int], message: str,
+                content_type: str = 'text', tg_chat_id: int = None, tg_message_id: int = None):
+        self._pending.append({
+            'chat_id': chat_id,
+            'sender_id': sender_id,
+            'recipient_id': recipient_id,
+            'message': message,
+            'content_type': content_type,
+            'tg_chat_id': tg_chat_id,
+            'tg_message_id': tg_message_id,
+            # Время фиксируем при получении, а не при записи: порядок истории не зависит от пачек
+            'created_at': datetime.now(),
+        })
+        self._trim()
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _save_rows(self, batch: List[dict]):
+        """Пачка, не записанная из-за данных, — по одной строке; плохие строки отбрасываются"""
+        for index, row in enumerate(batch):
+            try:
+                await self.db.save_chat_messages([row])
+            except CONNECTION_ERRORS as e:
+                self._requeue(batch[index:], e)
+                raise
+            except Exception as e:
+                self.dropped += 1
+                logger.error(
+                    f"Сообщение чата {row['chat_id']} от {row['sender_id']} не сохранено "
+                    f"и отброшено: {e}"
+                )
+
+    async def _flush_batch(self, batch: List[dict]):
+        try:
+            await self.db.save_chat_messages(batch)
+        except CONNECTION_ERRORS as e:
+            self._requeue(batch, e)
+            raise
+        except Exception:
+            await self._save_rows(batch)
+
+    async def flush(self):
+        async with self._flush_lock:
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                await self._flush_batch(batch)
+
+    async def flush_before_read(self) -> bool:
+        """
+        Сброс перед чтением истории, который не держит хендлер дольше
+        read_flush_timeout: сброс идёт отдельной задачей (одной на всех читающих)
+        и продолжается в фоне, если не успел. Так открытие чата не зависает за
+        фоновым сбросом, который ждёт недоступную БД. True — всё из очереди записано.
+        """
+        task = self._read_flush
+        if task is None or task.done():
+            if not self._pending and not self._flush_lock.locked():
+                return True
+            task = self._read_flush = asyncio.ensure_future(self.flush())
+            task.add_done_callback(_log_flush_error)
+        try:
+            await asyncio.wait_for(asyncio.shield(task), timeout=self.read_flush_timeout)
+        except Exception:
+            return False
+        return True
+
+    async def run(self):
+        """Фоновая задача: периодический сброс очереди"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if not self._pending or not self.db.is_connected():
+                continue
+            try:
+                await self.flush()
+            except Exception:
+                await asyncio.sleep(self.flush_interval)
+
+    async def close(self):
+        """Сохраняет остаток очереди при остановке бота"""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"При остановке не сохранено {len(self._pending)} сообщений чата: {e}")
+
+
+def _log_flush_error(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.debug(f"Сброс очереди сообщений чата перед чтением не завершён: {task.exception()}")
@@ -3,26 +3,447 @@
 Все операции с PostgreSQL базой данных
 """
 import asyncpg
+import json
 import logging
 from datetime import datetime, timedelta
-from config import DATABASE_URL
+from decimal import Decimal
+from config import DATABASE_URL, DB_STATEMENT_CACHE_SIZE, SLOW_QUERY_MS, STATS_BACKFILL_DAYS
+from db_metrics import InstrumentedPool, QueryMetrics
+import partitioning
 
 logger = logging.getLogger(__name__)
 
+# ==================== ДНЕВНЫЕ СВОДКИ СТАТИСТИКИ ====================
+
+# Потоковые колонки stats_daily, которые суммируются по окнам 7/30 дней
+STATS_FLOW_FIELDS = (
+    'users_new', 'orders_new', 'orders_completed', 'gmv', 'reviews_new', 'complaints_new',
+    'moderation_checks', 'moderation_flagged', 'moderation_risk_sum',
+    'moderation_blocked', 'moderation_approved',
+)
+
+STATS_TODAY_QUERY = 'SELECT * FROM stats_daily WHERE day = CURRENT_DATE'
+
+# 60 дней: текущие окна 7/30 и предыдущие периоды той же длины для тренда
+STATS_DASHBOARD_QUERY = '''
+    SELECT *, CURRENT_DATE AS today FROM stats_daily
+    WHERE day > CURRENT_DATE - 60
+    ORDER BY day DESC
+'''
+
+# ==================== KEYSET-ПАГИНАЦИЯ ====================
+
+_CURSOR_EPOCH = datetime(1970, 1, 1)
+_CURSOR_DIGITS = '0123456789abcdefghijklmnopqrstuvwxyz'
+
+
+def _to_base36(value: int) -> str:
+    if value == 0:
+        return '0'
+    digits = []
+    while value:
+        value, rem = divmod(value, 36)
+        digits.append(_CURSOR_DIGITS[rem])
+    return ''.join(reversed(digits))
+
+
+def encode_keyset_cursor(created_at: datetime, row_id: int) -> str:
+    """Компактный курсор (created_at, id) для keyset-пагинации, помещается в callback_data"""
+    micros = (created_at.replace(tzinfo=None) - _CURSOR_EPOCH) // timedelta(microseconds=1)
+    return f"{_to_base36(micros)}.{_to_base36(row_id)}"
+
+
+def decode_keyset_cursor(cursor: str):
+    """Обратное преобразование; некорректный курсор трактуется как начало списка"""
+    try:
+        micros_raw, row_id_raw = cursor.split('.')
+        return _CURSOR_EPOCH + timedelta(microseconds=int(micros_raw, 36)), int(row_id_raw, 36)
+    except (AttributeError, ValueError):
+        return None
+
+
+_REVIEWS_PAGE_SELECT = '''
+    SELECT r.*, u.username, u.first_name
+    FROM reviews r
+    LEFT JOIN users u ON r.reviewer_id = u.user_id
+    WHERE r.reviewee_id = $1
+'''
+
+
+async def fetch_reviews_page(conn, user_id, cursor=None, limit=10, direction='older'):
+    """
+    Страница отзывов от новых к старым по ключу (created_at, review_id).
+    direction='older' — отзывы после курсора, 'newer' — перед ним (листание назад).
+    Стоимость не зависит от номера страницы: индекс idx_reviews_reviewee_keyset.
+    """
+    position = decode_keyset_cursor(cursor) if cursor else None
+    if position is None:
+        direction = 'older'
+        rows = await conn.fetch(
+            _REVIEWS_PAGE_SELECT + ' ORDER BY r.created_at DESC, r.review_id DESC LIMIT $2',
+            user_id, limit + 1
+        )
+    elif direction == 'newer':
+        rows = await conn.fetch(
+            _REVIEWS_PAGE_SELECT + ''' AND (r.created_at, r.review_id) > ($2, $3)
+               ORDER BY r.created_at ASC, r.review_id ASC LIMIT $4''',
+            user_id, position[0], position[1], limit + 1
+        )
+    else:
+        rows = await conn.fetch(
+            _REVIEWS_PAGE_SELECT + ''' AND (r.created_at, r.review_id) < ($2, $3)
+               ORDER BY r.created_at DESC, r.review_id DESC LIMIT $4''',
+            user_id, position[0], position[1], limit + 1
+        )
+
+    has_more = len(rows) > limit
+    rows = list(rows[:limit])
+    if direction == 'newer':
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = position is not None, has_more
+
+    return {
+        'reviews': rows,
+        'next_cursor': encode_keyset_cursor(rows[-1]['created_at'], rows[-1]['review_id']) if rows and has_older else None,
+        'prev_cursor': encode_keyset_cursor(rows[0]['created_at'], rows[0]['review_id']) if rows and has_newer else None,
+    }
+
+
+# Холодный архив заказов: строки переносятся в *_archive, чтение истории идёт через orders_all
+ARCHIVE_TABLES = {
+    'orders': 'orders_archive',
+    'responses': 'responses_archive',
+    'moderation_logs': 'moderation_logs_archive',
+}
+
+# Таблицы, хранящие order_id архивируемых заказов: внешний ключ на orders с них
+# снимается (Postgres не умеет ссылаться на orders ИЛИ orders_archive). У секционированных
+# таблиц ключ снимается с родителя — вместе с ним уходят ключи всех секций
+ORDER_HISTORY_REFERENCES = ('reviews', 'chats', 'penalty_log', 'admin_moderation_decisions')
+
+
+async def fetch_table_columns(conn, table):
+    """Колонки таблицы в порядке объявления: [(имя, тип, генерируемая)]"""
+    rows = await conn.fetch(
+        '''SELECT a.attname AS name, format_type(a.atttypid, a.atttypmod) AS type,
+                  a.attgenerated <> '' AS generated
+           FROM pg_attribute a
+           WHERE a.attrelid = to_regclass($1) AND a.attnum > 0 AND NOT a.attisdropped
+           ORDER BY a.attnum''',
+        table
+    )
+    return [(row['name'], row['type'], row['generated']) for row in rows]
+
+
+async def sync_archive_table(conn, source, archive):
+    """
+    Создаёт архивную таблицу по образцу source и добавляет в неё колонки,
+    появившиеся в source позже. Возвращает список колонок source для переноса.
+    """
+    await conn.execute(f'CREATE TABLE IF NOT EXISTS {archive} (LIKE {source})')
+    archive_columns = {name for name, _, _ in await fetch_table_columns(conn, archive)}
+    columns = []
+    for name, type_name, _ in await fetch_table_columns(conn, source):
+        if name not in archive_columns:
+            await conn.execute(f'ALTER TABLE {archive} ADD COLUMN IF NOT EXISTS {name} {type_name}')
+        columns.append(name)
+    return columns
+
+
+# Админский просмотр пользователей: профили подтягиваются тем же запросом, без N+1
+_ADMIN_USERS_SELECT = '''
+    SELECT u.*,
+           ep.rating AS executor_rating, ep.completed_orders, ep.level,
+           cp.rating AS customer_rating, cp.total_orders,
+           COALESCE(rs.reviews_count, 0) AS reviews_count
+    FROM users u
+    LEFT JOIN executor_profiles ep ON ep.user_id = u.user_id
+    LEFT JOIN customer_profiles cp ON cp.user_id = u.user_id
+    LEFT JOIN user_rating_summary rs ON rs.user_id = u.user_id
+'''
+
+ADMIN_USER_FILTERS = {
+    'all': None,
+    'exec': "u.user_role IN ('executor', 'both')",
+    'cust': "u.user_role IN ('customer', 'both')",
+    'banned': 'u.is_banned',
+    'admins': 'u.is_admin',
+}
+
+
+def _escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+# Фильтр ленты заказов: допустимые ключи и приведение типов (фильтры хранятся в JSONB)
+ORDER_FILTER_KEYS = {
+    'q': str,
+    'location': str,
+    'work_type': str,
+    'min_price': float,
+    'max_price': float,
+    'min_rating': float,
+}
+
+
+def normalize_order_filters(filters) -> dict:
+    """Отбрасывает пустые и неизвестные ключи, приводит числа; некорректные значения игнорируются"""
+    result = {}
+    for key, cast in ORDER_FILTER_KEYS.items():
+        value = (filters or {}).get(key)
+        if value is None or value == '':
+            continue
+        try:
+            result[key] = cast(value).strip() if cast is str else cast(value)
+        except (TypeError, ValueError):
+            continue
+    return result
+
+
+
+def _order_search_clause(filters):
+    """FROM/WHERE для search_orders и count_orders: все фильтры в одном запросе"""
+    filters = normalize_order_filters(filters)
+    conditions = ["o.status = 'open'", 'o.is_deleted = FALSE']
+    params = []
+    joins = ''
+    order_by = 'o.created_at DESC'
+
+    def param(value):
+        params.append(value)
+        return f'${len(params)}'
+
+    if filters.get('q'):
+        query = param(filters['q'])
+        conditions.append(f"o.search_tsv @@ websearch_to_tsquery('russian', {query})")
+        order_by = f"ts_rank(o.search_tsv, websearch_to_tsquery('russian', {query})) DESC, o.created_at DESC"
+    if filters.get('location'):
+        conditions.append(f"o.address ILIKE {param('%' + _escape_like(filters['location']) + '%')}")
+    if filters.get('work_type'):
+        conditions.append(f"o.work_type = {param(filters['work_type'])}")
+    if filters.get('min_price') is not None:
+        conditions.append(f"o.price >= {param(Decimal(str(filters['min_price'])))}")
+    if filters.get('max_price') is not None:
+        conditions.append(f"o.price <= {param(Decimal(str(filters['max_price'])))}")
+    if filters.get('min_rating') is not None:
+        joins = ' JOIN customer_profiles cp ON cp.user_id = o.customer_id'
+        conditions.append(f"cp.rating >= {param(Decimal(str(filters['min_rating'])))}")
+
+    return f"FROM orders o{joins} WHERE {' AND '.join(conditions)}", params, order_by
+
+
+# Подозрительные формулировки (keyword, категория, вес риска) для moderation_patterns
+MODERATION_PATTERNS = [
+    # === НАРКОТИКИ И КУРЬЕРЫ-ЗАКЛАДЧИКИ (приоритет 5) ===
+    ('закладчик', 'наркотики', 5),
+    ('закладки', 'наркотики', 5),
+    ('кладмен', 'наркотики', 5),
+    ('минер', 'наркотики', 5),
+    ('фасовщик', 'наркотики', 5),
+    ('трафаретчик', 'наркотики', 5),
+    ('легальная продукция', 'наркотики', 5),
+    ('клад', 'наркотики', 4),
+    ('развешивать по пакетикам', 'наркотики', 5),
+    ('мастер-квест', 'наркотики', 4),
+    ('спайс', 'наркотики', 5),
+    ('соль', 'наркотики', 3),
+    ('скорость', 'наркотики', 2),
+    ('курьер', 'наркотики', 2),
+    ('развозка', 'наркотики', 2),
+    ('доставка посылок', 'наркотики', 2),
+    ('доставка лёгких заказов', 'наркотики', 4),
+    ('пешие курьеры', 'наркотики', 3),
+    ('анонимно', 'наркотики', 3),
+    ('конфиденциально', 'наркотики', 2),
+    ('без опыта', 'наркотики', 1),
+    ('быстрые деньги', 'наркотики', 3),
+    ('наличные сразу', 'наркотики', 2),
+    ('телеграм только', 'наркотики', 3),
+    ('пишите в тг', 'наркотики', 2),
+    ('фото паспорта', 'наркотики', 4),
+    ('страховой взнос', 'наркотики', 4),
+    ('залог', 'наркотики', 2),
+    ('нефасованный опт', 'наркотики', 5),
+    ('мина', 'наркотики', 3),
+    
+    # === НЕРЕАЛЬНЫЕ СУММЫ (признак мошенничества) ===
+    ('лёгкий заработок', 'мошенничество', 4),
+    ('высокий доход', 'мошенничество', 3),
+    ('быстрый заработок', 'мошенничество', 4),
+    ('300 тысяч в месяц', 'мошенничество', 5),
+    ('500 тысяч в месяц', 'мошенничество', 5),
+    ('900 тысяч', 'мошенничество', 5),
+    ('30 тысяч в день', 'мошенничество', 5),
+    ('50 тысяч в день', 'мошенничество', 5),
+    ('3-4 часа в день', 'мошенничество', 2),
+    ('свободный график', 'мошенничество', 1),
+    
+    # === АЗАРТНЫЕ ИГРЫ ===
+    ('казино', 'азартные_игры', 5),
+    ('ставки', 'азартные_игры', 4),
+    ('букмекер', 'азартные_игры', 5),
+    ('покер', 'азартные_игры', 4),
+    ('слоты', 'азартные_игры', 5),
+    ('рулетка', 'азартные_игры', 5),
+    ('выигрыш', 'азартные_игры', 3),
+    ('бонус за регистрацию', 'азартные_игры', 4),
+    
+    # === ИНТИМ УСЛУГИ И ПОРНОГРАФИЯ ===
+    ('порно', 'порнография', 5),
+    ('эскорт', 'порнография', 5),
+    ('интим', 'порнография', 5),
+    ('интим услуги', 'порнография', 5),
+    ('проститутки', 'порнография', 5),
+    ('девушки по вызову', 'порнография', 5),
+    ('массаж для мужчин', 'порнография', 4),
+    ('знакомства 18+', 'порнография', 4),
+    ('вебкам', 'порнография', 5),
+    ('onlyfans', 'порнография', 4),
+    
+    # === ОРУЖИЕ И ВЗРЫВЧАТКА ===
+    ('оружие', 'оружие', 5),
+    ('пистолет', 'оружие', 5),
+    ('взрывчатка', 'оружие', 5),
+    ('автомат', 'оружие', 5),
+    ('патроны', 'оружие', 5),
+    ('граната', 'оружие', 5),
+    
+    # === ФИНАНСОВОЕ МОШЕННИЧЕСТВО ===
+    ('обнал', 'финансовые_махинации', 5),
+    ('обналичка', 'финансовые_махинации', 5),
+    ('отмыв денег', 'финансовые_махинации', 5),
+    ('фальшивые', 'финансовые_махинации', 5),
+    ('поддельные документы', 'финансовые_махинации', 5),
+    ('липовые', 'финансовые_махинации', 4),
+    ('чёрный нал', 'финансовые_махинации', 5),
+    ('крипта', 'криптовалюта', 2),
+    ('btc', 'криптовалюта', 2),
+    ('usdt', 'криптовалюта', 2),
+    ('киви-кошелёк', 'финансовые_махинации', 2),
+    
+    # === МЕДИЦИНСКИЕ И ФАРМАЦЕВТИЧЕСКИЕ ===
+    ('виагра', 'медицина', 4),
+    ('сиалис', 'медицина', 4),
+    ('аптека без рецепта', 'медицина', 4),
+    ('лекарства запрещённые', 'медицина', 5),
+    ('стероиды', 'медицина', 4),
+    ('100% результат', 'медицина', 3),
+    ('гарантия излечения', 'медицина', 4),
+    
+    # === АГРЕССИВНЫЙ МАРКЕТИНГ (Telegram/Avito запреты) ===
+    ('только сегодня', 'агрессивный_маркетинг', 2),
+    ('не упусти', 'агрессивный_маркетинг', 2),
+    ('последний шанс', 'агрессивный_маркетинг', 3),
+    ('лучший', 'агрессивный_маркетинг', 1),
+    ('самый выгодный', 'агрессивный_маркетинг', 2),
+    ('топовый', 'агрессивный_маркетинг', 1),
+]
+
+# Легальные формулировки: заказ с ними не проверяется паттернами
+WHITELIST_PHRASES = [
+    ('грузчик', 'легальная_работа'),
+    ('разнорабочий', 'легальная_работа'),
+    ('уборка', 'легальная_работа'),
+    ('клининг', 'легальная_работа'),
+    ('ремонт', 'легальная_работа'),
+    ('демонтаж', 'легальная_работа'),
+    ('стройка', 'легальная_работа'),
+    ('переезд', 'легальная_работа'),
+    ('погрузка', 'легальная_работа'),
+    ('разгрузка', 'легальная_работа'),
+    ('сборка мебели', 'легальная_работа'),
+    ('покраска', 'легальная_работа'),
+    ('монтаж', 'легальная_работа'),
+    ('сантехник', 'легальная_работа'),
+    ('электрик', 'легальная_работа'),
+    ('штукатурка', 'легальная_работа'),
+    ('поклейка обоев', 'легальная_работа'),
+]
+
+
+def score_moderation_patterns(text_lower, price, patterns):
+    """Риск по совпавшим паттернам (keyword, risk_weight) и цене курьерских заказов"""
+    risk_score = 0
+    matched_patterns = []
+    for pattern in patterns:
+        keyword = pattern['keyword'].lower()
+        if keyword in text_lower:
+            risk_score += pattern['risk_weight']
+            matched_patterns.append(f"{pattern['keyword']} (+{pattern['risk_weight']})")
+
+    # Дополнительная проверка на подозрительную цену для курьеров
+    if 'курьер' in text_lower and price > 4000:
+        risk_score += 3
+        matched_patterns.append("курьер+высокая_цена (+3)")
+
+    if 'доставка' in text_lower and price > 4000:
+        risk_score += 2
+        matched_patterns.append("доставка+высокая_цена (+2)")
+    return risk_score, matched_patterns
+
+
+def summarize_stats_rows(rows):
+    """
+    Строки stats_daily (от новых к старым, с колонкой today) → сегодняшние снимки
+    и суммы потоков за 7/30 дней вместе с предыдущими периодами для тренда
+    """
+    today = rows[0]['today'] if rows else None
+    windows = {}
+    for window in (7, 30):
+        current = dict.fromkeys(STATS_FLOW_FIELDS, 0)
+        previous = dict.fromkeys(STATS_FLOW_FIELDS, 0)
+        for row in rows:
+            age = (today - row['day']).days
+            if age < window:
+                bucket = current
+            elif age < window * 2:
+                bucket = previous
+            else:
+                continue
+            for field in STATS_FLOW_FIELDS:
+                bucket[field] += row[field] or 0
+        windows[window] = {'current': current, 'previous': previous}
+
+    snapshot = dict(rows[0]) if rows else {}
+    return {'snapshot': snapshot, 'windows': windows}
+
+
 class Database:
     def __init__(self):
         self.pool = None
+        # Задержки, строки и ожидание пула по именам запросов (db_metrics.py)
+        self.metrics = QueryMetrics(SLOW_QUERY_MS)
+        self._listeners = []
+        self.has_trigram = False
+        # Колонки, переносимые в архив, по исходной таблице (заполняется в create_tables)
+        self._archive_columns = {}
 
     def is_connected(self):
         """Проверка наличия подключения к БД"""
         return self.pool is not None
 
-    async def connect(self):
-        self.pool = await asyncpg.create_pool(
-            DATABASE_URL,
+    def subscribe(self, listener):
+        """Подписка на доменные события (listener(event, payload)), например для кэшей в памяти"""
+        self._listeners.append(listener)
+
+    def _emit(self, event, **payload):
+        for listener in self._listeners:
+            try:
+                listener(event, payload)
+            except Exception as e:
+                logger.debug(f"Обработчик события {event} завершился с ошибкой: {e}")
+
+    async def connect(self, dsn: str = None):
+        pool = await asyncpg.create_pool(
+            dsn or DATABASE_URL,
             min_size=5,
-            max_size=20
+            max_size=20,
+            # Каждое выражение готовится один раз на соединение; кеш вмещает весь реестр запросов
+            statement_cache_size=DB_STATEMENT_CACHE_SIZE
         )
+        self.pool = InstrumentedPool(pool, self.metrics)
         await self.create_tables()
 
     async def create_tables(self):
@@ -245,16 +666,349 @@ class Database:
                 )
             ''')
 
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_orders_completed_at
+                ON orders (completed_at) WHERE status = 'completed'
+            ''')
+
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_reviews_reviewee_keyset
+                ON reviews (reviewee_id, created_at DESC, review_id DESC)
+            ''')
+
+            # Агрегат отзывов: обновляется в той же транзакции, что и вставка отзыва
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_rating_summary (
+                    user_id BIGINT PRIMARY KEY REFERENCES users(user_id),
+                    reviews_count INTEGER NOT NULL DEFAULT 0,
+                    rating_sum INTEGER NOT NULL DEFAULT 0,
+                    stars_1 INTEGER NOT NULL DEFAULT 0,
+                    stars_2 INTEGER NOT NULL DEFAULT 0,
+                    stars_3 INTEGER NOT NULL DEFAULT 0,
+                    stars_4 INTEGER NOT NULL DEFAULT 0,
+                    stars_5 INTEGER NOT NULL DEFAULT 0,
+                    last_review_at TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Первый запуск после появления агрегата: заполняем его из истории
+            needs_backfill = await conn.fetchval('''
+                SELECT EXISTS (SELECT 1 FROM reviews)
+                   AND NOT EXISTS (SELECT 1 FROM user_rating_summary)
+            ''')
+            if needs_backfill:
+                await self._recompute_rating_summaries(conn)
+
+            # Дневные сводки для админской статистики. Снимки (всего пользователей,
+            # заказов по статусам и т.п.) фиксируются на момент последнего пересчёта дня,
+            # потоки (новые за день) считаются по created_at / completed_at
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS stats_daily (
+                    day DATE PRIMARY KEY,
+                    users_total INTEGER NOT NULL DEFAULT 0,
+                    executors INTEGER NOT NULL DEFAULT 0,
+                    customers INTEGER NOT NULL DEFAULT 0,
+                    banned INTEGER NOT NULL DEFAULT 0,
+                    admins INTEGER NOT NULL DEFAULT 0,
+                    orders_total INTEGER NOT NULL DEFAULT 0,
+                    orders_open INTEGER NOT NULL DEFAULT 0,
+                    orders_active INTEGER NOT NULL DEFAULT 0,
+                    orders_completed_total INTEGER NOT NULL DEFAULT 0,
+                    orders_cancelled_total INTEGER NOT NULL DEFAULT 0,
+                    complaints_open INTEGER NOT NULL DEFAULT 0,
+                    avg_rating DECIMAL(3,2),
+                    users_new INTEGER NOT NULL DEFAULT 0,
+                    orders_new INTEGER NOT NULL DEFAULT 0,
+                    orders_completed INTEGER NOT NULL DEFAULT 0,
+                    gmv DECIMAL(14,2) NOT NULL DEFAULT 0,
+                    reviews_new INTEGER NOT NULL DEFAULT 0,
+                    complaints_new INTEGER NOT NULL DEFAULT 0,
+                    moderation_checks INTEGER NOT NULL DEFAULT 0,
+                    moderation_flagged INTEGER NOT NULL DEFAULT 0,
+                    moderation_risk_sum BIGINT NOT NULL DEFAULT 0,
+                    moderation_blocked INTEGER NOT NULL DEFAULT 0,
+                    moderation_approved INTEGER NOT NULL DEFAULT 0,
+                    computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Админский просмотр: keyset по (created_at, user_id), отдельно для забаненных
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_created_keyset
+                ON users (created_at DESC, user_id DESC)
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_users_banned_keyset
+                ON users (created_at DESC, user_id DESC) WHERE is_banned
+            ''')
+
+            # Username в Telegram уникален в каждый момент времени, но сравнивается без учёта
+            # регистра. Уникальный индекс по lower(username) обслуживает точный поиск и префикс.
+            # Перед созданием сбрасываем устаревшие дубли (ник сменил владельца), оставляя новейшую запись
+            has_unique_username = await conn.fetchval("SELECT to_regclass('idx_users_username_unique') IS NOT NULL")
+            if not has_unique_username:
+                await conn.execute('''
+                    UPDATE users u SET username = NULL
+                    FROM users newer
+                    WHERE lower(u.username) = lower(newer.username)
+                      AND (newer.created_at, newer.user_id) > (u.created_at, u.user_id)
+                ''')
+                await conn.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS idx_users_username_unique
+                    ON users (lower(username) text_pattern_ops)
+                ''')
+                await conn.execute('DROP INDEX IF EXISTS idx_users_username_lower')
+
+            # Нечёткий поиск («возможно, вы имели в виду») по триграммам. pg_trgm может быть
+            # недоступен (нет прав на CREATE EXTENSION) — тогда работает только префикс
+            try:
+                await conn.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+                await conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_users_username_trgm
+                    ON users USING gin (lower(username) gin_trgm_ops)
+                ''')
+                # Частичное совпадение адреса (ILIKE '%...%') в search_orders
+                await conn.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_orders_address_trgm
+                    ON orders USING gin (address gin_trgm_ops)
+                ''')
+                self.has_trigram = True
+            except Exception as e:
+                logger.warning(f"pg_trgm недоступен, нечёткий поиск пользователей отключён: {e}")
+
+            # Поиск заказов: полнотекстовый вектор (русская морфология) по описанию и адресу
+            await conn.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS work_type VARCHAR(50)')
+            await conn.execute('''
+                ALTER TABLE orders ADD COLUMN IF NOT EXISTS search_tsv tsvector
+                GENERATED ALWAYS AS (
+                    to_tsvector('russian', coalesce(comment, '') || ' ' || coalesce(address, ''))
+                ) STORED
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_orders_search_tsv
+                ON orders USING gin (search_tsv)
+            ''')
+            # Открытая лента с фильтром по типу работ и цене
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_orders_open_type_price
+                ON orders (work_type, price)
+                WHERE status = 'open' AND is_deleted = FALSE
+            ''')
+            # Открытые заказы по цене: keyset (price, order_id) для get_orders_by_price_range
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_orders_open_price
+                ON orders (price, order_id)
+                WHERE status = 'open' AND is_deleted = FALSE
+            ''')
+
+            # Необязательные координаты заказа из геопозиции Telegram и последняя
+            # присланная геопозиция пользователя (для «рядом со мной» и сортировки ленты)
+            await conn.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS latitude DOUBLE PRECISION')
+            await conn.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS longitude DOUBLE PRECISION')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_locations (
+                    user_id BIGINT PRIMARY KEY REFERENCES users(user_id),
+                    latitude DOUBLE PRECISION NOT NULL,
+                    longitude DOUBLE PRECISION NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+
+            # Чат по заказу: keyset-история, тип вложения для copy_message и
+            # счётчики непрочитанных на участника (обновляются вместе с пачкой сообщений)
+            await conn.execute("ALTER TABLE messages ADD COLUMN IF NOT EXISTS content_type VARCHAR(20) DEFAULT 'text'")
+            await conn.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS tg_chat_id BIGINT')
+            await conn.execute('ALTER TABLE messages ADD COLUMN IF NOT EXISTS tg_message_id BIGINT')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_messages_chat_keyset
+                ON messages (chat_id, created_at DESC, message_id DESC)
+            ''')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_chats_order ON chats (order_id)')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS chat_unread (
+                    chat_id INTEGER REFERENCES chats(chat_id) ON DELETE CASCADE,
+                    user_id BIGINT REFERENCES users(user_id),
+                    unread_count INTEGER NOT NULL DEFAULT 0,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (chat_id, user_id)
+                )
+            ''')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_unread_user ON chat_unread (user_id) WHERE unread_count > 0')
+
+            # Фильтры ленты исполнителя: текущий и сохранённые пресеты
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS order_feed_filters (
+                    user_id BIGINT PRIMARY KEY REFERENCES users(user_id),
+                    filters JSONB NOT NULL DEFAULT '{}',
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS order_filter_presets (
+                    preset_id SERIAL PRIMARY KEY,
+                    user_id BIGINT NOT NULL REFERENCES users(user_id),
+                    name VARCHAR(64) NOT NULL,
+                    filters JSONB NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    UNIQUE (user_id, name)
+                )
+            ''')
+
+            # Индексы для дневных диапазонов в refresh_daily_stats
+            for table in ('users', 'orders', 'reviews', 'complaints', 'moderation_logs', 'admin_moderation_decisions'):
+                await conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{table}_created_at ON {table} (created_at)'
+                )
+
+            # Индексы по колонке возраста для пачечной очистки retention.py
+            for table, column in (
+                ('notifications', 'created_at'), ('messages', 'created_at'), ('penalty_log', 'created_at'),
+                ('hidden_orders', 'hidden_at'), ('user_bot_messages', 'updated_at'),
+            ):
+                await conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS idx_{table}_{column} ON {table} ({column})'
+                )
+
+            # Дельты ленты для live_feed.py: NOTIFY только когда заказ появляется
+            # в открытой ленте или пропадает из неё (взят, удалён, закрыт)
+            await conn.execute('''
+                CREATE OR REPLACE FUNCTION notify_orders_feed() RETURNS trigger AS $$
+                DECLARE
+                    was_visible BOOLEAN := FALSE;
+                    is_visible BOOLEAN := FALSE;
+                    feed_kind TEXT;
+                    feed_order_id INTEGER;
+                BEGIN
+                    IF TG_OP <> 'INSERT' THEN
+                        was_visible := OLD.status = 'open' AND NOT COALESCE(OLD.is_deleted, FALSE);
+                    END IF;
+                    IF TG_OP <> 'DELETE' THEN
+                        is_visible := NEW.status = 'open' AND NOT COALESCE(NEW.is_deleted, FALSE);
+                    END IF;
+
+                    IF is_visible AND NOT was_visible THEN
+                        feed_kind := 'added';
+                        feed_order_id := NEW.order_id;
+                    ELSIF was_visible AND NOT is_visible THEN
+                        IF TG_OP = 'UPDATE' AND NEW.executor_id IS NOT NULL
+                           AND NOT COALESCE(NEW.is_deleted, FALSE) THEN
+                            feed_kind := 'taken';
+                        ELSE
+                            feed_kind := 'removed';
+                        END IF;
+                        feed_order_id := OLD.order_id;
+                    ELSE
+                        RETURN NULL;
+                    END IF;
+
+                    PERFORM pg_notify(
+                        'orders_feed',
+                        json_build_object('kind', feed_kind, 'order_id', feed_order_id)::text
+                    );
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            await conn.execute('DROP TRIGGER IF EXISTS orders_feed_notify ON orders')
+            await conn.execute('''
+                CREATE TRIGGER orders_feed_notify
+                AFTER INSERT OR DELETE OR UPDATE OF status, is_deleted, executor_id ON orders
+                FOR EACH ROW EXECUTE FUNCTION notify_orders_feed()
+            ''')
+
+            # Таблицы событий — помесячные секции по created_at (partitioning.py)
+            await partitioning.maintain_partitions(conn)
+
+            # Холодный архив заказов. Момент мягкого удаления нужен, чтобы отсчитывать
+            # срок архивации удалённых заказов; старым удалённым подставляется created_at
+            await conn.execute('ALTER TABLE orders ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP')
+            await conn.execute('''
+                CREATE OR REPLACE FUNCTION orders_set_deleted_at() RETURNS trigger AS $$
+                BEGIN
+                    IF (NEW.is_deleted OR NEW.status = 'deleted')
+                       AND NOT (COALESCE(OLD.is_deleted, FALSE) OR OLD.status = 'deleted') THEN
+                        NEW.deleted_at := CURRENT_TIMESTAMP;
+                    ELSIF NOT (COALESCE(NEW.is_deleted, FALSE) OR NEW.status = 'deleted') THEN
+                        NEW.deleted_at := NULL;
+                    END IF;
+                    RETURN NEW;
+                END;
+                $$ LANGUAGE plpgsql
+            ''')
+            await conn.execute('DROP TRIGGER IF EXISTS orders_deleted_at ON orders')
+            await conn.execute('''
+                CREATE TRIGGER orders_deleted_at
+                BEFORE UPDATE OF is_deleted, status ON orders
+                FOR EACH ROW EXECUTE FUNCTION orders_set_deleted_at()
+            ''')
+            await conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_orders_deleted_at
+                ON orders (COALESCE(deleted_at, created_at))
+                WHERE is_deleted = TRUE OR status = 'deleted'
+            ''')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_moderation_logs_order ON moderation_logs (order_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_order ON responses (order_id)')
+
+            for source, archive in ARCHIVE_TABLES.items():
+                self._archive_columns[source] = await sync_archive_table(conn, source, archive)
+            await conn.execute('ALTER TABLE orders_archive ADD COLUMN IF NOT EXISTS archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP')
+            await conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_archive_id ON orders_archive (order_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_customer ON orders_archive (customer_id, created_at DESC)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_orders_archive_executor ON orders_archive (executor_id, completed_at DESC)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_archive_order ON responses_archive (order_id)')
+            await conn.execute('CREATE INDEX IF NOT EXISTS idx_moderation_logs_archive_order ON moderation_logs_archive (order_id)')
+
+            foreign_keys = await conn.fetch(
+                '''SELECT conrelid::regclass::text AS table_name, conname
+                   FROM pg_constraint
+                   WHERE contype = 'f' AND confrelid = 'orders'::regclass AND conparentid = 0
+                     AND conrelid::regclass::text = ANY($1::text[])''',
+                list(ORDER_HISTORY_REFERENCES)
+            )
+            for fk in foreign_keys:
+                await conn.execute(f'ALTER TABLE {fk["table_name"]} DROP CONSTRAINT IF EXISTS {fk["conname"]}')
+
+            # Горячие и архивные заказы одним отношением для чтения истории;
+            # список колонок меняется вместе с orders, поэтому представление пересоздаётся
+            order_columns = ', '.join(self._archive_columns['orders'])
+            async with conn.transaction():
+                await conn.execute('DROP VIEW IF EXISTS orders_all')
+                await conn.execute(f'''
+                    CREATE VIEW orders_all AS
+                    SELECT {order_columns}, FALSE AS is_archived FROM orders
+                    UNION ALL
+                    SELECT {order_columns}, TRUE AS is_archived FROM orders_archive
+                ''')
+
     async def get_user(self, user_id):
         async with self.pool.acquire() as conn:
             return await conn.fetchrow('SELECT * FROM users WHERE user_id = $1', user_id)
 
     async def create_user(self, user_id, username, first_name):
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                'INSERT INTO users (user_id, username, first_name) VALUES ($1, $2, $3) ON CONFLICT (user_id) DO NOTHING',
-                user_id, username, first_name
-            )
+            async with conn.transaction():
+                existing = await conn.fetchrow(
+                    'SELECT username, is_banned FROM users WHERE user_id = $1 FOR UPDATE',
+                    user_id
+                )
+                old_username = existing['username'] if existing else None
+                banned = bool(existing and existing['is_banned'])
+                username_changed = old_username != username
+                if username and username_changed:
+                    # Ник перешёл к этому пользователю — у прежнего владельца он устарел
+                    await conn.execute(
+                        'UPDATE users SET username = NULL WHERE lower(username) = lower($1) AND user_id <> $2',
+                        username, user_id
+                    )
+                await conn.execute(
+                    '''INSERT INTO users (user_id, username, first_name) VALUES ($1, $2, $3)
+                       ON CONFLICT (user_id) DO UPDATE
+                       SET username = EXCLUDED.username, first_name = EXCLUDED.first_name
+                       WHERE users.username IS DISTINCT FROM EXCLUDED.username
+                          OR users.first_name IS DISTINCT FROM EXCLUDED.first_name''',
+                    user_id, username, first_name
+                )
             await conn.execute(
                 'INSERT INTO executor_profiles (user_id) VALUES ($1) ON CONFLICT (user_id) DO NOTHING',
                 user_id
@@ -264,6 +1018,12 @@ class Database:
                 user_id
             )
         
+        if username_changed:
+            # banned: индекс username не знает о банах до своего запуска
+            self._emit(
+                'username_changed', user_id=user_id, old=old_username, new=username, banned=banned
+            )
+
         # Apply migrations
         await self._apply_migrations()
 
@@ -290,15 +1050,17 @@ class Database:
     async def update_role(self, user_id, role):
         async with self.pool.acquire() as conn:
             await conn.execute('UPDATE users SET user_role = $1 WHERE user_id = $2', role, user_id)
+        self._emit('role_changed', user_id=user_id, role=role)
 
-    async def create_order(self, customer_id, price, start_time, address, workers_count, comment, phone_number=None, work_type=None):
+    async def create_order(self, customer_id, price, start_time, address, workers_count, comment, phone_number=None, work_type=None, latitude=None, longitude=None):
         async with self.pool.acquire() as conn:
             order_id = await conn.fetchval(
-                '''INSERT INTO orders (customer_id, price, start_time, address, workers_count, comment, phone_number, work_type)
-                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8) RETURNING order_id''',
-                customer_id, price, start_time, address, workers_count, comment, phone_number, work_type
+                '''INSERT INTO orders (customer_id, price, start_time, address, workers_count, comment, phone_number, work_type, latitude, longitude)
+                   VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10) RETURNING order_id''',
+                customer_id, price, start_time, address, workers_count, comment, phone_number, work_type, latitude, longitude
             )
-            return order_id
+        self._emit('order_created', order_id=order_id, latitude=latitude, longitude=longitude)
+        return order_id
 
     async def get_customer_orders(self, customer_id):
         async with self.pool.acquire() as conn:
@@ -313,6 +1075,39 @@ class Database:
                 'SELECT * FROM orders WHERE status = \'open\' AND is_deleted = FALSE ORDER BY created_at DESC'
             )
 
+    async def get_open_orders_by_ids(self, order_ids):
+        """Открытые заказы из списка id (закрытые и удалённые отсеиваются)"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                'SELECT * FROM orders WHERE order_id = ANY($1::int[]) AND status = \'open\' AND is_deleted = FALSE',
+                list(order_ids)
+            )
+
+    async def get_open_order_locations(self):
+        """Координаты открытых заказов для OrderGeoIndex"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                '''SELECT order_id, latitude, longitude FROM orders
+                   WHERE status = 'open' AND is_deleted = FALSE AND latitude IS NOT NULL AND longitude IS NOT NULL'''
+            )
+
+    async def save_user_location(self, user_id, latitude, longitude):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                '''INSERT INTO user_locations (user_id, latitude, longitude, updated_at)
+                   VALUES ($1, $2, $3, CURRENT_TIMESTAMP)
+                   ON CONFLICT (user_id) DO UPDATE
+                   SET latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude, updated_at = EXCLUDED.updated_at''',
+                user_id, latitude, longitude
+            )
+
+    async def get_user_location(self, user_id):
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(
+                'SELECT latitude, longitude, updated_at FROM user_locations WHERE user_id = $1',
+                user_id
+            )
+
     async def get_all_active_orders(self):
         async with self.pool.acquire() as conn:
             return await conn.fetch(
@@ -321,43 +1116,120 @@ class Database:
 
     async def get_order(self, order_id):
         async with self.pool.acquire() as conn:
-            return await conn.fetchrow('SELECT * FROM orders WHERE order_id = $1', order_id)
+            order = await conn.fetchrow('SELECT * FROM orders WHERE order_id = $1', order_id)
+            if order is None:
+                # Карточки из истории могут ссылаться на уже заархивированный заказ
+                order = await conn.fetchrow('SELECT * FROM orders_archive WHERE order_id = $1', order_id)
+            return order
+
+    async def search_orders(self, filters=None, limit=None, offset=0):
+        """
+        Поиск по открытым заказам с комбинируемыми фильтрами (ключи ORDER_FILTER_KEYS):
+        q — полнотекстовый запрос по описанию и адресу (search_tsv), location — часть адреса
+        (триграммный индекс), work_type, min_price/max_price, min_rating — рейтинг заказчика.
+        При текстовом запросе сортировка по релевантности, иначе от новых к старым.
+        """
+        sql, params, order_by = _order_search_clause(filters)
+        sql = f"SELECT o.* {sql} ORDER BY {order_by}"
+        if limit is not None:
+            params += [limit, offset]
+            sql += f' LIMIT ${len(params) - 1} OFFSET ${len(params)}'
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(sql, *params)
+
+    async def count_orders(self, filters=None):
+        """Количество открытых заказов под фильтр (для экрана фильтров)"""
+        sql, params, _ = _order_search_clause(filters)
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(f"SELECT COUNT(*) {sql}", *params)
 
     # Filter methods
     async def get_orders_by_work_type(self, work_type):
         """Get open orders filtered by work type"""
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                'SELECT * FROM orders WHERE status = \'open\' AND work_type = $1 AND is_deleted = FALSE ORDER BY created_at DESC',
-                work_type
-            )
+        return await self.search_orders({'work_type': work_type})
     
-    async def get_orders_by_price_range(self, min_price, max_price):
-        """Get open orders filtered by price range"""
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                'SELECT * FROM orders WHERE status = \'open\' AND price >= $1 AND price <= $2 AND is_deleted = FALSE ORDER BY price ASC',
-                min_price, max_price
-            )
+    async def get_orders_by_price_range(self, min_price, max_price, after=None, limit=None):
+        """
+        Get open orders filtered by price range, cheapest first (price ASC, order_id ASC).
+        Keyset-пагинация: after — (price, order_id) последнего заказа предыдущей страницы,
+        индекс idx_orders_open_price.
+        """
+        sql, params, _ = _order_search_clause({'min_price': min_price, 'max_price': max_price})
+        if after is not None:
+            params += [Decimal(str(after[0])), after[1]]
+            sql += f' AND (o.price, o.order_id) > (${len(params) - 1}, ${len(params)})'
+        sql = f'SELECT o.* {sql} ORDER BY o.price ASC, o.order_id ASC'
+        if limit is not None:
+            params.append(limit)
+            sql += f' LIMIT ${len(params)}'
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(sql, *params)
     
     async def get_orders_by_location(self, location):
         """Get open orders filtered by location (substring match)"""
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(
-                'SELECT * FROM orders WHERE status = \'open\' AND address ILIKE $1 AND is_deleted = FALSE ORDER BY created_at DESC',
-                f'%{location}%'
-            )
+        return await self.search_orders({'location': location})
     
     async def get_orders_by_rating_threshold(self, min_rating):
         """Get open orders from customers with minimum rating"""
+        return await self.search_orders({'min_rating': min_rating})
+
+    async def get_feed_filter(self, user_id):
+        """Текущий фильтр ленты исполнителя (пустой словарь — без фильтра)"""
+        async with self.pool.acquire() as conn:
+            raw = await conn.fetchval('SELECT filters FROM order_feed_filters WHERE user_id = $1', user_id)
+        return normalize_order_filters(json.loads(raw)) if raw else {}
+
+    async def set_feed_filter(self, user_id, filters):
+        filters = normalize_order_filters(filters)
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                '''INSERT INTO order_feed_filters (user_id, filters, updated_at)
+                   VALUES ($1, $2::jsonb, CURRENT_TIMESTAMP)
+                   ON CONFLICT (user_id) DO UPDATE
+                   SET filters = EXCLUDED.filters, updated_at = EXCLUDED.updated_at''',
+                user_id, json.dumps(filters, ensure_ascii=False)
+            )
+        return filters
+
+    async def get_filter_presets(self, user_id):
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                'SELECT preset_id, name, filters FROM order_filter_presets WHERE user_id = $1 ORDER BY name',
+                user_id
+            )
+        return [
+            {'preset_id': row['preset_id'], 'name': row['name'], 'filters': normalize_order_filters(json.loads(row['filters']))}
+            for row in rows
+        ]
+
+    async def save_filter_preset(self, user_id, name, filters):
+        """Сохраняет пресет; пресет с тем же именем перезаписывается"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchval(
+                '''INSERT INTO order_filter_presets (user_id, name, filters)
+                   VALUES ($1, $2, $3::jsonb)
+                   ON CONFLICT (user_id, name) DO UPDATE SET filters = EXCLUDED.filters
+                   RETURNING preset_id''',
+                user_id, name[:64], json.dumps(normalize_order_filters(filters), ensure_ascii=False)
+            )
+
+    async def apply_filter_preset(self, user_id, preset_id):
+        """Делает пресет текущим фильтром ленты; None если пресет чужой или удалён"""
+        async with self.pool.acquire() as conn:
+            raw = await conn.fetchval(
+                'SELECT filters FROM order_filter_presets WHERE preset_id = $1 AND user_id = $2',
+                preset_id, user_id
+            )
+        if raw is None:
+            return None
+        return await self.set_feed_filter(user_id, json.loads(raw))
+
+    async def delete_filter_preset(self, user_id, preset_id):
         async with self.pool.acquire() as conn:
-            return await conn.fetch('''
-                SELECT o.* FROM orders o
-                JOIN users u ON o.customer_id = u.user_id
-                JOIN customer_profiles cp ON u.user_id = cp.user_id
-                WHERE o.status = 'open' AND cp.rating >= $1 AND o.is_deleted = FALSE
-                ORDER BY o.created_at DESC
-            ''', min_rating)
+            await conn.execute(
+                'DELETE FROM order_filter_presets WHERE preset_id = $1 AND user_id = $2',
+                preset_id, user_id
+            )
 
     async def delete_order(self, order_id):
         async with self.pool.acquire() as conn:
@@ -366,20 +1238,25 @@ class Database:
     async def get_deleted_orders(self, customer_id):
         async with self.pool.acquire() as conn:
             return await conn.fetch(
-                'SELECT * FROM orders WHERE customer_id = $1 AND is_deleted = TRUE ORDER BY created_at DESC',
+                'SELECT * FROM orders_all WHERE customer_id = $1 AND is_deleted = TRUE ORDER BY created_at DESC',
                 customer_id
             )
     
     async def get_customer_completed_orders(self, customer_id):
         async with self.pool.acquire() as conn:
             return await conn.fetch(
-                'SELECT * FROM orders WHERE customer_id = $1 AND status = \'completed\' AND is_deleted = FALSE ORDER BY created_at DESC',
+                'SELECT * FROM orders_all WHERE customer_id = $1 AND status = \'completed\' AND is_deleted = FALSE ORDER BY created_at DESC',
                 customer_id
             )
     
     async def restore_order(self, order_id):
         async with self.pool.acquire() as conn:
-            await conn.execute('UPDATE orders SET is_deleted = FALSE WHERE order_id = $1', order_id)
+            async with conn.transaction():
+                result = await conn.execute('UPDATE orders SET is_deleted = FALSE WHERE order_id = $1', order_id)
+                if result == 'UPDATE 0':
+                    # Удалённый заказ уже в архиве — возвращаем его вместе с откликами
+                    if await self._unarchive_order(conn, order_id):
+                        await conn.execute('UPDATE orders SET is_deleted = FALSE WHERE order_id = $1', order_id)
     
     async def delete_all_customer_orders(self, customer_id):
         async with self.pool.acquire() as conn:
@@ -391,6 +1268,9 @@ class Database:
     async def permanent_delete_order(self, order_id):
         async with self.pool.acquire() as conn:
             await conn.execute('DELETE FROM orders WHERE order_id = $1', order_id)
+            await conn.execute('DELETE FROM responses_archive WHERE order_id = $1', order_id)
+            await conn.execute('DELETE FROM moderation_logs_archive WHERE order_id = $1', order_id)
+            await conn.execute('DELETE FROM orders_archive WHERE order_id = $1', order_id)
     
     async def delete_all_user_orders(self, user_id):
         """Удаляет все активные заказы пользователя (и как заказчика, и как исполнителя)"""
@@ -475,7 +1355,7 @@ class Database:
                     r.rating,
                     r.comment as review_comment,
                     r.created_at as review_date
-                FROM orders o
+                FROM orders_all o
                 LEFT JOIN reviews r ON o.order_id = r.order_id AND r.reviewer_id = o.customer_id AND r.reviewee_id = o.executor_id
                 WHERE o.executor_id = $1 AND o.status IN ('completed', 'deleted', 'cancelled', 'excluded')
                 ORDER BY o.completed_at DESC NULLS LAST, o.created_at DESC
@@ -490,14 +1370,25 @@ class Database:
                 'UPDATE orders SET status = \'archived\' WHERE executor_id = $1 AND status IN (\'completed\', \'deleted\', \'cancelled\', \'excluded\')',
                 executor_id
             )
+            await conn.execute(
+                'UPDATE orders_archive SET status = \'archived\' WHERE executor_id = $1 AND status IN (\'completed\', \'deleted\', \'cancelled\', \'excluded\')',
+                executor_id
+            )
 
     async def complete_order(self, order_id):
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                'UPDATE orders SET status = \'completed\', completed_at = $1 WHERE order_id = $2',
+            row = await conn.fetchrow(
+                'UPDATE orders SET status = \'completed\', completed_at = $1 WHERE order_id = $2 RETURNING executor_id, completed_at',
                 datetime.now(), order_id
             )
+        if row:
+            self._emit('order_completed', order_id=order_id, executor_id=row['executor_id'], completed_at=row['completed_at'])
     
+    async def set_order_status(self, order_id, status):
+        """Смена статуса без побочных полей (in_progress, awaiting_confirmation)"""
+        async with self.pool.acquire() as conn:
+            await conn.execute('UPDATE orders SET status = $1 WHERE order_id = $2', status, order_id)
+
     async def decline_order(self, order_id, decline_reason):
         async with self.pool.acquire() as conn:
             await conn.execute(
@@ -506,28 +1397,123 @@ class Database:
             )
 
     async def create_review(self, order_id, reviewer_id, reviewee_id, rating, comment):
+        stars = int(rating)
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                'INSERT INTO reviews (order_id, reviewer_id, reviewee_id, rating, comment) VALUES ($1, $2, $3, $4, $5)',
-                order_id, reviewer_id, reviewee_id, rating, comment
-            )
-            
-            avg_rating = await conn.fetchval(
-                'SELECT AVG(rating) FROM reviews WHERE reviewee_id = $1',
-                reviewee_id
-            )
-            
-            user = await conn.fetchrow('SELECT user_role FROM users WHERE user_id = $1', reviewee_id)
-            if user['user_role'] == 'executor':
-                await conn.execute(
-                    'UPDATE executor_profiles SET rating = $1 WHERE user_id = $2',
-                    round(avg_rating, 2), reviewee_id
+            async with conn.transaction():
+                created_at = await conn.fetchval(
+                    '''INSERT INTO reviews (order_id, reviewer_id, reviewee_id, rating, comment)
+                       VALUES ($1, $2, $3, $4, $5) RETURNING created_at''',
+                    order_id, reviewer_id, reviewee_id, stars, comment
                 )
-            else:
-                await conn.execute(
-                    'UPDATE customer_profiles SET rating = $1 WHERE user_id = $2',
-                    round(avg_rating, 2), reviewee_id
+
+                # Инкремент агрегата вместо AVG по всем отзывам пользователя
+                summary = await conn.fetchrow(
+                    f'''INSERT INTO user_rating_summary (user_id, reviews_count, rating_sum, stars_{stars}, last_review_at)
+                        VALUES ($1, 1, $2, 1, $3)
+                        ON CONFLICT (user_id) DO UPDATE SET
+                            reviews_count = user_rating_summary.reviews_count + 1,
+                            rating_sum = user_rating_summary.rating_sum + EXCLUDED.rating_sum,
+                            stars_{stars} = user_rating_summary.stars_{stars} + 1,
+                            last_review_at = GREATEST(user_rating_summary.last_review_at, EXCLUDED.last_review_at),
+                            updated_at = CURRENT_TIMESTAMP
+                        RETURNING reviews_count, rating_sum''',
+                    reviewee_id, stars, created_at
                 )
+                avg_rating = round(summary['rating_sum'] / summary['reviews_count'], 2)
+
+                user = await conn.fetchrow('SELECT user_role FROM users WHERE user_id = $1', reviewee_id)
+                role = 'executor' if user and user['user_role'] == 'executor' else 'customer'
+                if role == 'executor':
+                    await conn.execute(
+                        'UPDATE executor_profiles SET rating = $1 WHERE user_id = $2',
+                        avg_rating, reviewee_id
+                    )
+                else:
+                    await conn.execute(
+                        'UPDATE customer_profiles SET rating = $1 WHERE user_id = $2',
+                        avg_rating, reviewee_id
+                    )
+        self._emit('rating_changed', user_id=reviewee_id, role=role, rating=avg_rating)
+        return avg_rating
+
+    async def get_rating_summary(self, user_id):
+        """Возвращает агрегат отзывов пользователя: количество, среднее и гистограмму 1–5"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                'SELECT * FROM user_rating_summary WHERE user_id = $1',
+                user_id
+            )
+        return self.format_rating_summary(row)
+
+    @staticmethod
+    def format_rating_summary(row):
+        """Приводит строку user_rating_summary (или её отсутствие) к словарю для бота и API"""
+        if not row or not row['reviews_count']:
+            return {
+                'reviews_count': 0,
+                'avg_rating': 0.0,
+                'histogram': {stars: 0 for stars in range(1, 6)},
+                'last_review_at': None,
+            }
+        return {
+            'reviews_count': row['reviews_count'],
+            'avg_rating': round(row['rating_sum'] / row['reviews_count'], 2),
+            'histogram': {stars: row[f'stars_{stars}'] for stars in range(1, 6)},
+            'last_review_at': row['last_review_at'],
+        }
+
+    async def recompute_all_ratings(self):
+        """Админский ремонт: пересобирает агрегаты и рейтинги профилей из таблицы reviews"""
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                result = await self._recompute_rating_summaries(conn)
+        self._emit('ratings_recomputed')
+        return result
+
+    async def _recompute_rating_summaries(self, conn):
+        """Set-based пересчёт: один GROUP BY по reviews вместо цикла по пользователям"""
+        await conn.execute('DELETE FROM user_rating_summary')
+        summaries = await conn.fetchval('''
+            WITH inserted AS (
+                INSERT INTO user_rating_summary (
+                    user_id, reviews_count, rating_sum,
+                    stars_1, stars_2, stars_3, stars_4, stars_5, last_review_at
+                )
+                SELECT reviewee_id,
+                       COUNT(*),
+                       SUM(rating),
+                       COUNT(*) FILTER (WHERE rating = 1),
+                       COUNT(*) FILTER (WHERE rating = 2),
+                       COUNT(*) FILTER (WHERE rating = 3),
+                       COUNT(*) FILTER (WHERE rating = 4),
+                       COUNT(*) FILTER (WHERE rating = 5),
+                       MAX(created_at)
+                FROM reviews
+                WHERE reviewee_id IS NOT NULL
+                GROUP BY reviewee_id
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM inserted
+        ''')
+        executors = await conn.execute('''
+            UPDATE executor_profiles ep
+            SET rating = ROUND(s.rating_sum::numeric / s.reviews_count, 2)
+            FROM user_rating_summary s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE ep.user_id = s.user_id AND u.user_role = 'executor'
+        ''')
+        customers = await conn.execute('''
+            UPDATE customer_profiles cp
+            SET rating = ROUND(s.rating_sum::numeric / s.reviews_count, 2)
+            FROM user_rating_summary s
+            JOIN users u ON u.user_id = s.user_id
+            WHERE cp.user_id = s.user_id AND u.user_role <> 'executor'
+        ''')
+        return {
+            'summaries': summaries,
+            'executor_profiles': int(executors.split()[-1]),
+            'customer_profiles': int(customers.split()[-1]),
+        }
 
     async def update_executor_rating(self, user_id, new_rating):
         """Обновляет рейтинг исполнителя напрямую (для админов)"""
@@ -536,6 +1522,7 @@ class Database:
                 'UPDATE executor_profiles SET rating = $1 WHERE user_id = $2',
                 round(float(new_rating), 2), user_id
             )
+        self._emit('rating_changed', user_id=user_id, role='executor', rating=round(float(new_rating), 2))
     
     async def update_customer_rating(self, user_id, new_rating):
         """Обновляет рейтинг заказчика напрямую (для админов)"""
@@ -544,6 +1531,7 @@ class Database:
                 'UPDATE customer_profiles SET rating = $1 WHERE user_id = $2',
                 round(float(new_rating), 2), user_id
             )
+        self._emit('rating_changed', user_id=user_id, role='customer', rating=round(float(new_rating), 2))
 
     async def get_executor_profile(self, user_id):
         async with self.pool.acquire() as conn:
@@ -561,11 +1549,34 @@ class Database:
             return profile['rating'] if profile else 0.0
 
     async def get_user_by_username(self, username):
+        """Точный поиск без учёта регистра (индекс idx_users_username_unique)"""
         async with self.pool.acquire() as conn:
             return await conn.fetchrow(
-                'SELECT * FROM users WHERE username = $1',
-                username.lstrip('@')
+                'SELECT * FROM users WHERE lower(username) = lower($1)',
+                username.strip().lstrip('@')
+            )
+
+    async def get_active_usernames(self):
+        """Все username незаблокированных пользователей — для UsernameIndex"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetch(
+                'SELECT user_id, username FROM users WHERE username IS NOT NULL AND NOT COALESCE(is_banned, FALSE)'
+            )
+
+    async def similar_usernames(self, query, limit=5):
+        """Похожие username по триграммам для подсказок «возможно, вы имели в виду»"""
+        needle = query.strip().lstrip('@').lower()
+        if not needle or not self.has_trigram:
+            return []
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                '''SELECT username FROM users
+                   WHERE lower(username) % $1 AND NOT COALESCE(is_banned, FALSE)
+                   ORDER BY similarity(lower(username), $1) DESC
+                   LIMIT $2''',
+                needle, limit
             )
+        return [row['username'] for row in rows]
     
     async def get_reviews(self, user_id):
         async with self.pool.acquire() as conn:
@@ -578,10 +1589,15 @@ class Database:
                 user_id
             )
 
+    async def get_reviews_page(self, user_id, cursor=None, limit=10, direction='older'):
+        """Keyset-страница отзывов: {'reviews', 'next_cursor', 'prev_cursor'}"""
+        async with self.pool.acquire() as conn:
+            return await fetch_reviews_page(conn, user_id, cursor, limit, direction)
+
     async def update_executor_stats(self, executor_id):
         async with self.pool.acquire() as conn:
             completed = await conn.fetchval(
-                'SELECT COUNT(*) FROM orders WHERE executor_id = $1 AND status = \'completed\'',
+                'SELECT COUNT(*) FROM orders_all WHERE executor_id = $1 AND status = \'completed\'',
                 executor_id
             )
             
@@ -595,6 +1611,7 @@ class Database:
                 'UPDATE executor_profiles SET completed_orders = $1, level = $2 WHERE user_id = $3',
                 completed, level, executor_id
             )
+        self._emit('executor_stats_changed', user_id=executor_id, completed_orders=completed, level=level)
 
     async def get_leaderboard(self, role='executor', limit=10):
         async with self.pool.acquire() as conn:
@@ -617,6 +1634,24 @@ class Database:
                     limit
                 )
 
+    async def get_leaderboard_snapshot(self):
+        """Исходные данные для LeaderboardService: профили исполнителей и выполнения за 24 часа"""
+        async with self.pool.acquire() as conn:
+            executors = await conn.fetch(
+                '''SELECT u.user_id, u.username, u.first_name, u.user_role,
+                          ep.rating, ep.completed_orders, ep.level
+                   FROM users u
+                   JOIN executor_profiles ep ON u.user_id = ep.user_id'''
+            )
+            completions = await conn.fetch(
+                '''SELECT executor_id, completed_at
+                   FROM orders
+                   WHERE status = 'completed'
+                     AND completed_at >= NOW() - INTERVAL '24 hours'
+                     AND executor_id IS NOT NULL'''
+            )
+        return executors, completions
+
     async def get_top_active_executors_24h(self, limit=2):
         """Получить топ активных исполнителей за последние 24 часа"""
         async with self.pool.acquire() as conn:
@@ -644,17 +1679,19 @@ class Database:
 
     async def ban_user(self, user_id, reason):
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                'UPDATE users SET is_banned = TRUE, ban_reason = $1, banned_at = $2 WHERE user_id = $3',
+            username = await conn.fetchval(
+                'UPDATE users SET is_banned = TRUE, ban_reason = $1, banned_at = $2 WHERE user_id = $3 RETURNING username',
                 reason, datetime.now(), user_id
             )
+        self._emit('user_banned', user_id=user_id, username=username)
 
     async def unban_user(self, user_id):
         async with self.pool.acquire() as conn:
-            await conn.execute(
-                'UPDATE users SET is_banned = FALSE, ban_reason = NULL, banned_at = NULL WHERE user_id = $1',
+            username = await conn.fetchval(
+                'UPDATE users SET is_banned = FALSE, ban_reason = NULL, banned_at = NULL WHERE user_id = $1 RETURNING username',
                 user_id
             )
+        self._emit('user_unbanned', user_id=user_id, username=username)
 
     async def make_admin(self, user_id):
         async with self.pool.acquire() as conn:
@@ -667,6 +1704,72 @@ class Database:
                 limit, offset
             )
     
+    async def browse_users(self, user_filter='all', cursor=None, limit=10, direction='older'):
+        """
+        Страница пользователей для админки, от новых к старым по (created_at, user_id).
+        Фильтр по роли/бану/админству выполняется в БД, профили присоединены тем же запросом.
+        """
+        conditions = []
+        condition = ADMIN_USER_FILTERS.get(user_filter)
+        if condition:
+            conditions.append(condition)
+        position = decode_keyset_cursor(cursor) if cursor else None
+        params = []
+        if position is None:
+            direction = 'older'
+        else:
+            params.extend(position)
+            op = '>' if direction == 'newer' else '<'
+            conditions.append(f'(u.created_at, u.user_id) {op} ($1, $2)')
+        order = 'ASC' if direction == 'newer' else 'DESC'
+        params.append(limit + 1)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                _ADMIN_USERS_SELECT + where +
+                f' ORDER BY u.created_at {order}, u.user_id {order} LIMIT ${len(params)}',
+                *params
+            )
+
+        has_more = len(rows) > limit
+        rows = list(rows[:limit])
+        if direction == 'newer':
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = position is not None, has_more
+
+        return {
+            'users': rows,
+            'next_cursor': encode_keyset_cursor(rows[-1]['created_at'], rows[-1]['user_id']) if rows and has_older else None,
+            'prev_cursor': encode_keyset_cursor(rows[0]['created_at'], rows[0]['user_id']) if rows and has_newer else None,
+        }
+
+    async def search_users(self, query, limit=10):
+        """
+        Поиск по username без учёта регистра: сначала совпадения по префиксу,
+        затем похожие по триграммам (если pg_trgm доступен). Оба шага идут по индексу.
+        """
+        needle = query.lstrip('@').strip().lower()
+        if not needle:
+            return []
+        async with self.pool.acquire() as conn:
+            rows = list(await conn.fetch(
+                _ADMIN_USERS_SELECT + ''' WHERE lower(u.username) LIKE $1 || '%'
+                   ORDER BY length(u.username), u.username LIMIT $2''',
+                _escape_like(needle), limit
+            ))
+            if len(rows) < limit and self.has_trigram:
+                found = [row['user_id'] for row in rows]
+                rows += await conn.fetch(
+                    _ADMIN_USERS_SELECT + ''' WHERE lower(u.username) % $1
+                       AND u.user_id <> ALL($2::bigint[])
+                       ORDER BY similarity(lower(u.username), $1) DESC LIMIT $3''',
+                    needle, found, limit - len(rows)
+                )
+        return rows
+
     async def get_all_admins(self):
         """Получить всех администраторов"""
         async with self.pool.acquire() as conn:
@@ -708,18 +1811,166 @@ class Database:
             return [row['order_id'] for row in rows]
 
     async def get_stats(self):
-        async with self.pool.acquire() as conn:
-            total_users = await conn.fetchval('SELECT COUNT(*) FROM users')
-            total_orders = await conn.fetchval('SELECT COUNT(*) FROM orders')
-            active_orders = await conn.fetchval('SELECT COUNT(*) FROM orders WHERE status IN (\'open\', \'assigned\', \'in_progress\')')
-            completed_orders = await conn.fetchval('SELECT COUNT(*) FROM orders WHERE status = \'completed\'')
-            
-            return {
-                'total_users': total_users,
-                'total_orders': total_orders,
-                'active_orders': active_orders,
-                'completed_orders': completed_orders
-            }
+        """Короткая сводка из сегодняшней строки stats_daily (без полных COUNT по таблицам)"""
+        today = await self.get_today_stats()
+        return {
+            'total_users': today['users_total'],
+            'total_orders': today['orders_total'],
+            'active_orders': today['orders_active'],
+            'completed_orders': today['orders_completed_total']
+        }
+
+    async def refresh_daily_stats(self, days=None):
+        """
+        Пересчитывает дневные сводки за последние days дней (по умолчанию 2 — сегодня и вчера,
+        чтобы закрыть день, или STATS_BACKFILL_DAYS при пустой таблице). Снимки обновляются
+        только у сегодняшней строки: прошлые дни хранят состояние на момент своего последнего пересчёта.
+        """
+        async with self.pool.acquire() as conn:
+            if days is None:
+                has_rows = await conn.fetchval('SELECT EXISTS (SELECT 1 FROM stats_daily)')
+                days = 2 if has_rows else STATS_BACKFILL_DAYS
+            async with conn.transaction():
+                await conn.execute('''
+                    WITH days AS (
+                        SELECT generate_series(CURRENT_DATE - ($1::int - 1), CURRENT_DATE, INTERVAL '1 day')::date AS day
+                    ),
+                    u AS (
+                        SELECT created_at::date AS day, COUNT(*) AS n
+                        FROM users WHERE created_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    ),
+                    o AS (
+                        SELECT created_at::date AS day, COUNT(*) AS n
+                        FROM orders_all WHERE created_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    ),
+                    done AS (
+                        SELECT completed_at::date AS day, COUNT(*) AS n, COALESCE(SUM(price), 0) AS gmv
+                        FROM orders_all
+                        WHERE status = 'completed' AND completed_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    ),
+                    r AS (
+                        SELECT created_at::date AS day, COUNT(*) AS n
+                        FROM reviews WHERE created_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    ),
+                    c AS (
+                        SELECT created_at::date AS day, COUNT(*) AS n
+                        FROM complaints WHERE created_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    ),
+                    ml AS (
+                        SELECT created_at::date AS day,
+                               COUNT(*) AS checks,
+                               COUNT(*) FILTER (WHERE risk_score >= 4) AS flagged,
+                               COALESCE(SUM(risk_score), 0) AS risk_sum
+                        FROM moderation_logs WHERE created_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    ),
+                    md AS (
+                        SELECT created_at::date AS day,
+                               COUNT(*) FILTER (WHERE decision = 'blocked') AS blocked,
+                               COUNT(*) FILTER (WHERE decision = 'approved') AS approved
+                        FROM admin_moderation_decisions WHERE created_at >= CURRENT_DATE - ($1::int - 1)
+                        GROUP BY 1
+                    )
+                    INSERT INTO stats_daily (
+                        day, users_new, orders_new, orders_completed, gmv, reviews_new, complaints_new,
+                        moderation_checks, moderation_flagged, moderation_risk_sum,
+                        moderation_blocked, moderation_approved, computed_at
+                    )
+                    SELECT d.day,
+                           COALESCE(u.n, 0), COALESCE(o.n, 0), COALESCE(done.n, 0), COALESCE(done.gmv, 0),
+                           COALESCE(r.n, 0), COALESCE(c.n, 0),
+                           COALESCE(ml.checks, 0), COALESCE(ml.flagged, 0), COALESCE(ml.risk_sum, 0),
+                           COALESCE(md.blocked, 0), COALESCE(md.approved, 0), NOW()
+                    FROM days d
+                    LEFT JOIN u USING (day)
+                    LEFT JOIN o USING (day)
+                    LEFT JOIN done USING (day)
+                    LEFT JOIN r USING (day)
+                    LEFT JOIN c USING (day)
+                    LEFT JOIN ml USING (day)
+                    LEFT JOIN md USING (day)
+                    ON CONFLICT (day) DO UPDATE SET
+                        users_new = EXCLUDED.users_new,
+                        orders_new = EXCLUDED.orders_new,
+                        orders_completed = EXCLUDED.orders_completed,
+                        gmv = EXCLUDED.gmv,
+                        reviews_new = EXCLUDED.reviews_new,
+                        complaints_new = EXCLUDED.complaints_new,
+                        moderation_checks = EXCLUDED.moderation_checks,
+                        moderation_flagged = EXCLUDED.moderation_flagged,
+                        moderation_risk_sum = EXCLUDED.moderation_risk_sum,
+                        moderation_blocked = EXCLUDED.moderation_blocked,
+                        moderation_approved = EXCLUDED.moderation_approved,
+                        computed_at = EXCLUDED.computed_at
+                ''', days)
+
+                # Снимки: по одному проходу на таблицу
+                await conn.execute('''
+                    UPDATE stats_daily s SET
+                        users_total = u.total,
+                        executors = u.executors,
+                        customers = u.customers,
+                        banned = u.banned,
+                        admins = u.admins,
+                        orders_total = o.total,
+                        orders_open = o.open_count,
+                        orders_active = o.active_count,
+                        orders_completed_total = o.completed_count,
+                        orders_cancelled_total = o.cancelled_count,
+                        complaints_open = c.open_count,
+                        avg_rating = r.avg_rating
+                    FROM (
+                        SELECT COUNT(*) AS total,
+                               COUNT(*) FILTER (WHERE user_role IN ('executor', 'both')) AS executors,
+                               COUNT(*) FILTER (WHERE user_role IN ('customer', 'both')) AS customers,
+                               COUNT(*) FILTER (WHERE is_banned) AS banned,
+                               COUNT(*) FILTER (WHERE is_admin) AS admins
+                        FROM users
+                    ) u, (
+                        SELECT COUNT(*) AS total,
+                               COUNT(*) FILTER (WHERE status = 'open' AND NOT COALESCE(is_deleted, FALSE)) AS open_count,
+                               COUNT(*) FILTER (WHERE status IN ('open', 'assigned', 'in_progress')) AS active_count,
+                               COUNT(*) FILTER (WHERE status = 'completed') AS completed_count,
+                               COUNT(*) FILTER (WHERE status IN ('cancelled', 'deleted')) AS cancelled_count
+                        FROM orders_all
+                    ) o, (
+                        SELECT COUNT(*) FILTER (WHERE status = 'new') AS open_count FROM complaints
+                    ) c, (
+                        SELECT ROUND(SUM(rating_sum)::numeric / NULLIF(SUM(reviews_count), 0), 2) AS avg_rating
+                        FROM user_rating_summary
+                    ) r
+                    WHERE s.day = CURRENT_DATE
+                ''')
+        return days
+
+    async def get_today_stats(self):
+        """Сегодняшняя строка stats_daily (снимки по ролям, банам, статусам заказов)"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(STATS_TODAY_QUERY)
+        if not row:
+            # Фоновый пересчёт ещё не успел создать сегодняшнюю строку
+            await self.refresh_daily_stats()
+            async with self.pool.acquire() as conn:
+                row = await conn.fetchrow(STATS_TODAY_QUERY)
+        return row
+
+    async def get_stats_dashboard(self):
+        """
+        Данные админской статистики одним запросом к stats_daily: сегодняшние снимки
+        и суммы потоков за 7/30 дней вместе с предыдущими периодами для тренда
+        """
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(STATS_DASHBOARD_QUERY)
+        if not rows or rows[0]['day'] != rows[0]['today']:
+            await self.refresh_daily_stats()
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(STATS_DASHBOARD_QUERY)
+        return summarize_stats_rows(rows)
 
     async def get_or_create_chat(self, order_id, user1_id, user2_id):
         async with self.pool.acquire() as conn:
@@ -735,25 +1986,140 @@ class Database:
                 return chat_id
             return chat['chat_id']
 
-    async def send_message(self, chat_id, sender_id, message):
+    async def send_message(self, chat_id, sender_id, message, recipient_id=None):
+        await self.save_chat_messages([{
+            'chat_id': chat_id,
+            'sender_id': sender_id,
+            'recipient_id': recipient_id,
+            'message': message,
+            'created_at': datetime.now(),
+        }])
+
+    async def save_chat_messages(self, items):
+        """
+        Сохраняет пачку сообщений чата одним INSERT ... unnest и одним upsert счётчиков
+        непрочитанных. items: dict с chat_id, sender_id, recipient_id, message,
+        created_at и необязательными content_type, tg_chat_id, tg_message_id.
+        """
+        if not items:
+            return
+        unread = {}
+        for item in items:
+            if item.get('recipient_id'):
+                key = (item['chat_id'], item['recipient_id'])
+                unread[key] = unread.get(key, 0) + 1
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute(
+                    '''INSERT INTO messages (chat_id, sender_id, message, content_type, tg_chat_id, tg_message_id, created_at)
+                       SELECT * FROM unnest($1::int[], $2::bigint[], $3::text[], $4::varchar[], $5::bigint[], $6::bigint[], $7::timestamp[])''',
+                    [item['chat_id'] for item in items],
+                    [item['sender_id'] for item in items],
+                    [item['message'] for item in items],
+                    [item.get('content_type') or 'text' for item in items],
+                    [item.get('tg_chat_id') for item in items],
+                    [item.get('tg_message_id') for item in items],
+                    [item['created_at'] for item in items]
+                )
+                if unread:
+                    await conn.execute(
+                        '''INSERT INTO chat_unread (chat_id, user_id, unread_count)
+                           SELECT * FROM unnest($1::int[], $2::bigint[], $3::int[])
+                           ON CONFLICT (chat_id, user_id) DO UPDATE
+                           SET unread_count = chat_unread.unread_count + EXCLUDED.unread_count,
+                               updated_at = CURRENT_TIMESTAMP''',
+                        [key[0] for key in unread],
+                        [key[1] for key in unread],
+                        list(unread.values())
+                    )
+
+    async def get_chat_messages(self, chat_id, limit=50):
+        page = await self.get_chat_history(chat_id, limit=limit)
+        return page['messages'][::-1]
+
+    async def get_chat_history(self, chat_id, cursor=None, limit=10, direction='older'):
+        """
+        Страница истории чата от новых к старым по ключу (created_at, message_id),
+        тем же способом, что и fetch_reviews_page: индекс idx_messages_chat_keyset.
+        Сообщения на странице — в хронологическом порядке (старые сверху).
+        """
+        select = '''
+            SELECT m.*, u.first_name, u.username
+            FROM messages m
+            JOIN users u ON m.sender_id = u.user_id
+            WHERE m.chat_id = $1
+        '''
+        position = decode_keyset_cursor(cursor) if cursor else None
+        async with self.pool.acquire() as conn:
+            if position is None:
+                direction = 'older'
+                rows = await conn.fetch(
+                    select + ' ORDER BY m.created_at DESC, m.message_id DESC LIMIT $2',
+                    chat_id, limit + 1
+                )
+            # Отдельное условие на created_at дублирует сравнение кортежей:
+            # по нему (а не по ROW(...)) планировщик отсекает секции messages
+            elif direction == 'newer':
+                rows = await conn.fetch(
+                    select + ''' AND m.created_at >= $2 AND (m.created_at, m.message_id) > ($2, $3)
+                       ORDER BY m.created_at ASC, m.message_id ASC LIMIT $4''',
+                    chat_id, position[0], position[1], limit + 1
+                )
+            else:
+                rows = await conn.fetch(
+                    select + ''' AND m.created_at <= $2 AND (m.created_at, m.message_id) < ($2, $3)
+                       ORDER BY m.created_at DESC, m.message_id DESC LIMIT $4''',
+                    chat_id, position[0], position[1], limit + 1
+                )
+
+        has_more = len(rows) > limit
+        rows = list(rows[:limit])
+        if direction == 'newer':
+            has_newer, has_older = has_more, True
+        else:
+            rows.reverse()
+            has_newer, has_older = position is not None, has_more
+
+        return {
+            'messages': rows,
+            # Курсор «раньше» — от самого старого сообщения страницы, «позже» — от самого нового
+            'next_cursor': encode_keyset_cursor(rows[0]['created_at'], rows[0]['message_id']) if rows and has_older else None,
+            'prev_cursor': encode_keyset_cursor(rows[-1]['created_at'], rows[-1]['message_id']) if rows and has_newer else None,
+        }
+
+    async def mark_chat_read(self, chat_id, user_id):
         async with self.pool.acquire() as conn:
             await conn.execute(
-                'INSERT INTO messages (chat_id, sender_id, message) VALUES ($1, $2, $3)',
-                chat_id, sender_id, message
+                'UPDATE chat_unread SET unread_count = 0, updated_at = CURRENT_TIMESTAMP WHERE chat_id = $1 AND user_id = $2 AND unread_count > 0',
+                chat_id, user_id
             )
 
-    async def get_chat_messages(self, chat_id, limit=50):
+    async def get_unread_chats(self, user_id):
+        """Чаты пользователя с непрочитанными сообщениями (частичный индекс idx_chat_unread_user)"""
         async with self.pool.acquire() as conn:
             return await conn.fetch(
-                '''SELECT m.*, u.first_name, u.username 
-                   FROM messages m
-                   JOIN users u ON m.sender_id = u.user_id
-                   WHERE m.chat_id = $1
-                   ORDER BY m.created_at DESC
-                   LIMIT $2''',
-                chat_id, limit
+                '''SELECT cu.chat_id, cu.unread_count, c.order_id
+                   FROM chat_unread cu
+                   JOIN chats c ON c.chat_id = cu.chat_id
+                   WHERE cu.user_id = $1 AND cu.unread_count > 0
+                   ORDER BY cu.updated_at DESC''',
+                user_id
             )
 
+    async def get_unread_count(self, user_id, chat_id=None):
+        async with self.pool.acquire() as conn:
+            if chat_id is not None:
+                value = await conn.fetchval(
+                    'SELECT unread_count FROM chat_unread WHERE chat_id = $1 AND user_id = $2',
+                    chat_id, user_id
+                )
+            else:
+                value = await conn.fetchval(
+                    'SELECT SUM(unread_count) FROM chat_unread WHERE user_id = $1 AND unread_count > 0',
+                    user_id
+                )
+            return int(value or 0)
+
     async def create_complaint(self, user_id, complaint_type, target_id, description):
         async with self.pool.acquire() as conn:
             complaint_id = await conn.fetchval(
@@ -805,19 +2171,19 @@ class Database:
         async with self.pool.acquire() as conn:
             if role == 'customer':
                 return await conn.fetch(
-                    'SELECT * FROM orders WHERE customer_id = $1 AND status = \'completed\' AND is_deleted = FALSE ORDER BY completed_at DESC',
+                    'SELECT * FROM orders_all WHERE customer_id = $1 AND status = \'completed\' AND is_deleted = FALSE ORDER BY completed_at DESC',
                     user_id
                 )
             else:
                 return await conn.fetch(
-                    'SELECT * FROM orders WHERE executor_id = $1 AND status = \'completed\' AND is_deleted = FALSE ORDER BY completed_at DESC',
+                    'SELECT * FROM orders_all WHERE executor_id = $1 AND status = \'completed\' AND is_deleted = FALSE ORDER BY completed_at DESC',
                     user_id
                 )
 
     async def update_customer_stats(self, customer_id):
         async with self.pool.acquire() as conn:
             total = await conn.fetchval(
-                'SELECT COUNT(*) FROM orders WHERE customer_id = $1',
+                'SELECT COUNT(*) FROM orders_all WHERE customer_id = $1',
                 customer_id
             )
             await conn.execute(
@@ -830,112 +2196,7 @@ class Database:
 
     async def init_moderation_patterns(self):
         """Заполняет базу подозрительных паттернов (расширенная база из интернет-исследований 2024-2025)"""
-        patterns = [
-            # === НАРКОТИКИ И КУРЬЕРЫ-ЗАКЛАДЧИКИ (приоритет 5) ===
-            ('закладчик', 'наркотики', 5),
-            ('закладки', 'наркотики', 5),
-            ('кладмен', 'наркотики', 5),
-            ('минер', 'наркотики', 5),
-            ('фасовщик', 'наркотики', 5),
-            ('трафаретчик', 'наркотики', 5),
-            ('легальная продукция', 'наркотики', 5),
-            ('клад', 'наркотики', 4),
-            ('развешивать по пакетикам', 'наркотики', 5),
-            ('мастер-квест', 'наркотики', 4),
-            ('спайс', 'наркотики', 5),
-            ('соль', 'наркотики', 3),
-            ('скорость', 'наркотики', 2),
-            ('курьер', 'наркотики', 2),
-            ('развозка', 'наркотики', 2),
-            ('доставка посылок', 'наркотики', 2),
-            ('доставка лёгких заказов', 'наркотики', 4),
-            ('пешие курьеры', 'наркотики', 3),
-            ('анонимно', 'наркотики', 3),
-            ('конфиденциально', 'наркотики', 2),
-            ('без опыта', 'наркотики', 1),
-            ('быстрые деньги', 'наркотики', 3),
-            ('наличные сразу', 'наркотики', 2),
-            ('телеграм только', 'наркотики', 3),
-            ('пишите в тг', 'наркотики', 2),
-            ('фото паспорта', 'наркотики', 4),
-            ('страховой взнос', 'наркотики', 4),
-            ('залог', 'наркотики', 2),
-            ('нефасованный опт', 'наркотики', 5),
-            ('мина', 'наркотики', 3),
-            
-            # === НЕРЕАЛЬНЫЕ СУММЫ (признак мошенничества) ===
-            ('лёгкий заработок', 'мошенничество', 4),
-            ('высокий доход', 'мошенничество', 3),
-            ('быстрый заработок', 'мошенничество', 4),
-            ('300 тысяч в месяц', 'мошенничество', 5),
-            ('500 тысяч в месяц', 'мошенничество', 5),
-            ('900 тысяч', 'мошенничество', 5),
-            ('30 тысяч в день', 'мошенничество', 5),
-            ('50 тысяч в день', 'мошенничество', 5),
-            ('3-4 часа в день', 'мошенничество', 2),
-            ('свободный график', 'мошенничество', 1),
-            
-            # === АЗАРТНЫЕ ИГРЫ ===
-            ('казино', 'азартные_игры', 5),
-            ('ставки', 'азартные_игры', 4),
-            ('букмекер', 'азартные_игры', 5),
-            ('покер', 'азартные_игры', 4),
-            ('слоты', 'азартные_игры', 5),
-            ('рулетка', 'азартные_игры', 5),
-            ('выигрыш', 'азартные_игры', 3),
-            ('бонус за регистрацию', 'азартные_игры', 4),
-            
-            # === ИНТИМ УСЛУГИ И ПОРНОГРАФИЯ ===
-            ('порно', 'порнография', 5),
-            ('эскорт', 'порнография', 5),
-            ('интим', 'порнография', 5),
-            ('интим услуги', 'порнография', 5),
-            ('проститутки', 'порнография', 5),
-            ('девушки по вызову', 'порнография', 5),
-            ('массаж для мужчин', 'порнография', 4),
-            ('знакомства 18+', 'порнография', 4),
-            ('вебкам', 'порнография', 5),
-            ('onlyfans', 'порнография', 4),
-            
-            # === ОРУЖИЕ И ВЗРЫВЧАТКА ===
-            ('оружие', 'оружие', 5),
-            ('пистолет', 'оружие', 5),
-            ('взрывчатка', 'оружие', 5),
-            ('автомат', 'оружие', 5),
-            ('патроны', 'оружие', 5),
-            ('граната', 'оружие', 5),
-            
-            # === ФИНАНСОВОЕ МОШЕННИЧЕСТВО ===
-            ('обнал', 'финансовые_махинации', 5),
-            ('обналичка', 'финансовые_махинации', 5),
-            ('отмыв денег', 'финансовые_махинации', 5),
-            ('фальшивые', 'финансовые_махинации', 5),
-            ('поддельные документы', 'финансовые_махинации', 5),
-            ('липовые', 'финансовые_махинации', 4),
-            ('чёрный нал', 'финансовые_махинации', 5),
-            ('крипта', 'криптовалюта', 2),
-            ('btc', 'криптовалюта', 2),
-            ('usdt', 'криптовалюта', 2),
-            ('киви-кошелёк', 'финансовые_махинации', 2),
-            
-            # === МЕДИЦИНСКИЕ И ФАРМАЦЕВТИЧЕСКИЕ ===
-            ('виагра', 'медицина', 4),
-            ('сиалис', 'медицина', 4),
-            ('аптека без рецепта', 'медицина', 4),
-            ('лекарства запрещённые', 'медицина', 5),
-            ('стероиды', 'медицина', 4),
-            ('100% результат', 'медицина', 3),
-            ('гарантия излечения', 'медицина', 4),
-            
-            # === АГРЕССИВНЫЙ МАРКЕТИНГ (Telegram/Avito запреты) ===
-            ('только сегодня', 'агрессивный_маркетинг', 2),
-            ('не упусти', 'агрессивный_маркетинг', 2),
-            ('последний шанс', 'агрессивный_маркетинг', 3),
-            ('лучший', 'агрессивный_маркетинг', 1),
-            ('самый выгодный', 'агрессивный_маркетинг', 2),
-            ('топовый', 'агрессивный_маркетинг', 1),
-        ]
-        
+        patterns = MODERATION_PATTERNS
         logging.info("Loading moderation patterns...")
         async with self.pool.acquire() as conn:
             for keyword, category, weight in patterns:
@@ -959,26 +2220,7 @@ class Database:
 
     async def init_whitelist(self):
         """Заполняет whitelist легальных формулировок"""
-        phrases = [
-            ('грузчик', 'легальная_работа'),
-            ('разнорабочий', 'легальная_работа'),
-            ('уборка', 'легальная_работа'),
-            ('клининг', 'легальная_работа'),
-            ('ремонт', 'легальная_работа'),
-            ('демонтаж', 'легальная_работа'),
-            ('стройка', 'легальная_работа'),
-            ('переезд', 'легальная_работа'),
-            ('погрузка', 'легальная_работа'),
-            ('разгрузка', 'легальная_работа'),
-            ('сборка мебели', 'легальная_работа'),
-            ('покраска', 'легальная_работа'),
-            ('монтаж', 'легальная_работа'),
-            ('сантехник', 'легальная_работа'),
-            ('электрик', 'легальная_работа'),
-            ('штукатурка', 'легальная_работа'),
-            ('поклейка обоев', 'легальная_работа'),
-        ]
-        
+        phrases = WHITELIST_PHRASES
         logging.info("Loading whitelist phrases...")
         async with self.pool.acquire() as conn:
             for phrase, category in phrases:
@@ -1010,20 +2252,9 @@ class Database:
                 'SELECT keyword, category, risk_weight FROM moderation_patterns WHERE is_active = TRUE'
             )
             
-            for pattern in patterns:
-                keyword = pattern['keyword'].lower()
-                if keyword in text_lower:
-                    risk_score += pattern['risk_weight']
-                    matched_patterns.append(f"{pattern['keyword']} (+{pattern['risk_weight']})")
-            
-            # Дополнительная проверка на подозрительную цену для курьеров
-            if 'курьер' in text_lower and price > 4000:
-                risk_score += 3
-                matched_patterns.append("курьер+высокая_цена (+3)")
-            
-            if 'доставка' in text_lower and price > 4000:
-                risk_score += 2
-                matched_patterns.append("доставка+высокая_цена (+2)")
+            pattern_score, pattern_matches = score_moderation_patterns(text_lower, price, patterns)
+            risk_score += pattern_score
+            matched_patterns.extend(pattern_matches)
         
         return risk_score, matched_patterns
 
@@ -1045,6 +2276,7 @@ class Database:
                    FROM orders o
                    JOIN moderation_logs m ON o.order_id = m.order_id
                    WHERE m.risk_score >= $1 AND o.is_deleted = FALSE
+                     AND m.created_at > NOW() - INTERVAL '90 days'
                    ORDER BY m.created_at DESC
                    LIMIT 50''',
                 min_risk_score
@@ -1174,20 +2406,9 @@ class Database:
                 'SELECT keyword, category, risk_weight FROM moderation_patterns WHERE is_active = TRUE'
             )
             
-            for pattern in patterns:
-                keyword = pattern['keyword'].lower()
-                if keyword in text_lower:
-                    risk_score += pattern['risk_weight']
-                    matched_patterns.append(f"{pattern['keyword']} (+{pattern['risk_weight']})")
-            
-            # Дополнительная проверка на подозрительную цену для курьеров
-            if 'курьер' in text_lower and price > 4000:
-                risk_score += 3
-                matched_patterns.append("курьер+высокая_цена (+3)")
-            
-            if 'доставка' in text_lower and price > 4000:
-                risk_score += 2
-                matched_patterns.append("доставка+высокая_цена (+2)")
+            pattern_score, pattern_matches = score_moderation_patterns(text_lower, price, patterns)
+            risk_score += pattern_score
+            matched_patterns.extend(pattern_matches)
             
             # Анализ аномалий
             anomaly_score, anomalies = await self.detect_anomalies(text, address)
@@ -1233,32 +2454,17 @@ class Database:
             )
 
     async def get_moderation_stats(self):
-        """Получает статистику эффективности модерации"""
-        async with self.pool.acquire() as conn:
-            stats = await conn.fetchrow(
-                '''SELECT 
-                    COUNT(*) as total_checks,
-                    COUNT(*) FILTER (WHERE risk_score >= 4) as flagged_count,
-                    AVG(risk_score) as avg_risk_score
-                   FROM moderation_logs
-                   WHERE created_at > NOW() - INTERVAL '30 days' '''
-            )
-            
-            admin_decisions = await conn.fetchrow(
-                '''SELECT 
-                    COUNT(*) FILTER (WHERE decision = 'blocked') as blocked_count,
-                    COUNT(*) FILTER (WHERE decision = 'approved') as approved_count
-                   FROM admin_moderation_decisions
-                   WHERE created_at > NOW() - INTERVAL '30 days' '''
-            )
-            
-            return {
-                'total_checks': stats['total_checks'] if stats else 0,
-                'flagged_count': stats['flagged_count'] if stats else 0,
-                'avg_risk_score': float(stats['avg_risk_score']) if stats and stats['avg_risk_score'] else 0,
-                'blocked_by_admins': admin_decisions['blocked_count'] if admin_decisions else 0,
-                'approved_by_admins': admin_decisions['approved_count'] if admin_decisions else 0
-            }
+        """Получает статистику эффективности модерации за 30 дней из дневных сводок"""
+        dashboard = await self.get_stats_dashboard()
+        month = dashboard['windows'][30]['current']
+        checks = month['moderation_checks']
+        return {
+            'total_checks': checks,
+            'flagged_count': month['moderation_flagged'],
+            'avg_risk_score': float(month['moderation_risk_sum']) / checks if checks else 0,
+            'blocked_by_admins': month['moderation_blocked'],
+            'approved_by_admins': month['moderation_approved']
+        }
 
     async def save_last_bot_message(self, user_id: int, message_id: int, chat_id: int):
         async with self.pool.acquire() as conn:
@@ -1323,10 +2529,169 @@ class Database:
         """Удаляет записи о последних сообщениях бота старше указанного срока."""
         async with self.pool.acquire() as conn:
             await conn.execute(
-                'DELETE FROM user_bot_messages WHERE updated_at < NOW() - ($1 || " hours")::INTERVAL',
+                'DELETE FROM user_bot_messages WHERE updated_at < NOW() - make_interval(hours => $1)',
                 hours,
             )
 
+    # ==================== АРХИВ ЗАКАЗОВ ====================
+
+    async def _move_rows(self, conn, source, target, columns, where, *params):
+        """Переносит строки source → target одним DELETE ... RETURNING; возвращает их число"""
+        column_list = ', '.join(columns)
+        result = await conn.execute(
+            f'''WITH moved AS (
+                    DELETE FROM {source} WHERE {where} RETURNING {column_list}
+                )
+                INSERT INTO {target} ({column_list}) SELECT {column_list} FROM moved''',
+            *params
+        )
+        return int(result.split()[-1])
+
+    async def archive_orders_batch(self, completed_before=None, deleted_before=None, limit=500):
+        """
+        Переносит в архив пачку заказов, выполненных раньше completed_before или
+        удалённых раньше deleted_before (None — правило выключено), вместе с их
+        откликами и логами модерации. Одна пачка — одна транзакция; заказы,
+        заблокированные другими транзакциями, пропускаются до следующей пачки.
+        """
+        moved = {'orders': 0, 'responses': 0, 'moderation_logs': 0}
+        async with self.pool.acquire() as conn:
+            async with conn.transaction():
+                order_ids = [row['order_id'] for row in await conn.fetch(
+                    '''SELECT order_id FROM orders
+                       WHERE (status = 'completed' AND NOT COALESCE(is_deleted, FALSE) AND completed_at < $1)
+                          OR ((is_deleted = TRUE OR status = 'deleted') AND COALESCE(deleted_at, created_at) < $2)
+                       ORDER BY order_id
+                       LIMIT $3
+                       FOR UPDATE SKIP LOCKED''',
+                    completed_before, deleted_before, limit
+                )]
+                if not order_ids:
+                    return moved
+                for source in ('responses', 'moderation_logs', 'orders'):
+                    moved[source] = await self._move_rows(
+                        conn, source, ARCHIVE_TABLES[source], self._archive_columns[source],
+                        'order_id = ANY($1::int[])', order_ids
+                    )
+        return moved
+
+    async def _unarchive_order(self, conn, order_id):
+        """Возвращает заказ и его отклики из архива (генерируемые колонки пересчитываются)"""
+        insertable = [name for name, _, generated in await fetch_table_columns(conn, 'orders') if not generated]
+        restored = await self._move_rows(
+            conn, 'orders_archive', 'orders', insertable, 'order_id = $1', order_id
+        )
+        if restored:
+            await self._move_rows(
+                conn, 'responses_archive', 'responses', self._archive_columns['responses'], 'order_id = $1', order_id
+            )
+        return restored
+
+    async def get_archive_stats(self, completed_before=None, deleted_before=None):
+        """Размер архива и сколько заказов ждут переноса по текущим срокам"""
+        async with self.pool.acquire() as conn:
+            return await conn.fetchrow(
+                '''SELECT
+                       (SELECT COUNT(*) FROM orders_archive) AS archived_total,
+                       (SELECT MAX(archived_at) FROM orders_archive) AS last_archived_at,
+                       (SELECT COUNT(*) FROM orders
+                        WHERE status = 'completed' AND NOT COALESCE(is_deleted, FALSE) AND completed_at < $1) AS pending_completed,
+                       (SELECT COUNT(*) FROM orders
+                        WHERE (is_deleted = TRUE OR status = 'deleted') AND COALESCE(deleted_at, created_at) < $2) AS pending_deleted''',
+                completed_before, deleted_before
+            )
+
+    async def get_archive_settings(self):
+        """Настройки архивации из system_settings: сроки в днях (0 — правило выключено)"""
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                "SELECT setting_key, setting_value FROM system_settings WHERE setting_key LIKE 'archive_%'"
+            )
+        values = {row['setting_key']: row['setting_value'] for row in rows}
+        return {
+            'completed_days': int(values.get('archive_completed_days', 90)),
+            'deleted_days': int(values.get('archive_deleted_days', 30)),
+        }
+
+    async def set_archive_setting(self, key, days, admin_id):
+        async with self.pool.acquire() as conn:
+            await conn.execute(
+                '''INSERT INTO system_settings (setting_key, setting_value, updated_by)
+                   VALUES ($1, $2, $3)
+                   ON CONFLICT (setting_key) DO UPDATE
+                   SET setting_value = EXCLUDED.setting_value, updated_at = CURRENT_TIMESTAMP, updated_by = EXCLUDED.updated_by''',
+                f'archive_{key}', str(days), admin_id
+            )
+
+    # ==================== ХРАНЕНИЕ ДАННЫХ ====================
+
+    @staticmethod
+    def _retention_where(policy):
+        where = f'{policy.age_column} < $1'
+        if policy.condition:
+            where += f' AND ({policy.condition})'
+        return where
+
+    async def retention_purge_batch(self, policy, cutoff, after=None, limit=1000):
+        """
+        Удаляет одну пачку строк по политике retention.RetentionPolicy.
+        Пачка выбирается по ключу (колонка возраста, первичный ключ) после курсора after,
+        так что строки, не прошедшие дополнительное условие, не просматриваются повторно.
+        Возвращает (удалено, курсор для следующей пачки).
+        """
+        where = self._retention_where(policy)
+        params = [cutoff, limit]
+        if after is not None:
+            where += f' AND ({policy.age_column}, {policy.key}) > ($3, $4)'
+            params.extend(after)
+        # Соединение и по колонке возраста: у секционированной таблицы DELETE
+        # трогает только секции пачки, а не ищет ключ во всех
+        async with self.pool.acquire() as conn:
+            rows = await conn.fetch(
+                f'''WITH batch AS (
+                        SELECT {policy.key}, {policy.age_column} FROM {policy.table}
+                        WHERE {where}
+                        ORDER BY {policy.age_column}, {policy.key}
+                        LIMIT $2
+                    )
+                    DELETE FROM {policy.table} t USING batch
+                    WHERE t.{policy.key} = batch.{policy.key}
+                      AND t.{policy.age_column} = batch.{policy.age_column}
+                    RETURNING t.{policy.age_column} AS age, t.{policy.key} AS key''',
+                *params
+            )
+        if not rows:
+            return 0, after
+        last = max((row['age'], row['key']) for row in rows)
+        return len(rows), last
+
+    async def retention_drop_partitions(self, policy, cutoff):
+        """
+        Для секционированных таблиц без доп. условия: целиком удаляет секции старше cutoff.
+        Возвращает (секций, примерно строк); для обычных таблиц — (0, 0).
+        """
+        if policy.condition or policy.age_column != partitioning.PARTITION_COLUMN:
+            return 0, 0
+        async with self.pool.acquire() as conn:
+            if not await partitioning.is_partitioned(conn, policy.table):
+                return 0, 0
+            return await partitioning.drop_expired_partitions(conn, policy.table, cutoff)
+
+    async def maintain_partitions(self):
+        """Заготовка секций на следующие месяцы (вызывается из прогона очистки)"""
+        async with self.pool.acquire() as conn:
+            await partitioning.maintain_partitions(conn)
+
+    async def retention_preview(self, policy, cutoff):
+        """Пробный прогон политики: сколько строк подпадает под удаление и самая старая"""
+        async with self.pool.acquire() as conn:
+            row = await conn.fetchrow(
+                f'SELECT COUNT(*) AS rows, MIN({policy.age_column}) AS oldest '
+                f'FROM {policy.table} WHERE {self._retention_where(policy)}',
+                cutoff
+            )
+            return {'rows': row['rows'], 'oldest': row['oldest']}
+
     async def close(self):
         if self.pool:
             await self.pool.close()
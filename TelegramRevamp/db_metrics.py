@@ -0,0 +1,294 @@
+"""
+Метрики запросов к БД
+Пул asyncpg оборачивается так, что каждый запрос попадает в реестр именованных
+выражений (имя — метод Database и короткий хеш нормализованного SQL, у DDL и
+обслуживания схемы — один ряд на метод) и учитывается в гистограмме задержек,
+счётчике строк и времени ожидания соединения.
+Медленные запросы пишутся в лог с замаскированными параметрами; метрики отдаются
+в текстовом формате Prometheus.
+"""
+import hashlib
+import logging
+import re
+import sys
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# DDL и обслуживание: SQL собирается из имён таблиц и секций, отдельный ряд на каждый
+# вариант только раздувал бы метрики
+DDL_KEYWORDS = (
+    'CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'COMMENT', 'LOCK', 'VACUUM', 'ANALYZE', 'REINDEX',
+    'CLUSTER', 'GRANT', 'REVOKE', 'DO',
+)
+_DDL_RE = re.compile(rf"\s*({'|'.join(DDL_KEYWORDS)})\b", re.IGNORECASE)
+MAINTENANCE_LABELS = frozenset({
+    'create_tables', '_apply_migrations', 'maintain_partitions', 'retention_drop_partitions',
+})
+
+# Список, куда в текущем контексте складываются выполненные запросы (см. capture_queries)
+_captured_queries: ContextVar[Optional[list]] = ContextVar('captured_queries', default=None)
+
+
+@contextmanager
+def capture_queries():
+    """
+    Собирает (имя, метод соединения, SQL, параметры) всех запросов, выполненных
+    в этом контексте, — бенчмарки берут их для EXPLAIN
+    """
+    captured = []
+    token = _captured_queries.set(captured)
+    try:
+        yield captured
+    finally:
+        _captured_queries.reset(token)
+
+
+def redact_params(args) -> str:
+    """Параметры запроса для лога без значений: только типы и длины строк"""
+    parts = []
+    for index, value in enumerate(args, start=1):
+        if value is None:
+            shown = 'NULL'
+        elif isinstance(value, str):
+            shown = f'<str:{len(value)}>'
+        elif isinstance(value, (list, tuple)):
+            shown = f'<{type(value).__name__}:{len(value)}>'
+        else:
+            shown = f'<{type(value).__name__}>'
+        parts.append(f'${index}={shown}')
+    return ' '.join(parts)
+
+
+def _rows_from_status(status) -> int:
+    """Число строк из статуса команды ('UPDATE 3', 'INSERT 0 1')"""
+    try:
+        return int(str(status).rsplit(' ', 1)[-1])
+    except (ValueError, IndexError):
+        return 0
+
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        index = 0
+        while index < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[index]:
+            index += 1
+        self.counts[index] += 1
+        self.total += seconds
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return LATENCY_BUCKETS[index] if index < len(LATENCY_BUCKETS) else float('inf')
+        return float('inf')
+
+
+class QueryStats:
+    __slots__ = ('latency', 'acquire', 'rows', 'errors')
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.acquire = Histogram()
+        self.rows = 0
+        self.errors = 0
+
+
+class QueryMetrics:
+    """Реестр выражений и накопленные метрики по имени запроса"""
+
+    def __init__(self, slow_query_ms: float = 200):
+        self.slow_query_seconds = slow_query_ms / 1000
+        self.stats: Dict[str, QueryStats] = {}
+        self.statements: Dict[str, str] = {}
+        self._names: Dict[Tuple[str, str], str] = {}
+        self._observers: List[Callable[[str, float], None]] = []
+
+    def subscribe(self, observer: Callable[[str, float], None]):
+        """Подписка на время каждого запроса и ожидания пула (например, для трассировки хендлеров)"""
+        self._observers.append(observer)
+
+    def _notify(self, kind: str, seconds: float):
+        for observer in self._observers:
+            try:
+                observer(kind, seconds)
+            except Exception as e:
+                logger.debug(f"Наблюдатель метрик БД завершился с ошибкой: {e}")
+
+    def statement_name(self, label: str, sql: str) -> str:
+        """
+        Имя выражения: label#хеш нормализованного SQL — не зависит от порядка первых
+        вызовов и одинаково между перезапусками. DDL и методы обслуживания схемы
+        идут одним рядом под именем метода.
+        """
+        key = (label, sql)
+        name = self._names.get(key)
+        if name is not None:
+            return name
+        statement = _WHITESPACE_RE.sub(' ', sql).strip()
+        if label in MAINTENANCE_LABELS or _DDL_RE.match(statement):
+            self.statements.setdefault(label, statement)
+            return label
+        digest = hashlib.blake2b(statement.encode(), digest_size=4).hexdigest()
+        name = self._names[key] = f'{label}#{digest}'
+        self.statements[name] = statement
+        return name
+
+    def _stats(self, name: str) -> QueryStats:
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = QueryStats()
+        return stats
+
+    def observe_query(self, name: str, seconds: float, rows: int, error: bool = False, args=()):
+        stats = self._stats(name)
+        stats.latency.observe(seconds)
+        self._notify('query', seconds)
+        stats.rows += rows
+        if error:
+            stats.errors += 1
+        if seconds >= self.slow_query_seconds:
+            logger.warning(
+                "🐢 Медленный запрос %s: %.0f мс, строк %d; %s; %s",
+                name, seconds * 1000, rows, self.statements.get(name, '')[:300], redact_params(args)
+            )
+
+    def observe_acquire(self, label: str, seconds: float):
+        self._stats(label).acquire.observe(seconds)
+        self._notify('acquire', seconds)
+
+    def top(self, limit: int = 10) -> List[Tuple[str, QueryStats]]:
+        """Запросы с наибольшим суммарным временем выполнения"""
+        ranked = [(name, stats) for name, stats in self.stats.items() if stats.latency.count]
+        ranked.sort(key=lambda item: item[1].latency.total, reverse=True)
+        return ranked[:limit]
+
+    def render_prometheus(self) -> str:
+        lines = [
+            '# HELP db_query_duration_seconds Время выполнения запроса к БД',
+            '# TYPE db_query_duration_seconds histogram',
+        ]
+        for name, stats in sorted(self.stats.items()):
+            lines.extend(_histogram_lines('db_query_duration_seconds', name, stats.latency))
+        lines += [
+            '# HELP db_pool_acquire_seconds Ожидание соединения из пула',
+            '# TYPE db_pool_acquire_seconds histogram',
+        ]
+        for name, stats in sorted(self.stats.items()):
+            if stats.acquire.count:
+                lines.extend(_histogram_lines('db_pool_acquire_seconds', name, stats.acquire))
+        lines += ['# HELP db_query_rows_total Строк возвращено или изменено', '# TYPE db_query_rows_total counter']
+        lines += [f'db_query_rows_total{{query="{name}"}} {stats.rows}' for name, stats in sorted(self.stats.items())]
+        lines += ['# HELP db_query_errors_total Запросы, завершившиеся ошибкой', '# TYPE db_query_errors_total counter']
+        lines += [f'db_query_errors_total{{query="{name}"}} {stats.errors}' for name, stats in sorted(self.stats.items())]
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_lines(metric: str, name: str, histogram: Histogram) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, bucket_count in zip(LATENCY_BUCKETS, histogram.counts):
+        cumulative += bucket_count
+        lines.append(f'{metric}_bucket{{query="{name}",le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{query="{name}",le="+Inf"}} {histogram.count}')
+    lines.append(f'{metric}_sum{{query="{name}"}} {histogram.total:.6f}')
+    lines.append(f'{metric}_count{{query="{name}"}} {histogram.count}')
+    return lines
+
+
+class InstrumentedConnection:
+    """Соединение, которое меряет fetch/fetchrow/fetchval/execute; остальное — как у asyncpg"""
+
+    def __init__(self, conn, label: str, metrics: QueryMetrics):
+        self._conn = conn
+        self._label = label
+        self._metrics = metrics
+
+    def __getattr__(self, item):
+        return getattr(self._conn, item)
+
+    async def _run(self, method: str, sql: str, args, count_rows):
+        name = self._metrics.statement_name(self._label, sql)
+        captured = _captured_queries.get()
+        if captured is not None:
+            captured.append((name, method, sql, args))
+        started = time.perf_counter()
+        try:
+            result = await getattr(self._conn, method)(sql, *args)
+        except Exception:
+            self._metrics.observe_query(name, time.perf_counter() - started, 0, error=True, args=args)
+            raise
+        self._metrics.observe_query(name, time.perf_counter() - started, count_rows(result), args=args)
+        return result
+
+    async def fetch(self, sql, *args):
+        return await self._run('fetch', sql, args, len)
+
+    async def fetchrow(self, sql, *args):
+        return await self._run('fetchrow', sql, args, lambda row: 0 if row is None else 1)
+
+    async def fetchval(self, sql, *args):
+        return await self._run('fetchval', sql, args, lambda value: 0 if value is None else 1)
+
+    async def execute(self, sql, *args):
+        return await self._run('execute', sql, args, _rows_from_status)
+
+    async def executemany(self, sql, args):
+        return await self._run('executemany', sql, (args,), lambda _: len(args))
+
+
+class InstrumentedPool:
+    """
+    Обёртка над asyncpg.Pool: acquire() меряет ожидание соединения и отдаёт
+    InstrumentedConnection, подписанное именем вызывающего метода Database.
+    Сами выражения готовятся один раз на соединение кешем asyncpg (statement_cache_size).
+    """
+
+    def __init__(self, pool, metrics: QueryMetrics):
+        self._pool = pool
+        self.metrics = metrics
+        # Корутины, ждущие свободного соединения (для health.py)
+        self.waiting = 0
+
+    def __getattr__(self, item):
+        return getattr(self._pool, item)
+
+    def acquire(self, label: Optional[str] = None):
+        return self._acquire(label or sys._getframe(1).f_code.co_name)
+
+    @asynccontextmanager
+    async def _acquire(self, label: str):
+        started = time.perf_counter()
+        self.waiting += 1
+        acquired = False
+        try:
+            async with self._pool.acquire() as conn:
+                self.waiting -= 1
+                acquired = True
+                self.metrics.observe_acquire(label, time.perf_counter() - started)
+                yield InstrumentedConnection(conn, label, self.metrics)
+        finally:
+            # Ожидание прервано (таймаут, отмена) до получения соединения
+            if not acquired:
+                self.waiting -= 1
@@ -0,0 +1,212 @@
+"""
+Координатор правок сообщений бота
+Запоминает хеш последнего показанного (текст, клавиатура) для каждого сообщения
+и не вызывает editMessageText, если содержимое не изменилось. Серия правок одного
+сообщения, пришедшая быстрее, чем Telegram успевает ответить, схлопывается до
+последней. Счётчики показывают, сколько вызовов API сэкономлено.
+"""
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import (
+    DeleteMessage, DeleteMessages, EditMessageCaption, EditMessageMedia,
+    EditMessageReplyMarkup, EditMessageText
+)
+
+logger = logging.getLogger(__name__)
+
+NOT_MODIFIED_TEXT = "Bad Request: message is not modified"
+
+MessageKey = Tuple[str, int]
+
+
+def is_not_modified(error: Exception) -> bool:
+    return isinstance(error, TelegramBadRequest) and 'message is not modified' in str(error)
+
+
+def content_hash(text: str, reply_markup=None, parse_mode=None) -> str:
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup is not None else ''
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (str(parse_mode), text or '', markup):
+        digest.update(part.encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+def _copy_outcome(source: asyncio.Future, target: asyncio.Future):
+    if target.done():
+        return
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+
+class _Slot:
+    """
+    Очередь правок одного сообщения: отправляется только самая свежая. Правки,
+    пришедшие, пока сообщение правится, копятся в пачку: content — последнее
+    содержимое, result — общий итог пачки. Пачку отправляет первый её участник,
+    дождавшийся блокировки, итог получают все участники.
+    """
+    __slots__ = ('lock', 'waiting', 'content', 'result')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.waiting = 0
+        self.content: Optional[tuple] = None
+        self.result: Optional[asyncio.Future] = None
+
+
+class EditCoordinator:
+    """
+    Хеши хранятся для max_messages последних сообщений (LRU). Правки, сделанные
+    в обход edit_text (callback.message.edit_text и т.п.), тоже проходят через
+    middleware сессии бота: он обновляет хеши, сбрасывает их при других правках
+    и удалении и отвечает «message is not modified» без обращения к Telegram.
+    """
+
+    def __init__(self, bot, max_messages: int = 20000):
+        self.bot = bot
+        self.max_messages = max_messages
+        self._hashes: 'OrderedDict[MessageKey, str]' = OrderedDict()
+        self._slots: Dict[MessageKey, _Slot] = {}
+        self.counters = {
+            'requested': 0,       # правок запрошено (через координатор и напрямую)
+            'api_calls': 0,       # из них ушло в Telegram
+            'skipped_same': 0,    # не отправлено: содержимое не изменилось
+            'coalesced': 0,       # не отправлено: вытеснено более свежей правкой
+            'not_modified': 0,    # Telegram всё равно ответил «not modified»
+        }
+
+    @property
+    def saved_calls(self) -> int:
+        return self.counters['skipped_same'] + self.counters['coalesced']
+
+    @staticmethod
+    def _key(chat_id, message_id) -> MessageKey:
+        return str(chat_id), int(message_id)
+
+    def remember(self, chat_id, message_id, digest: str):
+        key = self._key(chat_id, message_id)
+        self._hashes[key] = digest
+        self._hashes.move_to_end(key)
+        while len(self._hashes) > self.max_messages:
+            self._hashes.popitem(last=False)
+
+    def forget(self, chat_id, message_id):
+        self._hashes.pop(self._key(chat_id, message_id), None)
+
+    def is_unchanged(self, chat_id, message_id, digest: str) -> bool:
+        return self._hashes.get(self._key(chat_id, message_id)) == digest
+
+    def middleware(self) -> 'EditDedupMiddleware':
+        return EditDedupMiddleware(self)
+
+    async def edit_text(self, chat_id: int, message_id: int, text: str,
+                        reply_markup=None, parse_mode: Optional[str] = "HTML") -> bool:
+        """
+        Правка текста с дедупликацией и схлопыванием. True — сообщение показывает
+        этот текст или текст более свежей правки, которая его вытеснила (либо он
+        уже был таким). Ошибки Telegram пробрасываются вызывающему; вытесненные
+        вызовы получают итог правки, которая ушла вместо них.
+        """
+        key = self._key(chat_id, message_id)
+        slot = self._slots.get(key)
+        if slot is None:
+            slot = self._slots[key] = _Slot()
+        slot.content = (text, reply_markup, parse_mode)
+        if slot.result is None:
+            slot.result = asyncio.get_running_loop().create_future()
+        result = slot.result
+        slot.waiting += 1
+        try:
+            async with slot.lock:
+                if slot.result is result:
+                    # Следующие правки соберутся в новую пачку
+                    slot.result = None
+                    try:
+                        await self._send(result, chat_id, message_id, *slot.content)
+                    except asyncio.CancelledError:
+                        # Пачку отправит другой её участник; если уже собирается
+                        # следующая, её итог достанется и этой
+                        if slot.result is None:
+                            slot.result = result
+                        else:
+                            slot.result.add_done_callback(lambda done: _copy_outcome(done, result))
+                        raise
+                    return result.result()
+            self.counters['requested'] += 1
+            self.counters['coalesced'] += 1
+            return await result
+        finally:
+            slot.waiting -= 1
+            if not slot.waiting and self._slots.get(key) is slot:
+                del self._slots[key]
+
+    async def _send(self, result: asyncio.Future, chat_id, message_id, text,
+                    reply_markup, parse_mode):
+        try:
+            await self.bot.edit_message_text(
+                text=text,
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=reply_markup,
+                parse_mode=parse_mode
+            )
+        except TelegramBadRequest as e:
+            if is_not_modified(e):
+                result.set_result(True)
+            else:
+                result.set_exception(e)
+        except Exception as e:
+            result.set_exception(e)
+        else:
+            result.set_result(True)
+
+
+class EditDedupMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: пропуск неизменившихся правок и учёт хешей"""
+
+    def __init__(self, coordinator: EditCoordinator):
+        self.coordinator = coordinator
+
+    async def __call__(self, make_request, bot, method):
+        coordinator = self.coordinator
+        if isinstance(method, EditMessageText) and method.message_id is not None and not method.entities:
+            coordinator.counters['requested'] += 1
+            digest = content_hash(method.text, method.reply_markup, method.parse_mode)
+            if coordinator.is_unchanged(method.chat_id, method.message_id, digest):
+                coordinator.counters['skipped_same'] += 1
+                # Тот же ответ, что дал бы Telegram, — вызывающий код уже умеет его обрабатывать
+                raise TelegramBadRequest(method=method, message=NOT_MODIFIED_TEXT)
+            coordinator.counters['api_calls'] += 1
+            try:
+                response = await make_request(bot, method)
+            except TelegramBadRequest as e:
+                if is_not_modified(e):
+                    coordinator.counters['not_modified'] += 1
+                    coordinator.remember(method.chat_id, method.message_id, digest)
+                else:
+                    coordinator.forget(method.chat_id, method.message_id)
+                raise
+            except Exception:
+                coordinator.forget(method.chat_id, method.message_id)
+                raise
+            coordinator.remember(method.chat_id, method.message_id, digest)
+            return response
+
+        if isinstance(method, (EditMessageReplyMarkup, EditMessageCaption, EditMessageMedia, DeleteMessage)):
+            if method.message_id is not None:
+                coordinator.forget(method.chat_id, method.message_id)
+        elif isinstance(method, DeleteMessages):
+            for message_id in method.message_ids:
+                coordinator.forget(method.chat_id, message_id)
+        return await make_request(bot, method)
@@ -0,0 +1,214 @@
+"""
+Геоиндекс открытых заказов
+Равномерная сетка по широте/долготе в памяти: k ближайших и поиск в радиусе
+без внешних сервисов геокодинга. Координаты приходят из геопозиций Telegram.
+"""
+import asyncio
+import heapq
+import logging
+import math
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+# ~2.2 км по широте: в городе в ячейке десятки заказов, соседние кольца дёшевы
+DEFAULT_CELL_DEG = 0.02
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Расстояние по дуге большого круга в километрах"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def format_distance(km: float) -> str:
+    if km < 1:
+        return f"{int(round(km * 1000, -1))} м"
+    if km < 10:
+        return f"{km:.1f} км"
+    return f"{km:.0f} км"
+
+
+class GeoGridIndex:
+    """
+    Точки раскладываются по ячейкам cell_deg × cell_deg. Поиск обходит кольца
+    ячеек вокруг точки запроса и останавливается, когда ближайшая ещё не
+    просмотренная ячейка заведомо дальше k-го найденного кандидата (или радиуса).
+    Переход через 180-й меридиан не учитывается.
+    """
+
+    def __init__(self, cell_deg: float = DEFAULT_CELL_DEG):
+        self.cell_deg = cell_deg
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._points: Dict[int, Tuple[float, float]] = {}
+        # Габариты занятых ячеек (только расширяются) — предел обхода колец
+        self._bounds: Optional[List[int]] = None
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, item_id: int):
+        return item_id in self._points
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def add(self, item_id: int, lat: float, lon: float):
+        if item_id in self._points:
+            self.remove(item_id)
+        self._points[item_id] = (lat, lon)
+        cy, cx = self._cell(lat, lon)
+        self._cells.setdefault((cy, cx), set()).add(item_id)
+        if self._bounds is None:
+            self._bounds = [cy, cy, cx, cx]
+        else:
+            b = self._bounds
+            b[0], b[1], b[2], b[3] = min(b[0], cy), max(b[1], cy), min(b[2], cx), max(b[3], cx)
+
+    def remove(self, item_id: int):
+        point = self._points.pop(item_id, None)
+        if point is None:
+            return
+        cell = self._cell(*point)
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(item_id)
+            if not members:
+                del self._cells[cell]
+
+    def get(self, item_id: int) -> Optional[Tuple[float, float]]:
+        return self._points.get(item_id)
+
+    @staticmethod
+    def _ring(cy: int, cx: int, r: int):
+        if r == 0:
+            yield cy, cx
+            return
+        for dx in range(-r, r + 1):
+            yield cy - r, cx + dx
+            yield cy + r, cx + dx
+        for dy in range(-r + 1, r):
+            yield cy + dy, cx - r
+            yield cy + dy, cx + r
+
+    def _ring_min_km(self, lat: float, r: int) -> float:
+        """Нижняя граница расстояния до точек в кольце r и дальше (между ними r-1 целых ячеек)"""
+        if r <= 1:
+            return 0.0
+        cell_km = self.cell_deg * math.pi * EARTH_RADIUS_KM / 180
+        # По долготе ячейки сужаются к полюсам: берём самую высокую широту полосы,
+        # небольшой запас покрывает разницу между дугой параллели и большого круга
+        band_lat = min(89.9, abs(lat) + (r + 1) * self.cell_deg)
+        return (r - 1) * cell_km * math.cos(math.radians(band_lat)) * 0.995
+
+    def nearest(self, lat: float, lon: float, k: int = 10, max_km: Optional[float] = None) -> List[Tuple[float, int]]:
+        """k ближайших точек: список (расстояние_км, id) по возрастанию расстояния"""
+        if not self._points or k <= 0:
+            return []
+        cy, cx = self._cell(lat, lon)
+        b = self._bounds
+        max_ring = max(cy - b[0], b[1] - cy, cx - b[2], b[3] - cx, 0)
+        heap: List[Tuple[float, int]] = []  # max-heap по расстоянию через отрицание
+
+        def consider(members):
+            for item_id in members:
+                plat, plon = self._points[item_id]
+                dist = haversine_km(lat, lon, plat, plon)
+                if max_km is not None and dist > max_km:
+                    continue
+                if len(heap) < k:
+                    heapq.heappush(heap, (-dist, item_id))
+                elif dist < -heap[0][0]:
+                    heapq.heapreplace(heap, (-dist, item_id))
+
+        for r in range(max_ring + 1):
+            bound = self._ring_min_km(lat, r)
+            if max_km is not None and bound > max_km:
+                break
+            if len(heap) >= k and bound > -heap[0][0]:
+                break
+            if (2 * r + 1) ** 2 > len(self._cells):
+                # Точка запроса далеко от заказов: обойдённых ячеек уже больше, чем
+                # занятых всего, — дешевле один раз пройти по оставшимся занятым
+                for (y, x), members in self._cells.items():
+                    if max(abs(y - cy), abs(x - cx)) >= r:
+                        consider(members)
+                break
+            for cell in self._ring(cy, cx, r):
+                members = self._cells.get(cell)
+                if members:
+                    consider(members)
+        return sorted((-neg, item_id) for neg, item_id in heap)
+
+    def within(self, lat: float, lon: float, radius_km: float) -> List[Tuple[float, int]]:
+        """Все точки в радиусе radius_km, по возрастанию расстояния"""
+        return self.nearest(lat, lon, k=len(self._points), max_km=radius_km)
+
+
+class OrderGeoIndex:
+    """
+    Геоиндекс открытых заказов с координатами. Новые заказы добавляются по событию
+    order_created, закрытые отсеиваются при выдаче (проверка статуса в БД) и
+    окончательно вычищаются периодической сверкой.
+    """
+
+    def __init__(self, db, reconcile_interval: int = 120, cell_deg: float = DEFAULT_CELL_DEG):
+        self.db = db
+        self.reconcile_interval = reconcile_interval
+        self.cell_deg = cell_deg
+        self.index = GeoGridIndex(cell_deg)
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        db.subscribe(self.handle_event)
+
+    async def ensure_loaded(self):
+        if self._loaded or not self.db.is_connected():
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await self.reconcile()
+
+    def handle_event(self, event: str, payload: dict):
+        if not self._loaded:
+            return
+        if event == 'order_created' and payload.get('latitude') is not None:
+            self.index.add(payload['order_id'], payload['latitude'], payload['longitude'])
+
+    async def reconcile(self):
+        rows = await self.db.get_open_order_locations()
+        index = GeoGridIndex(self.cell_deg)
+        for row in rows:
+            index.add(row['order_id'], row['latitude'], row['longitude'])
+        self.index = index
+        self._loaded = True
+        logger.debug("Геоиндекс заказов сверен с БД: %d точек", len(index))
+
+    async def run_reconciliation(self):
+        """Фоновая задача: пересборка индекса, чтобы убрать закрытые заказы"""
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            if not self.db.is_connected():
+                continue
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Не удалось сверить геоиндекс заказов: {e}")
+
+    async def nearest_orders(self, lat: float, lon: float, k: int = 10, max_km: Optional[float] = None):
+        """
+        Открытые заказы рядом с точкой: [(расстояние_км, заказ)] по возрастанию расстояния.
+        Кандидатов берём с запасом — часть могла закрыться после последней сверки.
+        """
+        await self.ensure_loaded()
+        candidates = self.index.nearest(lat, lon, k * 2, max_km)
+        if not candidates:
+            return []
+        orders = {order['order_id']: order for order in await self.db.get_open_orders_by_ids([oid for _, oid in candidates])}
+        for _, order_id in candidates:
+            if order_id not in orders:
+                self.index.remove(order_id)
+        return [(dist, orders[order_id]) for dist, order_id in candidates if order_id in orders][:k]
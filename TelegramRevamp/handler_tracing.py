@@ -0,0 +1,237 @@
+"""
+Трассировка хендлеров
+Middleware диспетчера aiogram записывает для каждого апдейта спан: общее время
+хендлера, время запросов к БД, время вызовов Bot API и ожидание до начала
+обработки (от получения апдейта ответом getUpdates до хендлера, включая очередь
+перед семафором tasks_concurrency_limit). По имени хендлера
+держатся скользящие p50/p95/p99; медленные апдейты пишутся в лог с разбивкой.
+"""
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.methods import GetUpdates
+
+logger = logging.getLogger(__name__)
+
+# Спан апдейта, который сейчас обрабатывается в этом контексте
+current_span: ContextVar[Optional['Span']] = ContextVar('current_span', default=None)
+
+# Ключ в data диспетчера с моментом получения апдейта
+RECEIVED_KEY = 'trace_received_at'
+
+# Сколько моментов получения держать, пока апдейты ждут своей очереди в диспетчере
+FETCHED_KEEP = 10000
+
+
+class Span:
+    __slots__ = ('handler', 'received', 'started', 'queue_wait', 'db_time', 'db_calls',
+                 'api_time', 'api_calls', 'api_methods')
+
+    def __init__(self, handler: str, received: float, started: float):
+        self.handler = handler
+        self.received = received
+        self.started = started
+        self.queue_wait = max(0.0, started - received)
+        self.db_time = 0.0
+        self.db_calls = 0
+        self.api_time = 0.0
+        self.api_calls = 0
+        self.api_methods: List[str] = []
+
+
+class HandlerStats:
+    """Скользящее окно длительностей хендлера и накопительные суммы"""
+    __slots__ = ('durations', 'count', 'errors', 'total_time', 'db_time', 'api_time', 'queue_wait')
+
+    def __init__(self, window: int):
+        self.durations: Deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.db_time = 0.0
+        self.api_time = 0.0
+        self.queue_wait = 0.0
+
+    def percentiles(self, *qs: float) -> Tuple[float, ...]:
+        if not self.durations:
+            return tuple(0.0 for _ in qs)
+        ordered = sorted(self.durations)
+        last = len(ordered) - 1
+        return tuple(ordered[min(last, int(q * len(ordered)))] for q in qs)
+
+
+class HandlerTracer:
+    """
+    Сборщик спанов. install() вешает middleware на диспетчер (вход апдейта и
+    хендлеры), на сессию бота (получение апдейтов и вызовы Bot API) и
+    подписывается на метрики БД.
+    """
+
+    def __init__(self, slow_update_ms: float = 1000, window: int = 500, slow_keep: int = 20):
+        self.slow_update_seconds = slow_update_ms / 1000
+        self.window = window
+        self.stats: Dict[str, HandlerStats] = {}
+        self.recent_slow: Deque[dict] = deque(maxlen=slow_keep)
+        self.started_at = datetime.now()
+        # update_id → perf_counter() на момент ответа getUpdates
+        self.fetched: Dict[int, float] = {}
+
+    def install(self, dp, bot, query_metrics=None):
+        dp.update.outer_middleware(UpdateReceivedMiddleware(self))
+        handler_middleware = HandlerTracingMiddleware(self)
+        for name, observer in dp.observers.items():
+            if name not in ('update', 'error'):
+                observer.middleware(handler_middleware)
+        bot.session.middleware(UpdateFetchMiddleware(self))
+        bot.session.middleware(ApiTimingMiddleware())
+        if query_metrics is not None:
+            query_metrics.subscribe(self.on_db_time)
+
+    @staticmethod
+    def on_db_time(kind: str, seconds: float):
+        span = current_span.get()
+        if span is None:
+            return
+        span.db_time += seconds
+        if kind == 'query':
+            span.db_calls += 1
+
+    def mark_fetched(self, update_ids, at: float):
+        for update_id in update_ids:
+            self.fetched[update_id] = at
+        # Апдейты, не дошедшие до диспетчера, не копятся бесконечно
+        while len(self.fetched) > FETCHED_KEEP:
+            del self.fetched[next(iter(self.fetched))]
+
+    def received_at(self, update_id) -> float:
+        """Момент получения апдейта; без записи (вебхук, feed_update) — текущий"""
+        return self.fetched.pop(update_id, None) or time.perf_counter()
+
+    def record(self, span: Span, duration: float, error: bool = False):
+        stats = self.stats.get(span.handler)
+        if stats is None:
+            stats = self.stats[span.handler] = HandlerStats(self.window)
+        stats.durations.append(duration)
+        stats.count += 1
+        stats.total_time += duration
+        stats.db_time += span.db_time
+        stats.api_time += span.api_time
+        stats.queue_wait += span.queue_wait
+        if error:
+            stats.errors += 1
+        if duration >= self.slow_update_seconds:
+            self._log_slow(span, duration, error)
+
+    def _log_slow(self, span: Span, duration: float, error: bool):
+        other = max(0.0, duration - span.db_time - span.api_time)
+        methods = ', '.join(span.api_methods[:8]) + ('…' if len(span.api_methods) > 8 else '')
+        self.recent_slow.append({
+            'at': datetime.now(),
+            'handler': span.handler,
+            'total': duration,
+            'queue': span.queue_wait,
+            'db': span.db_time,
+            'db_calls': span.db_calls,
+            'api': span.api_time,
+            'api_calls': span.api_calls,
+            'other': other,
+            'error': error,
+        })
+        logger.warning(
+            "🐌 Медленный апдейт %s: %.0f мс (ожидание %.0f мс; БД %.0f мс / %d запр.; "
+            "Bot API %.0f мс / %d выз. [%s]; прочее %.0f мс)%s",
+            span.handler, duration * 1000, span.queue_wait * 1000, span.db_time * 1000, span.db_calls,
+            span.api_time * 1000, span.api_calls, methods, other * 1000, " с ошибкой" if error else ""
+        )
+
+    def summary(self, limit: int = 10) -> List[Tuple[str, HandlerStats]]:
+        """Хендлеры с наибольшим p95 в скользящем окне"""
+        ranked = [(name, stats) for name, stats in self.stats.items() if stats.durations]
+        ranked.sort(key=lambda item: item[1].percentiles(0.95)[0], reverse=True)
+        return ranked[:limit]
+
+    def totals(self) -> dict:
+        count = sum(stats.count for stats in self.stats.values())
+        return {
+            'updates': count,
+            'errors': sum(stats.errors for stats in self.stats.values()),
+            'handlers': len(self.stats),
+            'total_time': sum(stats.total_time for stats in self.stats.values()),
+            'db_time': sum(stats.db_time for stats in self.stats.values()),
+            'api_time': sum(stats.api_time for stats in self.stats.values()),
+            'queue_wait': sum(stats.queue_wait for stats in self.stats.values()),
+        }
+
+
+class UpdateFetchMiddleware(BaseRequestMiddleware):
+    """
+    Middleware сессии бота: момент ответа getUpdates для каждого апдейта.
+    Внешний middleware диспетчера вызывается уже после семафора
+    tasks_concurrency_limit, поэтому очередь перед ним видна только отсюда.
+    """
+
+    def __init__(self, tracer: HandlerTracer):
+        self.tracer = tracer
+
+    async def __call__(self, make_request, bot, method):
+        result = await make_request(bot, method)
+        if isinstance(method, GetUpdates) and result:
+            self.tracer.mark_fetched((update.update_id for update in result), time.perf_counter())
+        return result
+
+
+class UpdateReceivedMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: передаёт хендлерам момент получения апдейта"""
+
+    def __init__(self, tracer: HandlerTracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]):
+        data[RECEIVED_KEY] = self.tracer.received_at(getattr(event, 'update_id', None))
+        return await handler(event, data)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Внутренний middleware: спан вокруг выбранного хендлера"""
+
+    def __init__(self, tracer: HandlerTracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]):
+        handler_object = data.get('handler')
+        callback = getattr(handler_object, 'callback', None)
+        name = getattr(callback, '__name__', None) or type(event).__name__
+        started = time.perf_counter()
+        span = Span(name, data.get(RECEIVED_KEY, started), started)
+        token = current_span.set(span)
+        error = False
+        try:
+            return await handler(event, data)
+        except Exception:
+            error = True
+            raise
+        finally:
+            current_span.reset(token)
+            self.tracer.record(span, time.perf_counter() - started, error)
+
+
+class ApiTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время каждого вызова Bot API в текущий спан"""
+
+    async def __call__(self, make_request, bot, method):
+        span = current_span.get()
+        if span is None:
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            span.api_time += time.perf_counter() - started
+            span.api_calls += 1
+            span.api_methods.append(type(method).__name__)
@@ -0,0 +1,159 @@
+"""
+Здоровье процесса бота
+Сторож цикла событий раз в interval секунд засыпает и меряет, насколько позже
+проснулся (задержка цикла). Внешний middleware апдейтов отмечает время последнего
+обработанного апдейта и число апдейтов в работе. Эндпоинты /health/live и
+/health/ready (metrics_server.py) только читают эти счётчики — без запросов к БД
+и Bot API, поэтому проверка стоит микросекунды:
+
+- live — цикл событий жив: сторож тикал недавно;
+- ready — бот принимает апдейты: polling запущен, БД подключена,
+  задержка цикла ниже порога.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Sized
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class RuntimeHealth:
+    def __init__(
+        self, db, interval: float = 0.5, max_loop_lag: float = 1.0, stale_after: float = 10.0
+    ):
+        self.db = db
+        self.interval = interval
+        self.max_loop_lag = max_loop_lag
+        # Сторож не тикал дольше — цикл завис или задача сторожа умерла
+        self.stale_after = stale_after
+        self.loop_lag = 0.0
+        self.max_lag_seen = 0.0
+        self.last_tick = None
+        self.last_update_at = None
+        self.updates_in_flight = 0
+        self.updates_processed = 0
+        self.polling = False
+        self._queues: Dict[str, Callable[[], int]] = {}
+
+    def install(self, dp):
+        dp.update.outer_middleware(UpdateActivityMiddleware(self))
+        dp.startup.register(self._on_startup)
+        dp.shutdown.register(self._on_shutdown)
+
+    async def _on_startup(self):
+        self.polling = True
+
+    async def _on_shutdown(self):
+        self.polling = False
+
+    def add_queue(self, name: str, queue: Sized):
+        """Очередь исходящей работы (len() — сколько ждёт отправки/записи)"""
+        self._queues[name] = queue.__len__
+
+    def queue_depths(self) -> Dict[str, int]:
+        depths = {}
+        for name, size in self._queues.items():
+            try:
+                depths[name] = size()
+            except Exception as e:
+                logger.debug(f"Размер очереди {name} недоступен: {e}")
+        return depths
+
+    async def run_watchdog(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.loop_lag = max(0.0, now - started - self.interval)
+            self.max_lag_seen = max(self.max_lag_seen, self.loop_lag)
+            self.last_tick = now
+            if self.loop_lag > self.max_loop_lag:
+                logger.warning(f"⏱️ Цикл событий отстаёт на {self.loop_lag * 1000:.0f} мс")
+
+    def _pool(self) -> dict:
+        pool = getattr(self.db, "pool", None)
+        if pool is None:
+            return {"size": 0, "idle": 0, "waiting": 0}
+        return {
+            "size": pool.get_size(),
+            "idle": pool.get_idle_size(),
+            "waiting": getattr(pool, "waiting", 0),
+        }
+
+    def is_live(self) -> bool:
+        return self.last_tick is not None and time.monotonic() - self.last_tick < self.stale_after
+
+    def readiness(self) -> Dict[str, bool]:
+        return {
+            "polling": self.polling,
+            "database": self.db.is_connected(),
+            "loop": self.is_live() and self.loop_lag <= self.max_loop_lag,
+        }
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        return {
+            "live": self.is_live(),
+            "checks": self.readiness(),
+            "loop_lag_ms": round(self.loop_lag * 1000, 1),
+            "loop_lag_max_ms": round(self.max_lag_seen * 1000, 1),
+            "since_last_update_s": (
+                round(now - self.last_update_at, 1) if self.last_update_at else None
+            ),
+            "updates_in_flight": self.updates_in_flight,
+            "updates_processed": self.updates_processed,
+            "db_pool": self._pool(),
+            "queues": self.queue_depths(),
+        }
+
+    def render_prometheus(self) -> str:
+        since_update = (
+            f"{time.monotonic() - self.last_update_at:.3f}" if self.last_update_at else "NaN"
+        )
+        pool = self._pool()
+        lines = [
+            "# HELP bot_event_loop_lag_seconds Задержка пробуждения сторожа цикла событий",
+            "# TYPE bot_event_loop_lag_seconds gauge",
+            f"bot_event_loop_lag_seconds {self.loop_lag:.6f}",
+            "# HELP bot_updates_in_flight Апдейты в обработке",
+            "# TYPE bot_updates_in_flight gauge",
+            f"bot_updates_in_flight {self.updates_in_flight}",
+            "# HELP bot_updates_processed_total Обработано апдейтов",
+            "# TYPE bot_updates_processed_total counter",
+            f"bot_updates_processed_total {self.updates_processed}",
+            "# HELP bot_seconds_since_last_update Секунд с последнего обработанного апдейта",
+            "# TYPE bot_seconds_since_last_update gauge",
+            f"bot_seconds_since_last_update {since_update}",
+            "# HELP db_pool_waiting Ожидают соединения из пула",
+            "# TYPE db_pool_waiting gauge",
+            f'db_pool_waiting {pool["waiting"]}',
+            "# HELP bot_queue_depth Исходящая работа в очередях",
+            "# TYPE bot_queue_depth gauge",
+        ]
+        lines += [
+            f'bot_queue_depth{{queue="{name}"}} {depth}'
+            for name, depth in sorted(self.queue_depths().items())
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class UpdateActivityMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: апдейты в работе и момент последнего обработанного"""
+
+    def __init__(self, health: RuntimeHealth):
+        self.health = health
+
+    async def __call__(
+        self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]
+    ):
+        self.health.updates_in_flight += 1
+        try:
+            return await handler(event, data)
+        finally:
+            self.health.updates_in_flight -= 1
+            self.health.updates_processed += 1
+            self.health.last_update_at = time.monotonic()
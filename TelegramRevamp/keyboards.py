@@ -111,10 +111,44 @@ def get_admin_settings_keyboard(suspicious_enabled, complaints_enabled, quiet_mo
         [InlineKeyboardButton(text=f"🛡️ ИИ-защита: {sensitivity_text}", callback_data="change_moderation_sensitivity")],
         [InlineKeyboardButton(text=f"{suspicious_status} Подозрительные", callback_data="toggle_suspicious_notif"),
          InlineKeyboardButton(text=f"{complaints_status} Жалобы", callback_data="toggle_complaints_notif")],
+        [InlineKeyboardButton(text="📦 Автоархив", callback_data="admin_auto_archive"),
+         InlineKeyboardButton(text="🗑️ Автоочистка", callback_data="admin_auto_clean")],
+        [InlineKeyboardButton(text="🧹 Хранение данных", callback_data="admin_retention")],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_settings_back")]
     ])
     return keyboard
 
+def get_admin_perf_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_logs")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_settings_back")]
+    ])
+    return keyboard
+
+def get_admin_retention_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="▶️ Очистить сейчас", callback_data="admin_retention_run")],
+        [InlineKeyboardButton(text="🔄 Обновить", callback_data="admin_retention")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_settings")]
+    ])
+    return keyboard
+
+def get_admin_archive_keyboard(rule, current_days, choices):
+    day_buttons = [
+        InlineKeyboardButton(
+            text=("✅ " if days == current_days else "") + (f"{days} дн." if days else "Выкл"),
+            callback_data=f"archive_set_{rule}_{days}"
+        )
+        for days in choices
+    ]
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        day_buttons[:3],
+        day_buttons[3:],
+        [InlineKeyboardButton(text="▶️ Архивировать сейчас", callback_data=f"archive_run_{rule}")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="admin_settings")]
+    ])
+    return keyboard
+
 def get_moderation_sensitivity_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="⚪ Выключена", callback_data="sensitivity_off")],
@@ -138,8 +172,10 @@ def get_admin_users_menu():
          InlineKeyboardButton(text="🚫 Бан/Разбан", callback_data="admin_ban_menu")],
         [InlineKeyboardButton(text="⚡ Исполнители", callback_data="admin_list_executors"),
          InlineKeyboardButton(text="👤 Заказчики", callback_data="admin_list_customers")],
+        [InlineKeyboardButton(text="👥 Все пользователи", callback_data="admin_all_users")],
         [InlineKeyboardButton(text="⭐ Рейтинги", callback_data="admin_edit_ratings"),
          InlineKeyboardButton(text="🔄 Сброс заказа", callback_data="admin_reset_order")],
+        [InlineKeyboardButton(text="♻️ Пересчёт рейтингов", callback_data="admin_recompute_ratings")],
         [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_admin")]
     ])
     return keyboard
@@ -378,13 +414,71 @@ def get_order_details_keyboard(order_id):
     ])
     return keyboard
 
-def get_filters_keyboard():
+WORK_TYPE_NAMES = {
+    "construction": "🏗️ Стройка",
+    "handyman": "🔨 Разнорабочий",
+    "movers": "📦 Грузчики",
+    "delivery": "🚚 Доставка",
+    "repair": "🔧 Ремонт",
+    "cleaning": "🧹 Уборка",
+    "other": "🔨 Другое",
+}
+
+FILTER_PRICE_RANGES = [(0, 1000), (1000, 3000), (3000, 5000), (5000, 0)]
+
+FILTER_RATING_THRESHOLDS = ["3", "4", "4.5"]
+
+def get_filters_keyboard(presets_count=0):
+    presets_badge = f" ({presets_count})" if presets_count > 0 else ""
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔎 Текст", callback_data="filter_query"),
+         InlineKeyboardButton(text="🔍 Тип работы", callback_data="filter_type")],
+        [InlineKeyboardButton(text="📍 Локация", callback_data="filter_location"),
+         InlineKeyboardButton(text="💰 Цена", callback_data="filter_price")],
+        [InlineKeyboardButton(text="⭐ Рейтинг", callback_data="filter_rating"),
+         InlineKeyboardButton(text="❌ Сбросить", callback_data="clear_filters")],
+        [InlineKeyboardButton(text="💾 Сохранить", callback_data="filter_save"),
+         InlineKeyboardButton(text=f"📂 Пресеты{presets_badge}", callback_data="filter_presets")],
+        [InlineKeyboardButton(text="📱 Показать заказы", callback_data="feed_page_0")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="back_to_executor_menu")]
+    ])
+    return keyboard
+
+def get_filter_work_types_keyboard():
+    names = list(WORK_TYPE_NAMES.items())
+    rows = [
+        [InlineKeyboardButton(text=name, callback_data=f"fset_type_{code}") for code, name in names[i:i + 2]]
+        for i in range(0, len(names), 2)
+    ]
+    rows.append([InlineKeyboardButton(text="♾️ Любой", callback_data="fset_type_any")])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="feed_filters")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def get_filter_price_keyboard():
+    rows = []
+    for min_price, max_price in FILTER_PRICE_RANGES:
+        if not max_price:
+            text = f"от {min_price} ₽"
+        elif not min_price:
+            text = f"до {max_price} ₽"
+        else:
+            text = f"{min_price}–{max_price} ₽"
+        rows.append([InlineKeyboardButton(text=text, callback_data=f"fset_price_{min_price}_{max_price}")])
+    rows.append([InlineKeyboardButton(text="♾️ Любая", callback_data="fset_price_any")])
+    rows.append([InlineKeyboardButton(text="🔙 Назад", callback_data="feed_filters")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def get_filter_rating_keyboard():
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"⭐ от {value}", callback_data=f"fset_rating_{value}") for value in FILTER_RATING_THRESHOLDS],
+        [InlineKeyboardButton(text="♾️ Любой", callback_data="fset_rating_any")],
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="feed_filters")]
+    ])
+    return keyboard
+
+def get_filter_input_keyboard():
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="🔍 Тип работы", callback_data="filter_type"),
-         InlineKeyboardButton(text="📍 Локация", callback_data="filter_location")],
-        [InlineKeyboardButton(text="💰 Цена", callback_data="filter_price"),
-         InlineKeyboardButton(text="⭐ Рейтинг", callback_data="filter_rating")],
-        [InlineKeyboardButton(text="❌ Сбросить", callback_data="clear_filters")]
+        [InlineKeyboardButton(text="🔙 Назад", callback_data="feed_filters")]
     ])
     return keyboard
 
@@ -0,0 +1,265 @@
+"""
+Сервис лидербордов
+Материализованный в памяти рейтинг исполнителей и скользящее окно выполненных
+заказов за 24 часа. Обновляется событиями Database и периодически сверяется с БД,
+так что экраны топа не обращаются к таблице orders.
+"""
+import asyncio
+import heapq
+import logging
+from bisect import bisect_left, insort
+from collections import deque
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_WINDOW = timedelta(hours=24)
+
+
+class ExecutorEntry:
+    __slots__ = ('user_id', 'username', 'first_name', 'rating', 'completed_orders', 'level', 'role')
+
+    def __init__(self, user_id, username, first_name, rating, completed_orders, level,
+                 role='executor'):
+        self.user_id = user_id
+        self.username = username
+        self.first_name = first_name
+        self.rating = float(rating or 0)
+        self.completed_orders = int(completed_orders or 0)
+        self.level = level or 'новичок'
+        # Профиль исполнителя остаётся и после смены роли на заказчика
+        self.role = role
+
+    @property
+    def sort_key(self) -> Tuple[float, int, int]:
+        # Тот же порядок, что ORDER BY rating DESC, completed_orders DESC
+        return (-self.rating, -self.completed_orders, self.user_id)
+
+    def as_dict(self) -> dict:
+        return {
+            'user_id': self.user_id,
+            'username': self.username,
+            'first_name': self.first_name,
+            'rating': self.rating,
+            'completed_orders': self.completed_orders,
+            'level': self.level,
+        }
+
+
+class SortedKeys:
+    """
+    Отсортированный список ключей блоками не длиннее 2 * LOAD (как SortedList
+    из sortedcontainers): вставка и удаление сдвигают один блок, а не весь
+    список, ранг — сумма длин предыдущих блоков и bisect в блоке.
+    """
+
+    LOAD = 256
+
+    def __init__(self, keys: Iterable = ()):
+        ordered = sorted(keys)
+        self._blocks: List[list] = [
+            ordered[i:i + self.LOAD] for i in range(0, len(ordered), self.LOAD)
+        ]
+        self._maxes: list = [block[-1] for block in self._blocks]
+        self._len = len(ordered)
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self) -> Iterator:
+        for block in self._blocks:
+            yield from block
+
+    def add(self, key):
+        self._len += 1
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            return
+        pos = min(bisect_left(self._maxes, key), len(self._maxes) - 1)
+        block = self._blocks[pos]
+        insort(block, key)
+        self._maxes[pos] = block[-1]
+        if len(block) > 2 * self.LOAD:
+            self._blocks[pos:pos + 1] = [block[:self.LOAD], block[self.LOAD:]]
+            self._maxes[pos:pos + 1] = [block[self.LOAD - 1], block[-1]]
+
+    def discard(self, key):
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return
+        block = self._blocks[pos]
+        idx = bisect_left(block, key)
+        if idx == len(block) or block[idx] != key:
+            return
+        del block[idx]
+        self._len -= 1
+        if block:
+            self._maxes[pos] = block[-1]
+        else:
+            del self._blocks[pos]
+            del self._maxes[pos]
+
+    def index(self, key) -> int:
+        """Сколько ключей меньше key"""
+        pos = bisect_left(self._maxes, key)
+        if pos == len(self._maxes):
+            return self._len
+        return sum(len(block) for block in self._blocks[:pos]) + bisect_left(self._blocks[pos], key)
+
+
+class LeaderboardService:
+    """
+    Ключи (-rating, -completed_orders, user_id) в SortedKeys: обновление
+    и ранг пользователя без сдвига всего рейтинга, топ-N — первые ключи.
+    Окно активности — очередь (время, исполнитель) с вытеснением слева и счётчики.
+    """
+
+    def __init__(self, db, reconcile_interval: int = 600):
+        self.db = db
+        self.reconcile_interval = reconcile_interval
+        self._entries: Dict[int, ExecutorEntry] = {}
+        self._ranking = SortedKeys()
+        self._completions: Deque[Tuple[datetime, int]] = deque()
+        self._completions_24h: Dict[int, int] = {}
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self.last_reconciled_at: Optional[datetime] = None
+        db.subscribe(self.handle_event)
+
+    # ==================== ЧТЕНИЕ ====================
+
+    async def ensure_loaded(self):
+        if self._loaded or not self.db.is_connected():
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                await self.reconcile()
+
+    async def top(self, limit: int = 10) -> List[dict]:
+        await self.ensure_loaded()
+        return [self._entries[key[2]].as_dict() for key in islice(self._ranking, limit)]
+
+    async def top_active_24h(self, limit: int = 3) -> List[dict]:
+        """
+        Топ исполнителей (user_role = 'executor') по выполненным за 24 часа;
+        при равенстве — по рейтингу, как в SQL-версии. Если активных меньше
+        limit, список дополняется исполнителями без заказов по рейтингу.
+        """
+        await self.ensure_loaded()
+        self._expire_completions(datetime.now())
+        candidates = [
+            (count, self._entries[user_id].rating, user_id)
+            for user_id, count in self._completions_24h.items()
+            if user_id in self._entries and self._entries[user_id].role == 'executor'
+        ]
+        top = [(user_id, count) for count, _, user_id in heapq.nlargest(limit, candidates)]
+        if len(top) < limit:
+            for key in self._ranking:
+                entry = self._entries[key[2]]
+                if entry.role == 'executor' and entry.user_id not in self._completions_24h:
+                    top.append((entry.user_id, 0))
+                    if len(top) == limit:
+                        break
+        result = []
+        for user_id, count in top:
+            item = self._entries[user_id].as_dict()
+            item['orders_24h'] = count
+            result.append(item)
+        return result
+
+    async def rank_of(self, user_id: int) -> Optional[Tuple[int, int]]:
+        """Позиция пользователя (с 1) и размер рейтинга, либо None если его нет в рейтинге"""
+        await self.ensure_loaded()
+        entry = self._entries.get(user_id)
+        if not entry:
+            return None
+        return self._ranking.index(entry.sort_key) + 1, len(self._ranking)
+
+    # ==================== ИНКРЕМЕНТАЛЬНЫЕ ОБНОВЛЕНИЯ ====================
+
+    def handle_event(self, event: str, payload: dict):
+        if not self._loaded:
+            # До первой загрузки события не нужны: reconcile прочитает актуальное состояние
+            return
+        if event == 'rating_changed' and payload.get('role') == 'executor':
+            self._update(payload['user_id'], rating=payload['rating'])
+        elif event == 'executor_stats_changed':
+            self._update(payload['user_id'], completed_orders=payload['completed_orders'], level=payload['level'])
+        elif event == 'role_changed' and payload['user_id'] in self._entries:
+            self._entries[payload['user_id']].role = payload['role']
+        elif event == 'order_completed' and payload.get('executor_id'):
+            self._record_completion(payload['executor_id'], payload.get('completed_at') or datetime.now())
+        elif event == 'ratings_recomputed':
+            self._loaded = False
+
+    def _update(self, user_id: int, **fields):
+        entry = self._entries.get(user_id)
+        if not entry:
+            # Новый исполнитель появится в рейтинге при ближайшей сверке
+            return
+        self._ranking.discard(entry.sort_key)
+        for name, value in fields.items():
+            if name == 'rating':
+                value = float(value or 0)
+            setattr(entry, name, value)
+        self._ranking.add(entry.sort_key)
+
+    def _record_completion(self, executor_id: int, completed_at: datetime):
+        now = datetime.now()
+        if completed_at < now - ACTIVITY_WINDOW:
+            return
+        self._completions.append((completed_at, executor_id))
+        self._completions_24h[executor_id] = self._completions_24h.get(executor_id, 0) + 1
+        self._expire_completions(now)
+
+    def _expire_completions(self, now: datetime):
+        border = now - ACTIVITY_WINDOW
+        while self._completions and self._completions[0][0] < border:
+            _, executor_id = self._completions.popleft()
+            left = self._completions_24h.get(executor_id, 0) - 1
+            if left > 0:
+                self._completions_24h[executor_id] = left
+            else:
+                self._completions_24h.pop(executor_id, None)
+
+    # ==================== СВЕРКА С БД ====================
+
+    async def reconcile(self):
+        """Полностью пересобирает структуры из БД (старт и периодическая сверка)"""
+        executors, completions = await self.db.get_leaderboard_snapshot()
+
+        entries = {
+            row['user_id']: ExecutorEntry(
+                row['user_id'], row['username'], row['first_name'],
+                row['rating'], row['completed_orders'], row['level'], row['user_role'],
+            )
+            for row in executors
+        }
+        ranking = SortedKeys(entry.sort_key for entry in entries.values())
+
+        window: Deque[Tuple[datetime, int]] = deque(
+            sorted((row['completed_at'], row['executor_id']) for row in completions)
+        )
+        counts: Dict[int, int] = {}
+        for _, executor_id in window:
+            counts[executor_id] = counts.get(executor_id, 0) + 1
+
+        self._entries, self._ranking = entries, ranking
+        self._completions, self._completions_24h = window, counts
+        self._loaded = True
+        self.last_reconciled_at = datetime.now()
+        logger.debug("Лидерборд сверен с БД: %d исполнителей, %d выполнений за 24ч", len(entries), len(window))
+
+    async def run_reconciliation(self):
+        """Фоновая задача: периодическая сверка, чтобы поправить пропущенные события"""
+        while True:
+            await asyncio.sleep(self.reconcile_interval)
+            if not self.db.is_connected():
+                continue
+            try:
+                await self.reconcile()
+            except Exception as e:
+                logger.warning(f"Не удалось сверить лидерборд с БД: {e}")
@@ -0,0 +1,343 @@
+"""
+Живая лента заказов для мини-приложения
+SSE-канал /api/orders/stream: дельты ленты (заказ добавлен, взят, удалён)
+из Postgres LISTEN/NOTIFY, heartbeat и переподключение по Last-Event-ID
+"""
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import asyncpg
+from aiohttp import web
+
+from config import APP_TIMEZONE, DATABASE_URL, LIVE_FEED_HEARTBEAT, LIVE_FEED_PORT, LOG_LEVEL
+
+logger = logging.getLogger(__name__)
+
+try:
+    LOCAL_TZ = ZoneInfo(APP_TIMEZONE)
+except ZoneInfoNotFoundError:
+    LOCAL_TZ = ZoneInfo("UTC")
+UTC_TZ = ZoneInfo("UTC")
+
+FEED_CHANNEL = 'orders_feed'
+
+# Те же поля, что отдаёт /api/orders, чтобы клиент рендерил карточку без дозапроса
+ORDER_FEED_QUERY = '''
+    SELECT
+        o.order_id,
+        o.customer_id,
+        o.price,
+        o.start_time,
+        o.address,
+        o.workers_count,
+        o.comment,
+        o.status,
+        o.created_at,
+        o.phone_number,
+        u.username as customer_username,
+        u.first_name as customer_name,
+        COALESCE(cp.rating, 0) as customer_rating,
+        COALESCE(cp.total_orders, 0) as customer_total_orders
+    FROM orders o
+    LEFT JOIN users u ON o.customer_id = u.user_id
+    LEFT JOIN customer_profiles cp ON o.customer_id = cp.user_id
+    WHERE o.order_id = $1 AND o.status = 'open' AND o.is_deleted = FALSE
+'''
+
+
+def _serialize_order(row) -> dict:
+    order = dict(row)
+    created_at = order.get('created_at')
+    if created_at:
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=UTC_TZ)
+        order['created_at'] = created_at.astimezone(LOCAL_TZ).isoformat()
+    order['price'] = float(order['price']) if order['price'] else 0
+    order['customer_rating'] = float(order['customer_rating']) if order['customer_rating'] else 0
+    return order
+
+
+def _encode_event(event_id: Optional[str], event: str, data: dict) -> bytes:
+    lines = []
+    if event_id:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False, default=str)}")
+    return ("\n".join(lines) + "\n\n").encode('utf-8')
+
+
+HEARTBEAT_CHUNK = b": ping\n\n"
+
+
+class FeedSubscriber:
+    """Одно открытое SSE-соединение: очередь готовых к отправке чанков"""
+
+    __slots__ = ('queue', 'hidden', 'user_id')
+
+    def __init__(self, user_id: Optional[int], hidden: Set[int], queue_size: int):
+        self.user_id = user_id
+        self.hidden = hidden
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+
+class LiveFeedHub:
+    """
+    Fan-out хаб на одном event loop.
+    Каждое событие кодируется один раз и раскладывается по очередям подписчиков;
+    медленный клиент с переполненной очередью отключается и переподключается
+    сам с Last-Event-ID.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL, buffer_size: int = 2048,
+                 heartbeat: int = LIVE_FEED_HEARTBEAT, queue_size: int = 256):
+        self.dsn = dsn
+        self.heartbeat = heartbeat
+        self.queue_size = queue_size
+        # Эпоха меняется при каждом запуске: id из прошлой жизни хаба дают reset
+        self.epoch = format(int(time.time()), 'x')
+        self._seq = 0
+        self._buffer: Deque[Tuple[int, Optional[int], str, bytes]] = deque(maxlen=buffer_size)
+        self._subscribers: Set[FeedSubscriber] = set()
+        self._notifications: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._listen_conn: Optional[asyncpg.Connection] = None
+        self._connection_lost: Optional[asyncio.Event] = None
+        self.pool: Optional[asyncpg.Pool] = None
+
+    @property
+    def last_event_id(self) -> str:
+        return f"{self.epoch}-{self._seq}"
+
+    @property
+    def subscribers_count(self) -> int:
+        return len(self._subscribers)
+
+    async def start(self):
+        self.pool = await asyncpg.create_pool(self.dsn, min_size=1, max_size=4)
+        self._tasks = [
+            asyncio.create_task(self._listen_loop()),
+            asyncio.create_task(self._dispatch_loop()),
+            asyncio.create_task(self._heartbeat_loop()),
+        ]
+        logger.info("📡 Живая лента запущена (эпоха %s)", self.epoch)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for sub in list(self._subscribers):
+            self._evict(sub)
+        if self._listen_conn and not self._listen_conn.is_closed():
+            await self._listen_conn.close()
+        if self.pool:
+            await self.pool.close()
+
+    # ==================== ПОДПИСЧИКИ ====================
+
+    async def subscribe(self, user_id: Optional[int], last_event_id: Optional[str]) -> Tuple[FeedSubscriber, List[bytes]]:
+        """Регистрирует клиента и возвращает чанки, которые нужно отправить до живого потока"""
+        hidden: Set[int] = set()
+        if user_id is not None:
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch('SELECT order_id FROM hidden_orders WHERE user_id = $1', user_id)
+            hidden = {row['order_id'] for row in rows}
+
+        sub = FeedSubscriber(user_id, hidden, self.queue_size)
+        self._subscribers.add(sub)
+        return sub, self._replay(sub, last_event_id)
+
+    def unsubscribe(self, sub: FeedSubscriber):
+        self._subscribers.discard(sub)
+
+    def _replay(self, sub: FeedSubscriber, last_event_id: Optional[str]) -> List[bytes]:
+        hello = _encode_event(self.last_event_id, 'hello', {'last_event_id': self.last_event_id})
+        if not last_event_id:
+            return [hello]
+
+        epoch, _, seq_raw = last_event_id.partition('-')
+        try:
+            seq = int(seq_raw)
+        except ValueError:
+            seq = -1
+        oldest = self._buffer[0][0] if self._buffer else self._seq + 1
+        # Пропуск не восстановить: другая эпоха или события уже вытеснены из буфера
+        if epoch != self.epoch or seq < 0 or seq > self._seq or seq + 1 < oldest:
+            return [_encode_event(self.last_event_id, 'reset', {'reason': 'gap'})]
+
+        return [chunk for event_seq, order_id, kind, chunk in self._buffer
+                if event_seq > seq and self._visible_for(sub, order_id, kind)]
+
+    @staticmethod
+    def _visible_for(sub: FeedSubscriber, order_id: Optional[int], kind: str) -> bool:
+        return not (kind == 'order_added' and order_id in sub.hidden)
+
+    def _evict(self, sub: FeedSubscriber):
+        self._subscribers.discard(sub)
+        while True:
+            try:
+                sub.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                break
+        sub.queue.put_nowait(None)
+
+    def _offer(self, sub: FeedSubscriber, chunk: bytes):
+        try:
+            sub.queue.put_nowait(chunk)
+        except asyncio.QueueFull:
+            logger.debug("Живая лента: клиент %s не успевает, отключаем", sub.user_id)
+            self._evict(sub)
+
+    def publish(self, kind: str, data: dict, order_id: Optional[int] = None):
+        self._seq += 1
+        event_id = self.last_event_id
+        chunk = _encode_event(event_id, kind, data)
+        self._buffer.append((self._seq, order_id, kind, chunk))
+        for sub in list(self._subscribers):
+            if self._visible_for(sub, order_id, kind):
+                self._offer(sub, chunk)
+
+    # ==================== ИСТОЧНИК СОБЫТИЙ ====================
+
+    def _on_notify(self, conn, pid, channel, payload):
+        self._notifications.put_nowait(payload)
+
+    def _on_termination(self, conn):
+        if self._connection_lost:
+            self._connection_lost.set()
+
+    async def _listen_loop(self):
+        backoff = 1
+        first_connect = True
+        while True:
+            try:
+                self._connection_lost = asyncio.Event()
+                self._listen_conn = await asyncpg.connect(self.dsn)
+                self._listen_conn.add_termination_listener(self._on_termination)
+                await self._listen_conn.add_listener(FEED_CHANNEL, self._on_notify)
+                backoff = 1
+                if not first_connect:
+                    # Пока LISTEN не работал, NOTIFY терялись: клиентам нужен полный перечит
+                    self.publish('reset', {'reason': 'listener_reconnected'})
+                first_connect = False
+                await self._connection_lost.wait()
+                logger.warning("Живая лента: соединение LISTEN потеряно, переподключаемся")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Живая лента: не удалось подписаться на {FEED_CHANNEL}: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _dispatch_loop(self):
+        """Обрабатывает NOTIFY строго по порядку, обогащая 'added' одной выборкой на всех"""
+        while True:
+            payload = await self._notifications.get()
+            try:
+                note = json.loads(payload)
+                kind = note['kind']
+                order_id = int(note['order_id'])
+            except (ValueError, KeyError, TypeError):
+                logger.debug(f"Живая лента: некорректный payload {payload!r}")
+                continue
+
+            if kind == 'added':
+                try:
+                    async with self.pool.acquire() as conn:
+                        row = await conn.fetchrow(ORDER_FEED_QUERY, order_id)
+                except Exception as e:
+                    logger.debug(f"Живая лента: не удалось загрузить заказ {order_id}: {e}")
+                    continue
+                if not row:
+                    continue
+                self.publish('order_added', {'order': _serialize_order(row)}, order_id)
+            elif kind in ('taken', 'removed'):
+                self.publish(f'order_{kind}', {'order_id': order_id}, order_id)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(self.heartbeat)
+            for sub in list(self._subscribers):
+                # Пинг не важен, если очередь и так не пуста
+                if sub.queue.empty():
+                    self._offer(sub, HEARTBEAT_CHUNK)
+
+
+# ==================== HTTP ====================
+
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Last-Event-ID',
+}
+
+
+async def stream_handler(request: web.Request) -> web.StreamResponse:
+    hub: LiveFeedHub = request.app['hub']
+    try:
+        user_id = int(request.query['user_id']) if request.query.get('user_id') else None
+    except ValueError:
+        user_id = None
+    last_event_id = request.headers.get('Last-Event-ID') or request.query.get('last_event_id')
+
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',
+        **CORS_HEADERS,
+    })
+    await response.prepare(request)
+
+    sub, backlog = await hub.subscribe(user_id, last_event_id)
+    try:
+        await response.write(b"retry: 3000\n\n" + b"".join(backlog))
+        while True:
+            chunk = await sub.queue.get()
+            if chunk is None:
+                break
+            await response.write(chunk)
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        hub.unsubscribe(sub)
+    return response
+
+
+async def options_handler(request: web.Request) -> web.Response:
+    return web.Response(headers=CORS_HEADERS)
+
+
+async def status_handler(request: web.Request) -> web.Response:
+    hub: LiveFeedHub = request.app['hub']
+    return web.json_response({
+        'subscribers': hub.subscribers_count,
+        'last_event_id': hub.last_event_id,
+    })
+
+
+async def _on_startup(app: web.Application):
+    await app['hub'].start()
+
+
+async def _on_cleanup(app: web.Application):
+    await app['hub'].stop()
+
+
+def create_app(hub: Optional[LiveFeedHub] = None) -> web.Application:
+    app = web.Application()
+    app['hub'] = hub or LiveFeedHub()
+    app.router.add_get('/api/orders/stream', stream_handler)
+    app.router.add_route('OPTIONS', '/api/orders/stream', options_handler)
+    app.router.add_get('/api/orders/stream/status', status_handler)
+    app.on_startup.append(_on_startup)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=getattr(logging, LOG_LEVEL))
+    web.run_app(create_app(), host='0.0.0.0', port=LIVE_FEED_PORT)
@@ -0,0 +1,8 @@
+"""
+Нагрузочное тестирование
+Бот запускается в этом же процессе против поддельного Bot API (fake_bot_api.py)
+и локального Postgres; виртуальные пользователи (users.py) проходят сценарии
+заказчиков, исполнителей и админов. Запуск: python -m loadtest.run --help
+API мини-приложения (webapp.py): python -m loadtest.webapp_load --help
+Проигрывание записанного трафика (update_recorder.py): python -m loadtest.replay --help
+"""
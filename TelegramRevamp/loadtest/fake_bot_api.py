@@ -0,0 +1,381 @@
+"""
+Поддельный Telegram Bot API на aiohttp
+Отвечает на методы, которые бот вызывает в сценариях нагрузочного теста:
+getMe, deleteWebhook, getUpdates (long polling), sendMessage, editMessageText,
+editMessageReplyMarkup, deleteMessage, deleteMessages, answerCallbackQuery,
+copyMessage, sendChatAction. Задержка ответа и доля ответов 429 настраиваются.
+Всё, что бот отправляет в чат, попадает в очередь виртуального пользователя.
+"""
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "LoadTestBot", "username": "loadtest_bot"}
+
+# Методы, которые не участвуют в 429: без них бот не стартует или не отвечает на кнопки
+NEVER_THROTTLED = {"getMe", "deleteWebhook", "getUpdates", "answerCallbackQuery"}
+
+
+class BotEvent:
+    """То, что бот сделал в чате пользователя"""
+
+    __slots__ = (
+        "method",
+        "chat_id",
+        "message_id",
+        "text",
+        "reply_markup",
+        "at",
+        "callback_query_id",
+    )
+
+    def __init__(
+        self,
+        method: str,
+        chat_id: Optional[int] = None,
+        message_id: Optional[int] = None,
+        text: str = "",
+        reply_markup: Optional[dict] = None,
+        callback_query_id: Optional[str] = None,
+    ):
+        self.method = method
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+        self.reply_markup = reply_markup
+        self.callback_query_id = callback_query_id
+        self.at = time.perf_counter()
+
+    def buttons(self) -> List[str]:
+        """callback_data всех inline-кнопок сообщения"""
+        rows = (self.reply_markup or {}).get("inline_keyboard") or []
+        return [
+            button["callback_data"] for row in rows for button in row if button.get("callback_data")
+        ]
+
+
+class FakeBotAPI:
+    """
+    latency и jitter — задержка ответа в секундах (равномерно latency ± jitter);
+    rate_429 — доля вызовов, на которые сервер отвечает Too Many Requests.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.03,
+        jitter: float = 0.02,
+        rate_429: float = 0.0,
+        retry_after: int = 1,
+        seed: int = None,
+        deliver_events: bool = True,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+        self.updates_delivered = 0
+        # False — действия бота в чатах не копятся в очередях (проигрыванию их никто не читает)
+        self.deliver_events = deliver_events
+        self.url: Optional[str] = None
+        self._updates: List[dict] = []
+        self._update_id = 0
+        self._new_update = asyncio.Event()
+        self._messages: Dict[int, Dict[int, dict]] = {}
+        self._next_message_id: Dict[int, int] = {}
+        self._inboxes: Dict[int, asyncio.Queue] = {}
+        self._callback_owner: Dict[str, int] = {}
+        self._callback_seq = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    # ---------- Сторона пользователей ----------
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        queue = self._inboxes.get(chat_id)
+        if queue is None:
+            queue = self._inboxes[chat_id] = asyncio.Queue()
+        return queue
+
+    def _next_id(self, chat_id: int) -> int:
+        message_id = self._next_message_id.get(chat_id, 0) + 1
+        self._next_message_id[chat_id] = message_id
+        return message_id
+
+    def _push_update(self, update: dict):
+        self._update_id += 1
+        update["update_id"] = self._update_id
+        self._updates.append(update)
+        self._new_update.set()
+
+    @staticmethod
+    def _user(user_id: int, first_name: str, username: str) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": first_name, "username": username}
+
+    def push_message(self, user_id: int, first_name: str, username: str, text: str) -> int:
+        message_id = self._next_id(user_id)
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": first_name},
+            "from": self._user(user_id, first_name, username),
+            "text": text,
+        }
+        if text.startswith("/"):
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+            ]
+        self._messages.setdefault(user_id, {})[message_id] = message
+        self._push_update({"message": message})
+        return message_id
+
+    def push_update(self, update: dict) -> int:
+        """Готовый апдейт (из записи) как есть; update_id выдаётся заново"""
+        update = dict(update)
+        message = update.get("message") or (update.get("callback_query") or {}).get("message")
+        chat_id = ((message or {}).get("chat") or {}).get("id")
+        if chat_id is not None:
+            message_id = message["message_id"]
+            self._messages.setdefault(chat_id, {})[message_id] = message
+            # Свои id сообщений — после записанных, чтобы не затирать их
+            self._next_message_id[chat_id] = max(self._next_message_id.get(chat_id, 0), message_id)
+        callback = update.get("callback_query")
+        if callback and chat_id is not None:
+            self._callback_owner[callback["id"]] = chat_id
+        self._push_update(update)
+        return self._update_id
+
+    def pending(self) -> int:
+        """Апдейты, которые бот ещё не подтвердил (offset getUpdates)"""
+        return len(self._updates)
+
+    def push_callback(
+        self, user_id: int, first_name: str, username: str, message_id: int, data: str
+    ) -> str:
+        self._callback_seq += 1
+        query_id = str(self._callback_seq)
+        self._callback_owner[query_id] = user_id
+        message = self._messages.get(user_id, {}).get(message_id) or {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": first_name},
+            "from": BOT_USER,
+            "text": "",
+        }
+        self._push_update(
+            {
+                "callback_query": {
+                    "id": query_id,
+                    "from": self._user(user_id, first_name, username),
+                    "chat_instance": str(user_id),
+                    "message": message,
+                    "data": data,
+                }
+            }
+        )
+        return query_id
+
+    # ---------- Сторона бота ----------
+
+    def _deliver(self, event: BotEvent):
+        if self.deliver_events and event.chat_id is not None:
+            self.inbox(event.chat_id).put_nowait(event)
+
+    def _bot_message(
+        self, chat_id: int, message_id: int, text: str, reply_markup: Optional[dict]
+    ) -> dict:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": text,
+        }
+        if reply_markup and "inline_keyboard" in reply_markup:
+            message["reply_markup"] = reply_markup
+        self._messages.setdefault(chat_id, {})[message_id] = message
+        return message
+
+    async def get_updates(self, params: dict):
+        offset = int(params.get("offset") or 0)
+        timeout = float(params.get("timeout") or 0)
+        limit = int(params.get("limit") or 100)
+        if offset:
+            self._updates = [update for update in self._updates if update["update_id"] >= offset]
+        if not self._updates and timeout:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = self._updates[:limit]
+        self.updates_delivered += len(batch)
+        return batch
+
+    async def send_message(self, params: dict):
+        chat_id = int(params["chat_id"])
+        reply_markup = _json(params.get("reply_markup"))
+        message_id = self._next_id(chat_id)
+        message = self._bot_message(chat_id, message_id, params.get("text", ""), reply_markup)
+        self._deliver(BotEvent("sendMessage", chat_id, message_id, message["text"], reply_markup))
+        return message
+
+    async def edit_message_text(self, params: dict):
+        chat_id = int(params["chat_id"])
+        message_id = int(params["message_id"])
+        current = self._messages.get(chat_id, {}).get(message_id)
+        if current is None:
+            raise FakeAPIError(400, "Bad Request: message to edit not found")
+        reply_markup = _json(params.get("reply_markup"))
+        text = params.get("text", "")
+        if current.get("text") == text and current.get("reply_markup") == reply_markup:
+            raise FakeAPIError(
+                400,
+                "Bad Request: message is not modified: specified new message content "
+                "and reply markup are exactly the same as a current content "
+                "and reply markup of the message",
+            )
+        message = self._bot_message(chat_id, message_id, text, reply_markup)
+        self._deliver(BotEvent("editMessageText", chat_id, message_id, text, reply_markup))
+        return message
+
+    async def edit_message_reply_markup(self, params: dict):
+        chat_id = int(params["chat_id"])
+        message_id = int(params["message_id"])
+        current = self._messages.get(chat_id, {}).get(message_id)
+        if current is None:
+            raise FakeAPIError(400, "Bad Request: message to edit not found")
+        reply_markup = _json(params.get("reply_markup"))
+        message = self._bot_message(chat_id, message_id, current.get("text", ""), reply_markup)
+        self._deliver(
+            BotEvent("editMessageReplyMarkup", chat_id, message_id, message["text"], reply_markup)
+        )
+        return message
+
+    async def delete_message(self, params: dict):
+        chat_id = int(params["chat_id"])
+        if self._messages.get(chat_id, {}).pop(int(params["message_id"]), None) is None:
+            raise FakeAPIError(400, "Bad Request: message to delete not found")
+        return True
+
+    async def delete_messages(self, params: dict):
+        chat_id = int(params["chat_id"])
+        for message_id in _json(params.get("message_ids")) or []:
+            self._messages.get(chat_id, {}).pop(int(message_id), None)
+        return True
+
+    async def answer_callback_query(self, params: dict):
+        query_id = params.get("callback_query_id")
+        chat_id = self._callback_owner.pop(query_id, None)
+        self._deliver(
+            BotEvent(
+                "answerCallbackQuery",
+                chat_id,
+                text=params.get("text", ""),
+                callback_query_id=query_id,
+            )
+        )
+        return True
+
+    async def copy_message(self, params: dict):
+        chat_id = int(params["chat_id"])
+        message_id = self._next_id(chat_id)
+        self._bot_message(
+            chat_id, message_id, params.get("caption", ""), _json(params.get("reply_markup"))
+        )
+        self._deliver(BotEvent("copyMessage", chat_id, message_id))
+        return {"message_id": message_id}
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        params = dict(await request.post())
+        if method != "getUpdates":
+            delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if (
+                self.rate_429
+                and method not in NEVER_THROTTLED
+                and self.random.random() < self.rate_429
+            ):
+                self.throttled[method] += 1
+                return web.json_response(
+                    {
+                        "ok": False,
+                        "error_code": 429,
+                        "description": f"Too Many Requests: retry after {self.retry_after}",
+                        "parameters": {"retry_after": self.retry_after},
+                    }
+                )
+        handler = self._handlers().get(method)
+        try:
+            result = await handler(params) if handler else True
+        except FakeAPIError as e:
+            return web.json_response(
+                {"ok": False, "error_code": e.code, "description": e.description}
+            )
+        return web.json_response({"ok": True, "result": result})
+
+    def _handlers(self):
+        return {
+            "getMe": self._get_me,
+            "deleteWebhook": self._true,
+            "getUpdates": self.get_updates,
+            "sendMessage": self.send_message,
+            "editMessageText": self.edit_message_text,
+            "editMessageReplyMarkup": self.edit_message_reply_markup,
+            "deleteMessage": self.delete_message,
+            "deleteMessages": self.delete_messages,
+            "answerCallbackQuery": self.answer_callback_query,
+            "copyMessage": self.copy_message,
+            "sendChatAction": self._true,
+        }
+
+    async def _get_me(self, params: dict):
+        return BOT_USER
+
+    async def _true(self, params: dict):
+        return True
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=16 * 1024 * 1024)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        bound_port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{bound_port}"
+        logger.info(f"Поддельный Bot API слушает {self.url}")
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+
+class FakeAPIError(Exception):
+    def __init__(self, code: int, description: str):
+        super().__init__(description)
+        self.code = code
+        self.description = description
+
+
+def _json(value):
+    if not value:
+        return None
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,204 @@
+"""
+Виртуальные пользователи и сценарии
+Каждый шаг — апдейт в поддельный Bot API и ожидание реакции бота в чате
+пользователя (новое/изменённое сообщение или ответ на нажатие кнопки).
+Длительности шагов и сценариев целиком копятся в FlowStats.
+"""
+
+import asyncio
+import re
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+from loadtest.fake_bot_api import BotEvent, FakeBotAPI
+
+# Первый id виртуальных пользователей: вдали от реальных id Telegram в тестовой БД
+USER_ID_BASE = 7_000_000_000
+
+ORDER_PUBLISHED_RE = re.compile(r"Заказ #(\d+) опубликован")
+
+MESSAGE_METHODS = ("sendMessage", "editMessageText", "editMessageReplyMarkup")
+
+
+def text_contains(fragment: str) -> Callable[[BotEvent], bool]:
+    fragment = fragment.lower()
+    return lambda event: event.method in MESSAGE_METHODS and fragment in (event.text or "").lower()
+
+
+class FlowFailed(Exception):
+    pass
+
+
+class FlowStats:
+    """Длительности сценариев и шагов по именам"""
+
+    def __init__(self):
+        self.flows: Dict[str, List[float]] = defaultdict(list)
+        self.steps: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.updates_sent = 0
+
+    def flow(self, name: str, seconds: float):
+        self.flows[name].append(seconds)
+
+    def step(self, name: str, seconds: float):
+        self.steps[name].append(seconds)
+
+    def error(self, name: str):
+        self.errors[name] += 1
+
+
+def percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class VirtualUser:
+    def __init__(
+        self, api: FakeBotAPI, stats: FlowStats, number: int, role: str, timeout: float = 10.0
+    ):
+        self.api = api
+        self.stats = stats
+        self.user_id = USER_ID_BASE + number
+        self.role = role
+        self.first_name = f"{role.title()}{number}"
+        self.username = f"lt_{role}_{number}"
+        self.timeout = timeout
+        self.inbox = api.inbox(self.user_id)
+        # Экран — сообщение бота, с которым работает пользователь: к нему «прикреплены»
+        # нажимаемые кнопки. Уведомления (другие сообщения) экран не меняют.
+        self.screen: Optional[BotEvent] = None
+
+    def _drain(self):
+        while not self.inbox.empty():
+            self._track(self.inbox.get_nowait())
+
+    def _track(self, event: BotEvent):
+        if (
+            event.method in MESSAGE_METHODS
+            and self.screen
+            and event.message_id == self.screen.message_id
+        ):
+            self.screen = event
+
+    async def _expect(self, predicate: Callable[[BotEvent], bool]) -> BotEvent:
+        deadline = time.perf_counter() + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise FlowFailed("бот не ответил вовремя")
+            try:
+                event = await asyncio.wait_for(self.inbox.get(), timeout=remaining)
+            except asyncio.TimeoutError:
+                raise FlowFailed("бот не ответил вовремя")
+            self._track(event)
+            if predicate(event):
+                if event.method in MESSAGE_METHODS:
+                    self.screen = event
+                return event
+
+    async def send(
+        self, step: str, text: str, until: Callable[[BotEvent], bool] = None
+    ) -> BotEvent:
+        """Текст от пользователя; ждём новое или изменённое сообщение бота"""
+        self._drain()
+        started = time.perf_counter()
+        self.api.push_message(self.user_id, self.first_name, self.username, text)
+        self.stats.updates_sent += 1
+        event = await self._expect(until or (lambda e: e.method in MESSAGE_METHODS))
+        self.stats.step(step, time.perf_counter() - started)
+        return event
+
+    async def press(
+        self, step: str, data: str, until: Callable[[BotEvent], bool] = None
+    ) -> BotEvent:
+        """Нажатие inline-кнопки на текущем экране; по умолчанию ждём answerCallbackQuery"""
+        self._drain()
+        message_id = self.screen.message_id if self.screen else 1
+        started = time.perf_counter()
+        query_id = self.api.push_callback(
+            self.user_id, self.first_name, self.username, message_id, data
+        )
+        self.stats.updates_sent += 1
+        event = await self._expect(
+            until
+            or (lambda e: e.method == "answerCallbackQuery" and e.callback_query_id == query_id)
+        )
+        self.stats.step(step, time.perf_counter() - started)
+        return event
+
+    async def run_flow(self, name: str, coro):
+        started = time.perf_counter()
+        try:
+            result = await coro
+        except (FlowFailed, KeyError, ValueError):
+            self.stats.error(name)
+            return None
+        self.stats.flow(name, time.perf_counter() - started)
+        return result
+
+
+class Customer(VirtualUser):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # id исполнителей, откликнувшихся на текущий заказ
+        self.takers: asyncio.Queue = asyncio.Queue()
+
+    async def open(self):
+        await self.send("start", "/start")
+        await self.press("role_customer", "role_customer", until=text_contains("Режим Заказчика"))
+
+    async def create_order(self, price: int) -> int:
+        await self.press("create_order", "create_order")
+        await self.send("order_price", str(price))
+        await self.send("order_time", "Завтра к 9:00")
+        await self.send("order_address", f"ул. Нагрузочная, {self.user_id % 1000}")
+        await self.send("order_workers", "2")
+        await self.send("order_comment", "Разгрузить фуру, нагрузочный тест")
+        await self.send("order_phone", "⏭️ Пропустить")
+        published = await self.press(
+            "order_publish",
+            "confirm_order_publish",
+            until=lambda e: bool(ORDER_PUBLISHED_RE.search(e.text or "")),
+        )
+        return int(ORDER_PUBLISHED_RE.search(published.text).group(1))
+
+    async def accept_and_complete(self, order_id: int, executor_id: int):
+        await self.press("accept_executor", f"accept_executor_{order_id}_{executor_id}")
+        await self.press("complete_confirm", f"confirm_complete_{order_id}")
+        await self.press("complete_final", f"final_complete_{order_id}")
+        await self.press("review_rate", f"rate_{order_id}_5")
+        await self.press("review_submit", f"comment_no_{order_id}")
+
+
+class Executor(VirtualUser):
+    async def open(self):
+        await self.send("start", "/start")
+        await self.press("role_executor", "role_executor", until=text_contains("Режим Исполнителя"))
+
+    async def browse_feed(self, pages: int = 3):
+        await self.send("feed_open", "📱 Лента заказов", until=text_contains("Лента заказов"))
+        for page in range(1, pages):
+            if f"feed_page_{page}" not in (self.screen.buttons() if self.screen else []):
+                break
+            await self.press("feed_page", f"feed_page_{page}")
+
+    async def take(self, order_id: int):
+        await self.press("take_order", f"take_order_{order_id}")
+
+
+class Admin(VirtualUser):
+    async def open(self):
+        # config читается при импорте: импорт здесь, чтобы run.py успел выставить окружение
+        from config import ADMIN_CODE
+
+        await self.send("start", "/start")
+        await self.send("admin_login", ADMIN_CODE, until=text_contains("Админ-панель"))
+
+    async def dashboards(self):
+        await self.press("admin_stats", "admin_stats")
+        await self.press("admin_logs", "admin_logs")
+        await self.press("admin_orders", "admin_orders")
@@ -0,0 +1,194 @@
+"""
+Логирование бота вне цикла событий
+Логгеры пишут в QueueHandler: в цикле событий запись только кладётся в очередь,
+форматирование и вывод в поток делает QueueListener в отдельном потоке. Перед
+постановкой в очередь к записи добавляются поля текущего апдейта —
+update_id, user_id (внешний middleware) и имя хендлера (спан handler_tracing) —
+и отбрасывается часть частых записей ниже WARNING:
+
+    LOG_SAMPLING="aiogram.event=20,bot.feed=10"   # 1 из 20 и 1 из 10
+
+Отброшенная запись не форматируется: сообщения в горячих путях пишутся
+с %-аргументами, а не f-строками. LOG_FORMAT=json — одна JSON-строка на запись.
+"""
+
+import copy
+import json
+import logging
+import queue
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+
+from handler_tracing import current_span
+
+# (update_id, user_id) апдейта, который обрабатывается в этом контексте
+log_context: ContextVar[Optional[tuple]] = ContextVar("log_context", default=None)
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+CONTEXT_FIELDS = ("update_id", "user_id", "handler")
+
+
+def parse_sampling(spec: str) -> Dict[str, int]:
+    """'aiogram.event=20,bot.feed=10' → {'aiogram.event': 20, 'bot.feed': 10}"""
+    rates = {}
+    for item in spec.split(","):
+        name, _, rate = item.strip().partition("=")
+        try:
+            if name and int(rate) > 1:
+                rates[name] = int(rate)
+        except ValueError:
+            continue
+    return rates
+
+
+class LogContextFilter(logging.Filter):
+    """
+    Поля текущего апдейта в запись. Фильтр висит на QueueHandler и выполняется
+    в потоке цикла событий до постановки в очередь: только там видны contextvars
+    апдейта (log_context, current_span). Перенос в поток слушателя дал бы пустые поля.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = log_context.get()
+        record.update_id, record.user_id = context if context else (None, None)
+        span = current_span.get()
+        record.handler = span.handler if span else None
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Пропускает 1 из N записей ниже WARNING для логгера и его потомков;
+    предупреждения и ошибки проходят всегда.
+    """
+
+    def __init__(self, rates: Dict[str, int]):
+        super().__init__()
+        self.rates = rates
+        self._resolved: Dict[str, int] = {}
+        self._counters: Dict[str, int] = {}
+        self.dropped = 0
+
+    def _rate(self, name: str) -> int:
+        rate = self._resolved.get(name)
+        if rate is None:
+            rate, probe = 1, name
+            while probe:
+                if probe in self.rates:
+                    rate = self.rates[probe]
+                    break
+                probe = probe.rpartition(".")[0]
+            self._resolved[name] = rate
+        return rate
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self._rate(record.name)
+        if rate == 1:
+            return True
+        seen = self._counters.get(record.name, 0)
+        self._counters[record.name] = seen + 1
+        if seen % rate == 0:
+            record.sampled = rate
+            return True
+        self.dropped += 1
+        return False
+
+
+class ContextQueueHandler(QueueHandler):
+    """
+    QueueHandler, который не форматирует запись в цикле событий: подставляет
+    аргументы в сообщение и превращает исключение в текст, остальное — слушателю.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if getattr(record, "sampled", None):
+            entry["sampled"] = record.sampled
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        context = " ".join(
+            f"{field}={getattr(record, field)}"
+            for field in CONTEXT_FIELDS
+            if getattr(record, field, None) is not None
+        )
+        return f"{line} [{context}]" if context else line
+
+
+def setup_logging(
+    level: str = "INFO", fmt: str = "text", sampling: str = "", stream=None
+) -> QueueListener:
+    """
+    Корневой логгер пишет через очередь; возвращает запущенный слушатель —
+    его нужно остановить (listener.stop()) при выходе, чтобы дописать хвост очереди.
+    """
+    output = logging.StreamHandler(stream or sys.stderr)
+    output.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter(TEXT_FORMAT))
+
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    handler = ContextQueueHandler(log_queue)
+    rates = parse_sampling(sampling)
+    if rates:
+        # Сначала выборка: отброшенной записи контекст не нужен
+        handler.addFilter(SamplingFilter(rates))
+    handler.addFilter(LogContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(getattr(logging, level.upper(), logging.INFO))
+
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: update_id и user_id для записей лога"""
+
+    async def __call__(
+        self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]
+    ):
+        user = data.get("event_from_user")
+        token = log_context.set((event.update_id, user.id if user else None))
+        try:
+            return await handler(event, data)
+        finally:
+            log_context.reset(token)
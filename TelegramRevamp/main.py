@@ -4,19 +4,27 @@ Telegram Bot - Точка входа
 """
 import asyncio
 import logging
-from bot import dp, bot, db
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+from config import (
+    DATABASE_MEMORY_FALLBACK, LOG_FORMAT, LOG_LEVEL, LOG_SAMPLING, METRICS_PORT, SHUTDOWN_FLUSH_TIMEOUT,
+    STATS_REFRESH_INTERVAL, UPDATE_CONCURRENCY
 )
+from log_setup import setup_logging
+
+# Настройка логирования до импорта бота: bot.py пишет в лог уже при импорте.
+# Запись уходит в очередь, в поток вывода её пишет фоновый поток
+log_listener = setup_logging(LOG_LEVEL, LOG_FORMAT, LOG_SAMPLING)
+
+from bot import dp, bot, db, leaderboard_service, username_index, order_geo, chat_writer, retention_engine, order_archiver, message_cleanup, update_recorder, runtime_health, update_journal
+from memory_database import switch_to_memory
+from metrics_server import start_metrics_server
+
 logger = logging.getLogger(__name__)
 
 
 async def main():
     """Основная функция для запуска бота"""
     logger.info("🚀 Запуск Telegram бота...")
+    metrics_runner = None
     
     try:
         # Попытка подключения к БД
@@ -25,32 +33,70 @@ async def main():
             logger.info("✅ Подключение к БД успешно")
         except Exception as db_error:
             logger.warning(f"⚠️ Не удалось подключиться к БД: {db_error}")
-            logger.info("   Бот работает в режиме без БД")
+            if DATABASE_MEMORY_FALLBACK:
+                switch_to_memory(db)
+                await db.connect()
+                logger.error(
+                    "   DATABASE_MEMORY_FALLBACK: бот работает на базе в памяти, "
+                    "данные пропадут при перезапуске"
+                )
+            else:
+                logger.info("   Бот работает в режиме без БД")
         
-        async def cleanup_worker():
-            """Периодически чистит записи о последних сообщениях, чтобы не копился мусор."""
+        async def stats_worker():
+            """Пересчитывает дневные сводки stats_daily для админской статистики."""
             while True:
-                await asyncio.sleep(3600)
                 if db.is_connected():
                     try:
-                        await db.prune_old_bot_messages(hours=48)
-                        logger.debug("🧹 Очистка старых записей user_bot_messages завершена")
-                    except Exception as clean_err:
-                        logger.debug(f"Не удалось очистить старые записи user_bot_messages: {clean_err}")
-
-        # Пропускаем все накопившиеся обновления при запуске (только старые)
-        await bot.delete_webhook(drop_pending_updates=True)
-        logger.info("🗑️ Старые обновления пропущены")
+                        days = await db.refresh_daily_stats()
+                        logger.debug(f"📊 Сводки статистики пересчитаны за {days} дн.")
+                    except Exception as stats_err:
+                        logger.warning(f"Не удалось пересчитать сводки статистики: {stats_err}")
+                await asyncio.sleep(STATS_REFRESH_INTERVAL)
+
+        # Накопившиеся за перезапуск апдейты не выбрасываем: Telegram отдаст их заново,
+        # уже обработанные до остановки отсечёт журнал
+        await bot.delete_webhook(drop_pending_updates=False)
+        update_journal.load()
         
-        # Запуск фоновой уборки и polling
-        asyncio.create_task(cleanup_worker())
+        # Эндпоинт /metrics для Prometheus
+        try:
+            metrics_runner = await start_metrics_server(db, METRICS_PORT, runtime_health)
+        except OSError as metrics_error:
+            logger.warning(f"⚠️ Эндпоинт метрик не запущен: {metrics_error}")
+        
+        # Запуск фоновой очистки старых данных и polling
+        asyncio.create_task(retention_engine.run_forever())
+        asyncio.create_task(order_archiver.run_forever())
+        asyncio.create_task(leaderboard_service.run_reconciliation())
+        asyncio.create_task(stats_worker())
+        asyncio.create_task(username_index.ensure_loaded())
+        asyncio.create_task(order_geo.ensure_loaded())
+        asyncio.create_task(order_geo.run_reconciliation())
+        asyncio.create_task(runtime_health.run_watchdog())
+        asyncio.create_task(chat_writer.run())
+        asyncio.create_task(message_cleanup.run())
+        if update_recorder:
+            asyncio.create_task(update_recorder.run())
+        asyncio.create_task(update_journal.run())
         logger.info("📡 Бот начал слушать сообщения...")
-        await dp.start_polling(bot)
+        # SIGTERM/SIGINT: polling останавливается, хук shutdown журнала дожидается апдейтов в работе.
+        # Сессию закрываем сами — после сброса очереди удаления сообщений
+        await dp.start_polling(bot, tasks_concurrency_limit=UPDATE_CONCURRENCY, close_bot_session=False)
         
     except Exception as e:
         logger.error(f"❌ Критическая ошибка: {e}")
         raise
     finally:
+        closing = [chat_writer.close(), message_cleanup.close()]
+        if update_recorder:
+            closing.append(update_recorder.close())
+        try:
+            await asyncio.wait_for(asyncio.gather(*closing), timeout=SHUTDOWN_FLUSH_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Очереди записи не сброшены за {SHUTDOWN_FLUSH_TIMEOUT:.0f} с")
+        if metrics_runner:
+            await metrics_runner.cleanup()
         logger.info("🛑 Бот остановлен")
         await bot.session.close()
 
@@ -60,3 +106,6 @@ if __name__ == "__main__":
         asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("⚠️ Бот остановлен пользователем")
+    finally:
+        # Дописываем хвост очереди лога
+        log_listener.stop()
@@ -0,0 +1,1827 @@
+"""
+База данных в памяти
+Тот же интерфейс, что у Database, без PostgreSQL: таблицы — словари по первичному
+ключу, упорядоченные выборки идут по отсортированным спискам ключей (created_at, id)
+вместо btree-индексов. Семантика повторяет SQL: мягкое удаление и deleted_at,
+фильтры статусов, порядок сортировки с NULL, пересчёт рейтингов, холодный архив.
+Включается DATABASE_BACKEND=memory (тесты, нагрузочные прогоны без Postgres)
+и служит деградированным режимом, когда БД недоступна. Данные живут до перезапуска.
+"""
+
+import bisect
+import itertools
+import logging
+import re
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+
+from config import STATS_BACKFILL_DAYS
+from database import (
+    MODERATION_PATTERNS,
+    STATS_FLOW_FIELDS,
+    WHITELIST_PHRASES,
+    Database,
+    decode_keyset_cursor,
+    encode_keyset_cursor,
+    normalize_order_filters,
+    score_moderation_patterns,
+    summarize_stats_rows,
+)
+
+logger = logging.getLogger(__name__)
+
+CENTS = Decimal("0.01")
+
+ACTIVE_EXECUTOR_STATUSES = ("assigned", "in_progress", "awaiting_confirmation")
+HISTORY_STATUSES = ("completed", "deleted", "cancelled", "excluded")
+
+# Порог оператора % из pg_trgm (pg_trgm.similarity_threshold по умолчанию)
+TRIGRAM_THRESHOLD = 0.3
+
+# Аналог ADMIN_USER_FILTERS из database.py
+ADMIN_USER_PREDICATES = {
+    "all": None,
+    "exec": lambda user: user["user_role"] in ("executor", "both"),
+    "cust": lambda user: user["user_role"] in ("customer", "both"),
+    "banned": lambda user: user["is_banned"],
+    "admins": lambda user: user["is_admin"],
+}
+
+# Снимки stats_daily: пересчитываются только у сегодняшней строки
+STATS_SNAPSHOT_DEFAULTS = {
+    "users_total": 0,
+    "executors": 0,
+    "customers": 0,
+    "banned": 0,
+    "admins": 0,
+    "orders_total": 0,
+    "orders_open": 0,
+    "orders_active": 0,
+    "orders_completed_total": 0,
+    "orders_cancelled_total": 0,
+    "complaints_open": 0,
+    "avg_rating": None,
+}
+
+
+def _money(value):
+    """DECIMAL(n,2): округление как в PostgreSQL (половина — от нуля)"""
+    if value is None:
+        return None
+    return Decimal(str(value)).quantize(CENTS, rounding=ROUND_HALF_UP)
+
+
+def _before(value, cutoff):
+    """value < cutoff с NULL-семантикой SQL: сравнение с NULL ложно"""
+    return value is not None and cutoff is not None and value < cutoff
+
+
+def _order_by(rows, *columns):
+    """
+    ORDER BY по спецификациям вида 'created_at DESC' / 'completed_at DESC NULLS LAST'
+    с правилами PostgreSQL: NULL больше любого значения (ASC — в конце, DESC — в начале)
+    """
+    rows = list(rows)
+    for spec in reversed(columns):
+        column, *options = spec.split()
+        descending = "DESC" in options
+        nulls_last = options[-1] == "LAST" if "NULLS" in options else not descending
+        present = [row for row in rows if row.get(column) is not None]
+        missing = [row for row in rows if row.get(column) is None]
+        # Сортировка устойчива и при reverse=True: следующий ключ не ломает порядок предыдущего
+        present.sort(key=lambda row: row[column], reverse=descending)
+        rows = present + missing if nulls_last else missing + present
+    return rows
+
+
+def _trigrams(text):
+    """Триграммы как в pg_trgm: слова из букв и цифр, два пробела в начале и один в конце"""
+    result = set()
+    for word in re.findall(r"[^\W_]+", text.lower()):
+        padded = f"  {word} "
+        result.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return result
+
+
+def trigram_similarity(left, right):
+    a, b = _trigrams(left), _trigrams(right)
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _search_terms(query):
+    """
+    Приближение websearch_to_tsquery('russian', ...): слова запроса длиной от трёх букв
+    (короткие — в основном стоп-слова), каждое обрезается до грубой основы
+    """
+    terms = []
+    for word in re.findall(r"[^\W_]+", query.lower()):
+        if len(word) >= 3:
+            terms.append(word[: max(3, len(word) - 2)])
+    return terms
+
+
+def _search_rank(text, terms):
+    """Сколько слов текста совпало с основами; 0, если не нашлось хотя бы одной основы (AND)"""
+    words = re.findall(r"[^\W_]+", text.lower())
+    rank = 0
+    for term in terms:
+        hits = sum(1 for word in words if word.startswith(term))
+        if not hits:
+            return 0
+        rank += hits
+    return rank
+
+
+class _KeysetIndex:
+    """Отсортированный список ключей (created_at, id) — аналог btree-индекса для keyset-пагинации"""
+
+    __slots__ = ("_keys",)
+
+    def __init__(self):
+        self._keys = []
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, created_at, row_id):
+        bisect.insort(self._keys, (created_at, row_id))
+
+    def remove(self, created_at, row_id):
+        key = (created_at, row_id)
+        i = bisect.bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def scan(self, position=None, direction="older"):
+        """
+        id строк от новых к старым строго после position ('older')
+        или от старых к новым строго после position ('newer'); ленивый обход
+        """
+        keys = self._keys
+        if direction == "newer":
+            start = bisect.bisect_right(keys, tuple(position)) if position else 0
+            return (keys[i][1] for i in range(start, len(keys)))
+        end = bisect.bisect_left(keys, tuple(position)) if position else len(keys)
+        return (keys[i][1] for i in range(end - 1, -1, -1))
+
+
+class MemoryDatabase(Database):
+    """
+    Database без пула соединений. Методы, не обращающиеся к пулу напрямую
+    (get_stats, get_moderation_stats, поиск по фильтрам ленты, send_message и т.п.),
+    наследуются как есть.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._connected = False
+        self._create_storage()
+
+    def _create_storage(self):
+        self.has_trigram = True
+        self._sequences = defaultdict(lambda: itertools.count(1))
+
+        self.users = {}
+        self.executor_profiles = {}
+        self.customer_profiles = {}
+        self.user_rating_summary = {}
+        self.user_locations = {}
+        self.user_bot_messages = {}
+        # Хранятся в нижнем регистре: ник уникален без учёта регистра
+        self._user_by_username = {}
+        self._users_keyset = _KeysetIndex()
+
+        # Горячие и архивные заказы; order_id не пересекаются
+        self.orders = {}
+        self.orders_archive = {}
+        self._orders_by_customer = defaultdict(set)
+        self._orders_by_executor = defaultdict(set)
+        # Открытая лента: status = 'open' AND is_deleted = FALSE
+        self._open_orders = _KeysetIndex()
+
+        # Отклики по заказу (все чтения и перенос в архив идут по order_id)
+        self.responses = defaultdict(list)
+        self.responses_archive = defaultdict(list)
+
+        self.reviews = {}
+        self._reviews_by_reviewee = defaultdict(_KeysetIndex)
+        self._reviews_by_order = defaultdict(list)
+
+        self.chats = {}
+        self._chat_by_order = {}
+        self.messages = {}
+        self._messages_by_chat = defaultdict(_KeysetIndex)
+        # user_id -> {chat_id: строка chat_unread}
+        self.chat_unread = defaultdict(dict)
+
+        self.complaints = {}
+        self.notifications = {}
+        self.hidden_orders = {}
+        self.penalty_log = {}
+        self.moderation_patterns = {}
+        self.whitelist_phrases = {}
+        self.moderation_logs = {}
+        self.moderation_logs_archive = {}
+        self.admin_moderation_decisions = {}
+        self.system_settings = {}
+        self.stats_daily = {}
+        self.order_feed_filters = {}
+        self.order_filter_presets = {}
+
+    def _next_id(self, table):
+        return next(self._sequences[table])
+
+    def is_connected(self):
+        return self._connected
+
+    async def connect(self, dsn=None):
+        await self.create_tables()
+        self._connected = True
+        logger.info("🧠 База данных в памяти: данные не сохраняются между перезапусками")
+
+    async def create_tables(self):
+        self.system_settings.setdefault(
+            "moderation_sensitivity",
+            {
+                "setting_key": "moderation_sensitivity",
+                "setting_value": "medium",
+                "updated_at": datetime.now(),
+                "updated_by": None,
+            },
+        )
+        # В Postgres паттерны сохраняются с прошлых запусков, здесь база каждый раз пустая
+        await self.init_moderation_patterns()
+        await self.init_whitelist()
+
+    async def close(self):
+        self._connected = False
+
+    # ==================== ЗАКАЗЫ: ХРАНЕНИЕ И ИНДЕКСЫ ====================
+
+    @staticmethod
+    def _is_open(order):
+        return order["status"] == "open" and not order["is_deleted"]
+
+    def _index_order(self, order):
+        self._orders_by_customer[order["customer_id"]].add(order["order_id"])
+        if order["executor_id"] is not None:
+            self._orders_by_executor[order["executor_id"]].add(order["order_id"])
+        if self._is_open(order):
+            self._open_orders.add(order["created_at"], order["order_id"])
+
+    def _unindex_order(self, order):
+        self._orders_by_customer[order["customer_id"]].discard(order["order_id"])
+        if order["executor_id"] is not None:
+            self._orders_by_executor[order["executor_id"]].discard(order["order_id"])
+        if self._is_open(order):
+            self._open_orders.remove(order["created_at"], order["order_id"])
+
+    def _update_order(self, order, **changes):
+        """UPDATE orders вместе с триггером orders_set_deleted_at и индексами"""
+        was_deleted = bool(order["is_deleted"]) or order["status"] == "deleted"
+        self._unindex_order(order)
+        order.update(changes)
+        is_deleted = bool(order["is_deleted"]) or order["status"] == "deleted"
+        if is_deleted and not was_deleted:
+            order["deleted_at"] = datetime.now()
+        elif not is_deleted:
+            order["deleted_at"] = None
+        self._index_order(order)
+
+    def _hot_orders(self, order_ids):
+        return [self.orders[order_id] for order_id in order_ids if order_id in self.orders]
+
+    def _orders_all(self, order_ids):
+        """Строки представления orders_all: горячие и архивные с флагом is_archived"""
+        rows = []
+        for order_id in order_ids:
+            if order_id in self.orders:
+                rows.append({**self.orders[order_id], "is_archived": False})
+            elif order_id in self.orders_archive:
+                row = dict(self.orders_archive[order_id])
+                row.pop("archived_at", None)
+                row["is_archived"] = True
+                rows.append(row)
+        return rows
+
+    # ==================== ПОЛЬЗОВАТЕЛИ ====================
+
+    async def get_user(self, user_id):
+        user = self.users.get(user_id)
+        return dict(user) if user else None
+
+    async def create_user(self, user_id, username, first_name):
+        user = self.users.get(user_id)
+        old_username = user["username"] if user else None
+        username_changed = old_username != username
+        if username and username_changed:
+            # Ник перешёл к этому пользователю — у прежнего владельца он устарел
+            previous_owner = self._user_by_username.get(username.lower())
+            if previous_owner is not None and previous_owner != user_id:
+                self.users[previous_owner]["username"] = None
+        if user is None:
+            user = {
+                "user_id": user_id,
+                "username": username,
+                "first_name": first_name,
+                "user_role": "customer",
+                "photo_url": None,
+                "created_at": datetime.now(),
+                "is_banned": False,
+                "ban_reason": None,
+                "banned_at": None,
+                "is_admin": False,
+                "suspicious_orders_notifications": True,
+                "complaints_notifications": True,
+                "quiet_mode": False,
+                "moderation_sensitivity": "medium",
+                "captcha_passed": False,
+            }
+            self.users[user_id] = user
+            self._users_keyset.add(user["created_at"], user_id)
+        else:
+            user["username"], user["first_name"] = username, first_name
+        if old_username and self._user_by_username.get(old_username.lower()) == user_id:
+            del self._user_by_username[old_username.lower()]
+        if username:
+            self._user_by_username[username.lower()] = user_id
+
+        self.executor_profiles.setdefault(
+            user_id,
+            {
+                "user_id": user_id,
+                "rating": _money(0),
+                "completed_orders": 0,
+                "level": "новичок",
+                "bio": None,
+                "badges": None,
+                "penalty_points": _money(0),
+                "base_rating": _money(5),
+            },
+        )
+        self.customer_profiles.setdefault(
+            user_id, {"user_id": user_id, "rating": _money(0), "total_orders": 0}
+        )
+
+        if username_changed:
+            self._emit(
+                "username_changed",
+                user_id=user_id,
+                old=old_username,
+                new=username,
+                banned=bool(user["is_banned"]),
+            )
+
+    async def update_role(self, user_id, role):
+        if user_id in self.users:
+            self.users[user_id]["user_role"] = role
+        self._emit("role_changed", user_id=user_id, role=role)
+
+    async def save_user_location(self, user_id, latitude, longitude):
+        self.user_locations[user_id] = {
+            "user_id": user_id,
+            "latitude": latitude,
+            "longitude": longitude,
+            "updated_at": datetime.now(),
+        }
+
+    async def get_user_location(self, user_id):
+        row = self.user_locations.get(user_id)
+        return {key: row[key] for key in ("latitude", "longitude", "updated_at")} if row else None
+
+    async def get_user_by_username(self, username):
+        user_id = self._user_by_username.get(username.strip().lstrip("@").lower())
+        return await self.get_user(user_id) if user_id is not None else None
+
+    async def get_active_usernames(self):
+        return [
+            {"user_id": user["user_id"], "username": user["username"]}
+            for user in self.users.values()
+            if user["username"] is not None and not user["is_banned"]
+        ]
+
+    async def similar_usernames(self, query, limit=5):
+        needle = query.strip().lstrip("@").lower()
+        if not needle:
+            return []
+        scored = []
+        for user in self.users.values():
+            if user["username"] is None or user["is_banned"]:
+                continue
+            similarity = trigram_similarity(user["username"].lower(), needle)
+            if similarity >= TRIGRAM_THRESHOLD:
+                scored.append((similarity, user["username"]))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [username for _, username in scored[:limit]]
+
+    async def ban_user(self, user_id, reason):
+        user = self.users.get(user_id)
+        if user:
+            user.update(is_banned=True, ban_reason=reason, banned_at=datetime.now())
+        self._emit("user_banned", user_id=user_id, username=user["username"] if user else None)
+
+    async def unban_user(self, user_id):
+        user = self.users.get(user_id)
+        if user:
+            user.update(is_banned=False, ban_reason=None, banned_at=None)
+        self._emit("user_unbanned", user_id=user_id, username=user["username"] if user else None)
+
+    async def make_admin(self, user_id):
+        if user_id in self.users:
+            self.users[user_id]["is_admin"] = True
+
+    async def get_all_users(self, limit=20, offset=0):
+        user_ids = itertools.islice(self._users_keyset.scan(), offset, offset + limit)
+        return [dict(self.users[user_id]) for user_id in user_ids]
+
+    def _admin_user_row(self, user):
+        """Строка _ADMIN_USERS_SELECT: пользователь с профилями и числом отзывов"""
+        executor = self.executor_profiles.get(user["user_id"]) or {}
+        customer = self.customer_profiles.get(user["user_id"]) or {}
+        summary = self.user_rating_summary.get(user["user_id"]) or {}
+        return {
+            **user,
+            "executor_rating": executor.get("rating"),
+            "completed_orders": executor.get("completed_orders"),
+            "level": executor.get("level"),
+            "customer_rating": customer.get("rating"),
+            "total_orders": customer.get("total_orders"),
+            "reviews_count": summary.get("reviews_count", 0),
+        }
+
+    async def browse_users(self, user_filter="all", cursor=None, limit=10, direction="older"):
+        predicate = ADMIN_USER_PREDICATES.get(user_filter)
+        position = decode_keyset_cursor(cursor) if cursor else None
+        if position is None:
+            direction = "older"
+        matching = (
+            self.users[user_id]
+            for user_id in self._users_keyset.scan(position, direction)
+            if predicate is None or predicate(self.users[user_id])
+        )
+        rows = [self._admin_user_row(user) for user in itertools.islice(matching, limit + 1)]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == "newer":
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = position is not None, has_more
+
+        return {
+            "users": rows,
+            "next_cursor": (
+                encode_keyset_cursor(rows[-1]["created_at"], rows[-1]["user_id"])
+                if rows and has_older
+                else None
+            ),
+            "prev_cursor": (
+                encode_keyset_cursor(rows[0]["created_at"], rows[0]["user_id"])
+                if rows and has_newer
+                else None
+            ),
+        }
+
+    async def search_users(self, query, limit=10):
+        needle = query.lstrip("@").strip().lower()
+        if not needle:
+            return []
+        named = [user for user in self.users.values() if user["username"] is not None]
+        prefixed = [user for user in named if user["username"].lower().startswith(needle)]
+        prefixed.sort(key=lambda user: (len(user["username"]), user["username"]))
+        rows = [self._admin_user_row(user) for user in prefixed[:limit]]
+        if len(rows) < limit:
+            found = {row["user_id"] for row in rows}
+            scored = []
+            for user in named:
+                if user["user_id"] in found:
+                    continue
+                similarity = trigram_similarity(user["username"].lower(), needle)
+                if similarity >= TRIGRAM_THRESHOLD:
+                    scored.append((similarity, user))
+            scored.sort(key=lambda item: item[0], reverse=True)
+            rows += [self._admin_user_row(user) for _, user in scored[: limit - len(rows)]]
+        return rows
+
+    async def get_all_admins(self):
+        return [dict(user) for user in self.users.values() if user["is_admin"]]
+
+    async def get_all_executors(self):
+        return [
+            dict(user)
+            for user in self.users.values()
+            if user["user_role"] == "executor" and user["is_banned"] is False
+        ]
+
+    async def mark_captcha_passed(self, user_id: int):
+        if user_id in self.users:
+            self.users[user_id]["captcha_passed"] = True
+
+    # ==================== ЗАКАЗЫ ====================
+
+    async def create_order(
+        self,
+        customer_id,
+        price,
+        start_time,
+        address,
+        workers_count,
+        comment,
+        phone_number=None,
+        work_type=None,
+        latitude=None,
+        longitude=None,
+    ):
+        order_id = self._next_id("orders")
+        order = {
+            "order_id": order_id,
+            "customer_id": customer_id,
+            "executor_id": None,
+            "price": _money(price),
+            "start_time": start_time,
+            "address": address,
+            "workers_count": workers_count,
+            "comment": comment,
+            "status": "open",
+            "created_at": datetime.now(),
+            "assigned_at": None,
+            "completed_at": None,
+            "is_urgent": False,
+            "decline_reason": None,
+            "declined_at": None,
+            "phone_number": phone_number,
+            "is_deleted": False,
+            "work_type": work_type,
+            "latitude": latitude,
+            "longitude": longitude,
+            "deleted_at": None,
+        }
+        self.orders[order_id] = order
+        self._index_order(order)
+        self._emit("order_created", order_id=order_id, latitude=latitude, longitude=longitude)
+        return order_id
+
+    async def get_customer_orders(self, customer_id):
+        rows = [
+            dict(order)
+            for order in self._hot_orders(self._orders_by_customer.get(customer_id, ()))
+            if order["status"] not in ("completed", "deleted") and not order["is_deleted"]
+        ]
+        return _order_by(rows, "created_at DESC")
+
+    async def get_open_orders(self):
+        return [dict(self.orders[order_id]) for order_id in self._open_orders.scan()]
+
+    async def get_open_orders_by_ids(self, order_ids):
+        return [dict(order) for order in self._hot_orders(set(order_ids)) if self._is_open(order)]
+
+    async def get_open_order_locations(self):
+        return [
+            {
+                "order_id": order["order_id"],
+                "latitude": order["latitude"],
+                "longitude": order["longitude"],
+            }
+            for order in (self.orders[order_id] for order_id in self._open_orders.scan())
+            if order["latitude"] is not None and order["longitude"] is not None
+        ]
+
+    async def get_all_active_orders(self):
+        rows = [
+            dict(order)
+            for order in self.orders.values()
+            if order["status"] not in ("completed", "deleted", "cancelled")
+            and not order["is_deleted"]
+        ]
+        return _order_by(rows, "created_at DESC")
+
+    async def get_order(self, order_id):
+        order = self.orders.get(order_id) or self.orders_archive.get(order_id)
+        return dict(order) if order else None
+
+    def _search(self, filters):
+        """Открытые заказы под фильтр ленты в порядке выдачи search_orders"""
+        filters = normalize_order_filters(filters)
+        terms = _search_terms(filters["q"]) if filters.get("q") else None
+        if terms is not None and not terms:
+            # Запрос только из стоп-слов: пустой tsquery ничего не находит
+            return []
+        location = filters.get("location", "").lower()
+        min_price = Decimal(str(filters["min_price"])) if "min_price" in filters else None
+        max_price = Decimal(str(filters["max_price"])) if "max_price" in filters else None
+        min_rating = Decimal(str(filters["min_rating"])) if "min_rating" in filters else None
+
+        found = []
+        for order_id in self._open_orders.scan():
+            order = self.orders[order_id]
+            if location and location not in (order["address"] or "").lower():
+                continue
+            if filters.get("work_type") and order["work_type"] != filters["work_type"]:
+                continue
+            if min_price is not None and not (
+                order["price"] is not None and order["price"] >= min_price
+            ):
+                continue
+            if max_price is not None and not (
+                order["price"] is not None and order["price"] <= max_price
+            ):
+                continue
+            if min_rating is not None:
+                profile = self.customer_profiles.get(order["customer_id"])
+                if not profile or profile["rating"] is None or profile["rating"] < min_rating:
+                    continue
+            rank = 0
+            if terms:
+                rank = _search_rank(f"{order['comment'] or ''} {order['address'] or ''}", terms)
+                if not rank:
+                    continue
+            found.append((rank, order))
+        if terms:
+            # Лента уже от новых к старым; устойчивая сортировка сохраняет этот порядок
+            # при равном ранге
+            found.sort(key=lambda item: item[0], reverse=True)
+        return [order for _, order in found]
+
+    async def search_orders(self, filters=None, limit=None, offset=0):
+        orders = self._search(filters)
+        if limit is not None:
+            orders = orders[offset : offset + limit]
+        return [dict(order) for order in orders]
+
+    async def count_orders(self, filters=None):
+        return len(self._search(filters))
+
+    async def get_orders_by_price_range(self, min_price, max_price, after=None, limit=None):
+        orders = self._search({"min_price": min_price, "max_price": max_price})
+        keys = sorted((order["price"], order["order_id"]) for order in orders)
+        if after is not None:
+            keys = keys[bisect.bisect_right(keys, (Decimal(str(after[0])), after[1])) :]
+        if limit is not None:
+            keys = keys[:limit]
+        return [dict(self.orders[order_id]) for _, order_id in keys]
+
+    async def get_feed_filter(self, user_id):
+        row = self.order_feed_filters.get(user_id)
+        return normalize_order_filters(row["filters"]) if row else {}
+
+    async def set_feed_filter(self, user_id, filters):
+        filters = normalize_order_filters(filters)
+        self.order_feed_filters[user_id] = {
+            "user_id": user_id,
+            "filters": dict(filters),
+            "updated_at": datetime.now(),
+        }
+        return filters
+
+    async def get_filter_presets(self, user_id):
+        presets = sorted(
+            (
+                preset
+                for preset in self.order_filter_presets.values()
+                if preset["user_id"] == user_id
+            ),
+            key=lambda preset: preset["name"],
+        )
+        return [
+            {
+                "preset_id": preset["preset_id"],
+                "name": preset["name"],
+                "filters": normalize_order_filters(preset["filters"]),
+            }
+            for preset in presets
+        ]
+
+    async def save_filter_preset(self, user_id, name, filters):
+        name = name[:64]
+        filters = normalize_order_filters(filters)
+        for preset in self.order_filter_presets.values():
+            if preset["user_id"] == user_id and preset["name"] == name:
+                preset["filters"] = filters
+                return preset["preset_id"]
+        preset_id = self._next_id("order_filter_presets")
+        self.order_filter_presets[preset_id] = {
+            "preset_id": preset_id,
+            "user_id": user_id,
+            "name": name,
+            "filters": filters,
+            "created_at": datetime.now(),
+        }
+        return preset_id
+
+    async def apply_filter_preset(self, user_id, preset_id):
+        preset = self.order_filter_presets.get(preset_id)
+        if preset is None or preset["user_id"] != user_id:
+            return None
+        return await self.set_feed_filter(user_id, preset["filters"])
+
+    async def delete_filter_preset(self, user_id, preset_id):
+        preset = self.order_filter_presets.get(preset_id)
+        if preset and preset["user_id"] == user_id:
+            del self.order_filter_presets[preset_id]
+
+    async def delete_order(self, order_id):
+        if order_id in self.orders:
+            self._update_order(self.orders[order_id], is_deleted=True)
+
+    async def get_deleted_orders(self, customer_id):
+        rows = [
+            row
+            for row in self._orders_all(self._orders_by_customer.get(customer_id, ()))
+            if row["is_deleted"] is True
+        ]
+        return _order_by(rows, "created_at DESC")
+
+    async def get_customer_completed_orders(self, customer_id):
+        rows = [
+            row
+            for row in self._orders_all(self._orders_by_customer.get(customer_id, ()))
+            if row["status"] == "completed" and row["is_deleted"] is False
+        ]
+        return _order_by(rows, "created_at DESC")
+
+    async def restore_order(self, order_id):
+        if order_id not in self.orders:
+            # Удалённый заказ уже в архиве — возвращаем его вместе с откликами
+            if not self._restore_from_archive(order_id):
+                return
+        self._update_order(self.orders[order_id], is_deleted=False)
+
+    async def delete_all_customer_orders(self, customer_id):
+        for order in self._hot_orders(list(self._orders_by_customer.get(customer_id, ()))):
+            if order["status"] not in ("completed", "deleted") and order["is_deleted"] is False:
+                self._update_order(order, is_deleted=True)
+
+    async def permanent_delete_order(self, order_id):
+        order = self.orders.pop(order_id, None)
+        if order:
+            self._unindex_order(order)
+            # ON DELETE CASCADE у responses и hidden_orders
+            self.responses.pop(order_id, None)
+            for key in [key for key in self.hidden_orders if key[1] == order_id]:
+                del self.hidden_orders[key]
+        self.responses_archive.pop(order_id, None)
+        for log_id in [
+            log_id
+            for log_id, log in self.moderation_logs_archive.items()
+            if log["order_id"] == order_id
+        ]:
+            del self.moderation_logs_archive[log_id]
+        archived = self.orders_archive.pop(order_id, None)
+        if archived:
+            self._orders_by_customer[archived["customer_id"]].discard(order_id)
+            if archived["executor_id"] is not None:
+                self._orders_by_executor[archived["executor_id"]].discard(order_id)
+
+    async def delete_all_user_orders(self, user_id):
+        for order in self._hot_orders(list(self._orders_by_customer.get(user_id, ()))):
+            if order["status"] not in ("completed", "deleted") and order["is_deleted"] is False:
+                self._update_order(
+                    order, is_deleted=True, status="cancelled", executor_id=None, assigned_at=None
+                )
+        for order in self._hot_orders(list(self._orders_by_executor.get(user_id, ()))):
+            if order["status"] in ACTIVE_EXECUTOR_STATUSES and order["is_deleted"] is False:
+                self._update_order(order, status="open", executor_id=None, assigned_at=None)
+
+    # ==================== ОТКЛИКИ И ИСПОЛНЕНИЕ ====================
+
+    async def create_response(self, order_id, executor_id, message):
+        self.responses[order_id].append(
+            {
+                "response_id": self._next_id("responses"),
+                "order_id": order_id,
+                "executor_id": executor_id,
+                "message": message,
+                "created_at": datetime.now(),
+            }
+        )
+
+    async def get_responses(self, order_id):
+        rows = []
+        for response in self.responses.get(order_id, ()):
+            user = self.users.get(response["executor_id"])
+            profile = self.executor_profiles.get(response["executor_id"])
+            if not user or not profile:
+                continue
+            rows.append(
+                {
+                    **response,
+                    "username": user["username"],
+                    "first_name": user["first_name"],
+                    "rating": profile["rating"],
+                    "completed_orders": profile["completed_orders"],
+                    "level": profile["level"],
+                }
+            )
+        return _order_by(rows, "rating DESC", "completed_orders DESC")
+
+    async def get_response_by_executor(self, order_id, executor_id):
+        for response in self.responses.get(order_id, ()):
+            if response["executor_id"] == executor_id:
+                return dict(response)
+        return None
+
+    async def assign_executor(self, order_id, executor_id):
+        if order_id in self.orders:
+            self._update_order(
+                self.orders[order_id],
+                executor_id=executor_id,
+                status="assigned",
+                assigned_at=datetime.now(),
+            )
+
+    def _executor_active(self, executor_id, statuses):
+        rows = [
+            dict(order)
+            for order in self._hot_orders(self._orders_by_executor.get(executor_id, ()))
+            if order["status"] in statuses and order["is_deleted"] is False
+        ]
+        return _order_by(rows, "created_at DESC")
+
+    async def get_executor_orders(self, executor_id):
+        return self._executor_active(executor_id, ACTIVE_EXECUTOR_STATUSES)
+
+    async def get_executor_active_order(self, executor_id):
+        # Исключаем 'awaiting_confirmation' чтобы исполнитель мог брать новые заказы
+        rows = self._executor_active(executor_id, ("assigned", "in_progress"))
+        return rows[0] if rows else None
+
+    async def get_executor_history(self, executor_id):
+        rows = []
+        for order in self._orders_all(self._orders_by_executor.get(executor_id, ())):
+            if order["status"] not in HISTORY_STATUSES:
+                continue
+            reviews = [
+                self.reviews[review_id]
+                for review_id in self._reviews_by_order.get(order["order_id"], ())
+                if self.reviews[review_id]["reviewer_id"] == order["customer_id"]
+                and self.reviews[review_id]["reviewee_id"] == order["executor_id"]
+            ]
+            for review in reviews or [None]:
+                rows.append(
+                    {
+                        **order,
+                        "rating": review["rating"] if review else None,
+                        "review_comment": review["comment"] if review else None,
+                        "review_date": review["created_at"] if review else None,
+                    }
+                )
+        return _order_by(rows, "completed_at DESC NULLS LAST", "created_at DESC")[:50]
+
+    async def clear_executor_history(self, executor_id):
+        for order_id in list(self._orders_by_executor.get(executor_id, ())):
+            if order_id in self.orders:
+                if self.orders[order_id]["status"] in HISTORY_STATUSES:
+                    self._update_order(self.orders[order_id], status="archived")
+            elif (
+                order_id in self.orders_archive
+                and self.orders_archive[order_id]["status"] in HISTORY_STATUSES
+            ):
+                self.orders_archive[order_id]["status"] = "archived"
+
+    async def complete_order(self, order_id):
+        order = self.orders.get(order_id)
+        if order:
+            self._update_order(order, status="completed", completed_at=datetime.now())
+            self._emit(
+                "order_completed",
+                order_id=order_id,
+                executor_id=order["executor_id"],
+                completed_at=order["completed_at"],
+            )
+
+    async def set_order_status(self, order_id, status):
+        if order_id in self.orders:
+            self._update_order(self.orders[order_id], status=status)
+
+    async def decline_order(self, order_id, decline_reason):
+        if order_id in self.orders:
+            self._update_order(
+                self.orders[order_id],
+                status="open",
+                executor_id=None,
+                decline_reason=decline_reason,
+                declined_at=datetime.now(),
+            )
+
+    async def get_completed_orders(self, user_id, role="customer"):
+        index = self._orders_by_customer if role == "customer" else self._orders_by_executor
+        rows = [
+            row
+            for row in self._orders_all(index.get(user_id, ()))
+            if row["status"] == "completed" and row["is_deleted"] is False
+        ]
+        return _order_by(rows, "completed_at DESC")
+
+    async def update_customer_stats(self, customer_id):
+        total = len(self._orders_all(self._orders_by_customer.get(customer_id, ())))
+        profile = self.customer_profiles.setdefault(
+            customer_id, {"user_id": customer_id, "rating": _money(0), "total_orders": 0}
+        )
+        profile["total_orders"] = total
+
+    async def update_executor_stats(self, executor_id):
+        completed = sum(
+            1
+            for row in self._orders_all(self._orders_by_executor.get(executor_id, ()))
+            if row["status"] == "completed"
+        )
+        level = "новичок"
+        if completed >= 50:
+            level = "топ"
+        elif completed >= 10:
+            level = "опытный"
+        if executor_id in self.executor_profiles:
+            self.executor_profiles[executor_id].update(completed_orders=completed, level=level)
+        self._emit(
+            "executor_stats_changed", user_id=executor_id, completed_orders=completed, level=level
+        )
+
+    # ==================== ОТЗЫВЫ И РЕЙТИНГИ ====================
+
+    def _set_profile_rating(self, user_id, rating):
+        """
+        Рейтинг в профиль по роли, как в create_review: executor — профиль исполнителя,
+        иначе заказчика
+        """
+        user = self.users.get(user_id)
+        role = "executor" if user and user["user_role"] == "executor" else "customer"
+        profiles = self.executor_profiles if role == "executor" else self.customer_profiles
+        if user_id in profiles:
+            profiles[user_id]["rating"] = _money(rating)
+        return role
+
+    async def create_review(self, order_id, reviewer_id, reviewee_id, rating, comment):
+        stars = int(rating)
+        if not 1 <= stars <= 5:
+            raise ValueError(f"rating вне диапазона 1–5: {stars}")
+        review_id = self._next_id("reviews")
+        created_at = datetime.now()
+        self.reviews[review_id] = {
+            "review_id": review_id,
+            "order_id": order_id,
+            "reviewer_id": reviewer_id,
+            "reviewee_id": reviewee_id,
+            "rating": stars,
+            "comment": comment,
+            "created_at": created_at,
+        }
+        self._reviews_by_reviewee[reviewee_id].add(created_at, review_id)
+        self._reviews_by_order[order_id].append(review_id)
+
+        summary = self.user_rating_summary.get(reviewee_id)
+        if summary is None:
+            summary = self.user_rating_summary[reviewee_id] = {
+                "user_id": reviewee_id,
+                "reviews_count": 0,
+                "rating_sum": 0,
+                **{f"stars_{n}": 0 for n in range(1, 6)},
+                "last_review_at": None,
+            }
+        summary["reviews_count"] += 1
+        summary["rating_sum"] += stars
+        summary[f"stars_{stars}"] += 1
+        summary["last_review_at"] = max(filter(None, (summary["last_review_at"], created_at)))
+        summary["updated_at"] = datetime.now()
+        avg_rating = round(summary["rating_sum"] / summary["reviews_count"], 2)
+
+        role = self._set_profile_rating(reviewee_id, avg_rating)
+        self._emit("rating_changed", user_id=reviewee_id, role=role, rating=avg_rating)
+        return avg_rating
+
+    async def get_rating_summary(self, user_id):
+        return self.format_rating_summary(self.user_rating_summary.get(user_id))
+
+    async def recompute_all_ratings(self):
+        summaries = {}
+        for review in self.reviews.values():
+            if review["reviewee_id"] is None:
+                continue
+            summary = summaries.setdefault(
+                review["reviewee_id"],
+                {
+                    "user_id": review["reviewee_id"],
+                    "reviews_count": 0,
+                    "rating_sum": 0,
+                    **{f"stars_{n}": 0 for n in range(1, 6)},
+                    "last_review_at": None,
+                    "updated_at": datetime.now(),
+                },
+            )
+            summary["reviews_count"] += 1
+            summary["rating_sum"] += review["rating"]
+            summary[f"stars_{review['rating']}"] += 1
+            summary["last_review_at"] = max(
+                filter(None, (summary["last_review_at"], review["created_at"]))
+            )
+        self.user_rating_summary = summaries
+
+        result = {"summaries": len(summaries), "executor_profiles": 0, "customer_profiles": 0}
+        for user_id, summary in summaries.items():
+            if user_id not in self.users:
+                continue
+            rating = Decimal(summary["rating_sum"]) / summary["reviews_count"]
+            role = self._set_profile_rating(user_id, rating)
+            profiles = self.executor_profiles if role == "executor" else self.customer_profiles
+            if user_id in profiles:
+                result[f"{role}_profiles"] += 1
+        self._emit("ratings_recomputed")
+        return result
+
+    async def update_executor_rating(self, user_id, new_rating):
+        rating = round(float(new_rating), 2)
+        if user_id in self.executor_profiles:
+            self.executor_profiles[user_id]["rating"] = _money(rating)
+        self._emit("rating_changed", user_id=user_id, role="executor", rating=rating)
+
+    async def update_customer_rating(self, user_id, new_rating):
+        rating = round(float(new_rating), 2)
+        if user_id in self.customer_profiles:
+            self.customer_profiles[user_id]["rating"] = _money(rating)
+        self._emit("rating_changed", user_id=user_id, role="customer", rating=rating)
+
+    async def get_executor_profile(self, user_id):
+        profile = self.executor_profiles.get(user_id)
+        return dict(profile) if profile else None
+
+    async def get_customer_rating(self, user_id):
+        profile = self.customer_profiles.get(user_id)
+        return profile["rating"] if profile else 0.0
+
+    def _review_row(self, review):
+        reviewer = self.users.get(review["reviewer_id"]) or {}
+        return {
+            **review,
+            "username": reviewer.get("username"),
+            "first_name": reviewer.get("first_name"),
+        }
+
+    async def get_reviews(self, user_id):
+        # Внутренний JOIN: отзывы от неизвестных пользователей не выводятся
+        index = self._reviews_by_reviewee.get(user_id) or _KeysetIndex()
+        return [
+            self._review_row(self.reviews[review_id])
+            for review_id in index.scan(direction="newer")
+            if self.reviews[review_id]["reviewer_id"] in self.users
+        ]
+
+    async def get_reviews_page(self, user_id, cursor=None, limit=10, direction="older"):
+        index = self._reviews_by_reviewee.get(user_id) or _KeysetIndex()
+        position = decode_keyset_cursor(cursor) if cursor else None
+        if position is None:
+            direction = "older"
+        review_ids = itertools.islice(index.scan(position, direction), limit + 1)
+        rows = [self._review_row(self.reviews[review_id]) for review_id in review_ids]
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == "newer":
+            rows.reverse()
+            has_newer, has_older = has_more, True
+        else:
+            has_newer, has_older = position is not None, has_more
+
+        return {
+            "reviews": rows,
+            "next_cursor": (
+                encode_keyset_cursor(rows[-1]["created_at"], rows[-1]["review_id"])
+                if rows and has_older
+                else None
+            ),
+            "prev_cursor": (
+                encode_keyset_cursor(rows[0]["created_at"], rows[0]["review_id"])
+                if rows and has_newer
+                else None
+            ),
+        }
+
+    def _executor_rows(self):
+        rows = []
+        for user_id, profile in self.executor_profiles.items():
+            user = self.users.get(user_id)
+            if user:
+                rows.append(
+                    {
+                        "user_id": user_id,
+                        "username": user["username"],
+                        "first_name": user["first_name"],
+                        "rating": profile["rating"],
+                        "completed_orders": profile["completed_orders"],
+                        "level": profile["level"],
+                    }
+                )
+        return rows
+
+    def _completions_24h(self):
+        since = datetime.now() - timedelta(hours=24)
+        return [
+            order
+            for order in self.orders.values()
+            if order["status"] == "completed"
+            and order["executor_id"] is not None
+            and order["completed_at"] is not None
+            and order["completed_at"] >= since
+        ]
+
+    async def get_leaderboard(self, role="executor", limit=10):
+        if role == "executor":
+            return _order_by(self._executor_rows(), "rating DESC", "completed_orders DESC")[:limit]
+        rows = []
+        for user_id, profile in self.customer_profiles.items():
+            user = self.users.get(user_id)
+            if user:
+                rows.append(
+                    {
+                        "user_id": user_id,
+                        "username": user["username"],
+                        "first_name": user["first_name"],
+                        "rating": profile["rating"],
+                        "total_orders": profile["total_orders"],
+                    }
+                )
+        return _order_by(rows, "rating DESC", "total_orders DESC")[:limit]
+
+    async def get_leaderboard_snapshot(self):
+        executors = [
+            dict(row, user_role=self.users[row["user_id"]]["user_role"])
+            for row in self._executor_rows()
+        ]
+        completions = [
+            {"executor_id": order["executor_id"], "completed_at": order["completed_at"]}
+            for order in self._completions_24h()
+        ]
+        return executors, completions
+
+    async def get_top_active_executors_24h(self, limit=2):
+        counts = defaultdict(int)
+        for order in self._completions_24h():
+            counts[order["executor_id"]] += 1
+        rows = [
+            {
+                "user_id": row["user_id"],
+                "username": row["username"],
+                "first_name": row["first_name"],
+                "rating": row["rating"],
+                "orders_24h": counts[row["user_id"]],
+            }
+            for row in self._executor_rows()
+            if self.users[row["user_id"]]["user_role"] == "executor"
+        ]
+        return _order_by(rows, "orders_24h DESC", "rating DESC")[:limit]
+
+    # ==================== УВЕДОМЛЕНИЯ, СКРЫТЫЕ ЗАКАЗЫ ====================
+
+    async def create_notification(self, user_id, message):
+        notification_id = self._next_id("notifications")
+        self.notifications[notification_id] = {
+            "notification_id": notification_id,
+            "user_id": user_id,
+            "message": message,
+            "is_read": False,
+            "created_at": datetime.now(),
+        }
+
+    async def hide_order_for_user(self, user_id, order_id):
+        if (user_id, order_id) not in self.hidden_orders:
+            self.hidden_orders[(user_id, order_id)] = {
+                "id": self._next_id("hidden_orders"),
+                "user_id": user_id,
+                "order_id": order_id,
+                "hidden_at": datetime.now(),
+            }
+
+    async def is_order_hidden(self, user_id, order_id):
+        return (user_id, order_id) in self.hidden_orders
+
+    async def get_hidden_orders_for_user(self, user_id):
+        return [order_id for hidden_user, order_id in self.hidden_orders if hidden_user == user_id]
+
+    # ==================== СТАТИСТИКА ====================
+
+    async def refresh_daily_stats(self, days=None):
+        if days is None:
+            days = 2 if self.stats_daily else STATS_BACKFILL_DAYS
+        today = date.today()
+        since = datetime.combine(today - timedelta(days=days - 1), datetime.min.time())
+        flows = defaultdict(lambda: dict.fromkeys(STATS_FLOW_FIELDS, 0))
+
+        def count(rows, field, column="created_at"):
+            for row in rows:
+                if row[column] is not None and row[column] >= since:
+                    flows[row[column].date()][field] += 1
+
+        all_orders = self._orders_all(itertools.chain(self.orders, self.orders_archive))
+        count(self.users.values(), "users_new")
+        count(all_orders, "orders_new")
+        done = [order for order in all_orders if order["status"] == "completed"]
+        count(done, "orders_completed", "completed_at")
+        for order in done:
+            if order["completed_at"] is not None and order["completed_at"] >= since:
+                flows[order["completed_at"].date()]["gmv"] += order["price"] or 0
+        count(self.reviews.values(), "reviews_new")
+        count(self.complaints.values(), "complaints_new")
+        logs = [log for log in self.moderation_logs.values() if log["created_at"] >= since]
+        count(logs, "moderation_checks")
+        count([log for log in logs if log["risk_score"] >= 4], "moderation_flagged")
+        for log in logs:
+            flows[log["created_at"].date()]["moderation_risk_sum"] += log["risk_score"]
+        decisions = self.admin_moderation_decisions.values()
+        count([d for d in decisions if d["decision"] == "blocked"], "moderation_blocked")
+        count([d for d in decisions if d["decision"] == "approved"], "moderation_approved")
+
+        computed_at = datetime.now()
+        for offset in range(days):
+            day = today - timedelta(days=offset)
+            row = self.stats_daily.setdefault(day, {"day": day, **STATS_SNAPSHOT_DEFAULTS})
+            row.update(flows[day], computed_at=computed_at)
+            row["gmv"] = _money(row["gmv"])
+
+        # Снимки: только сегодняшняя строка
+        users = self.users.values()
+        rating_sum = sum(summary["rating_sum"] for summary in self.user_rating_summary.values())
+        rating_count = sum(
+            summary["reviews_count"] for summary in self.user_rating_summary.values()
+        )
+        self.stats_daily[today].update(
+            users_total=len(self.users),
+            executors=sum(1 for user in users if user["user_role"] in ("executor", "both")),
+            customers=sum(1 for user in users if user["user_role"] in ("customer", "both")),
+            banned=sum(1 for user in users if user["is_banned"]),
+            admins=sum(1 for user in users if user["is_admin"]),
+            orders_total=len(all_orders),
+            orders_open=sum(
+                1 for order in all_orders if order["status"] == "open" and not order["is_deleted"]
+            ),
+            orders_active=sum(
+                1 for order in all_orders if order["status"] in ("open", "assigned", "in_progress")
+            ),
+            orders_completed_total=len(done),
+            orders_cancelled_total=sum(
+                1 for order in all_orders if order["status"] in ("cancelled", "deleted")
+            ),
+            complaints_open=sum(
+                1 for complaint in self.complaints.values() if complaint["status"] == "new"
+            ),
+            avg_rating=_money(Decimal(rating_sum) / rating_count) if rating_count else None,
+        )
+        return days
+
+    async def get_today_stats(self):
+        if date.today() not in self.stats_daily:
+            # Фоновый пересчёт ещё не успел создать сегодняшнюю строку
+            await self.refresh_daily_stats()
+        return dict(self.stats_daily[date.today()])
+
+    async def get_stats_dashboard(self):
+        today = date.today()
+        if today not in self.stats_daily:
+            await self.refresh_daily_stats()
+        rows = [
+            {**self.stats_daily[day], "today": today}
+            for day in sorted(self.stats_daily, reverse=True)
+            if day > today - timedelta(days=60)
+        ]
+        return summarize_stats_rows(rows)
+
+    # ==================== ЧАТЫ ====================
+
+    async def get_or_create_chat(self, order_id, user1_id, user2_id):
+        chat_id = self._chat_by_order.get(order_id)
+        if chat_id is None:
+            chat_id = self._next_id("chats")
+            self.chats[chat_id] = {
+                "chat_id": chat_id,
+                "order_id": order_id,
+                "user1_id": user1_id,
+                "user2_id": user2_id,
+                "created_at": datetime.now(),
+            }
+            self._chat_by_order[order_id] = chat_id
+        return chat_id
+
+    async def save_chat_messages(self, items):
+        if not items:
+            return
+        for item in items:
+            message_id = self._next_id("messages")
+            self.messages[message_id] = {
+                "message_id": message_id,
+                "chat_id": item["chat_id"],
+                "sender_id": item["sender_id"],
+                "message": item["message"],
+                "created_at": item["created_at"],
+                "content_type": item.get("content_type") or "text",
+                "tg_chat_id": item.get("tg_chat_id"),
+                "tg_message_id": item.get("tg_message_id"),
+            }
+            self._messages_by_chat[item["chat_id"]].add(item["created_at"], message_id)
+            if item.get("recipient_id"):
+                unread = self.chat_unread[item["recipient_id"]].setdefault(
+                    item["chat_id"],
+                    {
+                        "chat_id": item["chat_id"],
+                        "user_id": item["recipient_id"],
+                        "unread_count": 0,
+                    },
+                )
+                unread["unread_count"] += 1
+                unread["updated_at"] = datetime.now()
+
+    async def get_chat_history(self, chat_id, cursor=None, limit=10, direction="older"):
+        index = self._messages_by_chat.get(chat_id) or _KeysetIndex()
+        position = decode_keyset_cursor(cursor) if cursor else None
+        if position is None:
+            direction = "older"
+        # Внутренний JOIN users: сообщения неизвестных отправителей не выводятся
+        joined = (
+            {**message, "first_name": sender["first_name"], "username": sender["username"]}
+            for message, sender in (
+                (self.messages[message_id], self.users.get(self.messages[message_id]["sender_id"]))
+                for message_id in index.scan(position, direction)
+            )
+            if sender
+        )
+        rows = list(itertools.islice(joined, limit + 1))
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        if direction == "newer":
+            has_newer, has_older = has_more, True
+        else:
+            rows.reverse()
+            has_newer, has_older = position is not None, has_more
+
+        return {
+            "messages": rows,
+            "next_cursor": (
+                encode_keyset_cursor(rows[0]["created_at"], rows[0]["message_id"])
+                if rows and has_older
+                else None
+            ),
+            "prev_cursor": (
+                encode_keyset_cursor(rows[-1]["created_at"], rows[-1]["message_id"])
+                if rows and has_newer
+                else None
+            ),
+        }
+
+    async def mark_chat_read(self, chat_id, user_id):
+        unread = self.chat_unread.get(user_id, {}).get(chat_id)
+        if unread and unread["unread_count"] > 0:
+            unread.update(unread_count=0, updated_at=datetime.now())
+
+    async def get_unread_chats(self, user_id):
+        rows = [
+            {
+                "chat_id": chat_id,
+                "unread_count": unread["unread_count"],
+                "order_id": self.chats[chat_id]["order_id"],
+                "updated_at": unread["updated_at"],
+            }
+            for chat_id, unread in self.chat_unread.get(user_id, {}).items()
+            if unread["unread_count"] > 0 and chat_id in self.chats
+        ]
+        rows = _order_by(rows, "updated_at DESC")
+        for row in rows:
+            del row["updated_at"]
+        return rows
+
+    async def get_unread_count(self, user_id, chat_id=None):
+        chats = self.chat_unread.get(user_id, {})
+        if chat_id is not None:
+            return int(chats[chat_id]["unread_count"]) if chat_id in chats else 0
+        return sum(
+            unread["unread_count"] for unread in chats.values() if unread["unread_count"] > 0
+        )
+
+    # ==================== ЖАЛОБЫ ====================
+
+    async def create_complaint(self, user_id, complaint_type, target_id, description):
+        if complaint_type not in ("order", "user", "idea"):
+            raise ValueError(f"Неизвестный тип жалобы: {complaint_type}")
+        complaint_id = self._next_id("complaints")
+        self.complaints[complaint_id] = {
+            "complaint_id": complaint_id,
+            "user_id": user_id,
+            "complaint_type": complaint_type,
+            "target_id": target_id,
+            "description": description,
+            "status": "new",
+            "created_at": datetime.now(),
+            "resolved_at": None,
+            "admin_note": None,
+        }
+        return complaint_id
+
+    async def get_complaints(self, status=None):
+        rows = [dict(c) for c in self.complaints.values() if not status or c["status"] == status]
+        return _order_by(rows, "created_at DESC")
+
+    async def get_complaint(self, complaint_id):
+        complaint = self.complaints.get(complaint_id)
+        return dict(complaint) if complaint else None
+
+    async def resolve_complaint(self, complaint_id, admin_note=None):
+        if complaint_id in self.complaints:
+            self.complaints[complaint_id].update(
+                status="resolved", resolved_at=datetime.now(), admin_note=admin_note
+            )
+
+    async def get_complaints_count(self, status=None):
+        return sum(1 for c in self.complaints.values() if not status or c["status"] == status)
+
+    # ==================== МОДЕРАЦИЯ ====================
+
+    async def init_moderation_patterns(self):
+        for keyword, category, weight in MODERATION_PATTERNS:
+            row = self.moderation_patterns.get(keyword)
+            if row:
+                row.update(category=category, risk_weight=weight, is_active=True)
+            else:
+                self.moderation_patterns[keyword] = {
+                    "pattern_id": self._next_id("moderation_patterns"),
+                    "keyword": keyword,
+                    "category": category,
+                    "risk_weight": weight,
+                    "is_active": True,
+                    "created_at": datetime.now(),
+                }
+
+    async def init_whitelist(self):
+        for phrase, category in WHITELIST_PHRASES:
+            self.whitelist_phrases.setdefault(
+                phrase,
+                {
+                    "phrase_id": self._next_id("whitelist_phrases"),
+                    "phrase": phrase,
+                    "category": category,
+                    "is_active": True,
+                    "created_at": datetime.now(),
+                },
+            )
+
+    def _whitelisted(self, text_lower):
+        return any(
+            row["is_active"] and row["phrase"].lower() in text_lower
+            for row in self.whitelist_phrases.values()
+        )
+
+    def _active_patterns(self):
+        return [row for row in self.moderation_patterns.values() if row["is_active"]]
+
+    async def check_order_content(self, text, price):
+        text_lower = text.lower()
+        if self._whitelisted(text_lower):
+            return 0, []
+        return score_moderation_patterns(text_lower, price, self._active_patterns())
+
+    async def check_order_content_smart(self, text, price, address, user_id, sensitivity="medium"):
+        text_lower = text.lower()
+        risk_score = 0
+        matched_patterns = []
+        sensitivity_thresholds = {"off": 999, "low": 6, "medium": 4, "high": 2}
+        threshold = sensitivity_thresholds.get(sensitivity, 4)
+
+        user = self.users.get(user_id)
+        if user:
+            user_age = datetime.now() - user["created_at"]
+            if user_age < timedelta(hours=48):
+                risk_score += 2
+                matched_patterns.append("новый_пользователь (<48ч) (+2)")
+            elif user_age < timedelta(hours=168):
+                risk_score += 1
+                matched_patterns.append("молодой_аккаунт (<7д) (+1)")
+
+        if self._whitelisted(text_lower):
+            return 0, [], threshold
+
+        pattern_score, pattern_matches = score_moderation_patterns(
+            text_lower, price, self._active_patterns()
+        )
+        risk_score += pattern_score
+        matched_patterns.extend(pattern_matches)
+
+        anomaly_score, anomalies = await self.detect_anomalies(text, address)
+        risk_score += anomaly_score
+        matched_patterns.extend(anomalies)
+        return risk_score, matched_patterns, threshold
+
+    async def log_moderation(self, order_id, risk_score, matched_patterns):
+        log_id = self._next_id("moderation_logs")
+        self.moderation_logs[log_id] = {
+            "log_id": log_id,
+            "order_id": order_id,
+            "risk_score": risk_score,
+            "matched_patterns": ", ".join(matched_patterns) if matched_patterns else "",
+            "created_at": datetime.now(),
+        }
+
+    async def get_suspicious_orders(self, min_risk_score=4):
+        since = datetime.now() - timedelta(days=90)
+        logged = [
+            {
+                **self.orders[log["order_id"]],
+                "risk_score": log["risk_score"],
+                "matched_patterns": log["matched_patterns"],
+                "checked_at": log["created_at"],
+            }
+            for log in self.moderation_logs.values()
+            if log["risk_score"] >= min_risk_score
+            and log["created_at"] > since
+            and log["order_id"] in self.orders
+            and self.orders[log["order_id"]]["is_deleted"] is False
+        ]
+        if logged:
+            return _order_by(logged, "checked_at DESC")[:50]
+
+        since = datetime.now() - timedelta(days=7)
+        recent = [
+            dict(order)
+            for order in self.orders.values()
+            if order["is_deleted"] is False and order["created_at"] > since
+        ]
+        return _order_by(recent, "created_at DESC")[:50]
+
+    async def toggle_notifications(self, user_id, notification_type, enabled):
+        user = self.users.get(user_id)
+        if user and notification_type in ("suspicious_orders", "complaints"):
+            user[f"{notification_type}_notifications"] = enabled
+
+    async def get_admin_notification_settings(self, user_id):
+        user = self.users.get(user_id)
+        if not user:
+            return None
+        return {
+            key: user[key]
+            for key in ("suspicious_orders_notifications", "complaints_notifications", "quiet_mode")
+        }
+
+    async def toggle_quiet_mode(self, user_id):
+        user = self.users.get(user_id)
+        if not user:
+            return False
+        user["quiet_mode"] = not user["quiet_mode"]
+        return user["quiet_mode"]
+
+    async def save_admin_decision(self, order_id, admin_id, decision, order_text, risk_score):
+        decision_id = self._next_id("admin_moderation_decisions")
+        self.admin_moderation_decisions[decision_id] = {
+            "decision_id": decision_id,
+            "order_id": order_id,
+            "admin_id": admin_id,
+            "decision": decision,
+            "order_text": order_text,
+            "risk_score": risk_score,
+            "created_at": datetime.now(),
+        }
+
+    async def get_moderation_sensitivity(self):
+        row = self.system_settings.get("moderation_sensitivity")
+        return row["setting_value"] if row else "medium"
+
+    async def set_moderation_sensitivity(self, sensitivity, admin_id):
+        row = self.system_settings.get("moderation_sensitivity")
+        if row:
+            row.update(setting_value=sensitivity, updated_at=datetime.now(), updated_by=admin_id)
+
+    # ==================== СЛУЖЕБНЫЕ СООБЩЕНИЯ И ШТРАФЫ ====================
+
+    async def save_last_bot_message(self, user_id: int, message_id: int, chat_id: int):
+        self.user_bot_messages[user_id] = {
+            "user_id": user_id,
+            "last_bot_message_id": message_id,
+            "chat_id": chat_id,
+            "updated_at": datetime.now(),
+        }
+
+    async def get_last_bot_message(self, user_id: int):
+        row = self.user_bot_messages.get(user_id)
+        return (
+            {"last_bot_message_id": row["last_bot_message_id"], "chat_id": row["chat_id"]}
+            if row
+            else None
+        )
+
+    async def delete_last_bot_message(self, user_id: int):
+        self.user_bot_messages.pop(user_id, None)
+
+    async def add_executor_penalty(
+        self, executor_id: int, penalty_amount: float, reason: str, order_id: int = None
+    ):
+        profile = self.executor_profiles.get(executor_id)
+        if profile:
+            profile["penalty_points"] = _money(
+                (profile["penalty_points"] or 0) + _money(penalty_amount)
+            )
+        penalty_id = self._next_id("penalty_log")
+        self.penalty_log[penalty_id] = {
+            "id": penalty_id,
+            "executor_id": executor_id,
+            "order_id": order_id,
+            "penalty": _money(penalty_amount),
+            "reason": reason,
+            "created_at": datetime.now(),
+        }
+
+    async def get_executor_rating_with_penalty(self, executor_id: int) -> float:
+        profile = self.executor_profiles.get(executor_id)
+        if not profile:
+            return 5.0
+        base = float(profile["base_rating"] if profile["base_rating"] is not None else 5.0)
+        penalty = float(profile["penalty_points"] or 0)
+        return max(1.0, base - penalty)
+
+    async def prune_old_bot_messages(self, hours: int = 48):
+        cutoff = datetime.now() - timedelta(hours=hours)
+        for user_id in [
+            user_id
+            for user_id, row in self.user_bot_messages.items()
+            if _before(row["updated_at"], cutoff)
+        ]:
+            del self.user_bot_messages[user_id]
+
+    # ==================== АРХИВ ЗАКАЗОВ ====================
+
+    def _archivable(self, order, completed_before, deleted_before):
+        if (
+            order["status"] == "completed"
+            and not order["is_deleted"]
+            and _before(order["completed_at"], completed_before)
+        ):
+            return True
+        is_deleted = order["is_deleted"] is True or order["status"] == "deleted"
+        return is_deleted and _before(order["deleted_at"] or order["created_at"], deleted_before)
+
+    async def archive_orders_batch(self, completed_before=None, deleted_before=None, limit=500):
+        moved = {"orders": 0, "responses": 0, "moderation_logs": 0}
+        order_ids = sorted(
+            order_id
+            for order_id, order in self.orders.items()
+            if self._archivable(order, completed_before, deleted_before)
+        )[:limit]
+        if not order_ids:
+            return moved
+        archived_at = datetime.now()
+        for order_id in order_ids:
+            responses = self.responses.pop(order_id, [])
+            if responses:
+                self.responses_archive[order_id].extend(responses)
+            moved["responses"] += len(responses)
+            # Открытые заказы не архивируются; индексы по заказчику и исполнителю общие с архивом
+            order = self.orders.pop(order_id)
+            self.orders_archive[order_id] = {**order, "archived_at": archived_at}
+            moved["orders"] += 1
+        archived = set(order_ids)
+        for log_id in [
+            log_id for log_id, log in self.moderation_logs.items() if log["order_id"] in archived
+        ]:
+            self.moderation_logs_archive[log_id] = self.moderation_logs.pop(log_id)
+            moved["moderation_logs"] += 1
+        return moved
+
+    def _restore_from_archive(self, order_id):
+        """Возвращает заказ и его отклики из архива; False — заказа в архиве нет"""
+        order = self.orders_archive.pop(order_id, None)
+        if order is None:
+            return False
+        order.pop("archived_at", None)
+        self.orders[order_id] = order
+        if self._is_open(order):
+            self._open_orders.add(order["created_at"], order_id)
+        responses = self.responses_archive.pop(order_id, [])
+        if responses:
+            self.responses[order_id].extend(responses)
+        return True
+
+    async def get_archive_stats(self, completed_before=None, deleted_before=None):
+        hot = self.orders.values()
+        return {
+            "archived_total": len(self.orders_archive),
+            "last_archived_at": max(
+                (row["archived_at"] for row in self.orders_archive.values()), default=None
+            ),
+            "pending_completed": sum(
+                1
+                for order in hot
+                if order["status"] == "completed"
+                and not order["is_deleted"]
+                and _before(order["completed_at"], completed_before)
+            ),
+            "pending_deleted": sum(
+                1
+                for order in hot
+                if (order["is_deleted"] is True or order["status"] == "deleted")
+                and _before(order["deleted_at"] or order["created_at"], deleted_before)
+            ),
+        }
+
+    async def get_archive_settings(self):
+        values = {
+            key: row["setting_value"]
+            for key, row in self.system_settings.items()
+            if key.startswith("archive_")
+        }
+        return {
+            "completed_days": int(values.get("archive_completed_days", 90)),
+            "deleted_days": int(values.get("archive_deleted_days", 30)),
+        }
+
+    async def set_archive_setting(self, key, days, admin_id):
+        self.system_settings[f"archive_{key}"] = {
+            "setting_key": f"archive_{key}",
+            "setting_value": str(days),
+            "updated_at": datetime.now(),
+            "updated_by": admin_id,
+        }
+
+    # ==================== ХРАНЕНИЕ ДАННЫХ ====================
+
+    # Условия смотрят в orders_all: заказ чата мог уже уйти в архив
+    def _chat_order_closed(self, chat_id):
+        chat = self.chats.get(chat_id)
+        orders = self._orders_all((chat["order_id"],)) if chat else []
+        return bool(orders) and (
+            orders[0]["status"] in ("completed", "cancelled") or orders[0]["is_deleted"] is True
+        )
+
+    def _order_in_feed(self, order_id):
+        orders = self._orders_all((order_id,))
+        return bool(orders) and orders[0]["status"] == "open" and orders[0]["is_deleted"] is False
+
+    # Дополнительные условия политик retention.DEFAULT_POLICIES
+    # (SQL-условие там — по имени политики здесь)
+    RETENTION_CONDITIONS = {
+        "notifications_read": lambda db, row: row["is_read"] is True,
+        "messages": lambda db, row: db._chat_order_closed(row["chat_id"]),
+        "hidden_orders": lambda db, row: not db._order_in_feed(row["order_id"]),
+    }
+
+    def _retention_candidates(self, policy, cutoff, after=None):
+        """
+        [(возраст, ключ, ключ в словаре таблицы)] строк политики по возрастанию
+        (возраст, ключ)
+        """
+        table = getattr(self, policy.table, None)
+        if not isinstance(table, dict):
+            logger.debug(
+                f"Таблица {policy.table} не хранится в памяти, политика {policy.name} пропущена"
+            )
+            return []
+        condition = None
+        if policy.condition:
+            condition = self.RETENTION_CONDITIONS.get(policy.name)
+            if condition is None:
+                logger.debug(
+                    f"Условие политики {policy.name} не поддерживается в памяти, политика пропущена"
+                )
+                return []
+        rows = []
+        for storage_key, row in table.items():
+            age = row[policy.age_column]
+            if not _before(age, cutoff):
+                continue
+            if after is not None and (age, row[policy.key]) <= tuple(after):
+                continue
+            if condition and not condition(self, row):
+                continue
+            rows.append((age, row[policy.key], storage_key))
+        rows.sort(key=lambda item: (item[0], item[1]))
+        return rows
+
+    async def retention_purge_batch(self, policy, cutoff, after=None, limit=1000):
+        batch = self._retention_candidates(policy, cutoff, after)[:limit]
+        if not batch:
+            return 0, after
+        table = getattr(self, policy.table)
+        for _, _, storage_key in batch:
+            row = table.pop(storage_key)
+            if policy.table == "messages":
+                self._messages_by_chat[row["chat_id"]].remove(row["created_at"], row["message_id"])
+        last = max((age, key) for age, key, _ in batch)
+        return len(batch), last
+
+    async def retention_drop_partitions(self, policy, cutoff):
+        return 0, 0
+
+    async def maintain_partitions(self):
+        pass
+
+    async def retention_preview(self, policy, cutoff):
+        candidates = self._retention_candidates(policy, cutoff)
+        return {"rows": len(candidates), "oldest": candidates[0][0] if candidates else None}
+
+
+def switch_to_memory(db: Database) -> MemoryDatabase:
+    """
+    Переводит уже созданный экземпляр Database в режим памяти (деградированный режим
+    при недоступном Postgres). Объект тот же: на него уже ссылаются хендлеры и сервисы,
+    подписчики событий и метрики сохраняются.
+    """
+    db.__class__ = MemoryDatabase
+    db.pool = None
+    db._connected = False
+    db._create_storage()
+    return db
@@ -0,0 +1,117 @@
+"""
+Фоновая очистка сообщений
+Хендлеры только ставят id сообщений в очередь и сразу продолжают работу.
+Очередь сбрасывается в фоне пакетным deleteMessages (до 100 id за вызов) с
+ограничением частоты вызовов; при 429 от Telegram пачка возвращается в очередь
+и отправляется после паузы retry_after.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+# Ограничение Bot API на число id в одном deleteMessages
+DELETE_MESSAGES_LIMIT = 100
+
+
+class MessageCleanup:
+    """
+    Очередь id сообщений по чатам. Сбрасывается раз в flush_interval секунд;
+    между вызовами API выдерживается не меньше 1 / max_calls_per_second секунды.
+    """
+
+    def __init__(self, bot, flush_interval: float = 0.3, max_calls_per_second: float = 20):
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.min_call_gap = 1 / max_calls_per_second
+        self._pending: Dict[int, Dict[int, None]] = {}
+        self._in_flight: Set[Tuple[int, int]] = set()
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._last_call = 0.0
+        self._paused_until = 0.0
+        self.counters = {'scheduled': 0, 'api_calls': 0, 'deleted': 0, 'retry_after': 0, 'failed': 0}
+
+    def __len__(self):
+        return sum(len(ids) for ids in self._pending.values())
+
+    def schedule(self, chat_id: int, message_id: int):
+        """Поставить сообщение в очередь на удаление (без ожидания)"""
+        if not message_id:
+            return
+        ids = self._pending.setdefault(chat_id, {})
+        if message_id not in ids:
+            ids[message_id] = None
+            self.counters['scheduled'] += 1
+        self._wakeup.set()
+
+    def is_scheduled(self, chat_id: int, message_id: int) -> bool:
+        """Сообщение ждёт удаления — редактировать его бессмысленно"""
+        return message_id in self._pending.get(chat_id, ()) or (chat_id, message_id) in self._in_flight
+
+    def schedule_many(self, chat_id: int, message_ids: Iterable[int]):
+        for message_id in message_ids:
+            self.schedule(chat_id, message_id)
+
+    async def _throttle(self):
+        now = time.monotonic()
+        wait = max(self._paused_until - now, self._last_call + self.min_call_gap - now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        self._last_call = time.monotonic()
+
+    async def _delete_chunk(self, chat_id: int, chunk: List[int]):
+        await self._throttle()
+        self.counters['api_calls'] += 1
+        try:
+            await self.bot.delete_messages(chat_id=chat_id, message_ids=chunk)
+            self.counters['deleted'] += len(chunk)
+        except TelegramRetryAfter as e:
+            self.counters['retry_after'] += 1
+            self._paused_until = time.monotonic() + e.retry_after
+            # Пачка вернётся в очередь и уйдёт после паузы
+            self.schedule_many(chat_id, chunk)
+            logger.warning(f"deleteMessages: лимит Telegram, пауза {e.retry_after} с")
+        except Exception as e:
+            # Сообщения старше 48 ч или уже удалённые — повторять нечего
+            self.counters['failed'] += len(chunk)
+            logger.debug(f"Не удалось удалить сообщения {chunk} в чате {chat_id}: {e}")
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            pending, self._pending = self._pending, {}
+            # До ответа Telegram сообщения считаются удаляемыми (см. is_scheduled)
+            self._in_flight.update((chat_id, message_id) for chat_id, ids in pending.items() for message_id in ids)
+            for chat_id, ids in pending.items():
+                message_ids = list(ids)
+                for start in range(0, len(message_ids), DELETE_MESSAGES_LIMIT):
+                    chunk = message_ids[start:start + DELETE_MESSAGES_LIMIT]
+                    try:
+                        await self._delete_chunk(chat_id, chunk)
+                    finally:
+                        self._in_flight.difference_update((chat_id, message_id) for message_id in chunk)
+
+    async def run(self):
+        """Фоновая задача: сброс очереди"""
+        while True:
+            await self._wakeup.wait()
+            # Небольшая задержка собирает удаления одного апдейта в один вызов
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f"Сброс очереди удаления сообщений завершился ошибкой: {e}")
+
+    async def close(self):
+        """Удаляет остаток очереди при остановке бота"""
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.debug(f"При остановке не удалено {len(self)} сообщений: {e}")
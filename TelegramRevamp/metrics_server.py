@@ -0,0 +1,79 @@
+"""
+HTTP-эндпоинт метрик процесса бота
+/metrics — текстовый формат Prometheus: задержки и строки запросов к БД по именам,
+ожидание соединения из пула и размер пула, показатели health.py.
+/health/live и /health/ready — проверки для оркестратора (200 или 503),
+/health — все показатели здоровья в JSON.
+"""
+import json
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def render_pool_gauges(db) -> str:
+    if db.pool is None:
+        return 'db_pool_size 0\ndb_pool_idle 0\n'
+    return (
+        '# HELP db_pool_size Открытых соединений в пуле\n'
+        '# TYPE db_pool_size gauge\n'
+        f'db_pool_size {db.pool.get_size()}\n'
+        '# HELP db_pool_idle Свободных соединений в пуле\n'
+        '# TYPE db_pool_idle gauge\n'
+        f'db_pool_idle {db.pool.get_idle_size()}\n'
+    )
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    db = request.app['db']
+    body = db.metrics.render_prometheus() + render_pool_gauges(db)
+    health = request.app['health']
+    if health is not None:
+        body += health.render_prometheus()
+    return web.Response(body=body.encode('utf-8'), headers={'Content-Type': PROMETHEUS_CONTENT_TYPE})
+
+
+def _health_response(ok: bool, payload: dict) -> web.Response:
+    return web.Response(
+        status=200 if ok else 503, text=json.dumps(payload, ensure_ascii=False), content_type='application/json'
+    )
+
+
+async def live_handler(request: web.Request) -> web.Response:
+    live = request.app['health'].is_live()
+    return _health_response(live, {'live': live})
+
+
+async def ready_handler(request: web.Request) -> web.Response:
+    checks = request.app['health'].readiness()
+    return _health_response(all(checks.values()), checks)
+
+
+async def health_handler(request: web.Request) -> web.Response:
+    snapshot = request.app['health'].snapshot()
+    return _health_response(all(snapshot['checks'].values()), snapshot)
+
+
+def create_app(db, health=None) -> web.Application:
+    app = web.Application()
+    app['db'] = db
+    app['health'] = health
+    app.router.add_get('/metrics', metrics_handler)
+    if health is not None:
+        app.router.add_get('/health', health_handler)
+        app.router.add_get('/health/live', live_handler)
+        app.router.add_get('/health/ready', ready_handler)
+    return app
+
+
+async def start_metrics_server(db, port: int, health=None) -> web.AppRunner:
+    """Запускает эндпоинт в текущем цикле событий (рядом с polling бота)"""
+    runner = web.AppRunner(create_app(db, health), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, '0.0.0.0', port).start()
+    logger.info(f"📈 Метрики доступны на :{port}/metrics")
+    return runner
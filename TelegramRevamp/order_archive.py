@@ -0,0 +1,80 @@
+"""
+Архивация заказов
+Выполненные и удалённые заказы старше заданного срока вместе с откликами и логами
+модерации переносятся пачками в *_archive. Горячая таблица orders остаётся
+маленькой, а история читается через представление orders_all.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Варианты сроков для кнопок админки (дни); 0 — правило выключено
+ARCHIVE_DAYS_CHOICES = (0, 7, 30, 60, 90, 180)
+
+
+class OrderArchiver:
+    """
+    Прогон архивации: пачки по batch_size заказов с паузой между ними, не больше
+    max_batches за прогон. Сроки берутся из system_settings на каждом прогоне,
+    так что изменения из админки применяются без перезапуска.
+    """
+
+    def __init__(self, db, batch_size: int = 500, batch_pause: float = 0.2,
+                 max_batches: int = 40, interval: int = 3600):
+        self.db = db
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.max_batches = max_batches
+        self.interval = interval
+        self.last_run: Optional[dict] = None
+        self.last_run_at: Optional[datetime] = None
+        self._run_lock = asyncio.Lock()
+
+    @staticmethod
+    def cutoffs(settings: dict, now: datetime = None):
+        now = now or datetime.now()
+        completed = now - timedelta(days=settings['completed_days']) if settings['completed_days'] else None
+        deleted = now - timedelta(days=settings['deleted_days']) if settings['deleted_days'] else None
+        return completed, deleted
+
+    async def run_once(self) -> dict:
+        async with self._run_lock:
+            settings = await self.db.get_archive_settings()
+            completed_before, deleted_before = self.cutoffs(settings)
+            report = {'orders': 0, 'responses': 0, 'moderation_logs': 0, 'batches': 0, 'capped': False}
+            started = time.monotonic()
+            if completed_before or deleted_before:
+                while True:
+                    if report['batches'] >= self.max_batches:
+                        report['capped'] = True
+                        break
+                    moved = await self.db.archive_orders_batch(completed_before, deleted_before, self.batch_size)
+                    report['batches'] += 1
+                    for key, value in moved.items():
+                        report[key] += value
+                    if moved['orders'] < self.batch_size:
+                        break
+                    await asyncio.sleep(self.batch_pause)
+            report['seconds'] = round(time.monotonic() - started, 3)
+            self.last_run, self.last_run_at = report, datetime.now()
+            if report['orders']:
+                logger.info(
+                    "📦 В архив перенесено заказов: %d (откликов %d, логов модерации %d) за %.1f с",
+                    report['orders'], report['responses'], report['moderation_logs'], report['seconds']
+                )
+            return report
+
+    async def run_forever(self):
+        """Фоновая задача: прогон раз в interval секунд"""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.db.is_connected():
+                continue
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning(f"Прогон архивации заказов завершился ошибкой: {e}")
@@ -0,0 +1,259 @@
+"""
+Помесячное секционирование таблиц событий
+moderation_logs, messages, notifications и penalty_log секционируются по RANGE
+(created_at) с секцией на каждый месяц. Существующая таблица не копируется:
+она становится секцией «всё до начала следующего месяца», а новые строки идут
+в помесячные секции. Устаревшие секции отсоединяются и удаляются целиком.
+"""
+import logging
+import re
+from datetime import date, datetime
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Таблица → первичный ключ (в секционированной таблице PK = (ключ, created_at))
+PARTITIONED_TABLES = {
+    'moderation_logs': 'log_id',
+    'messages': 'message_id',
+    'notifications': 'notification_id',
+    'penalty_log': 'id',
+}
+PARTITION_COLUMN = 'created_at'
+# Сколько будущих месяцев держать созданными заранее
+MONTHS_AHEAD = 3
+
+_BOUND_RE = re.compile(r"FROM \((.+?)\) TO \((.+?)\)")
+
+
+def month_start(day) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(day: date, months: int) -> date:
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month:%Y%m}"
+
+
+def _parse_bound(raw: str) -> Optional[datetime]:
+    raw = raw.strip()
+    if raw in ('MINVALUE', 'MAXVALUE'):
+        return None
+    return datetime.fromisoformat(raw.strip("'"))
+
+
+async def is_partitioned(conn, table: str) -> bool:
+    relkind = await conn.fetchval('SELECT relkind FROM pg_class WHERE oid = to_regclass($1)', table)
+    return relkind == 'p'
+
+
+async def list_partitions(conn, table: str) -> List[Tuple[str, Optional[datetime], Optional[datetime], bool]]:
+    """Секции таблицы: (имя, нижняя граница, верхняя граница, секция по умолчанию); None — MINVALUE/MAXVALUE"""
+    rows = await conn.fetch(
+        '''SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) AS bound
+           FROM pg_inherits i
+           JOIN pg_class c ON c.oid = i.inhrelid
+           WHERE i.inhparent = to_regclass($1)
+           ORDER BY c.relname''',
+        table
+    )
+    result = []
+    for row in rows:
+        if row['bound'] == 'DEFAULT':
+            result.append((row['relname'], None, None, True))
+            continue
+        match = _BOUND_RE.search(row['bound'])
+        if not match:
+            continue
+        result.append((row['relname'], _parse_bound(match.group(1)), _parse_bound(match.group(2)), False))
+    return result
+
+
+async def convert_to_partitioned(conn, table: str, key: str, today: date = None):
+    """
+    Переводит обычную таблицу в секционированную без копирования данных.
+    Старая таблица переименовывается в {table}_legacy и присоединяется секцией
+    FROM (MINVALUE) TO (начало следующего месяца); пустая старая таблица просто удаляется.
+    Индексы пересоздаются на родителе (для legacy-секции подхватываются существующие),
+    последовательность ключа переходит к новой таблице.
+
+    Границу секции до блокировки доказывает CHECK-ограничение: оно добавляется
+    NOT VALID и проверяется VALIDATE CONSTRAINT, которое не мешает чтению и записи.
+    Под ACCESS EXCLUSIVE SET NOT NULL и ATTACH PARTITION видят проверенное
+    ограничение и не сканируют таблицу.
+
+    Первичный ключ родителя ({key}, created_at) тоже готовится заранее: уникальный
+    индекс строится CONCURRENTLY, под блокировкой он только оформляется
+    ограничением, и ATTACH присоединяет его вместо построения нового.
+    """
+    today = today or date.today()
+    boundary = add_months(month_start(today), 1)
+    legacy = f"{table}_legacy"
+    bound_check = f"{table}_{PARTITION_COLUMN}_bound"
+
+    # Новые строки проверяются с момента добавления ограничения, старые — при VALIDATE
+    await conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {bound_check}')
+    await conn.execute(
+        f"ALTER TABLE {table} ADD CONSTRAINT {bound_check} CHECK ("
+        f"{PARTITION_COLUMN} IS NOT NULL AND {PARTITION_COLUMN} < '{boundary.isoformat()}') NOT VALID"
+    )
+    await conn.execute(
+        f'UPDATE {table} SET {PARTITION_COLUMN} = CURRENT_TIMESTAMP '
+        f'WHERE {PARTITION_COLUMN} IS NULL'
+    )
+    await conn.execute(f'ALTER TABLE {table} VALIDATE CONSTRAINT {bound_check}')
+
+    # Прерванная сборка CONCURRENTLY оставляет невалидный индекс — его строим заново
+    partition_key = f"{table}_{key}_{PARTITION_COLUMN}_key"
+    index_valid = await conn.fetchval(
+        'SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass($1)', partition_key
+    )
+    if index_valid is False:
+        await conn.execute(f'DROP INDEX CONCURRENTLY {partition_key}')
+    await conn.execute(
+        f'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS {partition_key} '
+        f'ON {table} ({key}, {PARTITION_COLUMN})'
+    )
+
+    async with conn.transaction():
+        await conn.execute(f'LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE')
+        has_rows = await conn.fetchval(f'SELECT EXISTS (SELECT 1 FROM {table})')
+        indexes = await conn.fetch(
+            '''SELECT c.relname AS name, pg_get_indexdef(i.indexrelid) AS definition
+               FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+               WHERE i.indrelid = to_regclass($1) AND NOT i.indisprimary AND NOT i.indisunique''',
+            table
+        )
+        foreign_keys = await conn.fetch(
+            '''SELECT pg_get_constraintdef(oid) AS definition FROM pg_constraint
+               WHERE conrelid = to_regclass($1) AND contype = 'f' ''',
+            table
+        )
+        sequence = await conn.fetchval('SELECT pg_get_serial_sequence($1, $2)', table, key)
+
+        await conn.execute(f'ALTER TABLE {table} ALTER COLUMN {PARTITION_COLUMN} SET NOT NULL')
+        # Индекс первичного ключа родителя присоединяет только индекс ограничения
+        await conn.execute(
+            f'ALTER TABLE {table} ADD CONSTRAINT {partition_key} UNIQUE USING INDEX {partition_key}'
+        )
+        await conn.execute(f'ALTER TABLE {table} RENAME TO {legacy}')
+        for index in indexes:
+            await conn.execute(f'ALTER INDEX {index["name"]} RENAME TO {index["name"]}_legacy')
+
+        await conn.execute(f'''
+            CREATE TABLE {table} (
+                LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+                PRIMARY KEY ({key}, {PARTITION_COLUMN})
+            ) PARTITION BY RANGE ({PARTITION_COLUMN})
+        ''')
+        # LIKE ... INCLUDING CONSTRAINTS скопировал и ограничение границы legacy-секции
+        await conn.execute(f'ALTER TABLE {table} DROP CONSTRAINT {bound_check}')
+        for fk in foreign_keys:
+            await conn.execute(f'ALTER TABLE {table} ADD {fk["definition"]}')
+        if sequence:
+            # Иначе удаление legacy-секции по сроку хранения удалило бы и последовательность
+            await conn.execute(f'ALTER SEQUENCE {sequence} OWNED BY {table}.{key}')
+
+        if has_rows:
+            await conn.execute(
+                f"ALTER TABLE {table} ATTACH PARTITION {legacy} FOR VALUES FROM (MINVALUE) TO ('{boundary.isoformat()}')"
+            )
+            # Граница теперь обеспечивается самой секцией
+            await conn.execute(f'ALTER TABLE {legacy} DROP CONSTRAINT {bound_check}')
+        else:
+            await conn.execute(f'DROP TABLE {legacy}')
+
+        # Определения сняты до переименования и указывают на {table}: на родителе
+        # создаётся секционированный индекс, а готовый индекс legacy-секции к нему присоединяется
+        for index in indexes:
+            await conn.execute(
+                index['definition'].replace(f'INDEX {index["name"]} ', f'INDEX IF NOT EXISTS {index["name"]} ', 1)
+            )
+
+        await conn.execute(f'CREATE TABLE IF NOT EXISTS {table}_pdefault PARTITION OF {table} DEFAULT')
+
+    logger.info(
+        "Таблица %s переведена на помесячные секции (%s)", table,
+        f"старые строки — секция {legacy}" if has_rows else "была пустой"
+    )
+
+
+async def ensure_partitions(conn, table: str, months_ahead: int = MONTHS_AHEAD, today: date = None) -> List[str]:
+    """
+    Создаёт секции с текущего месяца на months_ahead вперёд, если диапазон ещё не
+    покрыт. Строки, успевшие попасть в секцию по умолчанию, переносятся в новую секцию.
+    """
+    today = today or date.today()
+    existing = await list_partitions(conn, table)
+    ranges = [(lower, upper) for _, lower, upper, is_default in existing if not is_default]
+    created = []
+    for offset in range(months_ahead + 1):
+        lower = add_months(month_start(today), offset)
+        upper = add_months(lower, 1)
+        lower_dt, upper_dt = datetime.combine(lower, datetime.min.time()), datetime.combine(upper, datetime.min.time())
+        overlaps = any(
+            (low is None or low < upper_dt) and (high is None or high > lower_dt)
+            for low, high in ranges
+        )
+        if overlaps:
+            continue
+        name = partition_name(table, lower)
+        async with conn.transaction():
+            stray = await conn.fetchval(
+                f'SELECT EXISTS (SELECT 1 FROM {table}_pdefault WHERE {PARTITION_COLUMN} >= $1 AND {PARTITION_COLUMN} < $2)',
+                lower_dt, upper_dt
+            )
+            if stray:
+                await conn.execute(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+                await conn.execute(
+                    f'''WITH moved AS (
+                            DELETE FROM {table}_pdefault
+                            WHERE {PARTITION_COLUMN} >= $1 AND {PARTITION_COLUMN} < $2
+                            RETURNING *
+                        )
+                        INSERT INTO {name} SELECT * FROM moved''',
+                    lower_dt, upper_dt
+                )
+                await conn.execute(
+                    f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                )
+            else:
+                await conn.execute(
+                    f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                )
+        ranges.append((lower_dt, upper_dt))
+        created.append(name)
+    return created
+
+
+async def drop_expired_partitions(conn, table: str, cutoff: datetime) -> Tuple[int, int]:
+    """
+    Отсоединяет и удаляет секции, целиком лежащие раньше cutoff.
+    Возвращает (число секций, оценка удалённых строк по pg_class.reltuples).
+    """
+    dropped = rows = 0
+    for name, _, upper, is_default in await list_partitions(conn, table):
+        if is_default or upper is None or upper > cutoff:
+            continue
+        estimate = await conn.fetchval('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass($1)', name)
+        async with conn.transaction():
+            await conn.execute(f'ALTER TABLE {table} DETACH PARTITION {name}')
+            await conn.execute(f'DROP TABLE {name}')
+        dropped += 1
+        rows += max(int(estimate or 0), 0)
+        logger.info("Удалена устаревшая секция %s (до %s)", name, upper)
+    return dropped, rows
+
+
+async def maintain_partitions(conn, months_ahead: int = MONTHS_AHEAD):
+    """Перевод таблиц на секции (один раз) и заготовка будущих месяцев"""
+    for table, key in PARTITIONED_TABLES.items():
+        if not await is_partitioned(conn, table):
+            await convert_to_partitioned(conn, table, key)
+        created = await ensure_partitions(conn, table, months_ahead)
+        if created:
+            logger.debug("Созданы секции %s: %s", table, ", ".join(created))
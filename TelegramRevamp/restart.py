@@ -5,9 +5,25 @@ import signal
 import subprocess
 import time
 
+from config import SHUTDOWN_DRAIN_TIMEOUT, SHUTDOWN_FLUSH_TIMEOUT
+
+# Бот по SIGTERM дожидается апдейтов в работе и сбрасывает очереди; SIGKILL — только если не успел
+STOP_DEADLINE = SHUTDOWN_DRAIN_TIMEOUT + SHUTDOWN_FLUSH_TIMEOUT + 5
+
+
+def is_running(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
 print("🛑 Останавливаем старый процесс бота...")
 
-# Найти и убить процесс
+pids = []
 try:
     result = subprocess.run(
         ["pgrep", "-f", "python3 main.py"],
@@ -16,19 +32,33 @@ try:
     )
     
     if result.stdout.strip():
-        pids = result.stdout.strip().split('\n')
-        for pid in pids:
+        for pid in result.stdout.strip().split('\n'):
             try:
-                os.kill(int(pid), signal.SIGKILL)
-                print(f"  ✓ Остановлен процесс {pid}")
-            except:
+                os.kill(int(pid), signal.SIGTERM)
+                pids.append(int(pid))
+                print(f"  … Процесс {pid} завершает работу")
+            except (ValueError, OSError):
                 pass
     else:
         print("  Процесс не найден")
 except Exception as e:
     print(f"  Ошибка: {e}")
 
-time.sleep(2)
+stopping = len(pids)
+deadline = time.monotonic() + STOP_DEADLINE
+while pids and time.monotonic() < deadline:
+    pids = [pid for pid in pids if is_running(pid)]
+    if pids:
+        time.sleep(0.5)
+
+for pid in pids:
+    try:
+        os.kill(pid, signal.SIGKILL)
+        print(f"  ⚠️ Процесс {pid} не остановился за {STOP_DEADLINE:.0f} с — убит")
+    except OSError:
+        pass
+if stopping and not pids:
+    print(f"  ✓ Остановлено процессов: {stopping}")
 
 print("🚀 Запускаем бота...")
 os.chdir("/workspaces/3r3r3r/TelegramRevamp")
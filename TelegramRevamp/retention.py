@@ -0,0 +1,175 @@
+"""
+Хранение данных
+Политики очистки для таблиц, которые только растут (уведомления, сообщения чатов,
+логи модерации, штрафы, скрытые заказы). Удаление идёт небольшими пачками по
+ключу (колонка возраста, первичный ключ) с паузой между пачками, чтобы не держать
+длинные блокировки; есть пробный прогон без удаления. У секционированных
+таблиц (partitioning.py) устаревшие месяцы удаляются целыми секциями.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionPolicy:
+    """
+    Что и когда удалять: строки table, у которых age_column старше max_age и
+    выполнено дополнительное условие condition (SQL над колонками таблицы).
+    """
+    __slots__ = ('name', 'table', 'key', 'age_column', 'max_age', 'condition', 'title')
+
+    def __init__(self, name: str, table: str, key: str, age_column: str, max_age: timedelta,
+                 condition: Optional[str] = None, title: str = ''):
+        self.name = name
+        self.table = table
+        self.key = key
+        self.age_column = age_column
+        self.max_age = max_age
+        self.condition = condition
+        self.title = title or name
+
+    def cutoff(self, now: datetime) -> datetime:
+        return now - self.max_age
+
+
+DEFAULT_POLICIES: List[RetentionPolicy] = [
+    RetentionPolicy(
+        'bot_messages', 'user_bot_messages', 'user_id', 'updated_at', timedelta(hours=48),
+        title='Последние сообщения бота (48 ч)',
+    ),
+    RetentionPolicy(
+        'notifications_read', 'notifications', 'notification_id', 'created_at', timedelta(days=30),
+        condition='is_read = TRUE',
+        title='Прочитанные уведомления (30 дн.)',
+    ),
+    RetentionPolicy(
+        'notifications', 'notifications', 'notification_id', 'created_at', timedelta(days=180),
+        title='Все уведомления (180 дн.)',
+    ),
+    RetentionPolicy(
+        'messages', 'messages', 'message_id', 'created_at', timedelta(days=365),
+        condition='''chat_id IN (
+            SELECT c.chat_id FROM chats c JOIN orders_all o ON o.order_id = c.order_id
+            WHERE o.status IN ('completed', 'cancelled') OR o.is_deleted = TRUE
+        )''',
+        title='Чаты закрытых заказов (365 дн.)',
+    ),
+    RetentionPolicy(
+        'moderation_logs', 'moderation_logs', 'log_id', 'created_at', timedelta(days=180),
+        title='Логи модерации (180 дн.)',
+    ),
+    RetentionPolicy(
+        'penalty_log', 'penalty_log', 'id', 'created_at', timedelta(days=365),
+        title='Журнал штрафов (365 дн.)',
+    ),
+    RetentionPolicy(
+        'hidden_orders', 'hidden_orders', 'id', 'hidden_at', timedelta(days=14),
+        condition='''NOT EXISTS (
+            SELECT 1 FROM orders_all o
+            WHERE o.order_id = hidden_orders.order_id AND o.status = 'open' AND o.is_deleted = FALSE
+        )''',
+        title='Скрытые заказы, ушедшие из ленты (14 дн.)',
+    ),
+]
+
+
+class RetentionEngine:
+    """
+    Прогон по всем политикам. За один прогон на политику — не больше max_batches
+    пачек по batch_size строк; остаток доберёт следующий прогон.
+    Метрики последнего прогона и накопительные итоги хранятся в памяти.
+    """
+
+    def __init__(self, db, policies: List[RetentionPolicy] = None, batch_size: int = 1000,
+                 batch_pause: float = 0.2, max_batches: int = 50, interval: int = 3600):
+        self.db = db
+        self.policies = list(policies if policies is not None else DEFAULT_POLICIES)
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.max_batches = max_batches
+        self.interval = interval
+        self.last_run: Dict[str, dict] = {}
+        self.last_run_at: Optional[datetime] = None
+        self.totals: Dict[str, int] = {}
+        self._run_lock = asyncio.Lock()
+
+    async def purge_policy(self, policy: RetentionPolicy, now: datetime = None) -> dict:
+        now = now or datetime.now()
+        cutoff = policy.cutoff(now)
+        started = time.monotonic()
+        batches = 0
+        after = None
+        capped = False
+        # Секционированные таблицы: сначала целые устаревшие секции, остаток — пачками
+        partitions, deleted = await self.db.retention_drop_partitions(policy, cutoff)
+        while True:
+            if batches >= self.max_batches:
+                capped = True
+                break
+            count, after = await self.db.retention_purge_batch(policy, cutoff, after, self.batch_size)
+            batches += 1
+            deleted += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause)
+        return {
+            'deleted': deleted,
+            'partitions_dropped': partitions,
+            'batches': batches,
+            'seconds': round(time.monotonic() - started, 3),
+            # Упёрлись в лимит пачек — строки ещё остались
+            'capped': capped,
+        }
+
+    async def run_once(self) -> Dict[str, dict]:
+        """Один прогон всех политик; ошибка в одной политике не останавливает остальные"""
+        async with self._run_lock:
+            now = datetime.now()
+            report = {}
+            try:
+                await self.db.maintain_partitions()
+            except Exception as e:
+                logger.warning(f"Не удалось подготовить секции таблиц событий: {e}")
+            for policy in self.policies:
+                try:
+                    report[policy.name] = await self.purge_policy(policy, now)
+                except Exception as e:
+                    logger.warning(f"Очистка {policy.name} не выполнена: {e}")
+                    report[policy.name] = {'deleted': 0, 'partitions_dropped': 0, 'batches': 0, 'seconds': 0, 'capped': False, 'error': str(e)}
+                    continue
+                self.totals[policy.name] = self.totals.get(policy.name, 0) + report[policy.name]['deleted']
+            self.last_run, self.last_run_at = report, now
+            purged = sum(item['deleted'] for item in report.values())
+            if purged:
+                logger.info(
+                    "🧹 Очистка старых данных: удалено %d строк (%s)", purged,
+                    ", ".join(f"{name}={item['deleted']}" for name, item in report.items() if item['deleted'])
+                )
+            return report
+
+    async def dry_run(self) -> Dict[str, dict]:
+        """Сколько строк удалил бы прогон прямо сейчас — без удаления"""
+        now = datetime.now()
+        report = {}
+        for policy in self.policies:
+            try:
+                report[policy.name] = await self.db.retention_preview(policy, policy.cutoff(now))
+            except Exception as e:
+                logger.debug(f"Не удалось оценить очистку {policy.name}: {e}")
+                report[policy.name] = {'rows': None, 'oldest': None, 'error': str(e)}
+        return report
+
+    async def run_forever(self):
+        """Фоновая задача: прогон раз в interval секунд"""
+        while True:
+            await asyncio.sleep(self.interval)
+            if not self.db.is_connected():
+                continue
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.warning(f"Прогон очистки старых данных завершился ошибкой: {e}")
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from chat_relay import ChatMessageWriter
+
+
+class FlakyDB:
+    """save_chat_messages отклоняет пачки, где есть «плохие» chat_id, или всё подряд"""
+
+    def __init__(self, bad_chats=(), down=False):
+        self.bad_chats = set(bad_chats)
+        self.down = down
+        self.saved = []
+        self.calls = 0
+        self.gate = None
+
+    def is_connected(self):
+        return not self.down
+
+    async def save_chat_messages(self, items):
+        self.calls += 1
+        if self.gate:
+            await self.gate.wait()
+        if self.down:
+            raise ConnectionError("database is down")
+        if any(item["chat_id"] in self.bad_chats for item in items):
+            raise ValueError("insert or update violates foreign key constraint")
+        self.saved.extend(items)
+
+
+def enqueue(writer, count, chat_id=1):
+    for number in range(count):
+        writer.enqueue(chat_id, sender_id=10, recipient_id=20, message=f"m{number}")
+
+
+async def test_bad_row_is_dropped_and_does_not_block_the_queue():
+    db = FlakyDB(bad_chats={666})
+    writer = ChatMessageWriter(db, batch_size=10)
+    enqueue(writer, 3)
+    enqueue(writer, 1, chat_id=666)
+    enqueue(writer, 3)
+
+    await writer.flush()
+
+    assert len(db.saved) == 6
+    assert all(item["chat_id"] == 1 for item in db.saved)
+    assert writer.dropped == 1
+    assert len(writer) == 0
+
+
+async def test_unavailable_db_keeps_messages_without_per_row_retries():
+    db = FlakyDB(down=True)
+    writer = ChatMessageWriter(db, batch_size=10)
+    enqueue(writer, 4)
+
+    for _ in range(20):
+        with pytest.raises(ConnectionError):
+            await writer.flush()
+    assert len(writer) == 4
+    assert writer.dropped == 0
+    assert db.calls == 20
+
+    db.down = False
+    await writer.flush()
+    assert len(db.saved) == 4
+
+
+async def test_connection_lost_during_row_retries_requeues_the_rest():
+    db = FlakyDB(bad_chats={666})
+    writer = ChatMessageWriter(db, batch_size=10)
+    enqueue(writer, 1, chat_id=666)
+    enqueue(writer, 3)
+    original = db.save_chat_messages
+
+    async def fail_after_bad_row(items):
+        if db.calls >= 2:
+            db.down = True
+        return await original(items)
+
+    db.save_chat_messages = fail_after_bad_row
+    with pytest.raises(ConnectionError):
+        await writer.flush()
+    assert writer.dropped == 1
+    assert len(writer) == 3
+
+
+async def test_requeued_batch_is_saved_first_after_recovery():
+    db = FlakyDB(down=True)
+    writer = ChatMessageWriter(db, batch_size=10)
+    enqueue(writer, 2)
+    with pytest.raises(ConnectionError):
+        await writer.flush()
+    enqueue(writer, 1, chat_id=2)
+
+    db.down = False
+    await writer.flush()
+    assert [item["chat_id"] for item in db.saved] == [1, 1, 2]
+
+
+def test_queue_is_bounded():
+    writer = ChatMessageWriter(FlakyDB(), max_pending=5)
+    enqueue(writer, 8)
+    assert len(writer) == 5
+    assert writer.dropped == 3
+    assert writer._pending[0]["message"] == "m3"
+
+
+async def test_read_flush_does_not_wait_for_a_stuck_flush():
+    db = FlakyDB()
+    db.gate = asyncio.Event()
+    writer = ChatMessageWriter(db, read_flush_timeout=0.05)
+    enqueue(writer, 2)
+    background = asyncio.create_task(writer.flush())
+    await asyncio.sleep(0)
+
+    assert await writer.flush_before_read() is False
+    assert await writer.flush_before_read() is False
+
+    db.gate.set()
+    await background
+    assert await writer.flush_before_read() is True
+    assert len(db.saved) == 2
+
+
+async def test_read_flush_saves_pending_messages():
+    db = FlakyDB()
+    writer = ChatMessageWriter(db)
+    enqueue(writer, 3)
+    assert await writer.flush_before_read() is True
+    assert len(db.saved) == 3
@@ -0,0 +1,68 @@
+import math
+
+from db_metrics import (
+    LATENCY_BUCKETS,
+    Histogram,
+    QueryMetrics,
+    _rows_from_status,
+    redact_params,
+)
+
+
+def test_histogram_buckets_are_upper_inclusive():
+    histogram = Histogram()
+    histogram.observe(0.0005)
+    histogram.observe(LATENCY_BUCKETS[0])
+    histogram.observe(0.003)
+    histogram.observe(60)
+    assert histogram.counts[0] == 2
+    assert histogram.counts[LATENCY_BUCKETS.index(0.005)] == 1
+    assert histogram.counts[-1] == 1
+    assert histogram.count == 4
+    assert math.isclose(histogram.total, 0.0005 + 0.001 + 0.003 + 60)
+
+
+def test_histogram_quantile_is_bucket_upper_bound():
+    histogram = Histogram()
+    assert histogram.quantile(0.5) == 0.0
+    for _ in range(90):
+        histogram.observe(0.002)
+    for _ in range(10):
+        histogram.observe(0.3)
+    assert histogram.quantile(0.5) == 0.0025
+    assert histogram.quantile(0.9) == 0.0025
+    assert histogram.quantile(0.95) == 0.5
+    histogram.observe(100)
+    assert histogram.quantile(1.0) == float("inf")
+
+
+def test_rows_from_status_and_redacted_params():
+    assert _rows_from_status("UPDATE 3") == 3
+    assert _rows_from_status("INSERT 0 1") == 1
+    assert _rows_from_status("BEGIN") == 0
+    assert redact_params([None, "secret", [1, 2], 5]) == "$1=NULL $2=<str:6> $3=<list:2> $4=<int>"
+
+
+def test_statement_names_hash_sql_not_call_order():
+    first, second = QueryMetrics(), QueryMetrics()
+    select_user = "SELECT * FROM users WHERE user_id = $1"
+    select_order = "SELECT * FROM orders WHERE order_id = $1"
+    a = first.statement_name("get_thing", select_user)
+    b = first.statement_name("get_thing", select_order)
+    assert second.statement_name("get_thing", select_order) == b
+    assert second.statement_name("get_thing", "SELECT *\n  FROM users WHERE user_id = $1") == a
+    assert a != b and a.startswith("get_thing#")
+    assert first.statements[a] == select_user
+
+
+def test_ddl_and_maintenance_share_one_series():
+    metrics = QueryMetrics()
+    assert (
+        metrics.statement_name("get_thing", "  create index if not exists ix ON t (a)")
+        == "get_thing"
+    )
+    assert metrics.statement_name("maintain_partitions", "SELECT 1 FROM pg_inherits") == (
+        "maintain_partitions"
+    )
+    assert metrics.statement_name("maintain_partitions", "SELECT 2") == "maintain_partitions"
+    assert metrics.statements["maintain_partitions"] == "SELECT 1 FROM pg_inherits"
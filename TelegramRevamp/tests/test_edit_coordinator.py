@@ -0,0 +1,107 @@
+import asyncio
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.methods import EditMessageText
+
+from edit_coordinator import NOT_MODIFIED_TEXT, EditCoordinator
+
+
+class FakeBot:
+    """Каждый вызов edit_message_text ждёт своего release; fail — ошибка ответа"""
+
+    def __init__(self):
+        self.calls = []
+        self.open = False
+        self.fail = None
+
+    @property
+    def sent(self):
+        return [text for text, _ in self.calls]
+
+    def release(self, index=None):
+        if index is None:
+            self.open = True
+        for _, gate in self.calls if index is None else [self.calls[index]]:
+            gate.set()
+
+    async def edit_message_text(
+        self, text, chat_id, message_id, reply_markup=None, parse_mode=None
+    ):
+        gate = asyncio.Event()
+        self.calls.append((text, gate))
+        if not self.open:
+            await gate.wait()
+        if self.fail:
+            raise self.fail
+
+
+def bad_request(message):
+    method = EditMessageText(text="x", chat_id=1, message_id=1)
+    return TelegramBadRequest(method=method, message=message)
+
+
+async def start_burst(coordinator, texts):
+    tasks = []
+    for text in texts:
+        tasks.append(asyncio.create_task(coordinator.edit_text(1, 10, text)))
+        await asyncio.sleep(0)
+    return tasks
+
+
+async def test_burst_is_coalesced_to_latest_text():
+    bot = FakeBot()
+    coordinator = EditCoordinator(bot)
+    tasks = await start_burst(coordinator, ["v1", "v2", "v3", "v4"])
+    bot.release()
+    assert await asyncio.gather(*tasks) == [True] * 4
+    assert bot.sent == ["v1", "v4"]
+    assert coordinator.counters["coalesced"] == 2
+    assert not coordinator._slots
+
+
+async def test_coalesced_callers_get_the_failure_of_the_edit_sent_for_them():
+    bot = FakeBot()
+    coordinator = EditCoordinator(bot)
+    tasks = await start_burst(coordinator, ["v1", "v2", "v3"])
+    bot.fail = bad_request("Bad Request: message to edit not found")
+    bot.release()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert bot.sent == ["v1", "v3"]
+    assert all(isinstance(result, TelegramBadRequest) for result in results)
+
+
+async def test_not_modified_counts_as_success():
+    bot = FakeBot()
+    bot.fail = bad_request(NOT_MODIFIED_TEXT)
+    bot.release()
+    assert await EditCoordinator(bot).edit_text(1, 10, "same") is True
+
+
+async def test_cancelled_sender_leaves_the_batch_to_other_callers():
+    bot = FakeBot()
+    coordinator = EditCoordinator(bot)
+    # v1 уходит в Telegram, v2 и v3 ждут пачкой; v2 отправляет v3 и отменяется
+    tasks = await start_burst(coordinator, ["v1", "v2", "v3"])
+    bot.release(0)
+    assert await tasks[0] is True
+    while len(bot.calls) < 2:
+        await asyncio.sleep(0)
+    tasks[1].cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await tasks[1]
+    bot.release()
+    assert await tasks[2] is True
+    assert bot.sent == ["v1", "v3", "v3"]
+
+
+async def test_cancelled_sender_follows_the_next_batch():
+    bot = FakeBot()
+    coordinator = EditCoordinator(bot)
+    tasks = await start_burst(coordinator, ["v1", "v2"])
+    tasks[0].cancel()
+    bot.release()
+    assert await tasks[1] is True
+    with pytest.raises(asyncio.CancelledError):
+        await tasks[0]
+    assert bot.sent == ["v1", "v2"]
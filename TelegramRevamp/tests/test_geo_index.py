@@ -0,0 +1,63 @@
+import random
+
+from geo_index import GeoGridIndex, format_distance, haversine_km
+
+
+def brute_force(points, lat, lon, max_km=None):
+    found = sorted(
+        (haversine_km(lat, lon, plat, plon), item_id) for item_id, (plat, plon) in points.items()
+    )
+    return [item for item in found if max_km is None or item[0] <= max_km]
+
+
+def make_index(rng, count, cell_deg=0.02):
+    index, points = GeoGridIndex(cell_deg), {}
+    for item_id in range(count):
+        # Город и несколько точек далеко за его пределами
+        if item_id % 50 == 0:
+            lat, lon = rng.uniform(40, 65), rng.uniform(20, 120)
+        else:
+            lat, lon = rng.gauss(55.75, 0.15), rng.gauss(37.62, 0.25)
+        index.add(item_id, lat, lon)
+        points[item_id] = (lat, lon)
+    return index, points
+
+
+def test_haversine_known_distance():
+    # Москва — Санкт-Петербург, около 634 км
+    assert abs(haversine_km(55.7558, 37.6173, 59.9311, 30.3609) - 634) < 5
+    assert haversine_km(10, 20, 10, 20) == 0
+
+
+def test_nearest_matches_brute_force():
+    rng = random.Random(11)
+    index, points = make_index(rng, 2000)
+    for _ in range(50):
+        lat, lon = rng.gauss(55.75, 0.5), rng.gauss(37.62, 0.8)
+        k = rng.choice([1, 5, 20])
+        assert index.nearest(lat, lon, k) == brute_force(points, lat, lon)[:k]
+    # Точка запроса далеко от всех заказов
+    assert index.nearest(-30, -60, 3) == brute_force(points, -30, -60)[:3]
+
+
+def test_within_matches_brute_force_after_moves_and_removals():
+    rng = random.Random(12)
+    index, points = make_index(rng, 1000)
+    for item_id in range(0, 1000, 7):
+        index.remove(item_id)
+        del points[item_id]
+    for item_id in range(1, 1000, 11):
+        if item_id in points:
+            points[item_id] = (rng.gauss(55.75, 0.15), rng.gauss(37.62, 0.25))
+            index.add(item_id, *points[item_id])
+    assert len(index) == len(points)
+    for _ in range(30):
+        lat, lon = rng.gauss(55.75, 0.2), rng.gauss(37.62, 0.3)
+        radius = rng.choice([0.5, 2, 10])
+        assert index.within(lat, lon, radius) == brute_force(points, lat, lon, radius)
+
+
+def test_format_distance():
+    assert format_distance(0.234) == "230 м"
+    assert format_distance(3.456) == "3.5 км"
+    assert format_distance(42.4) == "42 км"
@@ -0,0 +1,37 @@
+import time
+
+from aiogram.methods import GetMe, GetUpdates
+from aiogram.types import Update
+
+from handler_tracing import (
+    RECEIVED_KEY,
+    HandlerTracer,
+    UpdateFetchMiddleware,
+    UpdateReceivedMiddleware,
+)
+
+
+async def test_queue_wait_starts_at_get_updates_response():
+    tracer = HandlerTracer()
+    fetch = UpdateFetchMiddleware(tracer)
+    updates = [Update(update_id=7), Update(update_id=8)]
+
+    async def make_request(bot, method):
+        return updates if isinstance(method, GetUpdates) else None
+
+    before = time.perf_counter()
+    assert await fetch(make_request, None, GetUpdates()) is updates
+    await fetch(make_request, None, GetMe())
+    assert set(tracer.fetched) == {7, 8}
+
+    seen = {}
+
+    async def handler(event, data):
+        seen[event.update_id] = data[RECEIVED_KEY]
+
+    received = UpdateReceivedMiddleware(tracer)
+    await received(handler, updates[0], {})
+    await received(handler, Update(update_id=9), {})
+
+    assert before <= seen[7] < seen[9]
+    assert set(tracer.fetched) == {8}
@@ -0,0 +1,54 @@
+import random
+
+from leaderboard import LeaderboardService, SortedKeys
+from memory_database import MemoryDatabase
+
+
+def test_sorted_keys_matches_sorted_list():
+    rng = random.Random(7)
+    SortedKeys.LOAD, load = 4, SortedKeys.LOAD
+    try:
+        keys = SortedKeys(rng.sample(range(1000), 50))
+        expected = sorted(keys)
+        for _ in range(500):
+            key = rng.randrange(1000)
+            if key in expected:
+                keys.discard(key)
+                expected.remove(key)
+            else:
+                keys.add(key)
+                expected.append(key)
+                expected.sort()
+            assert list(keys) == expected
+            assert len(keys) == len(expected)
+            probe = rng.randrange(1000)
+            assert keys.index(probe) == sum(1 for k in expected if k < probe)
+    finally:
+        SortedKeys.LOAD = load
+
+
+async def complete_orders(db, executor_id, count):
+    for _ in range(count):
+        order_id = await db.create_order(1, 1000, "09:00", "ул. Тестовая", 1, "")
+        await db.assign_executor(order_id, executor_id)
+        await db.complete_order(order_id)
+
+
+async def test_top_active_24h_only_counts_executors():
+    db = MemoryDatabase()
+    await db.connect()
+    for user_id in (1, 2, 3, 4):
+        await db.create_user(user_id, f"user{user_id}", f"User {user_id}")
+    for user_id in (2, 3, 4):
+        await db.update_role(user_id, "executor")
+    service = LeaderboardService(db)
+    await service.ensure_loaded()
+
+    await complete_orders(db, 2, 1)
+    await complete_orders(db, 3, 3)
+    await db.update_role(3, "customer")
+
+    top = await service.top_active_24h(3)
+    assert [(item["user_id"], item["orders_24h"]) for item in top] == [(2, 1), (4, 0)]
+    sql_like = await db.get_top_active_executors_24h(3)
+    assert [row["user_id"] for row in sql_like] == [item["user_id"] for item in top]
@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import retention
+from memory_database import MemoryDatabase
+
+
+async def make_db():
+    db = MemoryDatabase()
+    await db.connect()
+    await db.create_user(1, "customer", "Customer")
+    return db
+
+
+async def test_permanent_delete_removes_archived_history():
+    db = await make_db()
+    order_id = await db.create_order(1, 1500, "09:00", "ул. Тестовая, 1", 2, "")
+    await db.log_moderation(order_id, 10, "price")
+    await db.delete_order(order_id)
+
+    moved = await db.archive_orders_batch(deleted_before=datetime.now() + timedelta(days=1))
+    assert moved["orders"] == 1
+    assert moved["moderation_logs"] == 1
+
+    await db.permanent_delete_order(order_id)
+    assert order_id not in db.orders_archive
+    assert not [log for log in db.moderation_logs_archive.values() if log["order_id"] == order_id]
+
+
+async def test_price_range_is_cheapest_first_with_keyset_pages():
+    db = await make_db()
+    for price in (3000, 1200, 1200, 500, 2500, 1800):
+        await db.create_order(1, price, "09:00", "ул. Тестовая, 1", 1, "")
+
+    rows = await db.get_orders_by_price_range(1000, 3000)
+    assert [row["price"] for row in rows] == [1200, 1200, 1800, 2500, 3000]
+
+    pages, after = [], None
+    while True:
+        page = await db.get_orders_by_price_range(1000, 3000, after=after, limit=2)
+        if not page:
+            break
+        pages.append([row["order_id"] for row in page])
+        after = (page[-1]["price"], page[-1]["order_id"])
+    assert [order_id for page in pages for order_id in page] == [row["order_id"] for row in rows]
+
+
+async def test_retention_purges_chats_of_archived_orders():
+    db = await make_db()
+    order_id = await db.create_order(1, 1500, "09:00", "ул. Тестовая, 1", 1, "")
+    await db.complete_order(order_id)
+    chat_id = await db.get_or_create_chat(order_id, 1, 2)
+    old = datetime.now() - timedelta(days=400)
+    await db.save_chat_messages(
+        [{"chat_id": chat_id, "sender_id": 1, "message": "hi", "created_at": old}]
+    )
+    await db.archive_orders_batch(completed_before=datetime.now() + timedelta(days=1))
+    assert order_id in db.orders_archive
+
+    policy = next(policy for policy in retention.DEFAULT_POLICIES if policy.name == "messages")
+    deleted, _ = await db.retention_purge_batch(policy, policy.cutoff(datetime.now()))
+    assert deleted == 1
+    assert not db.messages
@@ -0,0 +1,81 @@
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.methods import DeleteMessages
+
+from message_cleanup import DELETE_MESSAGES_LIMIT, MessageCleanup
+
+
+class FakeBot:
+    """Запоминает вызовы deleteMessages; errors — ответы на очередные вызовы"""
+
+    def __init__(self, cleanup=None):
+        self.calls = []
+        self.errors = []
+        self.cleanup = cleanup
+        self.seen_in_flight = []
+
+    async def delete_messages(self, chat_id, message_ids):
+        self.calls.append((chat_id, list(message_ids)))
+        if self.cleanup:
+            self.seen_in_flight.append(self.cleanup.is_scheduled(chat_id, message_ids[0]))
+        if self.errors:
+            raise self.errors.pop(0)
+
+
+def make_cleanup():
+    bot = FakeBot()
+    cleanup = MessageCleanup(bot, max_calls_per_second=10_000)
+    bot.cleanup = cleanup
+    return bot, cleanup
+
+
+async def test_duplicates_are_scheduled_once_and_chunked_by_limit():
+    bot, cleanup = make_cleanup()
+    cleanup.schedule_many(1, range(1, 251))
+    cleanup.schedule(1, 5)
+    cleanup.schedule(2, 7)
+    cleanup.schedule(2, 0)
+    assert len(cleanup) == 251
+    assert cleanup.is_scheduled(1, 5)
+
+    await cleanup.flush()
+    assert [(chat_id, len(ids)) for chat_id, ids in bot.calls] == [
+        (1, DELETE_MESSAGES_LIMIT),
+        (1, DELETE_MESSAGES_LIMIT),
+        (1, 50),
+        (2, 1),
+    ]
+    assert bot.calls[0][1][:3] == [1, 2, 3]
+    assert all(bot.seen_in_flight)
+    assert not cleanup.is_scheduled(1, 5)
+    assert cleanup.counters["deleted"] == 251
+    assert len(cleanup) == 0
+
+
+async def test_retry_after_requeues_the_chunk():
+    bot, cleanup = make_cleanup()
+    method = DeleteMessages(chat_id=1, message_ids=[1])
+    bot.errors.append(TelegramRetryAfter(method=method, message="Too Many Requests", retry_after=0))
+    cleanup.schedule_many(1, [1, 2, 3])
+
+    await cleanup.flush()
+    assert cleanup.counters["retry_after"] == 1
+    assert cleanup.is_scheduled(1, 2)
+
+    await cleanup.flush()
+    assert bot.calls == [(1, [1, 2, 3]), (1, [1, 2, 3])]
+    assert cleanup.counters["deleted"] == 3
+
+
+async def test_other_errors_drop_the_chunk():
+    bot, cleanup = make_cleanup()
+    method = DeleteMessages(chat_id=1, message_ids=[1])
+    bot.errors.append(
+        TelegramBadRequest(method=method, message="Bad Request: message can't be deleted")
+    )
+    cleanup.schedule_many(1, [1, 2])
+
+    await cleanup.flush()
+    await cleanup.flush()
+    assert len(bot.calls) == 1
+    assert cleanup.counters["failed"] == 2
+    assert not cleanup.is_scheduled(1, 1)
@@ -0,0 +1,64 @@
+from datetime import date, datetime
+
+import pytest
+
+from partitioning import add_months, list_partitions, month_start, partition_name
+
+
+@pytest.mark.parametrize(
+    "day, months, expected",
+    [
+        (date(2024, 1, 1), 1, date(2024, 2, 1)),
+        (date(2024, 11, 1), 2, date(2025, 1, 1)),
+        (date(2024, 12, 1), 1, date(2025, 1, 1)),
+        (date(2024, 1, 1), -1, date(2023, 12, 1)),
+        (date(2024, 3, 1), -14, date(2023, 1, 1)),
+        (date(2024, 5, 1), 0, date(2024, 5, 1)),
+    ],
+)
+def test_add_months(day, months, expected):
+    assert add_months(day, months) == expected
+
+
+def test_month_start_and_partition_name():
+    assert month_start(datetime(2024, 2, 29, 23, 59)) == date(2024, 2, 1)
+    assert partition_name("messages", date(2024, 2, 1)) == "messages_p202402"
+
+
+class FakeConn:
+    def __init__(self, rows):
+        self.rows = rows
+
+    async def fetch(self, sql, *args):
+        return self.rows
+
+
+async def test_list_partitions_parses_bounds():
+    conn = FakeConn(
+        [
+            {
+                "relname": "messages_legacy",
+                "bound": "FOR VALUES FROM (MINVALUE) TO ('2024-02-01 00:00:00')",
+            },
+            {
+                "relname": "messages_p202402",
+                "bound": "FOR VALUES FROM ('2024-02-01 00:00:00') TO ('2024-03-01 00:00:00')",
+            },
+            {
+                "relname": "messages_p202403",
+                "bound": "FOR VALUES FROM ('2024-03-01 00:00:00+03') TO (MAXVALUE)",
+            },
+            {"relname": "messages_pdefault", "bound": "DEFAULT"},
+            {"relname": "messages_odd", "bound": "FOR VALUES IN (1)"},
+        ]
+    )
+    partitions = await list_partitions(conn, "messages")
+    assert partitions[:2] == [
+        ("messages_legacy", None, datetime(2024, 2, 1), False),
+        ("messages_p202402", datetime(2024, 2, 1), datetime(2024, 3, 1), False),
+    ]
+    name, lower, upper, is_default = partitions[2]
+    assert (name, upper, is_default) == ("messages_p202403", None, False)
+    assert lower.replace(tzinfo=None) == datetime(2024, 3, 1) and lower.utcoffset() is not None
+    assert partitions[3] == ("messages_pdefault", None, None, True)
+    assert len(partitions) == 4
@@ -0,0 +1,93 @@
+from datetime import datetime, timedelta
+
+from memory_database import MemoryDatabase
+from retention import RetentionEngine, RetentionPolicy
+
+NOTIFICATIONS = RetentionPolicy(
+    "notifications", "notifications", "notification_id", "created_at", timedelta(days=180)
+)
+
+
+class RecordingDB(MemoryDatabase):
+    """MemoryDatabase, который запоминает курсоры пачек; fail — политики, падающие с ошибкой"""
+
+    def __init__(self, fail=(), dropped=(0, 0)):
+        super().__init__()
+        self.fail = set(fail)
+        self.dropped = dropped
+        self.cursors = []
+
+    async def retention_drop_partitions(self, policy, cutoff):
+        return self.dropped
+
+    async def retention_purge_batch(self, policy, cutoff, after=None, limit=1000):
+        if policy.name in self.fail:
+            raise RuntimeError("relation does not exist")
+        self.cursors.append(after)
+        return await super().retention_purge_batch(policy, cutoff, after, limit)
+
+
+async def make_db(old=0, fresh=0, **kwargs):
+    db = RecordingDB(**kwargs)
+    await db.connect()
+    for _ in range(old):
+        await db.create_notification(1, "old")
+    for row in db.notifications.values():
+        row["created_at"] -= timedelta(days=200)
+    for _ in range(fresh):
+        await db.create_notification(1, "fresh")
+    return db
+
+
+async def test_batches_are_capped_and_the_rest_waits_for_the_next_run():
+    db = await make_db(old=25, fresh=3)
+    engine = RetentionEngine(db, [NOTIFICATIONS], batch_size=10, batch_pause=0, max_batches=2)
+
+    first = await engine.run_once()
+    assert first["notifications"]["deleted"] == 20
+    assert first["notifications"]["batches"] == 2
+    assert first["notifications"]["capped"] is True
+
+    second = await engine.run_once()
+    assert second["notifications"]["deleted"] == 5
+    assert second["notifications"]["capped"] is False
+    assert engine.totals["notifications"] == 25
+    assert [row["message"] for row in db.notifications.values()] == ["fresh"] * 3
+
+
+async def test_keyset_cursor_advances_between_batches():
+    db = await make_db(old=7)
+    engine = RetentionEngine(db, batch_size=3, batch_pause=0)
+
+    result = await engine.purge_policy(NOTIFICATIONS)
+
+    assert result["deleted"] == 7
+    assert result["batches"] == 3
+    assert db.cursors[0] is None
+    assert db.cursors[1] < db.cursors[2]
+    assert db.cursors[2][1] == 6
+
+
+async def test_dropped_partitions_leave_one_empty_batch():
+    db = await make_db(dropped=(2, 5000))
+    engine = RetentionEngine(db, batch_size=10, batch_pause=0)
+
+    result = await engine.purge_policy(NOTIFICATIONS)
+
+    assert result["partitions_dropped"] == 2
+    assert result["deleted"] == 5000
+    assert result["batches"] == 1
+    assert db.cursors == [None]
+
+
+async def test_failing_policy_does_not_stop_the_others():
+    broken = RetentionPolicy("broken", "no_such_table", "id", "created_at", timedelta(days=1))
+    db = await make_db(old=4, fail={"broken"})
+    engine = RetentionEngine(db, [broken, NOTIFICATIONS], batch_size=10, batch_pause=0)
+
+    report = await engine.run_once()
+
+    assert "relation does not exist" in report["broken"]["error"]
+    assert report["notifications"]["deleted"] == 4
+    assert "broken" not in engine.totals
+    assert engine.last_run is report
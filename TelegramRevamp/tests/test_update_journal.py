@@ -0,0 +1,92 @@
+import asyncio
+import json
+
+from aiogram.types import Update
+
+from update_journal import REPLAY_KEY, UpdateJournal, UpdateJournalMiddleware
+
+
+def make_update(update_id: int) -> Update:
+    return Update(update_id=update_id)
+
+
+async def run_updates(middleware, update_ids, delays, data=None):
+    async def handler(event, handler_data):
+        await asyncio.sleep(delays.get(event.update_id, 0))
+
+    return [
+        asyncio.create_task(middleware(handler, make_update(update_id), dict(data or {})))
+        for update_id in update_ids
+    ]
+
+
+async def test_watermark_waits_for_the_lowest_unfinished_update():
+    journal = UpdateJournal("")
+    journal.begin(make_update(10))
+    journal.begin(make_update(11))
+    journal.begin(make_update(12))
+    journal.finish(12)
+    journal.finish(11)
+    assert journal.watermark() == 9
+    journal.finish(10)
+    assert journal.watermark() == 12
+    assert journal.is_duplicate(12)
+    assert not journal.is_duplicate(13)
+
+
+async def test_out_of_order_completions_survive_restart(tmp_path):
+    path = str(tmp_path / "journal.json")
+    journal = UpdateJournal(path, drain_timeout=0.05)
+    middleware = UpdateJournalMiddleware(journal)
+    # 100 застревает, 101 и 102 успевают завершиться после него
+    tasks = await run_updates(middleware, [99, 100, 101, 102], {100: 10})
+    await asyncio.sleep(0.01)
+
+    assert await journal.drain() is False
+    await journal.save(force=True)
+    for task in tasks:
+        task.cancel()
+
+    resumed = UpdateJournal(path)
+    resumed.load()
+    assert resumed.resumed_from == 99
+    assert list(resumed._pending) == [100]
+    # Telegram пришлёт 100–102 заново: выполнить нужно только прерванный 100
+    assert resumed.is_duplicate(99)
+    assert resumed.is_duplicate(101)
+    assert resumed.is_duplicate(102)
+    assert not resumed.is_duplicate(103)
+
+    replay_middleware = UpdateJournalMiddleware(resumed)
+    handled = []
+
+    async def handler(event, data):
+        handled.append(event.update_id)
+
+    await replay_middleware(handler, make_update(100), {REPLAY_KEY: True})
+    for update_id in (100, 101, 102, 103):
+        await replay_middleware(handler, make_update(update_id), {})
+    assert handled == [100, 103]
+    assert resumed.watermark() == 103
+
+
+async def test_stale_journal_is_ignored(tmp_path):
+    path = str(tmp_path / "journal.json")
+    journal = UpdateJournal(path)
+    journal.begin(make_update(5))
+    journal.finish(5)
+    await journal.save(force=True)
+
+    resumed = UpdateJournal(path)
+    resumed.load()
+    assert resumed.resumed_from == 5
+
+    with open(path, encoding="utf-8") as f:
+        state = json.load(f)
+    state["saved_at"] = 0
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    stale = UpdateJournal(path)
+    stale.load()
+    assert stale.resumed_from is None
+    assert not stale.is_duplicate(5)
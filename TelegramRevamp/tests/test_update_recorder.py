@@ -0,0 +1,151 @@
+import json
+
+from aiogram.types import Update
+
+from update_recorder import Anonymizer, UpdateRecorder, UpdateRecordingMiddleware
+
+REAL_USER_ID = 482913377
+REAL_CONTACT_ID = 715530021
+REAL_FORWARD_ID = 390011224
+SECRETS = [
+    str(REAL_USER_ID),
+    str(REAL_CONTACT_ID),
+    str(REAL_FORWARD_ID),
+    "Алексей",
+    "Смирнов",
+    "alexey_smirnov",
+    "Мария",
+    "Иванова",
+    "Пётр",
+    "petr_fw",
+    "79161234567",
+    "+7 916 123-45-67",
+]
+
+
+def sample_update() -> Update:
+    user = {
+        "id": REAL_USER_ID,
+        "is_bot": False,
+        "first_name": "Алексей",
+        "last_name": "Смирнов",
+        "username": "alexey_smirnov",
+    }
+    return Update.model_validate(
+        {
+            "update_id": 1001,
+            "message": {
+                "message_id": 17,
+                "date": 1_700_000_000,
+                "chat": {
+                    "id": REAL_USER_ID,
+                    "type": "private",
+                    "first_name": "Алексей",
+                    "username": "alexey_smirnov",
+                },
+                "from": user,
+                "forward_from": {
+                    "id": REAL_FORWARD_ID,
+                    "is_bot": False,
+                    "first_name": "Пётр",
+                    "username": "petr_fw",
+                },
+                "contact": {
+                    "phone_number": "79161234567",
+                    "first_name": "Мария",
+                    "last_name": "Иванова",
+                    "user_id": REAL_CONTACT_ID,
+                    "vcard": "BEGIN:VCARD\nFN:Мария Иванова\nEND:VCARD",
+                },
+                "text": f"позвоните +7 916 123-45-67, мой id {REAL_USER_ID}",
+            },
+        }
+    )
+
+
+async def test_recorded_update_has_no_personal_data():
+    recorder = UpdateRecorder("unused.jsonl", salt="test")
+    middleware = UpdateRecordingMiddleware(recorder)
+
+    async def handler(event, data):
+        return "ok"
+
+    assert await middleware(handler, sample_update(), {}) == "ok"
+    assert len(recorder) == 1
+    line = recorder._buffer[0]
+    for secret in SECRETS:
+        assert secret not in line, secret
+    recorded = json.loads(line)["u"]
+    # Запись по-прежнему разбирается как апдейт для проигрывания
+    update = Update.model_validate(recorded)
+    assert update.message.from_user.id == update.message.chat.id != REAL_USER_ID
+    assert update.message.contact.user_id not in (REAL_CONTACT_ID, None)
+
+
+def test_alias_is_stable_and_keeps_sign():
+    anonymizer = Anonymizer("salt")
+    assert anonymizer.alias(REAL_USER_ID) == anonymizer.alias(REAL_USER_ID)
+    assert anonymizer.alias(REAL_USER_ID) != REAL_USER_ID
+    assert anonymizer.alias(-100123456789) < 0
+    assert Anonymizer("salt").alias(REAL_USER_ID) == anonymizer.alias(REAL_USER_ID)
+    assert Anonymizer("other").alias(REAL_USER_ID) != anonymizer.alias(REAL_USER_ID)
+
+
+def test_callback_data_ids_follow_aliases():
+    anonymizer = Anonymizer("salt")
+    scrubbed = anonymizer.scrub(
+        {
+            "callback_query": {
+                "from": {"id": REAL_USER_ID, "is_bot": False, "first_name": "Алексей"},
+                "data": f"accept_executor_12_{REAL_USER_ID}",
+            }
+        }
+    )
+    alias = anonymizer.alias(REAL_USER_ID)
+    assert scrubbed["callback_query"]["data"] == f"accept_executor_12_{alias}"
+
+
+def test_free_text_is_masked_but_commands_and_buttons_are_kept():
+    anonymizer = Anonymizer("salt")
+    scrubbed = anonymizer.scrub(
+        [
+            {"message": {"text": "ул. Ленина, 15 кв 3"}},
+            {"message": {"text": "/start ref_42"}},
+            {"message": {"text": "❌ Отмена"}},
+            {"message": {"caption": "Фото двора"}},
+            {"callback_query": {"data": "take_order_12"}},
+        ]
+    )
+    assert scrubbed[0]["message"]["text"] == "xx. xxxxxx, 15 xx 3"
+    assert scrubbed[1]["message"]["text"] == "/start ref_42"
+    assert scrubbed[2]["message"]["text"] == "❌ Отмена"
+    assert scrubbed[3]["message"]["caption"] == "xxxx xxxxx"
+    assert scrubbed[4]["callback_query"]["data"] == "take_order_12"
+
+
+async def test_private_chat_updates_are_masked_entirely():
+    recorder = UpdateRecorder("unused.jsonl", salt="test")
+    recorder.private_states.add("Chat:messaging")
+    middleware = UpdateRecordingMiddleware(recorder)
+
+    async def handler(event, data):
+        return "ok"
+
+    update = Update.model_validate(
+        {
+            "update_id": 1002,
+            "message": {
+                "message_id": 18,
+                "date": 1_700_000_000,
+                "chat": {"id": REAL_USER_ID, "type": "private"},
+                "caption": "/start ключи под ковриком",
+                "photo": [
+                    {"file_id": "AgACAgIAA", "file_unique_id": "AQAD", "width": 1, "height": 1}
+                ],
+            },
+        }
+    )
+    await middleware(handler, update, {"raw_state": "Chat:messaging"})
+    message = json.loads(recorder._buffer[0])["u"]["message"]
+    assert message["caption"] == "/xxxxx xxxxx xxx xxxxxxxx"
+    assert message["photo"][0]["file_id"] == "xxxxxxxxx"
@@ -0,0 +1,41 @@
+from memory_database import MemoryDatabase
+from username_index import UsernameIndex
+
+
+async def make_index(users):
+    db = MemoryDatabase()
+    await db.connect()
+    for user_id, username in users:
+        await db.create_user(user_id, username, username.title())
+    return db, UsernameIndex(db)
+
+
+async def test_prefix_completion_is_case_insensitive():
+    db, index = await make_index([(1, "Alice"), (2, "alfred"), (3, "bob")])
+    await index.ensure_loaded()
+    assert index.complete("AL") == ["alfred", "Alice"]
+    assert index.complete("@bo") == ["bob"]
+    assert index.complete("z") == []
+
+
+async def test_user_banned_before_startup_stays_out_after_rename():
+    db, _ = await make_index([(1, "alice"), (2, "mallory")])
+    await db.ban_user(2, "spam")
+    index = UsernameIndex(db)
+    await index.ensure_loaded()
+    assert index.complete("mal") == []
+
+    await db.create_user(2, "mallory_new", "Mallory")
+    assert index.complete("mal") == []
+
+    await db.unban_user(2)
+    assert index.complete("mal") == ["mallory_new"]
+
+
+async def test_rename_moves_username_to_new_owner():
+    db, index = await make_index([(1, "alice")])
+    await index.ensure_loaded()
+    await db.create_user(1, "alice2", "Alice")
+    await db.create_user(2, "alice", "Other")
+    assert index.complete("alice") == ["alice", "alice2"]
+    assert index._owners["alice"][0] == 2
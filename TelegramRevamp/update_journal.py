@@ -0,0 +1,277 @@
+"""
+Журнал обработанных апдейтов
+Бот больше не выбрасывает накопившиеся апдейты при запуске: Telegram отдаёт
+их заново, пока следующий getUpdates не подтвердил их offset'ом. Журнал
+хранит водяной знак — наибольший update_id, до которого включительно всё
+обработано, — id апдейтов выше него, которые успели завершиться (апдейты
+обрабатываются параллельно и завершаются не по порядку), и апдейты, которые
+были в работе на момент остановки:
+
+- внешний middleware отмечает начало и конец обработки каждого апдейта и
+  пропускает повторы (update_id не выше сохранённого водяного знака или
+  среди завершённых выше него);
+- состояние пишется в файл атомарно (временный файл + os.replace) раз в
+  save_interval секунд и при остановке;
+- при остановке (SIGTERM) хук shutdown ждёт завершения апдейтов в работе
+  до drain_timeout секунд; не успевшие сохраняются и при следующем запуске
+  проигрываются первыми.
+
+Доставка «хотя бы один раз»: апдейт, прерванный по истечении срока, при
+повторе может выполниться дважды.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+# Telegram начинает нумерацию заново со случайного id, если апдейтов не было неделю:
+# сохранённый водяной знак старше этого срока уже ничего не отсекает
+OFFSET_MAX_AGE = 6 * 24 * 3600
+# Ключ данных апдейта, которым помечены апдейты, проигрываемые из журнала
+REPLAY_KEY = "journal_replay"
+
+
+class UpdateJournal:
+    def __init__(
+        self,
+        path: str,
+        drain_timeout: float = 20.0,
+        save_interval: float = 5.0,
+        replay_concurrency: int = 8,
+    ):
+        # Пустой путь — без файла: только ожидание апдейтов в работе при остановке
+        self.path = path
+        self.drain_timeout = drain_timeout
+        self.save_interval = save_interval
+        self.replay_concurrency = replay_concurrency
+        self.resumed_from: Optional[int] = None
+        self.skipped = 0
+        self.replayed = 0
+        self._in_flight: Dict[int, Update] = {}
+        self._max_done: Optional[int] = None
+        # Завершённые апдейты выше водяного знака: ниже них остался незавершённый
+        self._completed = set()
+        # Апдейты из журнала, ещё не начатые повтором (update_id → JSON)
+        self._pending: Dict[int, dict] = {}
+        self._replaying = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._stopping = False
+        self._last_saved = None
+
+    def install(self, dp):
+        dp.update.outer_middleware(UpdateJournalMiddleware(self))
+        dp.startup.register(self._on_startup)
+        dp.shutdown.register(self._on_shutdown)
+
+    def load(self):
+        """Водяной знак и незавершённые апдейты прошлого запуска"""
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning(f"Журнал апдейтов {self.path} не прочитан: {e}")
+            return
+        offset = state.get("offset")
+        if offset is not None and time.time() - state.get("saved_at", 0) < OFFSET_MAX_AGE:
+            self.resumed_from = offset
+        for raw in state.get("pending", []):
+            update_id = raw.get("update_id")
+            if isinstance(update_id, int) and (
+                self.resumed_from is None or update_id > self.resumed_from
+            ):
+                self._pending[update_id] = raw
+        if self.resumed_from is not None:
+            self._completed = {
+                update_id
+                for update_id in state.get("done", [])
+                if isinstance(update_id, int) and update_id > self.resumed_from
+            }
+            if self._completed:
+                self._max_done = max(self._completed)
+        self._last_saved = self._state_key()
+        logger.info(
+            f"📒 Журнал апдейтов: продолжаем после {self.resumed_from}, "
+            f"к повтору {len(self._pending)}"
+        )
+
+    def __len__(self):
+        return len(self._in_flight) + len(self._pending)
+
+    def watermark(self) -> Optional[int]:
+        """Наибольший update_id, до которого включительно все апдейты обработаны"""
+        done = self._max_done if self._max_done is not None else self.resumed_from
+        unfinished = self._in_flight.keys() | self._pending.keys()
+        if unfinished:
+            below = min(unfinished) - 1
+            done = below if done is None else min(done, below)
+        if self.resumed_from is not None and done < self.resumed_from:
+            return self.resumed_from
+        return done
+
+    def is_duplicate(self, update_id: int) -> bool:
+        watermark = self.watermark()
+        return (
+            (watermark is not None and update_id <= watermark)
+            or update_id in self._completed
+            or update_id in self._in_flight
+            or update_id in self._replaying
+        )
+
+    def begin(self, update: Update):
+        self._in_flight[update.update_id] = update
+        self._pending.pop(update.update_id, None)
+        self._idle.clear()
+
+    def finish(self, update_id: int):
+        self._in_flight.pop(update_id, None)
+        if self._max_done is None or update_id > self._max_done:
+            self._max_done = update_id
+        self._completed.add(update_id)
+        if not self._in_flight:
+            self._idle.set()
+        if not self._pending and not self._in_flight:
+            self._completed.clear()
+
+    def completed_above_watermark(self) -> list:
+        watermark = self.watermark()
+        if watermark is None:
+            return sorted(self._completed)
+        self._completed = {update_id for update_id in self._completed if update_id > watermark}
+        return sorted(self._completed)
+
+    def _state_key(self):
+        return (
+            self.watermark(),
+            tuple(self._in_flight),
+            tuple(self._pending),
+            tuple(self.completed_above_watermark()),
+        )
+
+    def _snapshot(self) -> dict:
+        pending = list(self._pending.values())
+        for update in self._in_flight.values():
+            try:
+                pending.append(update.model_dump(mode="json", exclude_none=True))
+            except Exception as e:
+                logger.debug(f"Апдейт {update.update_id} не сериализован для журнала: {e}")
+        return {
+            "offset": self.watermark(),
+            "done": self.completed_above_watermark(),
+            "saved_at": round(time.time(), 3),
+            "pending": pending,
+        }
+
+    def _write(self, state: dict):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    async def save(self, force: bool = False):
+        if not self.path:
+            return
+        key = self._state_key()
+        if not force and key == self._last_saved:
+            return
+        try:
+            await asyncio.to_thread(self._write, self._snapshot())
+            self._last_saved = key
+        except OSError as e:
+            logger.warning(f"Не удалось записать журнал апдейтов {self.path}: {e}")
+
+    async def run(self):
+        """Фоновая задача: периодическое сохранение водяного знака"""
+        while True:
+            await asyncio.sleep(self.save_interval)
+            await self.save()
+
+    async def _replay_one(self, bot, dispatcher, semaphore: asyncio.Semaphore, raw: dict):
+        async with semaphore:
+            if self._stopping:
+                return
+            try:
+                update = Update.model_validate(raw, context={"bot": bot})
+            except Exception as e:
+                logger.warning(f"Апдейт {raw.get('update_id')} из журнала не разобран: {e}")
+                self._pending.pop(raw.get("update_id"), None)
+                return
+            try:
+                await dispatcher.feed_update(bot, update, **{REPLAY_KEY: True})
+                self.replayed += 1
+            except Exception as e:
+                logger.warning(f"Повтор апдейта {update.update_id} завершился ошибкой: {e}")
+
+    async def _replay(self, bot, dispatcher):
+        semaphore = asyncio.Semaphore(self.replay_concurrency)
+        raws = [self._pending[update_id] for update_id in sorted(self._pending)]
+        await asyncio.gather(*(self._replay_one(bot, dispatcher, semaphore, raw) for raw in raws))
+        logger.info(f"📒 Повторено апдейтов из журнала: {self.replayed}")
+
+    async def _on_startup(self, bot, dispatcher):
+        self._stopping = False
+        if self._pending:
+            # Telegram может прислать эти же апдейты ещё раз, если не успел получить подтверждение
+            self._replaying.update(self._pending)
+            asyncio.create_task(self._replay(bot, dispatcher))
+
+    async def drain(self) -> bool:
+        """Ждёт завершения апдейтов в работе; False — не успели за drain_timeout"""
+        self._stopping = True
+        # Задачи, созданные polling'ом перед остановкой, ещё не дошли до middleware
+        await asyncio.sleep(0)
+        if self._in_flight:
+            logger.info(f"⏳ Дожидаемся апдейтов в работе: {len(self._in_flight)}")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=self.drain_timeout)
+            return True
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"⚠️ За {self.drain_timeout:.0f} с не завершены апдейты {sorted(self._in_flight)}: "
+                f"они сохранены в журнал и будут повторены при запуске"
+            )
+            return False
+
+    async def _on_shutdown(self):
+        await self.drain()
+        await self.save(force=True)
+        logger.info(
+            f"📒 Журнал апдейтов сохранён: водяной знак {self.watermark()}, к повтору {len(self)}"
+        )
+
+
+class UpdateJournalMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: пропуск повторов и учёт апдейтов в работе"""
+
+    def __init__(self, journal: UpdateJournal):
+        self.journal = journal
+
+    async def __call__(
+        self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]
+    ):
+        if not data.get(REPLAY_KEY) and self.journal.is_duplicate(event.update_id):
+            self.journal.skipped += 1
+            logger.debug(f"Апдейт {event.update_id} уже обработан до перезапуска — пропущен")
+            return None
+        self.journal.begin(event)
+        try:
+            return await handler(event, data)
+        finally:
+            self.journal.finish(event.update_id)
@@ -0,0 +1,239 @@
+"""
+Запись входящих апдейтов
+Внешний middleware диспетчера складывает апдейты в очередь, фоновая задача
+дописывает их в файл JSON Lines (с .gz — сжатый; каждый сброс — отдельный
+gzip-блок, файл остаётся дописываемым). Перед записью апдейт обезличивается:
+id пользователей и чатов заменяются стабильными псевдонимами (HMAC от соли),
+имена и username — производными от псевдонима, телефоны вырезаются,
+координаты огрубляются. Свободный текст и подписи заменяются заглушкой той же
+длины (буквы → x, цифры и знаки остаются, чтобы проверки формата вели себя так же);
+команды, тексты кнопок и callback_data сохраняются. Апдейты переписки между
+пользователями (состояния из private_states) маскируются целиком, вместе с file_id.
+Записи проигрываются через loadtest/replay.py.
+"""
+import asyncio
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Псевдонимы лежат в отдельном диапазоне, не пересекаются с настоящими id Telegram
+ANON_ID_BASE = 9_000_000_000
+ANON_ID_SPAN = 900_000_000
+
+# Ключи апдейта, под которыми лежат пользователи и чаты. Апдейт пишется с алиасами
+# Bot API ('from'); 'from_user' — имя поля aiogram, на случай дампа без by_alias
+PERSON_KEYS = {
+    'from', 'from_user', 'chat', 'user', 'sender_chat', 'forward_from', 'forward_from_chat',
+    'new_chat_member', 'new_chat_members', 'old_chat_member', 'left_chat_member', 'via_bot',
+    'contact',
+}
+NAME_KEYS = ('first_name', 'last_name', 'title')
+
+PHONE_RE = re.compile(r'\+?\d[\d\s\-()]{8,}\d')
+NUMBER_RE = re.compile(r'-?\d{5,}')
+FAKE_PHONE = '+70000000000'
+
+# Тексты кнопок reply-клавиатур: хендлеры сравнивают текст сообщения с ними целиком
+KEEP_TEXTS = frozenset({'❌ Отмена'})
+FREE_TEXT_KEYS = ('text', 'caption', 'query')
+FILE_ID_KEYS = ('file_id', 'file_unique_id')
+
+
+def mask_text(text: str) -> str:
+    """Заглушка той же длины: буквы заменяются, цифры, пробелы и знаки остаются"""
+    return ''.join('x' if char.isalpha() else char for char in text)
+
+
+class Anonymizer:
+    """Стабильная замена id: один и тот же настоящий id всегда даёт один псевдоним"""
+
+    def __init__(self, salt: str, keep_texts=KEEP_TEXTS):
+        self._key = salt.encode()
+        self.keep_texts = frozenset(keep_texts)
+        self._ids: Dict[int, int] = {}
+        self._taken = set()
+
+    def alias(self, real_id: int) -> int:
+        anon = self._ids.get(real_id)
+        if anon is not None:
+            return anon
+        digest = hmac.new(self._key, str(abs(real_id)).encode(), hashlib.blake2b).digest()
+        anon = ANON_ID_BASE + int.from_bytes(digest[:8], 'big') % ANON_ID_SPAN
+        while anon in self._taken:
+            anon += 1
+        self._taken.add(anon)
+        # Знак сохраняем: отрицательные id — группы и каналы
+        anon = -anon if real_id < 0 else anon
+        self._ids[real_id] = anon
+        return anon
+
+    def _person(self, person: dict):
+        if person.get('is_bot'):
+            return
+        real_id = person.get('id')
+        if isinstance(real_id, int):
+            person['id'] = self.alias(real_id)
+        anon_id = person.get('id')
+        # У контакта id лежит в user_id; его подменит scrub, здесь только псевдоним для имени
+        if anon_id is None and isinstance(person.get('user_id'), int):
+            anon_id = self.alias(person['user_id'])
+        suffix = abs(anon_id or 0) % 1_000_000
+        # vCard контакта повторяет имя и телефон
+        person.pop('vcard', None)
+        for key in NAME_KEYS:
+            if person.get(key):
+                person[key] = f'{key.split("_")[0].title()}{suffix}'
+        if person.get('username'):
+            person['username'] = f'user{suffix}'
+
+    def _text(self, text: str) -> str:
+        text = PHONE_RE.sub(FAKE_PHONE, text)
+        # id пользователей в тексте и callback_data (accept_executor_<заказ>_<id>)
+        return NUMBER_RE.sub(lambda m: str(self._ids.get(int(m.group()), m.group())), text)
+
+    def _free_text(self, text: str, private: bool) -> str:
+        text = self._text(text)
+        if not private and (text.startswith('/') or text in self.keep_texts):
+            return text
+        return mask_text(text)
+
+    def scrub(self, value: Any, key: Optional[str] = None, private: bool = False) -> Any:
+        """
+        Обезличивает апдейт на месте. private — переписка между пользователями:
+        маскируются и команды с кнопками, и идентификаторы вложений.
+        """
+        if isinstance(value, dict):
+            if key in PERSON_KEYS:
+                self._person(value)
+            if 'phone_number' in value:
+                value['phone_number'] = FAKE_PHONE
+            if key == 'location':
+                for coordinate in ('latitude', 'longitude'):
+                    if isinstance(value.get(coordinate), float):
+                        value[coordinate] = round(value[coordinate], 2)
+            for child_key, child in value.items():
+                if child_key in FREE_TEXT_KEYS:
+                    if isinstance(child, str):
+                        value[child_key] = self._free_text(child, private)
+                elif child_key == 'data':
+                    if isinstance(child, str):
+                        value[child_key] = self._text(child)
+                elif child_key in FILE_ID_KEYS and private and isinstance(child, str):
+                    value[child_key] = mask_text(child)
+                elif child_key in ('user_id', 'chat_id') and isinstance(child, int):
+                    value[child_key] = self.alias(child)
+                elif isinstance(child, (dict, list)):
+                    self.scrub(child, child_key, private)
+        elif isinstance(value, list):
+            for item in value:
+                self.scrub(item, key, private)
+        return value
+
+
+class UpdateRecorder:
+    """
+    Буфер апдейтов и запись в файл раз в flush_interval секунд или при
+    накоплении flush_size записей. Ошибка записи не мешает обработке апдейтов.
+    """
+
+    def __init__(self, path: str, salt: str = '', flush_interval: float = 1.0, flush_size: int = 500):
+        self.path = path
+        # Без соли псевдонимы стабильны только в пределах одного запуска
+        self.anonymizer = Anonymizer(salt or os.urandom(16).hex())
+        # Состояния FSM переписки между пользователями: их апдейты маскируются целиком
+        self.private_states = set()
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._buffer: List[str] = []
+        self._wakeup = asyncio.Event()
+        self.recorded = 0
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def record(self, update: dict, private: bool = False):
+        try:
+            scrubbed = self.anonymizer.scrub(update, private=private)
+        except Exception as e:
+            logger.debug(f"Апдейт не записан: {e}")
+            return
+        self._buffer.append(json.dumps(
+            {'t': round(time.time(), 3), 'u': scrubbed}, ensure_ascii=False, separators=(',', ':')
+        ))
+        if len(self._buffer) >= self.flush_size:
+            self._wakeup.set()
+
+    def middleware(self) -> 'UpdateRecordingMiddleware':
+        return UpdateRecordingMiddleware(self)
+
+    def _write(self, lines: List[str]):
+        data = ''.join(line + '\n' for line in lines)
+        if self.path.endswith('.gz'):
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(data)
+        else:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(data)
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        lines, self._buffer = self._buffer, []
+        try:
+            await asyncio.to_thread(self._write, lines)
+            self.recorded += len(lines)
+        except OSError as e:
+            logger.warning(f"Не удалось записать апдейты в {self.path}: {e}")
+
+    async def run(self):
+        logger.info(f"📼 Запись апдейтов в {self.path}")
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
+
+
+def read_records(path: str):
+    """(время, апдейт) из файла записи по порядку; битые строки пропускаются"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            yield record['t'], record['u']
+
+
+class UpdateRecordingMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: копия апдейта уходит в буфер записи"""
+
+    def __init__(self, recorder: UpdateRecorder):
+        self.recorder = recorder
+
+    async def __call__(self, handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]], event, data: Dict[str, Any]):
+        try:
+            # raw_state кладёт FSM-middleware диспетчера, он стоит раньше пользовательских
+            private = data.get('raw_state') in self.recorder.private_states
+            self.recorder.record(
+                event.model_dump(mode='json', exclude_none=True, by_alias=True), private=private
+            )
+        except Exception as e:
+            logger.debug(f"Апдейт не сериализован для записи: {e}")
+        return await handler(event, data)
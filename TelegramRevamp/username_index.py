@@ -0,0 +1,117 @@
+"""
+Индекс username в памяти
+Префиксное автодополнение по никам активных пользователей без запросов к БД.
+Обновляется событиями Database (смена ника, бан/разбан), подсказки
+«возможно, вы имели в виду» дополняются триграммным поиском в PostgreSQL.
+"""
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class UsernameIndex:
+    """
+    Отсортированный массив ключей lower(username) вместо узлового trie: тот же
+    префиксный поиск (bisect к началу диапазона и проход, пока ключ начинается
+    с префикса), но без объекта на каждый символ — 500k ников укладываются в десятки МБ.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._keys: List[str] = []
+        self._owners: Dict[str, Tuple[int, str]] = {}
+        self._by_user: Dict[int, str] = {}
+        self._banned = set()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        db.subscribe(self.handle_event)
+
+    async def ensure_loaded(self):
+        if self._loaded or not self.db.is_connected():
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            rows = await self.db.get_active_usernames()
+            owners = {row['username'].lower(): (row['user_id'], row['username']) for row in rows}
+            self._owners = owners
+            self._by_user = {user_id: key for key, (user_id, _) in owners.items()}
+            self._keys = sorted(owners)
+            self._loaded = True
+            logger.debug("Индекс username загружен: %d ников", len(self._keys))
+
+    # ==================== ПОИСК ====================
+
+    def complete(self, prefix: str, limit: int = 5) -> List[str]:
+        """Ники, начинающиеся с prefix (без учёта регистра), в алфавитном порядке"""
+        prefix = prefix.strip().lstrip('@').lower()
+        if not prefix:
+            return []
+        result = []
+        idx = bisect_left(self._keys, prefix)
+        while idx < len(self._keys) and len(result) < limit:
+            key = self._keys[idx]
+            if not key.startswith(prefix):
+                break
+            result.append(self._owners[key][1])
+            idx += 1
+        return result
+
+    async def suggest(self, query: str, limit: int = 5) -> List[str]:
+        """
+        Подсказки для ненайденного ника: сначала продолжения по префиксу из памяти,
+        затем похожие по триграммам из БД (опечатки в середине ника)
+        """
+        await self.ensure_loaded()
+        suggestions = self.complete(query, limit)
+        if len(suggestions) < limit:
+            try:
+                for username in await self.db.similar_usernames(query, limit):
+                    if username not in suggestions:
+                        suggestions.append(username)
+            except Exception as e:
+                logger.debug(f"Не удалось получить похожие username: {e}")
+        return suggestions[:limit]
+
+    # ==================== ИНКРЕМЕНТАЛЬНЫЕ ОБНОВЛЕНИЯ ====================
+
+    def handle_event(self, event: str, payload: dict):
+        # banned в username_changed: пользователь мог быть забанен до запуска бота,
+        # тогда событий бана индекс не видел
+        if event == 'user_banned' or (event == 'username_changed' and payload.get('banned')):
+            self._banned.add(payload['user_id'])
+        elif event == 'user_unbanned':
+            self._banned.discard(payload['user_id'])
+        if not self._loaded:
+            return
+        if event == 'username_changed':
+            self._set(payload['user_id'], payload.get('new'))
+        elif event == 'user_banned':
+            self._set(payload['user_id'], None)
+        elif event == 'user_unbanned':
+            self._set(payload['user_id'], payload.get('username'))
+
+    def _set(self, user_id: int, username: Optional[str]):
+        old_key = self._by_user.pop(user_id, None)
+        if old_key is not None:
+            self._discard(old_key)
+        if not username or user_id in self._banned:
+            return
+        key = username.lower()
+        previous = self._owners.get(key)
+        if previous:
+            # Ник перешёл от другого пользователя
+            self._by_user.pop(previous[0], None)
+        else:
+            insort(self._keys, key)
+        self._owners[key] = (user_id, username)
+        self._by_user[user_id] = key
+
+    def _discard(self, key: str):
+        self._owners.pop(key, None)
+        idx = bisect_left(self._keys, key)
+        if idx < len(self._keys) and self._keys[idx] == key:
+            del self._keys[idx]
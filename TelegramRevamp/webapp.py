@@ -9,7 +9,8 @@ from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from flask import Flask, render_template, jsonify, request, redirect, url_for
 from flask_cors import CORS
 
-from config import DATABASE_URL, FLASK_PORT, LOG_LEVEL, APP_TIMEZONE
+from config import DATABASE_URL, FLASK_PORT, LOG_LEVEL, APP_TIMEZONE, LIVE_FEED_URL
+from database import Database, fetch_reviews_page
 
 # Настройка логирования
 logging.basicConfig(level=getattr(logging, LOG_LEVEL))
@@ -42,7 +43,7 @@ def index():
 @app.route('/orders')
 def orders_page():
     """Страница ленты заказов для Telegram Mini App"""
-    return render_template('orders.html')
+    return render_template('orders.html', live_feed_url=LIVE_FEED_URL)
 
 @app.route('/api/orders')
 def get_orders():
@@ -125,50 +126,54 @@ def get_orders():
 def get_reviews(user_id):
     async def fetch_reviews():
         pool = await get_db_pool()
-        async with pool.acquire() as conn:
-            reviews = await conn.fetch('''
-                SELECT 
-                    r.rating,
-                    r.comment,
-                    r.created_at,
-                    u.username as reviewer_username,
-                    u.first_name as reviewer_name
-                FROM reviews r
-                LEFT JOIN users u ON r.reviewer_id = u.user_id
-                WHERE r.reviewee_id = $1
-                ORDER BY r.created_at DESC
-                LIMIT 20
-            ''', user_id)
-            
-            avg_rating = await conn.fetchval('''
-                SELECT COALESCE(AVG(rating), 0) FROM reviews WHERE reviewee_id = $1
-            ''', user_id)
-            
-            total_reviews = await conn.fetchval('''
-                SELECT COUNT(*) FROM reviews WHERE reviewee_id = $1
-            ''', user_id)
-            
-            user = await conn.fetchrow('''
-                SELECT username, first_name FROM users WHERE user_id = $1
-            ''', user_id)
-        await pool.close()
-        return reviews, avg_rating, total_reviews, user
+        try:
+            async with pool.acquire() as conn:
+                # Пользователь и агрегат отзывов одной строкой вместо AVG + COUNT + SELECT
+                header = await conn.fetchrow('''
+                    SELECT u.username, u.first_name, s.*
+                    FROM users u
+                    LEFT JOIN user_rating_summary s ON s.user_id = u.user_id
+                    WHERE u.user_id = $1
+                ''', user_id)
+
+                page = await fetch_reviews_page(conn, user_id, cursor, limit, direction)
+        finally:
+            await pool.close()
+        return page, header
+    
+    cursor = request.args.get('cursor') or None
+    direction = 'newer' if request.args.get('direction') == 'newer' else 'older'
+    try:
+        limit = min(max(int(request.args.get('limit', 20)), 1), 50)
+    except ValueError:
+        limit = 20
     
     try:
-        reviews, avg_rating, total_reviews, user = run_async(fetch_reviews())
+        page, header = run_async(fetch_reviews())
         reviews_list = []
-        for r in reviews:
-            review_dict = dict(r)
-            if review_dict.get('created_at'):
-                review_dict['created_at'] = review_dict['created_at'].isoformat()
-            reviews_list.append(review_dict)
+        for r in page['reviews']:
+            reviews_list.append({
+                'review_id': r['review_id'],
+                'rating': r['rating'],
+                'comment': r['comment'],
+                'created_at': r['created_at'].isoformat() if r['created_at'] else None,
+                'reviewer_username': r['username'],
+                'reviewer_name': r['first_name'],
+            })
+
+        summary = Database.format_rating_summary(header)
+        if summary['last_review_at']:
+            summary['last_review_at'] = summary['last_review_at'].isoformat()
         
         return jsonify({
             'success': True,
             'reviews': reviews_list,
-            'avg_rating': float(avg_rating) if avg_rating else 0,
-            'total_reviews': total_reviews,
-            'user': dict(user) if user else None
+            'avg_rating': summary['avg_rating'],
+            'total_reviews': summary['reviews_count'],
+            'rating_summary': summary,
+            'next_cursor': page['next_cursor'],
+            'prev_cursor': page['prev_cursor'],
+            'user': {'username': header['username'], 'first_name': header['first_name']} if header else None
         })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500